@@ -14,6 +14,7 @@ from rest_framework.serializers import Serializer
 from utils.common.exceptions import OperateError
 from utils.plugin.public_utils import check_is_ip_address, timedelta_strftime
 from app_store.tmp_exec_back_task import front_end_verified_init
+from app_store import chunk_upload
 
 from db_models.models import (
     ApplicationHub, ProductHub, UploadPackageHistory,
@@ -135,6 +136,90 @@ class UploadPackageSerializer(Serializer):
         return validated_data
 
 
+class UploadChunkInitSerializer(Serializer):
+    """ 初始化分片上传序列化类 """
+
+    uuid = serializers.CharField(
+        help_text="上传安装包uuid",
+        required=True,
+        error_messages={"required": "必须包含[uuid]字段"}
+    )
+    operation_user = serializers.CharField(
+        help_text="操作用户",
+        required=True,
+        error_messages={"required": "必须包含[operation_user]字段"}
+    )
+    file_name = serializers.CharField(
+        help_text="上传的文件名",
+        required=True,
+        error_messages={"required": "必须包含[file_name]字段"}
+    )
+    file_size = serializers.IntegerField(
+        help_text="文件大小，单位字节",
+        required=True, min_value=1,
+        error_messages={"required": "必须包含[file_size]字段"}
+    )
+    md5 = serializers.CharField(
+        help_text="文件包的md5值",
+        required=True,
+        error_messages={"required": "必须包含[md5]字段"}
+    )
+    chunk_size = serializers.IntegerField(
+        help_text="分片大小，单位字节",
+        required=False,
+        default=chunk_upload.DEFAULT_CHUNK_SIZE,
+        min_value=chunk_upload.MIN_CHUNK_SIZE,
+        max_value=chunk_upload.MAX_CHUNK_SIZE
+    )
+
+    def validate_file_name(self, file_name):
+        if not file_name.endswith('.tar') and \
+                not file_name.endswith('tar.gz'):
+            raise ValidationError("上传文件名仅支持.tar或.tar.gz")
+        if os.path.basename(file_name) != file_name:
+            raise ValidationError("上传文件名不合法")
+        return file_name
+
+
+class UploadChunkSerializer(Serializer):
+    """ 上传分片序列化类 """
+
+    upload_id = serializers.RegexField(
+        r"^[0-9a-f]{40}$",
+        help_text="分片上传id",
+        required=True,
+        error_messages={"required": "必须包含[upload_id]字段",
+                        "invalid": "upload_id不合法"}
+    )
+    index = serializers.IntegerField(
+        help_text="分片序号",
+        required=True, min_value=0,
+        error_messages={"required": "必须包含[index]字段"}
+    )
+    chunk_md5 = serializers.CharField(
+        help_text="分片的md5值",
+        required=True,
+        error_messages={"required": "必须包含[chunk_md5]字段"}
+    )
+    file = serializers.FileField(
+        help_text="分片数据",
+        required=True,
+        error_messages={"required": "必须包含[file]字段"}
+    )
+
+
+class UploadChunkCompleteSerializer(Serializer):
+    """ 完成分片上传序列化类 """
+
+    upload_id = serializers.RegexField(
+        r"^[0-9a-f]{40}$",
+        help_text="分片上传id",
+        required=True,
+        error_messages={"required": "必须包含[upload_id]字段",
+                        "invalid": "upload_id不合法"}
+    )
+
+
 class RemovePackageSerializer(Serializer):
     """ 移除安装包序列化类 """
 
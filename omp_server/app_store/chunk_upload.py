@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# Project: chunk_upload
+# Create time: 2022-03-20
+# Introduction:
+
+"""
+安装包分片上传
+初始化时按文件大小预分配文件，分片按偏移写入，每个分片单独校验 md5，
+已接收的分片记录在索引文件中，断点续传时据此只上传缺少的分片；
+按顺序到达的分片在接收时同时计算整个文件的 md5，其余分片在完成上传时读取一次，
+最后一个分片写入后立即开始安装包校验
+"""
+
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+
+from app_store.tmp_exec_back_task import front_end_verified_init
+from db_models.models import UploadPackageHistory
+from utils.common.exceptions import OperateError
+
+logger = logging.getLogger("server")
+
+# 分片上传的临时目录，以 . 开头避免被校验清理逻辑删除
+SESSION_DIR = ".chunk_upload"
+# 默认分片大小
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# 分片大小范围
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# 单次读写的大小
+IO_SIZE = 1024 * 1024
+# 未完成的上传保留时间，单位秒
+SESSION_EXPIRE = 7 * 24 * 3600
+
+# 本进程内各上传任务已按顺序计算的 md5 {upload_id: [lock, md5, 下一个分片]}
+_digests = dict()
+_digests_lock = threading.Lock()
+
+
+def upload_dir():
+    """ 前端上传安装包的路径 """
+    return os.path.join(
+        settings.PROJECT_DIR, "package_hub/front_end_verified")
+
+
+class ChunkUpload(object):
+    """ 单个安装包的分片上传 """
+
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+        self.path = os.path.join(upload_dir(), SESSION_DIR, upload_id)
+        self.meta_file = os.path.join(self.path, "meta.json")
+        self.data_file = os.path.join(self.path, "data")
+        self.index_file = os.path.join(self.path, "index")
+        self.done_file = os.path.join(self.path, "done")
+        self._meta = None
+
+    @staticmethod
+    def make_id(uuid, file_name, file_size, md5):
+        """ 相同文件的上传使用同一 id，客户端丢失状态后仍可续传 """
+        return hashlib.sha1(
+            f"{uuid}|{file_name}|{file_size}|{md5}".encode("utf8")
+        ).hexdigest()
+
+    @classmethod
+    def clear_expired(cls):
+        """ 清理长时间未完成的上传 """
+        session_root = os.path.join(upload_dir(), SESSION_DIR)
+        if not os.path.isdir(session_root):
+            return
+        now = time.time()
+        for upload_id in os.listdir(session_root):
+            path = os.path.join(session_root, upload_id)
+            try:
+                # 每次接收分片都会更新索引文件
+                if now - os.path.getmtime(
+                        os.path.join(path, "index")) > SESSION_EXPIRE:
+                    shutil.rmtree(path, ignore_errors=True)
+                    logger.info(f"清理过期的分片上传{upload_id}")
+            except OSError:
+                continue
+
+    @classmethod
+    def init(cls, uuid, operation_user, file_name, file_size, md5,
+             chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        初始化上传，已存在时直接返回用于续传
+        :return: ChunkUpload
+        """
+        upload = cls(cls.make_id(uuid, file_name, file_size, md5))
+        if os.path.exists(upload.meta_file):
+            return upload
+        cls.clear_expired()
+        os.makedirs(upload.path, exist_ok=True)
+        if shutil.disk_usage(upload.path).free < file_size:
+            shutil.rmtree(upload.path, ignore_errors=True)
+            raise OperateError("磁盘空间不足")
+        chunk_count = max(math.ceil(file_size / chunk_size), 1)
+        # 按文件大小预分配，分片按偏移写入
+        with open(upload.data_file, "wb") as fp:
+            fp.truncate(file_size)
+        with open(upload.index_file, "wb") as fp:
+            fp.write(b"\0" * chunk_count)
+        meta = {
+            "uuid": uuid,
+            "operation_user": operation_user,
+            "file_name": file_name,
+            "file_size": file_size,
+            "md5": md5,
+            "chunk_size": chunk_size,
+            "chunk_count": chunk_count,
+        }
+        # 元数据最后写入，存在即表示初始化完成
+        tmp_file = f"{upload.meta_file}.tmp"
+        with open(tmp_file, "w", encoding="utf8") as fp:
+            json.dump(meta, fp, ensure_ascii=False)
+        os.replace(tmp_file, upload.meta_file)
+        return upload
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            try:
+                with open(self.meta_file, "r", encoding="utf8") as fp:
+                    self._meta = json.load(fp)
+            except FileNotFoundError:
+                raise OperateError("上传任务不存在或已完成")
+        return self._meta
+
+    def chunk_length(self, index):
+        """ 分片的长度，最后一个分片可能不足分片大小 """
+        chunk_size = self.meta["chunk_size"]
+        return min(chunk_size, self.meta["file_size"] - index * chunk_size)
+
+    def received(self):
+        """ 已接收的分片序号 """
+        try:
+            with open(self.index_file, "rb") as fp:
+                index_data = fp.read()
+        except FileNotFoundError:
+            raise OperateError("上传任务不存在或已完成")
+        return [index for index, flag in enumerate(index_data) if flag]
+
+    def status(self):
+        received = self.received()
+        return {
+            "upload_id": self.upload_id,
+            "chunk_size": self.meta["chunk_size"],
+            "chunk_count": self.meta["chunk_count"],
+            "received": received,
+            "completed": len(received) == self.meta["chunk_count"],
+        }
+
+    def digest_state(self):
+        """ 本进程内按顺序计算的整个文件 md5 状态 """
+        with _digests_lock:
+            return _digests.setdefault(
+                self.upload_id, [threading.Lock(), hashlib.md5(), 0])
+
+    def put(self, index, chunks, chunk_md5):
+        """
+        写入分片，分片为本进程下一个待计算的分片时，
+        使用接收的数据同时计算整个文件的 md5
+        :param index: 分片序号
+        :param chunks: 分片数据，可迭代的 bytes
+        :param chunk_md5: 分片 md5
+        :return: 上传状态
+        """
+        if not 0 <= index < self.meta["chunk_count"]:
+            raise OperateError(f"分片序号{index}超出范围")
+        offset = index * self.meta["chunk_size"]
+        length = self.chunk_length(index)
+        state = self.digest_state()
+        with state[0]:
+            file_md5 = state[1].copy() if state[2] == index else None
+        md5 = hashlib.md5()
+        size = 0
+        fd = os.open(self.data_file, os.O_WRONLY)
+        try:
+            for data in chunks:
+                if size + len(data) > length:
+                    raise OperateError(f"分片{index}大小不正确")
+                os.pwrite(fd, data, offset + size)
+                md5.update(data)
+                if file_md5 is not None:
+                    file_md5.update(data)
+                size += len(data)
+        finally:
+            os.close(fd)
+        if size != length:
+            raise OperateError(f"分片{index}大小不正确")
+        if md5.hexdigest() != chunk_md5:
+            raise OperateError(f"分片{index}md5校验失败")
+        # 数据写入后再记录到索引中
+        fd = os.open(self.index_file, os.O_WRONLY)
+        try:
+            os.pwrite(fd, b"\1", index)
+        finally:
+            os.close(fd)
+        if file_md5 is not None:
+            with state[0]:
+                # 同一分片并发重传时只记录一次
+                if state[2] == index:
+                    state[1], state[2] = file_md5, index + 1
+        return self.status()
+
+    def _read_chunk(self, fp, index):
+        fp.seek(index * self.meta["chunk_size"])
+        length = self.chunk_length(index)
+        while length > 0:
+            data = fp.read(min(IO_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+    def digest(self):
+        """
+        整个文件的 md5，由完成上传的进程调用，
+        未按顺序计算的分片在此从文件中读取，每个分片只读取一次
+        """
+        with _digests_lock:
+            state = _digests.pop(self.upload_id, None)
+        if state is None:
+            md5, next_index = hashlib.md5(), 0
+        else:
+            with state[0]:
+                md5, next_index = state[1], state[2]
+        if next_index < self.meta["chunk_count"]:
+            with open(self.data_file, "rb") as fp:
+                for index in range(next_index, self.meta["chunk_count"]):
+                    for data in self._read_chunk(fp, index):
+                        md5.update(data)
+        return md5.hexdigest()
+
+    def full_digest(self):
+        md5 = hashlib.md5()
+        with open(self.data_file, "rb") as fp:
+            for data in iter(lambda: fp.read(IO_SIZE), b""):
+                md5.update(data)
+        return md5.hexdigest()
+
+    def complete(self):
+        """
+        完成上传，移动至上传路径并开始安装包校验
+        :return: 上传记录，其它请求正在完成时为 None
+        """
+        status = self.status()
+        if not status["completed"]:
+            raise OperateError(
+                f"分片未上传完成，"
+                f"已上传{len(status['received'])}/{status['chunk_count']}")
+        try:
+            os.close(os.open(
+                self.done_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return None
+        meta = self.meta
+        md5 = self.digest()
+        if md5 != meta["md5"]:
+            # 重传的分片可能与已计算的内容不一致，按文件重新计算
+            md5 = self.full_digest()
+        if md5 != meta["md5"]:
+            shutil.rmtree(self.path, ignore_errors=True)
+            raise OperateError("文件md5校验失败，请重新上传")
+        try:
+            os.replace(
+                self.data_file,
+                os.path.join(upload_dir(), meta["file_name"]))
+            upload_obj = UploadPackageHistory.objects.create(
+                operation_uuid=meta["uuid"],
+                operation_user=meta["operation_user"],
+                package_name=meta["file_name"],
+                package_md5=md5,
+                package_path="verified")
+        except Exception as e:
+            logger.error(f"完成分片上传{meta['file_name']}失败: {e}")
+            os.remove(self.done_file)
+            raise OperateError("文件写入过程失败")
+        shutil.rmtree(self.path, ignore_errors=True)
+        front_end_verified_init(
+            meta["uuid"], meta["operation_user"],
+            meta["file_name"], upload_obj.id, md5)
+        return upload_obj
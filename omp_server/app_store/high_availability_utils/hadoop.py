@@ -75,21 +75,21 @@ class Hadoop(object):
             if not is_success:
                 raise GeneralError(message)
             # 执行成功且 message 有值，则补充至服务日志中
-            detail_obj.install_msg += \
-                f"{self.install_obj.now_time()} 初始化脚本执行成功，脚本输出如下:\n" \
-                f"{message}\n"
-            detail_obj.save()
+            self.install_obj.write_log(
+                detail_obj, "init",
+                f"初始化脚本执行成功，脚本输出如下:\n{message}",
+                field="install_msg")
             return True, "success"
         except Exception as err:
             for obj, name in self.detail_dict.items():
                 logger.error(f"Init Failed -> [{name}]: {err}")
                 obj.init_flag = 3
-                obj.init_msg += f"{self.install_obj.now_time()} {name} " \
-                                f"初始化服务失败: {err}\n"
+                self.install_obj.write_log(
+                    obj, "init", f"{name} 初始化服务失败: {err}")
                 # 更新安装流程状态为 '失败'，服务状态为 '安装失败'
                 obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_FAILED
-                obj.save()
+                self.install_obj.save_step(obj, "init")
                 obj.service.service_status = \
                     Service.SERVICE_STATUS_INSTALL_FAILED
                 obj.service.save()
@@ -112,8 +112,10 @@ class Hadoop(object):
                     self.target_set.add(target_ip)
                     logger.info(f"Init Begin -> [{service_name}]")
                     detail_obj.init_flag = 1
-                    detail_obj.init_msg += f"{self.install_obj.now_time()} {service_name} 开始初始化服务\n"
-                    detail_obj.save()
+                    self.install_obj.write_log(
+                        detail_obj, "init", f"{service_name} 开始初始化服务")
+                    self.install_obj.save_step(
+                        detail_obj, "init", with_log=False)
                 future_obj = executor.submit(
                     self.init_hadoop, detail_obj,
                     target_ip, service_controllers_dict,
@@ -126,10 +128,12 @@ class Hadoop(object):
             for obj, name in self.detail_dict.items():
                 logger.info(f"Init Success -> [{name}]")
                 obj.init_flag = 2
-                obj.init_msg += f"{self.install_obj.now_time()} {name} 成功初始化服务\n"
+                self.install_obj.write_log(
+                    obj, "init", f"{name} 成功初始化服务")
                 # 完成安装流程，更新状态为 '安装成功'
                 obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_SUCCESS
+                self.install_obj.save_step(obj, "init")
                 # 创建历史记录
                 self.install_obj.create_history(obj, is_success=True)
             return True, "Init Success"
@@ -261,7 +265,8 @@ class Hadoop(object):
                 # 更新单条安装记录的状态
                 detail_obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_INSTALLING
-                detail_obj.save()
+                detail_obj.save(
+                    update_fields=["install_step_status", "modified"])
                 future_obj = executor.submit(
                     self.single_service_executor, detail_obj
                 )
@@ -17,12 +17,15 @@ from concurrent.futures import (
 from django.conf import settings
 
 from app_store.high_availability_utils import HIGH_AVAILABILITY_UTILS
+from app_store.install_scheduler import InstallScheduler
+from app_store.package_distribution import PackageDistributor
 from db_models.models import (
     Host, Service, HostOperateLog, ServiceHistory,
     MainInstallHistory, DetailInstallHistory, ApplicationHub,
-    PreInstallHistory, PostInstallHistory
+    PreInstallHistory, PostInstallHistory, ExecutionEventLog
 )
 from utils.plugin.salt_client import SaltClient
+from utils.plugin.event_log import EventLogWriter
 from utils.parse_config import BASIC_ORDER
 from utils.parse_config import THREAD_POOL_MAX_WORKERS
 from utils.common.exceptions import GeneralError
@@ -48,6 +51,10 @@ class InstallServiceExecutor:
         self.is_error = False
         # 控制安装过程中单主机上的安装包解压并发数 TODO 暂时使用阻塞等待方式进行处理！！
         self.unzip_concurrent_controller = dict()
+        # 安装前统一分发的安装包 {(ip, package_name): (is_success, message)}
+        self.distributed_dic = dict()
+        # 安装步骤日志，多线程共享批量写入
+        self.event_log = EventLogWriter(ExecutionEventLog.MODULE_INSTALL)
 
     def parse_origin_data(self, json_source_path):
         """
@@ -251,6 +258,37 @@ class InstallServiceExecutor:
         """ 当前时间格式 """
         return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
+    def write_log(self, detail_obj, action, message, field=None):
+        """
+        记录步骤日志，逐行追加至执行过程日志，
+        安装详情中的日志字段仅在步骤结束时随状态一并保存
+        :param detail_obj: DetailInstallHistory
+        :param action: 安装步骤
+        :param message: 日志内容
+        :param field: 日志所属字段，默认为步骤对应字段
+        """
+        line = f"{self.now_time()} {message}\n"
+        field = field or f"{action}_msg"
+        setattr(detail_obj, field, getattr(detail_obj, field) + line)
+        self.event_log.append(detail_obj.id, action, line)
+
+    def save_step(self, detail_obj, action, with_log=True):
+        """
+        仅更新步骤状态相关字段，避免重写安装详情中的全部日志字段
+        :param detail_obj: DetailInstallHistory
+        :param action: 安装步骤
+        :param with_log: 是否一并保存日志字段，步骤结束时保存
+        """
+        # 步骤开始时同样写入缓冲日志，执行耗时命令期间可实时查看
+        self.event_log.flush()
+        update_fields = [f"{action}_flag", "install_step_status", "modified"]
+        if with_log:
+            update_fields.append(f"{action}_msg")
+            if action != "install":
+                # 初始化、启动脚本输出记录在安装日志中
+                update_fields.append("install_msg")
+        detail_obj.save(update_fields=update_fields)
+
     def create_history(self, detail_obj, is_success=True):
         """ 创建历史记录 """
         target_ip = detail_obj.service.ip
@@ -284,10 +322,23 @@ class InstallServiceExecutor:
         # 更新状态为 '发送中'，记录日志
         logger.info(f"Send Begin -> [{service_name}] package [{package_name}]")
         detail_obj.send_flag = 1
-        detail_obj.send_msg += f"{self.now_time()} {service_name} 开始发送服务包\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "send", f"{service_name} 开始发送服务包")
+        self.save_step(detail_obj, "send", with_log=False)
 
         try:
+            # 安装前已分发至目标主机，不再重复发送
+            is_distributed, message = self.distributed_dic.get(
+                (target_ip, package_name), (False, ""))
+            if is_distributed:
+                logger.info(
+                    f"Send Skip -> [{service_name}] package "
+                    f"[{package_name}]: {message}")
+                detail_obj.send_flag = 2
+                self.write_log(
+                    detail_obj, "send", f"{service_name} 服务包已分发至主机")
+                self.save_step(detail_obj, "send")
+                return True, "Send Success"
+
             # 获取目标路径
             target_host = Host.objects.filter(ip=target_ip).first()
             assert target_host is not None
@@ -327,11 +378,11 @@ class InstallServiceExecutor:
         except Exception as err:
             logger.error(f"Send Failed -> [{service_name}]: {err}")
             detail_obj.send_flag = 3
-            detail_obj.send_msg += f"{self.now_time()} {service_name} " \
-                                   f"发送服务包失败: {err}\n"
+            self.write_log(
+                detail_obj, "send", f"{service_name} 发送服务包失败: {err}")
             detail_obj.install_step_status = \
                 DetailInstallHistory.INSTALL_STATUS_FAILED
-            detail_obj.save()
+            self.save_step(detail_obj, "send")
             detail_obj.service.service_status = \
                 Service.SERVICE_STATUS_INSTALL_FAILED
             detail_obj.service.save()
@@ -342,8 +393,8 @@ class InstallServiceExecutor:
         logger.info(
             f"Send Success -> [{service_name}] package [{package_name}]")
         detail_obj.send_flag = 2
-        detail_obj.send_msg += f"{self.now_time()} {service_name} 成功发送服务包\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "send", f"{service_name} 成功发送服务包")
+        self.save_step(detail_obj, "send")
         return True, "Send Success"
 
     def unzip(self, detail_obj):
@@ -358,8 +409,8 @@ class InstallServiceExecutor:
         logger.info(
             f"Unzip Begin -> [{service_name}] package [{package_name}]")
         detail_obj.unzip_flag = 1
-        detail_obj.unzip_msg += f"{self.now_time()} {service_name} 开始解压服务包\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "unzip", f"{service_name} 开始解压服务包")
+        self.save_step(detail_obj, "unzip", with_log=False)
 
         try:
             # 控制单主机上的服务包解压操作，向控制队列中添加一项
@@ -408,12 +459,11 @@ class InstallServiceExecutor:
             self.unzip_concurrent_controller[target_ip].get()
             logger.error(f"Unzip Failed -> [{service_name}]: {err}")
             detail_obj.unzip_flag = 3
-            detail_obj.unzip_msg += \
-                f"{self.now_time()} {service_name} " \
-                f"解压服务包失败: {err}\n"
+            self.write_log(
+                detail_obj, "unzip", f"{service_name} 解压服务包失败: {err}")
             detail_obj.install_step_status = \
                 DetailInstallHistory.INSTALL_STATUS_FAILED
-            detail_obj.save()
+            self.save_step(detail_obj, "unzip")
             detail_obj.service.service_status = \
                 Service.SERVICE_STATUS_INSTALL_FAILED
             detail_obj.service.save()
@@ -426,9 +476,8 @@ class InstallServiceExecutor:
         logger.info(
             f"Unzip Success -> [{service_name}] package [{package_name}]")
         detail_obj.unzip_flag = 2
-        detail_obj.unzip_msg += \
-            f"{self.now_time()} {service_name} 成功解压服务包\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "unzip", f"{service_name} 成功解压服务包")
+        self.save_step(detail_obj, "unzip")
         return True, "Unzip Success"
 
     def install(self, detail_obj):
@@ -444,9 +493,8 @@ class InstallServiceExecutor:
         # 更新状态为 '安装中'，记录日志
         logger.info(f"Install Begin -> [{service_name}]")
         detail_obj.install_flag = 1
-        detail_obj.install_msg += \
-            f"{self.now_time()} {service_name} 开始安装服务\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "install", f"{service_name} 开始安装服务")
+        self.save_step(detail_obj, "install", with_log=False)
 
         try:
             # 获取服务安装脚本绝对路径
@@ -481,18 +529,17 @@ class InstallServiceExecutor:
                 raise GeneralError(message)
             # 执行成功且 message 有值，则补充至服务日志中
             if is_success and bool(message):
-                detail_obj.install_msg += \
-                    f"{self.now_time()} 安装脚本执行成功，脚本输出如下:\n" \
-                    f"{message}\n"
-                detail_obj.save()
+                self.write_log(
+                    detail_obj, "install",
+                    f"安装脚本执行成功，脚本输出如下:\n{message}")
         except Exception as err:
             logger.error(f"Install Failed -> [{service_name}]: {err}")
             detail_obj.install_flag = 3
-            detail_obj.install_msg += f"{self.now_time()} {service_name} " \
-                                      f"安装服务失败: {err}\n"
+            self.write_log(
+                detail_obj, "install", f"{service_name} 安装服务失败: {err}")
             detail_obj.install_step_status = \
                 DetailInstallHistory.INSTALL_STATUS_FAILED
-            detail_obj.save()
+            self.save_step(detail_obj, "install")
             detail_obj.service.service_status = \
                 Service.SERVICE_STATUS_INSTALL_FAILED
             detail_obj.service.save()
@@ -503,9 +550,8 @@ class InstallServiceExecutor:
         # 安装成功
         logger.info(f"Install Success -> [{service_name}]")
         detail_obj.install_flag = 2
-        detail_obj.install_msg += \
-            f"{self.now_time()} {service_name} 成功安装服务\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "install", f"{service_name} 成功安装服务")
+        self.save_step(detail_obj, "install")
         return True, "Install Success"
 
     def init(self, detail_obj):
@@ -519,8 +565,8 @@ class InstallServiceExecutor:
         # 更新状态为 '初始化中'，记录日志
         logger.info(f"Init Begin -> [{service_name}]")
         detail_obj.init_flag = 1
-        detail_obj.init_msg += f"{self.now_time()} {service_name} 开始初始化服务\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "init", f"{service_name} 开始初始化服务")
+        self.save_step(detail_obj, "init", with_log=False)
 
         try:
             # 获取服务初始化脚本绝对路径
@@ -528,12 +574,12 @@ class InstallServiceExecutor:
             if init_script_path == "":
                 logger.info(f"Init Un Do -> [{service_name}]")
                 detail_obj.init_flag = 2
-                detail_obj.init_msg += \
-                    f"{self.now_time()} {service_name} 无需执行初始化\n"
+                self.write_log(
+                    detail_obj, "init", f"{service_name} 无需执行初始化")
                 # 完成安装流程，更新状态为 '安装成功'
                 detail_obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_SUCCESS
-                detail_obj.save()
+                self.save_step(detail_obj, "init")
                 # 创建历史记录
                 self.create_history(detail_obj, is_success=True)
                 return True, "Init Un Do"
@@ -556,19 +602,19 @@ class InstallServiceExecutor:
                 raise GeneralError(message)
             # 执行成功且 message 有值，则补充至服务日志中
             if is_success and bool(message):
-                detail_obj.install_msg += \
-                    f"{self.now_time()} 初始化脚本执行成功，脚本输出如下:\n" \
-                    f"{message}\n"
-                detail_obj.save()
+                self.write_log(
+                    detail_obj, "init",
+                    f"初始化脚本执行成功，脚本输出如下:\n{message}",
+                    field="install_msg")
         except Exception as err:
             logger.error(f"Init Failed -> [{service_name}]: {err}")
             detail_obj.init_flag = 3
-            detail_obj.init_msg += f"{self.now_time()} {service_name} " \
-                                   f"初始化服务失败: {err}\n"
+            self.write_log(
+                detail_obj, "init", f"{service_name} 初始化服务失败: {err}")
             # 更新安装流程状态为 '失败'，服务状态为 '安装失败'
             detail_obj.install_step_status = \
                 DetailInstallHistory.INSTALL_STATUS_FAILED
-            detail_obj.save()
+            self.save_step(detail_obj, "init")
             detail_obj.service.service_status = \
                 Service.SERVICE_STATUS_INSTALL_FAILED
             detail_obj.service.save()
@@ -578,14 +624,14 @@ class InstallServiceExecutor:
         # 安装成功
         logger.info(f"Init Success -> [{service_name}]")
         detail_obj.init_flag = 2
-        detail_obj.init_msg += f"{self.now_time()} {service_name} 成功初始化服务\n"
+        self.write_log(detail_obj, "init", f"{service_name} 成功初始化服务")
         # 完成安装流程，更新状态为 '安装成功'
         # 如果是自研服务，初始化完成即认为其安装成功
         if detail_obj.service.service.app_type == \
                 ApplicationHub.APP_TYPE_SERVICE:
             detail_obj.install_step_status = \
                 DetailInstallHistory.INSTALL_STATUS_SUCCESS
-            detail_obj.save()
+        self.save_step(detail_obj, "init")
         # 创建历史记录
         self.create_history(detail_obj, is_success=True)
         return True, "Init Success"
@@ -601,8 +647,8 @@ class InstallServiceExecutor:
         # 更新状态为 '启动中'，记录日志
         logger.info(f"Start Begin -> [{service_name}]")
         detail_obj.start_flag = 1
-        detail_obj.start_msg += f"{self.now_time()} {service_name} 开始启动服务\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "start", f"{service_name} 开始启动服务")
+        self.save_step(detail_obj, "start", with_log=False)
 
         try:
             # 获取服务启动脚本绝对路径
@@ -610,8 +656,8 @@ class InstallServiceExecutor:
             if start_script_path == "":
                 logger.info(f"Start Un Do -> [{service_name}]")
                 detail_obj.start_flag = 2
-                detail_obj.start_msg += \
-                    f"{self.now_time()} {service_name} 无需执行启动\n"
+                self.write_log(
+                    detail_obj, "start", f"{service_name} 无需执行启动")
                 # 如果服务无需启动，则认可其为安装成功
                 detail_obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_SUCCESS
@@ -619,7 +665,7 @@ class InstallServiceExecutor:
                 detail_obj.service.service_status = \
                     Service.SERVICE_STATUS_NORMAL
                 detail_obj.service.save()
-                detail_obj.save()
+                self.save_step(detail_obj, "start")
                 return True, "Start Un Do"
 
             if "start" not in start_script_path:
@@ -642,21 +688,21 @@ class InstallServiceExecutor:
                 raise GeneralError(message)
             # 执行成功且 message 有值，则补充至服务日志中
             if is_success and bool(message):
-                detail_obj.install_msg += \
-                    f"{self.now_time()} 启动脚本执行成功，脚本输出如下:\n" \
-                    f"{message}\n"
-                detail_obj.save()
+                self.write_log(
+                    detail_obj, "start",
+                    f"启动脚本执行成功，脚本输出如下:\n{message}",
+                    field="install_msg")
         except Exception as err:
             logger.error(f"Start Failed -> [{service_name}]: {err}")
             detail_obj.start_flag = 3
-            detail_obj.start_msg += f"{self.now_time()} {service_name} " \
-                                    f"启动服务失败: {err}\n"
+            self.write_log(
+                detail_obj, "start", f"{service_name} 启动服务失败: {err}")
             # 如果是基础组件服务的启动步骤，如果启动失败则认为其安装失败
             if detail_obj.service.service.app_type == \
                     ApplicationHub.APP_TYPE_COMPONENT:
                 detail_obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_FAILED
-            detail_obj.save()
+            self.save_step(detail_obj, "start")
             # 服务状态更新为 '停止'
             detail_obj.service.service_status = \
                 Service.SERVICE_STATUS_STOP
@@ -665,15 +711,14 @@ class InstallServiceExecutor:
         # 安装成功
         logger.info(f"Start Success -> [{service_name}]")
         detail_obj.start_flag = 2
-        detail_obj.start_msg += f"{self.now_time()} {service_name} 成功启动服务\n"
-        detail_obj.save()
+        self.write_log(detail_obj, "start", f"{service_name} 成功启动服务")
         # 服务状态更新为 '正常'
         detail_obj.service.service_status = \
             Service.SERVICE_STATUS_NORMAL
         # 服务启动成功，则认为其已经安装成功
         detail_obj.install_step_status = \
             DetailInstallHistory.INSTALL_STATUS_SUCCESS
-        detail_obj.save()
+        self.save_step(detail_obj, "start")
         detail_obj.service.save()
         return True, "Start Success"
 
@@ -710,12 +755,14 @@ class InstallServiceExecutor:
                 if not flag:
                     self.is_error = True
                     detail_obj.post_action_flag = 3
-                    detail_obj.save()
+                    detail_obj.save(update_fields=[
+                        "post_action_flag", "post_action_msg", "modified"])
                     post_obj.install_flag = 3
                     post_obj.save()
                     break
                 detail_obj.post_action_flag = 2
-                detail_obj.save()
+                detail_obj.save(update_fields=[
+                    "post_action_flag", "post_action_msg", "modified"])
         except Exception as e:
             logger.error(f"Error while execute post_action: {str(e)}")
             self.is_error = True
@@ -775,7 +822,8 @@ class InstallServiceExecutor:
                 # 更新单条安装记录的状态
                 detail_obj.install_step_status = \
                     DetailInstallHistory.INSTALL_STATUS_INSTALLING
-                detail_obj.save()
+                detail_obj.save(
+                    update_fields=["install_step_status", "modified"])
                 future_obj = executor.submit(
                     self.single_service_executor, detail_obj
                 )
@@ -826,6 +874,23 @@ class InstallServiceExecutor:
         )
         return execute_lst
 
+    def execute_by_order(self, queryset):
+        """
+        按安装顺序逐层安装
+        :param queryset: 即将部署的详情对象组成的列表
+        :return:
+        """
+        tobe_execute_lst = self.make_install_order(queryset)
+        logger.info(f"Tobe_execute_lst: {tobe_execute_lst}")
+        for item in tobe_execute_lst:
+            if not item:
+                continue
+            # 根据安装顺序每层并发执行
+            self.thread_poll_executor(detail_obj_lst=item)
+            # 如果哪层的服务有安装失败的情况，那么直接退出循环
+            if self.is_error:
+                break
+
     def execute_post_action_main(self, main_obj):
         """
         执行注册操作 post_action
@@ -1010,7 +1075,8 @@ class InstallServiceExecutor:
 
         # 获取所有安装细节表，排除已经安装成功的记录，不再重复安装
         queryset = DetailInstallHistory.objects.select_related(
-            "service", "service__service", "service__service__app_package"
+            "service", "service__service", "service__service__app_package",
+            "service__cluster"
         ).filter(main_install_history_id=self.main_id).exclude(
             install_step_status=DetailInstallHistory.INSTALL_STATUS_SUCCESS)
         # assert queryset.exists()
@@ -1031,17 +1097,27 @@ class InstallServiceExecutor:
             id__in=service_ids
         ).update(service_status=Service.SERVICE_STATUS_READY)
 
-        # 对要执行安装的列表进行排序处理
-        tobe_execute_lst = self.make_install_order(queryset)
-        logger.info(f"Tobe_execute_lst: {tobe_execute_lst}")
-        for item in tobe_execute_lst:
-            if not item:
-                continue
-            # 根据安装顺序每层并发执行
-            self.thread_poll_executor(detail_obj_lst=item)
-            # 如果哪层的服务有安装失败的情况，那么直接退出循环
-            if self.is_error:
-                break
+        # 安装前按主机去重分发安装包，分发失败的由发送步骤重新发送
+        detail_obj_lst = list(queryset)
+        distributor = PackageDistributor(detail_obj_lst)
+        self.distributed_dic = distributor.run()
+        if self.distributed_dic:
+            report = distributor.report()
+            logger.info(f"Main Install [{self.main_id}] {report}")
+            main_obj.install_log += f"{self.now_time()} {report}\n"
+            main_obj.save()
+
+        # 按依赖关系调度安装，依赖关系有环时按安装顺序逐层安装
+        scheduler = InstallScheduler(self, detail_obj_lst)
+        if scheduler.build():
+            if not scheduler.run():
+                self.is_error = True
+            report = scheduler.report()
+            logger.info(f"Main Install [{self.main_id}] {report}")
+            main_obj.install_log += f"{self.now_time()} {report}\n"
+            main_obj.save()
+        else:
+            self.execute_by_order(queryset)
 
         if self.is_error:
             # 步骤失败，主流程失败
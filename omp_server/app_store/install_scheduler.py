@@ -0,0 +1,292 @@
+"""
+基于依赖关系图的安装调度器
+根据服务实例依赖关系构建有向无环图，服务的全部依赖安装成功后立即开始其
+send -> unzip -> install -> init -> start 流程，不再等待整层服务完成
+"""
+import json
+import time
+import logging
+from collections import deque
+from concurrent.futures import (
+    ThreadPoolExecutor, wait, FIRST_COMPLETED
+)
+
+from app_store.high_availability_utils import HIGH_AVAILABILITY_UTILS
+from db_models.models import ApplicationHub, DetailInstallHistory
+from utils.parse_config import BASIC_ORDER
+from utils.parse_config import THREAD_POOL_MAX_WORKERS
+from utils.parse_config import INSTALL_CONCURRENT_ONE_HOST
+
+logger = logging.getLogger("server")
+
+
+class InstallNode:
+    """ 调度节点，高可用服务的全部实例作为一个节点整体部署 """
+
+    def __init__(self, key, detail_list):
+        self.key = key
+        self.detail_list = detail_list
+        self.depends = set()
+        self.dependents = set()
+        # 该节点到终点的最长路径长度，作为调度优先级
+        self.height = 0
+        self.start_time = None
+        self.end_time = None
+        self.is_success = None
+        self.is_skipped = False
+
+    @property
+    def app_name(self):
+        return self.detail_list[0].service.service.app_name
+
+    @property
+    def ip(self):
+        """ 高可用节点跨多台主机，不参与单主机并发控制 """
+        if len(self.detail_list) > 1:
+            return None
+        return self.detail_list[0].service.ip
+
+    @property
+    def name(self):
+        if len(self.detail_list) > 1:
+            return self.app_name
+        return self.detail_list[0].service.service_instance_name
+
+    @property
+    def cost(self):
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+
+class InstallScheduler:
+    """ 安装调度器 """
+
+    def __init__(self, executor_obj, detail_obj_lst,
+                 max_workers=THREAD_POOL_MAX_WORKERS,
+                 host_max_workers=INSTALL_CONCURRENT_ONE_HOST):
+        """
+        :param executor_obj: InstallServiceExecutor 对象实例
+        :param detail_obj_lst: 待安装的 DetailInstallHistory 列表
+        :param max_workers: 全局并发数
+        :param host_max_workers: 单主机并发数
+        """
+        self.executor_obj = executor_obj
+        self.detail_obj_lst = detail_obj_lst
+        self.max_workers = max_workers
+        self.host_max_workers = host_max_workers
+        self.node_dic = dict()
+
+    @staticmethod
+    def get_rank(detail_obj):
+        """
+        同一主机上的安装顺序，基础组件按 BASIC_ORDER 排序，
+        其余组件及 level 为 0 的自研服务其次，其他自研服务最后
+        """
+        app = detail_obj.service.service
+        for i in range(10):
+            if i not in BASIC_ORDER:
+                break
+            if app.app_name in BASIC_ORDER[i]:
+                return i
+        if app.app_type == ApplicationHub.APP_TYPE_SERVICE and \
+                str(app.extend_fields.get("level")) != "0":
+            return len(BASIC_ORDER) + 1
+        return len(BASIC_ORDER)
+
+    def make_nodes(self):
+        """ 构建调度节点，高可用服务合并为一个节点 """
+        ha_dic = dict()
+        for detail_obj in self.detail_obj_lst:
+            app_name = detail_obj.service.service.app_name
+            if app_name in HIGH_AVAILABILITY_UTILS:
+                ha_dic.setdefault(app_name, []).append(detail_obj)
+                continue
+            self.node_dic[detail_obj.id] = InstallNode(
+                detail_obj.id, [detail_obj])
+        for app_name, detail_list in ha_dic.items():
+            key = f"ha_{app_name}"
+            self.node_dic[key] = InstallNode(key, detail_list)
+
+    def make_edges(self):
+        """ 根据服务依赖关系、应用依赖关系以及单主机安装顺序构建依赖 """
+        instance_dic, cluster_dic, app_dic = dict(), dict(), dict()
+        host_rank_dic = dict()
+        for node in self.node_dic.values():
+            for detail_obj in node.detail_list:
+                service = detail_obj.service
+                instance_dic[service.service_instance_name] = node
+                if service.cluster:
+                    cluster_dic.setdefault(
+                        service.cluster.cluster_name, set()).add(node)
+                app_dic.setdefault(service.service.app_name, set()).add(node)
+                host_rank_dic.setdefault(service.ip, dict()).setdefault(
+                    self.get_rank(detail_obj), set()).add(node)
+
+        for node in self.node_dic.values():
+            for detail_obj in node.detail_list:
+                service = detail_obj.service
+                # 服务实例的依赖关系
+                declared = set()
+                for dep in json.loads(service.service_dependence or "[]"):
+                    declared.add(dep.get("name"))
+                    if dep.get("instance_name") in instance_dic:
+                        node.depends.add(instance_dic[dep["instance_name"]])
+                    elif dep.get("cluster_name") in cluster_dic:
+                        node.depends.update(cluster_dic[dep["cluster_name"]])
+                    else:
+                        node.depends.update(app_dic.get(dep.get("name"), ()))
+                # 服务实例中未体现的应用依赖关系
+                for dep in json.loads(
+                        service.service.app_dependence or "[]"):
+                    if dep.get("name") not in declared:
+                        node.depends.update(app_dic.get(dep.get("name"), ()))
+                # 同一主机上依赖排序靠前的最近一级服务
+                rank = self.get_rank(detail_obj)
+                lower_ranks = [
+                    r for r in host_rank_dic[service.ip] if r < rank]
+                if lower_ranks:
+                    node.depends.update(
+                        host_rank_dic[service.ip][max(lower_ranks)])
+            node.depends.discard(node)
+        for node in self.node_dic.values():
+            for dep in node.depends:
+                dep.dependents.add(node)
+
+    def check_acyclic(self):
+        """ 拓扑排序校验依赖关系无环，并计算各节点的调度优先级 """
+        in_degree = {key: len(n.depends) for key, n in self.node_dic.items()}
+        ready = deque(k for k, v in in_degree.items() if v == 0)
+        order = list()
+        while ready:
+            node = self.node_dic[ready.popleft()]
+            order.append(node)
+            for child in node.dependents:
+                in_degree[child.key] -= 1
+                if in_degree[child.key] == 0:
+                    ready.append(child.key)
+        if len(order) != len(self.node_dic):
+            return False
+        for node in reversed(order):
+            node.height = 1 + max(
+                (child.height for child in node.dependents), default=0)
+        return True
+
+    def build(self):
+        """
+        构建依赖关系图
+        :return: 依赖关系是否无环
+        """
+        self.make_nodes()
+        self.make_edges()
+        if not self.check_acyclic():
+            logger.error("Install dependence has cycle!")
+            return False
+        return True
+
+    def execute_node(self, node):
+        """ 执行单个节点的安装流程 """
+        node.start_time = time.monotonic()
+        try:
+            if node.app_name in HIGH_AVAILABILITY_UTILS:
+                ha_obj = HIGH_AVAILABILITY_UTILS[node.app_name](
+                    self.executor_obj, node.detail_list)
+                ha_obj.high_thread_executor()
+                return not ha_obj.error
+            detail_obj = node.detail_list[0]
+            # 更新单条安装记录的状态
+            detail_obj.install_step_status = \
+                DetailInstallHistory.INSTALL_STATUS_INSTALLING
+            detail_obj.save(update_fields=["install_step_status", "modified"])
+            is_success, _ = self.executor_obj.single_service_executor(
+                detail_obj)
+            return is_success
+        finally:
+            node.end_time = time.monotonic()
+
+    def skip_dependents(self, node):
+        """ 安装失败时跳过全部直接及间接依赖该节点的服务 """
+        queue = deque(node.dependents)
+        while queue:
+            child = queue.popleft()
+            if child.is_skipped:
+                continue
+            child.is_skipped = True
+            logger.info(f"Skip install [{child.name}] for [{node.name}]")
+            queue.extend(child.dependents)
+
+    def run(self):
+        """
+        按依赖关系调度执行安装，依赖全部安装成功的服务立即开始安装，
+        失败服务的下游服务不再安装，其余服务继续执行
+        :return: 是否全部安装成功
+        """
+        in_degree = {key: len(n.depends) for key, n in self.node_dic.items()}
+        ready = [n for n in self.node_dic.values() if not n.depends]
+        host_running = dict()
+        running = dict()
+        all_success = True
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while ready or running:
+                # 优先调度剩余依赖链最长的服务
+                ready.sort(key=lambda x: x.height, reverse=True)
+                for node in list(ready):
+                    if len(running) >= self.max_workers:
+                        break
+                    if node.ip is not None and host_running.get(
+                            node.ip, 0) >= self.host_max_workers:
+                        continue
+                    ready.remove(node)
+                    if node.ip is not None:
+                        host_running[node.ip] = \
+                            host_running.get(node.ip, 0) + 1
+                    running[executor.submit(self.execute_node, node)] = node
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if node.ip is not None:
+                        host_running[node.ip] -= 1
+                    try:
+                        node.is_success = future.result()
+                    except Exception as e:
+                        logger.error(f"Install [{node.name}] error: {str(e)}")
+                        node.is_success = False
+                    if not node.is_success:
+                        all_success = False
+                        self.skip_dependents(node)
+                        continue
+                    for child in node.dependents:
+                        in_degree[child.key] -= 1
+                        if in_degree[child.key] == 0 and not child.is_skipped:
+                            ready.append(child)
+        return all_success
+
+    def critical_path(self):
+        """
+        本次安装的关键路径，从最后完成的服务开始，逐级回溯最晚完成的依赖
+        :return: [InstallNode]
+        """
+        finished = [
+            n for n in self.node_dic.values() if n.end_time is not None]
+        if not finished:
+            return []
+        node = max(finished, key=lambda x: x.end_time)
+        path = [node]
+        while True:
+            depends = [n for n in node.depends if n.end_time is not None]
+            if not depends:
+                break
+            node = max(depends, key=lambda x: x.end_time)
+            path.append(node)
+        return list(reversed(path))
+
+    def report(self):
+        """ 关键路径报告 """
+        path = self.critical_path()
+        if not path:
+            return ""
+        total = path[-1].end_time - path[0].start_time
+        detail = " -> ".join(f"{n.name}({n.cost:.1f}s)" for n in path)
+        return f"关键路径耗时 {total:.1f}s: {detail}"
@@ -35,7 +35,6 @@ from app_store.new_install_utils import (
     SerWithUtils,
     ServiceArgsPortUtils,
     BaseEnvServiceUtils,
-    RedisDB,
     BaseRedisData,
     CreateInstallPlan,
     MakeServiceOrder,
@@ -366,12 +365,8 @@ class CheckInstallInfoSerializer(BaseInstallSerializer):
         :param validated_data:
         :return:
         """
-        _re_obj = RedisDB()
-        _flag, _data = _re_obj.get(
-            name=validated_data["unique_key"] + "_step_2_origin_data"
-        )
-        if not _flag:
-            raise ValidationError(UNIQUE_KEY_ERROR)
+        _data = BaseRedisData(
+            validated_data["unique_key"]).get_step_2_origin_data()
         is_continue = validated_data["data"].get("is_continue")
         if is_continue:
             install = _data["install"]
@@ -648,11 +643,8 @@ class CheckServiceDistributionSerializer(BaseInstallSerializer):
                 if item not in all_install_service:
                     all_install_service[item] = 0
                 all_install_service[item] += 1
-        _re_obj = RedisDB()
-        _flag, _data = _re_obj.get(
-            name=f"{validated_data['unique_key']}_step_4_service_distribution")
-        if not _flag:
-            raise ValidationError(UNIQUE_KEY_ERROR)
+        _data = BaseRedisData(
+            validated_data["unique_key"]).get_step_4_service_distribution()
         for key, value in _data.items():
             if key not in all_install_service:
                 raise ValidationError(f"缺少必须部署的服务{key}")
@@ -8,10 +8,13 @@
 
 import os
 import json
-import pickle
+import time
+import zlib
+import shlex
 import logging
 import traceback
 from copy import deepcopy
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
 import redis
@@ -48,7 +51,19 @@ WEB_CONTAINERS = ["tengine"]
 class RedisDB(object):
     """
     redis数据库管理工具
+    值以带版本号的 json 存储，超过一定大小时压缩；
+    映射类数据以 hash 存储，可只读写部分字段
     """
+    # 存储格式版本号
+    FORMAT_JSON = b"\x01"
+    FORMAT_ZLIB_JSON = b"\x02"
+    # 超过此大小时压缩
+    COMPRESS_SIZE = 1024
+    COMPRESS_LEVEL = 6
+    # hash 中标记存在的字段，使空映射也可以被读取
+    HASH_MARK = "__format__"
+    # 批量删除时每批的 key 数量
+    DELETE_BATCH = 500
 
     def __init__(self):
         """
@@ -61,14 +76,49 @@ class RedisDB(object):
             password=OMP_REDIS_PASSWORD
         )
 
+    @classmethod
+    def dumps(cls, data):
+        """ 序列化 """
+        _raw = json.dumps(
+            data, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+        if len(_raw) > cls.COMPRESS_SIZE:
+            return cls.FORMAT_ZLIB_JSON + zlib.compress(
+                _raw, cls.COMPRESS_LEVEL)
+        return cls.FORMAT_JSON + _raw
+
+    @classmethod
+    def loads(cls, value):
+        """ 反序列化，不支持的格式抛出 ValueError """
+        _format, _body = value[:1], value[1:]
+        if _format == cls.FORMAT_ZLIB_JSON:
+            _body = zlib.decompress(_body)
+        elif _format != cls.FORMAT_JSON:
+            raise ValueError(f"unsupported format: {_format}")
+        return json.loads(_body.decode("utf8"))
+
+    @staticmethod
+    def _log_metric(action, name, size, start):
+        logger.info(
+            f"Redis {action} {name}: {size} bytes, "
+            f"{(time.time() - start) * 1000:.1f}ms")
+
     def delete_keys(self, keyword):
         """
         删除以某个关键字开头的key
         :param keyword: 关键字
         :return:
         """
-        for key in self.conn.scan_iter(f"{keyword}*"):
-            self.conn.delete(key)
+        _keys = list()
+        with self.conn.pipeline(transaction=False) as pipe:
+            for key in self.conn.scan_iter(
+                    f"{keyword}*", count=self.DELETE_BATCH):
+                _keys.append(key)
+                if len(_keys) >= self.DELETE_BATCH:
+                    pipe.delete(*_keys)
+                    _keys = list()
+            if _keys:
+                pipe.delete(*_keys)
+            pipe.execute()
 
     def set(self, name, data, timeout=60 * 60 * 8):
         """
@@ -78,8 +128,10 @@ class RedisDB(object):
         :param timeout: 超时时间
         :return:
         """
-        self.conn.set(name, pickle.dumps(data), ex=timeout)
-        logger.info(f"Insert data to redis:\nname:{name}\ndata:{data}")
+        _start = time.time()
+        _value = self.dumps(data)
+        self.conn.set(name, _value, ex=timeout)
+        self._log_metric("set", name, len(_value), _start)
 
     def get(self, name):
         """
@@ -88,14 +140,14 @@ class RedisDB(object):
         :return:
         """
         try:
-            logger.info(f"Try get data from redis by name: {name}")
+            _start = time.time()
             _obj = self.conn.get(name=name)
             if not _obj:
                 logger.error(
                     f"Failed get data from redis by name: {name}, res is None")
                 return False, None
-            data = pickle.loads(_obj)
-            logger.info(f"Get data from redis by name: {name}, res is {data}")
+            data = self.loads(_obj)
+            self._log_metric("get", name, len(_obj), _start)
             return True, data
         except Exception as e:
             logger.error(
@@ -103,6 +155,66 @@ class RedisDB(object):
                 f"{traceback.format_exc()}")
             return False, None
 
+    def hset(self, name, data, timeout=60 * 60 * 8, replace=True):
+        """
+        以hash存储映射数据，每个键单独序列化
+        :param name: redis键名称
+        :param data: 要存储的映射
+        :type data: dict
+        :param timeout: 超时时间
+        :param replace: 是否覆盖已有的全部字段，否则只更新传入的字段
+        :return:
+        """
+        _start = time.time()
+        _mapping = {key: self.dumps(value) for key, value in data.items()}
+        _mapping[self.HASH_MARK] = self.FORMAT_JSON
+        with self.conn.pipeline() as pipe:
+            if replace:
+                pipe.delete(name)
+            pipe.hset(name, mapping=_mapping)
+            pipe.expire(name, timeout)
+            pipe.execute()
+        self._log_metric(
+            "hset", name, sum(len(el) for el in _mapping.values()), _start)
+
+    def hget(self, name, fields=None):
+        """
+        获取hash存储的映射数据
+        :param name: redis键名称
+        :param fields: 要获取的字段，为空时获取全部
+        :type fields: list
+        :return: 不存在的字段不返回
+        """
+        try:
+            _start = time.time()
+            if fields is None:
+                _obj = self.conn.hgetall(name)
+            else:
+                _fields = [self.HASH_MARK] + list(fields)
+                _obj = {
+                    key: value for key, value in zip(
+                        _fields, self.conn.hmget(name, _fields))
+                    if value is not None
+                }
+            _obj = {
+                key.decode("utf8") if isinstance(key, bytes) else key: value
+                for key, value in _obj.items()
+            }
+            if self.HASH_MARK not in _obj:
+                logger.error(
+                    f"Failed get data from redis by name: {name}, res is None")
+                return False, None
+            _obj.pop(self.HASH_MARK)
+            data = {key: self.loads(value) for key, value in _obj.items()}
+            self._log_metric(
+                "hget", name, sum(len(el) for el in _obj.values()), _start)
+            return True, data
+        except Exception as e:
+            logger.error(
+                f"Error while hget {name} from redis: {str(e)}\n"
+                f"{traceback.format_exc()}")
+            return False, None
+
 
 class BaseRedisData(object):
     """ redis中存储信息配置类 """
@@ -130,6 +242,20 @@ class BaseRedisData(object):
             raise ValidationError(UNIQUE_KEY_ERROR)
         return _data
 
+    def _hget(self, key, fields=None):
+        """
+        根据redis的key获取hash存储的映射数据
+        :param key: redis的key
+        :type key: str
+        :param fields: 要获取的字段，为空时获取全部
+        :type fields: list
+        :return:
+        """
+        _flag, _data = self.redis.hget(name=key, fields=fields)
+        if not _flag:
+            raise ValidationError(UNIQUE_KEY_ERROR)
+        return _data
+
     def step_set_with_ser(self, data):
         """
         设置with服务范围，临时存储，在最终部署的时候添加回来
@@ -304,19 +430,21 @@ class BaseRedisData(object):
                 ).last().app_version,
                 "product": None
             }
-        self.redis.set(
+        self.redis.hset(
             name=self.unique_key + "_step_2_origin_data",
             data=_data
         )
         return _data
 
-    def get_step_2_origin_data(self):
+    def get_step_2_origin_data(self, fields=None):
         """
         获取安装原始数据
+        :param fields: 要获取的字段，install 或 use_exist，为空时获取全部
+        :type fields: list
         :return:
         """
         key = self.unique_key + "_step_2_origin_data"
-        return self._get(key=key)
+        return self._hget(key=key, fields=fields)
 
     def step_3_set_checked_data(self, data):
         """
@@ -379,11 +507,11 @@ class BaseRedisData(object):
                 service_vip_map[item.get("name")] = item.get("vip")
             cluster_name_map[item["name"]] = \
                 item.get("cluster_name")
-        self.redis.set(
+        self.redis.hset(
             name=self.unique_key + "_step_3_cluster_name_map",
             data=cluster_name_map
         )
-        self.redis.set(
+        self.redis.hset(
             name=self.unique_key + "_step3_service_vip_map",
             data=service_vip_map
         )
@@ -402,7 +530,7 @@ class BaseRedisData(object):
         :return:
         """
         key = self.unique_key + "_step_3_cluster_name_map"
-        return self._get(key=key)
+        return self._hget(key=key)
 
     def get_step3_service_vip_map(self):
         """
@@ -410,7 +538,7 @@ class BaseRedisData(object):
         :return:
         """
         key = self.unique_key + "_step3_service_vip_map"
-        return self._get(key=key)
+        return self._hget(key=key)
 
     def step_4_set_service_distribution(self, data):
         """
@@ -437,7 +565,7 @@ class BaseRedisData(object):
         :type data: dict
         :return:
         """
-        self.redis.set(
+        self.redis.hset(
             name=self.unique_key + "_step_4_service_distribution",
             data=data
         )
@@ -448,7 +576,7 @@ class BaseRedisData(object):
         :return:
         """
         key = self.unique_key + "_step_4_service_distribution"
-        return self._get(key=key)
+        return self._hget(key=key)
 
     def step_5_set_host_and_service_map(self, host_list, host_service_map):
         """
@@ -480,7 +608,7 @@ class BaseRedisData(object):
             name=self.unique_key + "_step_5_host_list",
             data=host_list
         )
-        self.redis.set(
+        self.redis.hset(
             name=self.unique_key + "_step_5_host_service_map",
             data=host_service_map
         )
@@ -493,13 +621,15 @@ class BaseRedisData(object):
         key = self.unique_key + "_step_5_host_list"
         return self._get(key=key)
 
-    def get_step_5_host_service_map(self):
+    def get_step_5_host_service_map(self, ips=None):
         """
         获取本次服务部署涉及到主机与服务的映射关系
+        :param ips: 要获取的主机，为空时获取全部
+        :type ips: list
         :return:
         """
         key = self.unique_key + "_step_5_host_service_map"
-        return self._get(key=key)
+        return self._hget(key=key, fields=ips)
 
     def step_6_set_final_data(self, data):
         """
@@ -529,14 +659,16 @@ class BaseRedisData(object):
         host_user_dic = dict()
         for item in host_user_lst:
             host_user_dic[item["ip"]] = item["username"]
-        self.redis.set(self.unique_key + "_host_user_map", data=host_user_dic)
+        self.redis.hset(self.unique_key + "_host_user_map", data=host_user_dic)
 
-    def get_host_user_map(self):
+    def get_host_user_map(self, ips=None):
         """
         获取主机与用户映射关系
+        :param ips: 要获取的主机，为空时获取全部
+        :type ips: list
         :return:
         """
-        return self._get(self.unique_key + "_host_user_map")
+        return self._hget(self.unique_key + "_host_user_map", fields=ips)
 
 
 def check_package_exists(app_obj):
@@ -1312,8 +1444,121 @@ class ServiceArgsPortUtils(object):
         return app_install_args
 
 
+class RemotePreCheck(object):
+    """
+    远程端口及路径预检查
+    按主机汇总所有待检查的端口和路径，每台主机只执行一次 salt 命令，
+    命令以 json 格式返回各项检查结果，各主机并发执行
+    """
+    # 单台主机检查的 salt 超时时间
+    timeout = 30
+    # 并发检查的最大主机数
+    max_workers = 50
+
+    def __init__(self):
+        # {ip: {"ports": OrderedDict, "paths": OrderedDict}}
+        self.checks = dict()
+        # {ip: (是否执行成功, 错误信息)}
+        self.host_status = dict()
+
+    def _host(self, ip):
+        return self.checks.setdefault(
+            ip, {"ports": OrderedDict(), "paths": OrderedDict()})
+
+    def add_port(self, ip, port):
+        """ 添加待检查的端口 """
+        self._host(ip)["ports"][str(port)] = None
+
+    def add_path(self, ip, path):
+        """ 添加待检查的路径 """
+        self._host(ip)["paths"][path] = None
+
+    def make_command(self, ip):
+        """
+        生成单台主机的检查命令，输出格式为
+        {"ports": [0, 1, ...], "paths": [0, 1, ...]}，1 表示端口已被占用或路径已存在
+        """
+        host = self.checks[ip]
+        cmd_lst = ["printf '{\"ports\": ['"]
+        for index, port in enumerate(host["ports"]):
+            if index:
+                cmd_lst.append("printf ,")
+            cmd_lst.append(
+                f"(</dev/tcp/{ip}/{port}) 2>/dev/null "
+                f"&& printf 1 || printf 0")
+        cmd_lst.append("printf '], \"paths\": ['")
+        for index, path in enumerate(host["paths"]):
+            if index:
+                cmd_lst.append("printf ,")
+            cmd_lst.append(f"test -d {shlex.quote(path)} "
+                           f"&& printf 1 || printf 0")
+        cmd_lst.append("printf ']}'")
+        return "; ".join(cmd_lst)
+
+    def check_host(self, ip):
+        """ 执行单台主机的检查 """
+        host = self.checks[ip]
+        _flag, _msg = SaltClient().cmd(
+            target=ip,
+            command=self.make_command(ip),
+            timeout=self.timeout
+        )
+        if not _flag:
+            return False, _msg
+        try:
+            _res = json.loads(_msg.strip().splitlines()[-1])
+            if len(_res["ports"]) != len(host["ports"]) or \
+                    len(_res["paths"]) != len(host["paths"]):
+                raise ValueError("result length mismatch")
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            logger.error(f"RemotePreCheck parse {ip} result failed: "
+                         f"{_msg}; {str(e)}")
+            return False, f"检查结果解析失败: {_msg}"
+        for key, value in zip(host["ports"], _res["ports"]):
+            host["ports"][key] = bool(value)
+        for key, value in zip(host["paths"], _res["paths"]):
+            host["paths"][key] = bool(value)
+        return True, ""
+
+    def run(self):
+        """ 并发执行所有主机的检查 """
+        if not self.checks:
+            return self
+        thread_p = ThreadPoolExecutor(
+            max_workers=min(len(self.checks), self.max_workers),
+            thread_name_prefix="remote_pre_check_"
+        )
+        futures_list = [
+            (ip, thread_p.submit(self.check_host, ip)) for ip in self.checks
+        ]
+        for ip, future in futures_list:
+            try:
+                self.host_status[ip] = future.result()
+            except Exception as e:
+                logger.error(f"RemotePreCheck {ip} failed: {str(e)}")
+                self.host_status[ip] = (False, str(e))
+        thread_p.shutdown(wait=True)
+        return self
+
+    def port_used(self, ip, port):
+        """ 端口是否已被占用，主机检查失败时视为未占用 """
+        return bool(self.checks.get(ip, {}).get(
+            "ports", {}).get(str(port)))
+
+    def path_exists(self, ip, path):
+        """
+        路径是否已存在
+        :return: 主机检查失败时返回 None
+        """
+        if not self.host_status.get(ip, (False,))[0]:
+            return None
+        return self.checks[ip]["paths"].get(path)
+
+
 class ValidateInstallService(object):
     """ 检查要安装的服务信息是否准确 """
+    port_field = "app_port"
+    args_field = "app_install_args"
 
     def __init__(self, data=None):
         """
@@ -1327,35 +1572,42 @@ class ValidateInstallService(object):
             )
         self.data = data
 
-    def check_service_port(self, app_port, ip):  # NOQA
+    def check_service_port(self, app_port, ip, pre_check):  # NOQA
         """
         检查服务端口
         :param app_port: 服务端口列表
         :type app_port: list
         :param ip: 主机ip地址
         :type ip: str
+        :param pre_check: 远程预检查结果
+        :type pre_check: RemotePreCheck
         :return:
         """
-        salt_obj = SaltClient()
         for el in app_port:
             _port = el.get("default", "")
             if not _port or not str(_port).isnumeric():
                 el["check_flag"] = False
                 el["error_msg"] = f"端口 {_port} 必须为数字"
                 continue
-            # method1: 从OMP本机查看端口是否已被占用
-            # _flag, _msg = public_utils.check_ip_port(ip=ip, port=int(_port))
-            # method2: 从目标服务器查看端口是否被占用
-            _flag, _msg = salt_obj.cmd(
-                target=ip,
-                command=f"</dev/tcp/{ip}/{_port}",
-                timeout=10
-            )
-            if _flag:
+            # 从目标服务器查看端口是否被占用
+            if pre_check.port_used(ip, _port):
                 el["error_msg"] = f"主机 {ip} 上的端口 {_port} 已被占用"
         return app_port
 
-    def check_service_args(self, app_install_args, data_path, ip):  # NOQA
+    def check_path(self, el, ip, pre_check):  # NOQA
+        """ 根据远程预检查结果检查路径 """
+        _tobe_check_path = el.get("default", "")
+        _exists = pre_check.path_exists(ip, _tobe_check_path)
+        if _exists is None:
+            el["error_msg"] = \
+                f"无法确定该路径状态: {_tobe_check_path}; " \
+                f"请检查主机及主机Agent状态是否正常"
+        elif _exists:
+            el["check_flag"] = False
+            el["error_msg"] = f"{_tobe_check_path} 在目标主机 {ip} 上已存在"
+
+    def check_service_args(self, app_install_args, data_path, ip,
+                           pre_check):  # NOQA
         """
         检查服务的安装参数，路径检查
         :param app_install_args: 服务安装参数
@@ -1364,79 +1616,78 @@ class ValidateInstallService(object):
         :type data_path: str
         :param ip: 主机ip地址
         :type ip: str
+        :param pre_check: 远程预检查结果
+        :type pre_check: RemotePreCheck
         :return:
         """
-        _salt_obj = SaltClient()
         for el in app_install_args:
             if "dir_key" not in el:
                 continue
-            # 直接封装部署数据到数据库中
-            _tobe_check_path = el["default"]
-            _cmd = \
-                f"test -d {_tobe_check_path} && echo 'EXISTS' || echo 'OK'"
-            _flag, _msg = _salt_obj.cmd(
-                target=ip,
-                command=_cmd,
-                timeout=10
-            )
-            if not _flag:
-                el["error_msg"] = \
-                    f"无法确定该路径状态: {_tobe_check_path}; " \
-                    f"请检查主机及主机Agent状态是否正常"
-                continue
-            if "OK" not in _msg:
-                el["check_flag"] = False
-                el["error_msg"] = f"{_tobe_check_path} 在目标主机 {ip} 上已存在"
+            self.check_path(el, ip, pre_check)
         return app_install_args
 
-    def check_single_service(self, dic):  # NOQA
+    def add_pre_check(self, dic, pre_check):
+        """ 汇总单个服务待远程检查的端口及路径 """
+        _ip = dic.get("ip")
+        for el in dic.get(self.port_field, []):
+            _port = el.get("default", "")
+            if _port and str(_port).isnumeric():
+                pre_check.add_port(_ip, _port)
+        for el in dic.get(self.args_field, []):
+            if "dir_key" in el:
+                pre_check.add_path(_ip, el.get("default", ""))
+
+    def check_single_service(self, dic, host_map, pre_check):  # NOQA
         """
         检查单个服务的安装信息
         :param dic: 服务安装信息
         :type dic: dict
+        :param host_map: 主机ip与主机对象的映射
+        :type host_map: dict
+        :param pre_check: 远程预检查结果
+        :type pre_check: RemotePreCheck
         :return:
         """
-        _dic = deepcopy(dic)
-        _ip = _dic.get("ip")
-        _host_obj = Host.objects.filter(ip=_ip).last()
+        _ip = dic.get("ip")
+        _host_obj = host_map.get(_ip)
         if not _host_obj:
-            _dic["error_msg"] = f"主机 {_ip} 不存在"
-            return _dic
-        _data_path = _host_obj.data_folder
+            dic["error_msg"] = f"主机 {_ip} 不存在"
+            return dic
         # 检查端口是否被占用
-        app_port = self.check_service_port(
-            app_port=_dic.get("app_port", []),
-            ip=_ip
+        dic[self.port_field] = self.check_service_port(
+            app_port=dic.get(self.port_field, []),
+            ip=_ip,
+            pre_check=pre_check
         )
         # 校验安装参数
-        app_install_args = self.check_service_args(
-            app_install_args=_dic.get("app_install_args", []),
-            data_path=_data_path,
-            ip=_ip
+        dic[self.args_field] = self.check_service_args(
+            app_install_args=dic.get(self.args_field, []),
+            data_path=_host_obj.data_folder,
+            ip=_ip,
+            pre_check=pre_check
         )
-        _dic["app_port"] = app_port
-        _dic["app_install_args"] = app_install_args
-        return _dic
+        return dic
 
     def run(self):
         """
-        运行检查入口函数
+        运行检查入口函数，所有端口及路径按主机汇总后每台主机检查一次
         :return:
         """
-        thread_p = ThreadPoolExecutor(
-            max_workers=10, thread_name_prefix="check_install_service_"
-        )
-        # futures_list:[(item, future)]
-        futures_list = list()
-        for item in self.data:
-            future = thread_p.submit(self.check_single_service, item)
-            futures_list.append((item.get("service_instance_name"), future))
+        data = [deepcopy(item) for item in self.data]
+        host_map = {
+            el.ip: el for el in Host.objects.filter(
+                ip__in={item.get("ip") for item in data})
+        }
+        pre_check = RemotePreCheck()
+        for item in data:
+            if item.get("ip") in host_map:
+                self.add_pre_check(item, pre_check)
+        pre_check.run()
         # result_list:[{}, ...]
-        result_list = list()
-        for f in futures_list:
-            result_list.append(f[1].result())
-        thread_p.shutdown(wait=True)
-        return result_list
+        return [
+            self.check_single_service(item, host_map, pre_check)
+            for item in data
+        ]
 
 
 class BaseEnvServiceUtils(object):
@@ -1919,7 +2170,7 @@ class CreateInstallPlan(object):
 
         exist_data = BaseRedisData(
             unique_key=self.unique_key
-        ).get_step_2_origin_data().get("use_exist")
+        ).get_step_2_origin_data(fields=["use_exist"]).get("use_exist")
         for item in lst:
             # 已存在的base_env服务依赖
             _dep_obj = ApplicationHub.objects.filter(
@@ -2151,62 +2402,34 @@ class MakeServiceOrder(object):
         return final_lst
 
 
-class ValidateInstallServicePortArgs(object):
+class ValidateInstallServicePortArgs(ValidateInstallService):
     """ 检查要安装的服务信息是否准确 """
+    port_field = "ports"
+    args_field = "install_args"
 
-    def __init__(self, data=None):
-        """
-        初始化方法
-        :param data: 要被检验的服务信息
-        :type data: list
-        """
-        if not data or not isinstance(data, list):
-            raise GeneralError(
-                "ValidateInstallService __init__ arg error: data"
-            )
-        self.data = data
-
-    def check_service_port(self, app_port, ip):  # NOQA
-        """
-        检查服务端口
-        :param app_port: 服务端口列表
-        :type app_port: list
-        :param ip: 主机ip地址
-        :type ip: str
-        :return:
-        """
-        salt_obj = SaltClient()
+    def check_service_port(self, app_port, ip, pre_check):  # NOQA
+        app_port = super(ValidateInstallServicePortArgs, self).\
+            check_service_port(app_port, ip, pre_check)
         for el in app_port:
-            _port = el.get("default", "")
-            if not _port or not str(_port).isnumeric():
-                el["check_flag"] = False
-                el["error_msg"] = f"端口 {_port} 必须为数字"
-                continue
-            # method1: 从OMP本机查看端口是否已被占用
-            # _flag, _msg = public_utils.check_ip_port(ip=ip, port=int(_port))
-            # method2: 从目标服务器查看端口是否被占用
-            _flag, _msg = salt_obj.cmd(
-                target=ip,
-                command=f"</dev/tcp/{ip}/{_port}",
-                timeout=10
-            )
-            if _flag:
+            if el.get("error_msg"):
                 el["check_flag"] = False
-                el["error_msg"] = f"主机 {ip} 上的端口 {_port} 已被占用"
         return app_port
 
-    def check_service_args(self, app_install_args, data_path, ip):  # NOQA
-        """
-        检查服务的安装参数，路径检查
-        :param app_install_args: 服务安装参数
-        :type app_install_args: list
-        :param data_path: 主机数据目录
-        :type data_path: str
-        :param ip: 主机ip地址
-        :type ip: str
-        :return:
-        """
-        _salt_obj = SaltClient()
+    def check_path(self, el, ip, pre_check):  # NOQA
+        super(ValidateInstallServicePortArgs, self).check_path(
+            el, ip, pre_check)
+        if el.get("error_msg"):
+            el["check_flag"] = False
+
+    def check_single_service(self, dic, host_map, pre_check):  # NOQA
+        dic = super(ValidateInstallServicePortArgs, self).\
+            check_single_service(dic, host_map, pre_check)
+        if dic.get("ip") not in host_map:
+            dic["check_flag"] = False
+        return dic
+
+    def check_service_args(self, app_install_args, data_path, ip,
+                           pre_check):  # NOQA
         for el in app_install_args:
             if el.get("key") == "instance_name" and Service.split_objects.filter(
                     service_instance_name=el.get("default")
@@ -2216,72 +2439,5 @@ class ValidateInstallServicePortArgs(object):
                 continue
             if "dir_key" not in el:
                 continue
-            _tobe_check_path = el.get("default", "")
-            _cmd = \
-                f"test -d {_tobe_check_path} && echo 'EXISTS' || echo 'OK'"
-            _flag, _msg = _salt_obj.cmd(
-                target=ip,
-                command=_cmd,
-                timeout=10
-            )
-            if not _flag:
-                el["check_flag"] = False
-                el["error_msg"] = \
-                    f"无法确定该路径状态: {_tobe_check_path}; " \
-                    f"请检查主机及主机Agent状态是否正常"
-                continue
-            if "OK" not in _msg:
-                el["check_flag"] = False
-                el["error_msg"] = f"{_tobe_check_path} 在目标主机 {ip} 上已存在"
+            self.check_path(el, ip, pre_check)
         return app_install_args
-
-    def check_single_service(self, dic):  # NOQA
-        """
-        检查单个服务的安装信息
-        :param dic: 服务安装信息
-        :type dic: dict
-        :return:
-        """
-        _dic = deepcopy(dic)
-        _ip = _dic.get("ip")
-        _host_obj = Host.objects.filter(ip=_ip).last()
-        if not _host_obj:
-            _dic["check_flag"] = False
-            _dic["error_msg"] = f"主机 {_ip} 不存在"
-            return _dic
-        _data_path = _host_obj.data_folder
-        # 检查端口是否被占用
-        app_port = self.check_service_port(
-            app_port=_dic.get("ports", []),
-            ip=_ip
-        )
-        # 校验安装参数
-        app_install_args = self.check_service_args(
-            app_install_args=_dic.get("install_args", []),
-            data_path=_data_path,
-            ip=_ip
-        )
-        _dic["ports"] = app_port
-        _dic["install_args"] = app_install_args
-        return _dic
-
-    def run(self):
-        """
-        运行检查入口函数
-        :return:
-        """
-        thread_p = ThreadPoolExecutor(
-            max_workers=10, thread_name_prefix="check_install_service_"
-        )
-        # futures_list:[(item, future)]
-        futures_list = list()
-        for item in self.data:
-            future = thread_p.submit(self.check_single_service, item)
-            futures_list.append((item.get("instance_name"), future))
-        # result_list:[{}, ...]
-        result_list = list()
-        for f in futures_list:
-            result_list.append(f[1].result())
-        thread_p.shutdown(wait=True)
-        # TODO 整体服务间的关键校验
-        return result_list
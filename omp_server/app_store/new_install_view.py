@@ -19,9 +19,10 @@ from rest_framework.mixins import (
 from db_models.models import (
     ApplicationHub, ProductHub, Product, Service,
     MainInstallHistory, DetailInstallHistory, Host,
-    PreInstallHistory, PostInstallHistory
+    PreInstallHistory, PostInstallHistory, ExecutionEventLog
 )
 from utils.common.exceptions import ValidationError
+from utils.plugin.event_log import read_event_log
 from utils.common.paginations import PageNumberPager
 # from app_store.install_utils import ServiceArgsSerializer
 from app_store.new_install_utils import ServiceArgsPortUtils
@@ -180,8 +181,10 @@ class GetInstallArgsByIpView(GenericViewSet, ListModelMixin):
         if not unique_key or not ip:
             return Response(
                 data={"error_msg": "请求参数必须包含[unique_key]和[ip]"})
-        _data = BaseRedisData(unique_key).get_step_5_host_service_map()
-        check_data = BaseRedisData(unique_key).get_step_2_origin_data()
+        _data = BaseRedisData(unique_key).get_step_5_host_service_map(
+            ips=[ip])
+        check_data = BaseRedisData(unique_key).get_step_2_origin_data(
+            fields=["install"])
         install_ser = check_data.get("install")
         services_lst = _data.get(ip, [])
         app_lst = ApplicationHub.objects.filter(app_name__in=services_lst)
@@ -370,6 +373,10 @@ class ShowSingleServiceInstallLogView(GenericViewSet, ListModelMixin):
         ip = request.query_params.get("ip")
         app_name = request.query_params.get("app_name")
         unique_key = request.query_params.get("unique_key")
+        # 已读取的日志序号，传入时仅返回该序号之后的安装过程日志
+        since = request.query_params.get("since")
+        if since is not None and not str(since).isdigit():
+            raise ValidationError("请求参数[since]必须为非负整数")
         lst = [
             "send_msg", "unzip_msg", "install_msg",
             "init_msg", "start_msg", "post_action_msg"
@@ -395,8 +402,12 @@ class ShowSingleServiceInstallLogView(GenericViewSet, ListModelMixin):
                 _log += getattr(detail, item, "")
             return _log
 
-        log = get_log(detail)
-        return Response(data={"log": log})
+        log, seq = read_event_log(
+            ExecutionEventLog.MODULE_INSTALL, detail.id, int(since or 0))
+        if since is None:
+            # 无安装过程日志的历史记录使用详情表中的日志
+            log = log + detail.post_action_msg if seq else get_log(detail)
+        return Response(data={"log": log, "seq": seq})
 
 
 class MainInstallHistoryView(GenericViewSet, ListModelMixin):
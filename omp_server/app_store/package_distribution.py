@@ -0,0 +1,322 @@
+"""
+安装包分发
+安装前按 (安装包, 主机) 去重后统一分发，同一主机上的多个服务实例只发送一次，
+目标主机上已存在且 md5 一致的安装包不再发送；
+开启节点间分发后，已获得安装包的主机作为分发源，按树形逐轮扩散，
+降低 OMP 服务端出口带宽对大规模部署的限制
+"""
+import os
+import re
+import shlex
+import logging
+import secrets
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from db_models.models import Host
+from utils.plugin.salt_client import SaltClient
+from utils.parse_config import THREAD_POOL_MAX_WORKERS
+from utils.parse_config import PACKAGE_DISTRIBUTION
+
+logger = logging.getLogger("server")
+
+# 由 OMP 服务端发送
+MASTER_SOURCE = "master"
+
+
+class DistributionTask:
+    """ 单个安装包在单台主机上的分发任务 """
+
+    def __init__(self, package_key, ip, target_path):
+        self.package_key = package_key
+        self.ip = ip
+        self.target_path = target_path
+        # 分发源，已存在时为 None
+        self.source = None
+        self.is_success = False
+        self.message = ""
+        # 节点间分发失败后仅由 OMP 服务端发送
+        self.master_only = False
+
+
+class PackageDistributor:
+    """ 安装包分发器 """
+
+    def __init__(self, detail_obj_lst, max_workers=THREAD_POOL_MAX_WORKERS,
+                 peer_enabled=PACKAGE_DISTRIBUTION.get("peer_enabled", False),
+                 fanout=PACKAGE_DISTRIBUTION.get("fanout", 3),
+                 peer_port=PACKAGE_DISTRIBUTION.get("peer_port", 19099),
+                 peer_ttl=PACKAGE_DISTRIBUTION.get("peer_ttl", 3600)):
+        """
+        :param detail_obj_lst: 待安装的 DetailInstallHistory 列表
+        :param max_workers: 同时进行的分发任务数
+        :param peer_enabled: 是否开启节点间分发
+        :param fanout: 每轮每个分发源最多发送的主机数
+        :param peer_port: 分发源主机上临时文件服务端口
+        :param peer_ttl: 临时文件服务最长存活时间，单位秒
+        """
+        self.detail_obj_lst = detail_obj_lst
+        self.max_workers = max_workers
+        self.peer_enabled = peer_enabled
+        self.fanout = max(int(fanout), 1)
+        self.peer_port = peer_port
+        self.peer_ttl = peer_ttl
+        self.salt_client = SaltClient()
+        # {(md5, package_name): source_path}
+        self.package_dic = dict()
+        # {(md5, package_name): {ip: DistributionTask}}
+        self.task_dic = dict()
+        # 已启动临时文件服务的主机 {ip: 临时文件服务信息}
+        self.peer_servers = dict()
+        self.lock = threading.Lock()
+
+    def make_tasks(self):
+        """ 计算需要分发的 (安装包, 主机)，已发送成功的服务实例不再计算 """
+        ips = {
+            detail_obj.service.ip for detail_obj in self.detail_obj_lst
+            if detail_obj.send_flag != 2
+        }
+        data_folder_dic = dict(
+            Host.objects.filter(ip__in=ips).values_list("ip", "data_folder"))
+        for detail_obj in self.detail_obj_lst:
+            ip = detail_obj.service.ip
+            if detail_obj.send_flag == 2 or ip not in data_folder_dic:
+                continue
+            app_package = detail_obj.service.service.app_package
+            package_key = (app_package.package_md5, app_package.package_name)
+            self.package_dic[package_key] = os.path.join(
+                app_package.package_path, app_package.package_name)
+            self.task_dic.setdefault(package_key, dict()).setdefault(
+                ip, DistributionTask(package_key, ip, os.path.join(
+                    data_folder_dic[ip], "omp_packages",
+                    app_package.package_name)))
+
+    def check_exists(self):
+        """ 每台主机执行一次 md5sum，校验目标路径下已存在的安装包 """
+        host_dic = dict()
+        for ip_dic in self.task_dic.values():
+            for ip, task in ip_dic.items():
+                host_dic.setdefault(ip, list()).append(task)
+
+        def _check(ip, tasks):
+            paths = " ".join(sorted({task.target_path for task in tasks}))
+            try:
+                is_success, message = self.salt_client.cmd(
+                    target=ip, command=f"md5sum {paths} 2>/dev/null || true",
+                    timeout=60, real_timeout=600)
+            except Exception as e:
+                is_success, message = False, str(e)
+            if not is_success:
+                logger.info(f"Check package md5 failed on [{ip}]: {message}")
+                return
+            md5_dic = dict()
+            for line in message.splitlines():
+                values = line.split()
+                if len(values) == 2:
+                    md5_dic[values[1]] = values[0]
+            for task in tasks:
+                if md5_dic.get(task.target_path) == task.package_key[0]:
+                    task.is_success = True
+                    task.message = "目标主机已存在安装包"
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for ip, tasks in host_dic.items():
+                executor.submit(_check, ip, tasks)
+
+    def start_peer_server(self, ip, target_path):
+        """
+        在分发源主机上提供安装包下载，超过存活时间后自动退出
+        安装包硬链接到随机命名的临时目录中，文件服务只提供该目录，
+        避免同目录下的其它文件（如部署信息）被下载
+        :return: (是否成功, 下载地址)
+        """
+        package_name = os.path.basename(target_path)
+        with self.lock:
+            server = self.peer_servers.get(ip)
+            if server is None:
+                token = secrets.token_hex(16)
+                server = self.peer_servers[ip] = {
+                    "root": os.path.join(
+                        os.path.dirname(target_path), f".omp_peer_{token}"),
+                    "token": token,
+                    "pid": None,
+                    "lock": threading.Lock(),
+                    "packages": set(),
+                }
+        with server["lock"]:
+            url = f"http://{ip}:{self.peer_port}/{server['token']}/" \
+                  f"{package_name}"
+            if package_name in server["packages"]:
+                return True, url
+            share_dir = os.path.join(server["root"], server["token"])
+            # 空的 index.html 避免目录列表暴露文件名
+            command = \
+                f"mkdir -p {share_dir} && chmod 700 {server['root']} && " \
+                f"touch {server['root']}/index.html {share_dir}/index.html" \
+                f" && ln -f {target_path} {share_dir}/{package_name}"
+            if server["pid"] is None:
+                python2_server = \
+                    "import sys, BaseHTTPServer, SimpleHTTPServer; " \
+                    "BaseHTTPServer.HTTPServer((sys.argv[1], " \
+                    "int(sys.argv[2])), SimpleHTTPServer." \
+                    "SimpleHTTPRequestHandler).serve_forever()"
+                command += \
+                    f" && cd {server['root']} && " \
+                    f"if command -v python3 >/dev/null 2>&1; then " \
+                    f"set -- python3 -m http.server {self.peer_port} " \
+                    f"--bind {ip}; else set -- python -c " \
+                    f"{shlex.quote(python2_server)} {ip} {self.peer_port}; " \
+                    f"fi; nohup timeout {self.peer_ttl} \"$@\" " \
+                    f">/dev/null 2>&1 & pid=$!; sleep 1; " \
+                    f"kill -0 $pid && echo \"peer_pid:$pid\""
+            is_success, message = self.salt_client.cmd(
+                target=ip, command=command, timeout=60)
+            if is_success and server["pid"] is None:
+                match = re.search(r"peer_pid:(\d+)", str(message))
+                if match:
+                    server["pid"] = match.group(1)
+                else:
+                    is_success = False
+            if not is_success:
+                logger.info(f"Start peer server failed on [{ip}]: {message}")
+                return False, url
+            server["packages"].add(package_name)
+        return True, url
+
+    def stop_peer_servers(self):
+        """ 分发结束后按进程号关闭全部临时文件服务，并删除临时目录 """
+        for ip, server in self.peer_servers.items():
+            command = f"rm -rf {server['root']}"
+            if server["pid"]:
+                command = f"kill {server['pid']} 2>/dev/null; {command}"
+            self.salt_client.cmd(target=ip, command=command, timeout=60)
+
+    def push_from_master(self, task):
+        """ 由 OMP 服务端发送安装包 """
+        return self.salt_client.cp_file(
+            target=task.ip,
+            source_path=self.package_dic[task.package_key],
+            target_path=task.target_path)
+
+    def push_from_peer(self, task, source_task):
+        """ 目标主机从分发源主机拉取安装包，校验 md5 后替换 """
+        is_success, url = self.start_peer_server(
+            source_task.ip, source_task.target_path)
+        if not is_success:
+            return False, f"分发源 {source_task.ip} 临时文件服务启动失败"
+        md5 = task.package_key[0]
+        tmp_path = f"{task.target_path}.omp_tmp"
+        command = \
+            f"mkdir -p {os.path.dirname(task.target_path)} && " \
+            f"curl -sf --connect-timeout 5 -o {tmp_path} {url} && " \
+            f"echo '{md5}  {tmp_path}' | md5sum -c --status && " \
+            f"mv -f {tmp_path} {task.target_path} || " \
+            f"(rm -f {tmp_path}; exit 1)"
+        return self.salt_client.cmd(
+            target=task.ip, command=command, timeout=60, real_timeout=600)
+
+    def execute_task(self, task, source_task):
+        """ 执行单个分发任务 """
+        try:
+            if source_task is None:
+                task.source = MASTER_SOURCE
+                is_success, message = self.push_from_master(task)
+            else:
+                task.source = source_task.ip
+                is_success, message = self.push_from_peer(task, source_task)
+        except Exception as e:
+            logger.error(
+                f"Distribute [{task.package_key[1]}] to [{task.ip}] "
+                f"raised: {traceback.format_exc()}")
+            is_success, message = False, str(e)
+        if not is_success:
+            logger.info(
+                f"Distribute [{task.package_key[1]}] to [{task.ip}] "
+                f"from [{task.source}] failed: {message}")
+            if source_task is not None:
+                # 节点间分发失败，下一轮由 OMP 服务端发送
+                task.master_only = True
+                return
+        task.is_success = is_success
+        task.message = str(message)
+
+    def assign(self, ip_dic, failed_set):
+        """
+        为单个安装包分配本轮的分发源
+        :return: [(task, source_task)]，source_task 为 None 时由服务端发送
+        """
+        pending = [
+            task for ip, task in ip_dic.items()
+            if not task.is_success and ip not in failed_set
+        ]
+        if not self.peer_enabled:
+            return [(task, None) for task in pending]
+        sources = [task for task in ip_dic.values() if task.is_success]
+        slots = [None] * self.fanout
+        for source_task in sources:
+            slots.extend([source_task] * self.fanout)
+        assignment = list()
+        for task in sorted(pending, key=lambda x: x.master_only):
+            if task.master_only:
+                if None not in slots:
+                    continue
+                slots.remove(None)
+                assignment.append((task, None))
+                continue
+            if not slots:
+                break
+            # 优先使用节点分发源，减少 OMP 服务端发送
+            assignment.append((task, slots.pop()))
+        return assignment
+
+    def run(self):
+        """
+        分发全部安装包
+        :return: {(ip, package_name): (is_success, message)}
+        """
+        self.make_tasks()
+        if not self.task_dic:
+            return dict()
+        self.check_exists()
+        # 服务端发送失败的主机不再重试，由后续发送步骤处理
+        failed_dic = {key: set() for key in self.task_dic}
+        try:
+            while True:
+                assignment = list()
+                for package_key, ip_dic in self.task_dic.items():
+                    assignment.extend(
+                        self.assign(ip_dic, failed_dic[package_key]))
+                if not assignment:
+                    break
+                with ThreadPoolExecutor(self.max_workers) as executor:
+                    for task, source_task in assignment:
+                        executor.submit(self.execute_task, task, source_task)
+                for task, source_task in assignment:
+                    if source_task is None and not task.is_success:
+                        failed_dic[task.package_key].add(task.ip)
+        finally:
+            if self.peer_servers:
+                self.stop_peer_servers()
+        return {
+            (task.ip, package_key[1]): (task.is_success, task.message)
+            for package_key, ip_dic in self.task_dic.items()
+            for task in ip_dic.values()
+        }
+
+    def report(self):
+        """ 分发统计 """
+        count_dic = {"exists": 0, MASTER_SOURCE: 0, "peer": 0, "failed": 0}
+        for ip_dic in self.task_dic.values():
+            for task in ip_dic.values():
+                if not task.is_success:
+                    count_dic["failed"] += 1
+                elif task.source is None:
+                    count_dic["exists"] += 1
+                elif task.source == MASTER_SOURCE:
+                    count_dic[MASTER_SOURCE] += 1
+                else:
+                    count_dic["peer"] += 1
+        return f"安装包分发: 已存在 {count_dic['exists']}, " \
+               f"服务端发送 {count_dic[MASTER_SOURCE]}, " \
+               f"节点间发送 {count_dic['peer']}, 失败 {count_dic['failed']}"
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Project: package_verifier
+# Create time: 2022-03-20
+# Introduction:
+
+"""
+安装包流式校验
+以数据流方式顺序读取一次安装包，读取过程中计算 md5，
+只解出校验所需的 yaml 及图片，产品包内的服务包在读取时计算 md5，不落盘；
+完整解压只在发布时直接解压到 verified 目标路径
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import tarfile
+import zlib
+
+from celery.utils.log import get_task_logger
+
+logging.getLogger("paramiko").setLevel(logging.WARNING)
+logger = get_task_logger("celery_log")
+
+# 单次读取的大小
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashReader(object):
+    """ 读取文件的同时计算 md5 """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        return data
+
+    def hexdigest(self):
+        """ 读完剩余内容后返回 md5，tar 结尾的填充块不会被 tarfile 读取 """
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.md5.hexdigest()
+
+
+def member_path(name):
+    """
+    归一化包内文件路径，去掉开头的 ./
+    :return: 不安全的路径返回 None
+    """
+    path = os.path.normpath(name)
+    if os.path.isabs(path) or path == ".." or path.startswith("../"):
+        return None
+    return path
+
+
+class UnsafeMemberError(Exception):
+    """ 包内文件解压后会超出目标路径 """
+
+
+# 解压时拒绝的不安全文件
+UNSAFE_MEMBER_ERRORS = (UnsafeMemberError,) + (
+    (tarfile.FilterError,) if hasattr(tarfile, "FilterError") else ())
+
+
+def is_within(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def extract_member(tar, member, target_dir):
+    """
+    解压单个文件，符号链接及已存在的符号链接目录不能指向目标路径以外
+    支持 tar 过滤器时使用 data 过滤器，否则按真实路径检查
+    """
+    if hasattr(tarfile, "data_filter"):
+        tar.extract(member, target_dir, filter="data")
+        return
+    root = os.path.realpath(target_dir)
+    parent = os.path.realpath(
+        os.path.join(root, os.path.dirname(member.name)))
+    if not is_within(parent, root):
+        raise UnsafeMemberError(f"{member.name} 的上级路径指向 {parent}")
+    if member.issym():
+        link = os.path.realpath(os.path.join(parent, member.linkname))
+        if os.path.isabs(member.linkname) or not is_within(link, root):
+            raise UnsafeMemberError(
+                f"{member.name} 链接至 {member.linkname}")
+    tar.extract(member, target_dir)
+
+
+class PackageVerifier(object):
+    """
+    安装包校验
+    包内结构为 {app}/{app}.yaml、{app}/{app}.svg，
+    产品包的服务 yaml 位于 {app}/{app}/ 下，服务包位于 {app}/ 下
+    """
+
+    def __init__(self, file_name, app_name):
+        """
+        :param file_name: 安装包路径
+        :param app_name: 安装包名称前缀
+        """
+        self.file_name = file_name
+        self.app_name = app_name
+        # 安装包 md5
+        self.md5 = None
+        # 产品包内的服务包 {包名: md5}
+        self.packages = dict()
+
+    def is_manifest(self, path):
+        """ 是否为校验所需的 yaml 或图片 """
+        app = self.app_name
+        if path in (f"{app}/{app}.yaml", f"{app}/{app}.svg"):
+            return True
+        return os.path.dirname(path) == f"{app}/{app}" and \
+            path.endswith(".yaml")
+
+    def is_package(self, path):
+        """ 是否为产品包内的服务包 """
+        return os.path.dirname(path) == self.app_name and \
+            "tar" in os.path.basename(path)
+
+    @staticmethod
+    def _save(fileobj, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as fp:
+            shutil.copyfileobj(fileobj, fp, CHUNK_SIZE)
+
+    @staticmethod
+    def _md5(fileobj):
+        md5 = hashlib.md5()
+        while True:
+            data = fileobj.read(CHUNK_SIZE)
+            if not data:
+                break
+            md5.update(data)
+        return md5.hexdigest()
+
+    def verify(self, target_dir):
+        """
+        读取安装包，解出 yaml 及图片到 target_dir，记录服务包 md5
+        :param target_dir: 临时校验路径
+        :return: 安装包格式是否合规
+        """
+        with open(self.file_name, "rb") as fp:
+            reader = HashReader(fp)
+            try:
+                with tarfile.open(fileobj=reader, mode="r|*") as tar:
+                    for member in tar:
+                        path = member_path(member.name)
+                        if path is None or not member.isfile():
+                            continue
+                        if self.is_manifest(path):
+                            self._save(
+                                tar.extractfile(member),
+                                os.path.join(target_dir, path))
+                        elif self.is_package(path):
+                            self.packages[os.path.basename(path)] = \
+                                self._md5(tar.extractfile(member))
+                return True
+            except (tarfile.TarError, EOFError, OSError, zlib.error) as e:
+                logger.error(f"安装包{self.file_name}读取失败: {e}")
+                return False
+            finally:
+                self.md5 = reader.hexdigest()
+
+    def extract_to(self, target_dir):
+        """
+        发布时将 {app}/ 下的内容直接解压到目标路径
+        :param target_dir: verified 下的目标路径
+        """
+        prefix = f"{self.app_name}/"
+        os.makedirs(target_dir, exist_ok=True)
+        with tarfile.open(self.file_name, "r|*") as tar:
+            for member in tar:
+                path = member_path(member.name)
+                if path is None or not path.startswith(prefix):
+                    continue
+                if member.islnk():
+                    # 硬链接指向包内路径，同样去掉 {app}/ 前缀
+                    link = member_path(member.linkname)
+                    if link is None or not link.startswith(prefix):
+                        continue
+                    member.linkname = link[len(prefix):]
+                member.name = path[len(prefix):]
+                try:
+                    extract_member(tar, member, target_dir)
+                except UNSAFE_MEMBER_ERRORS as e:
+                    logger.warning(f"{self.file_name} 中的 {path} 不安全，跳过: {e}")
@@ -22,6 +22,7 @@ from db_models.models import (
 )
 from app_store.upload_task import CreateDatabase
 from app_store.install_exec import InstallServiceExecutor
+from app_store.package_verifier import PackageVerifier
 # from app_store.install_executor import InstallServiceExecutor
 from promemonitor.prometheus_utils import PrometheusUtils
 
@@ -146,30 +147,29 @@ def front_end_verified(uuid, operation_user, package_name, random_str, ver_dir,
     upload_obj = UploadPackageHistory.objects.get(id=upload_obj)
     package_path = os.path.join(package_hub, ver_dir)
     file_name = os.path.join(package_path, package_name)
-    # md5校验生成
-    md5_out = public_utils.local_cmd(f'md5sum {file_name}')
-    if md5_out[2] != 0:
+    if not os.path.isfile(file_name):
         upload_obj.package_status = 1
-        upload_obj.error_msg = "md5sum命令执行失败"
+        upload_obj.error_msg = f"安装包{package_name}不存在"
         upload_obj.save()
         return None
-    md5sum = md5_out[0].split()[0]
-    md5 = md5sum
-    upload_obj.package_md5 = md5
-    upload_obj.save()
-    # 实例化状态更新公共类对象
-    public_action = PublicAction(md5)
     touch_name = file_name[:-7] if \
         file_name[-7:] == ".tar.gz" else file_name[:-3]
     tmp_dir = os.path.join(package_path, touch_name + random_str)
     # 创建临时校验路径
     os.mkdir(tmp_dir)
-    tar_out = public_utils.local_cmd(f'tar -xmf {file_name} -C {tmp_dir}')
-    if tar_out[2] != 0:
+    # 流式读取一次安装包，同时生成md5，只解出yaml及图片
+    app_name = package_name.split('-', 1)[0]
+    verifier = PackageVerifier(file_name, app_name)
+    is_valid = verifier.verify(tmp_dir)
+    md5 = verifier.md5
+    upload_obj.package_md5 = md5
+    upload_obj.save()
+    # 实例化状态更新公共类对象
+    public_action = PublicAction(md5)
+    if not is_valid:
         return public_action.update_package_status(
             1,
             f"安装包{package_name}解压失败或者压缩包格式不合规")
-    app_name = package_name.split('-', 1)[0]
     tmp_dir = os.path.join(tmp_dir, app_name)
     # 查询临时路径下符合规范的yaml
     check_file = os.path.join(tmp_dir, f'{app_name}.yaml')
@@ -210,17 +210,12 @@ def front_end_verified(uuid, operation_user, package_name, random_str, ver_dir,
                 f"安装包{package_name}已存在:请确保name联合version唯一")
         explain_service_list = []
         yml_dirs = os.path.join(tmp_dir, app_name)
-        # 查找产品包路径下符合规则的tar与产品字段内service字段进行比对，
-        # 成功的将会入库，未匹配到的则跳过逻辑。
-        service_name = [os.path.join(tmp_dir, i) for i in os.listdir(tmp_dir)]
-        service_packages_value = [
-            p for p in service_name if
-            os.path.isfile(p) and 'tar' in p]
-        service_packages_key = [service_package.rsplit("/", 1)[1].split("-")[0]
-                                for service_package in
-                                service_packages_value]
-        service_package = dict(
-            zip(service_packages_key, service_packages_value))
+        # 产品包路径下符合规则的tar与产品字段内service字段进行比对，
+        # 成功的将会入库，未匹配到的则跳过逻辑。服务包md5已在读取安装包时生成
+        service_package = {
+            service_pk_name.split("-")[0]: service_pk_name
+            for service_pk_name in verifier.packages
+        }
         # 对匹配到的yaml进行yaml校验，此时逻辑产品下服务包没有合法，
         # 但产品内service字段存在的service必须有对应的yaml文件。
         name_version = []
@@ -238,8 +233,8 @@ def front_end_verified(uuid, operation_user, package_name, random_str, ver_dir,
             ser_name = i.get('name')
             name_version.append(
                 {'name': ser_name, 'version': explain_service_yml[1].get('version')})
-            service_pk = service_package.get(ser_name)
-            if not service_pk:
+            service_pk_name = service_package.get(ser_name)
+            if not service_pk_name:
                 continue
             ser_kind = explain_service_yml[1].get("kind", "")
             if ser_kind != "service":
@@ -253,13 +248,7 @@ def front_end_verified(uuid, operation_user, package_name, random_str, ver_dir,
                 return public_action.update_package_status(
                     1,
                     f"安装包{package_name}服务{ser_name}已存在:请确保name联合version唯一")
-            # 校验md5
-            service_pk_name = service_pk.rsplit("/", 1)[1]
-            md5_ser = public_utils.local_cmd(f'md5sum {service_pk}')
-            if md5_ser[2] != 0:
-                return public_action.update_package_status(
-                    1, "md5sum命令执行失败")
-            md5_service = md5_ser[0].split()[0]
+            md5_service = verifier.packages[service_pk_name]
             # 对合法服务的记录进行创建操作，
             # 信息会追加入"product_service"字段并归入所属产品yaml，组件则不会有此值。
             UploadPackageHistory.objects.create(
@@ -278,6 +267,8 @@ def front_end_verified(uuid, operation_user, package_name, random_str, ver_dir,
             explain_service_list.append(explain_service_yml[1])
         explain_yml[1]['product_service'] = explain_service_list
         explain_yml[1]['service'] = name_version
+        # 产品包在发布时直接解压至目标路径
+        explain_yml[1]['package_file'] = file_name
         tmp_dir = [tmp_dir, versions]
     elif kind == 'service':
         dependence_product = explain_yml[1].get(
@@ -616,43 +607,122 @@ def clear_check(need_rm):
     return " ".join(result)
 
 
-@shared_task
-def publish_bak_end(uuid, exc_len):
+def extract_package(file_name, app_name, valid_dir):
+    """
+    产品包解压至目标路径
+    :return: 与 local_cmd 一致的 (stdout, stderr, ret_code)
+    """
+    rm_out = public_utils.local_cmd(f'rm -rf {valid_dir}')
+    if rm_out[2] != 0:
+        return rm_out
+    try:
+        PackageVerifier(file_name, app_name).extract_to(valid_dir)
+    except Exception as e:
+        logger.error(f'安装包{file_name}解压至{valid_dir}失败: {e}')
+        return "", str(e), 1
+    return "", "", 0
+
+
+# 后台扫描锁
+SCAN_LOCK_KEY = "back_end_verified"
+# 后台扫描未完成校验的安装包数
+SCAN_PENDING_KEY = "back_end_verified_pending:{}"
+# 后台扫描发布状态，publishing / published
+SCAN_DONE_KEY = "back_end_verified_done:{}"
+# 后台扫描进度通知频道
+SCAN_EVENT_CHANNEL = "back_end_verified_event"
+# 后台扫描超时时间，超时后未完成校验的安装包置为校验失败，其余安装包正常发布
+SCAN_TIMEOUT = 3000
+
+
+def scan_redis():
+    return redis.Redis(host=OMP_REDIS_HOST, port=OMP_REDIS_PORT, db=9,
+                       password=OMP_REDIS_PASSWORD)
+
+
+def scan_notify(conn, uuid, event, **kwargs):
+    """ 通知后台扫描进度 """
+    try:
+        conn.publish(SCAN_EVENT_CHANNEL, json.dumps(
+            dict(uuid=uuid, event=event, **kwargs), ensure_ascii=False))
+    except Exception as e:
+        logger.error(f"后台扫描{uuid}进度通知失败: {e}")
+
+
+def finish_back_end_scan(uuid):
     """
-    后台扫描同步等待发布函数
+    后台扫描的安装包全部校验完成后立即发布，多次调用只执行一次
     params:
     uuid 当前唯一操作id
-    exc_len 合法安装包个数
     """
-
-    # 增加try，并增加超时机制释放锁
-    exc_task = True
-    time_count = 0
+    conn = scan_redis()
+    done_key = SCAN_DONE_KEY.format(uuid)
+    if not conn.set(done_key, "publishing", nx=True, ex=SCAN_TIMEOUT * 2):
+        return
     try:
-        while exc_task and time_count <= 600:
-            # 当所有安装包的状态均不为正在校验，
-            # 并和扫描出得包的个数相同且不为0，进行发布逻辑。
-            valid_uuids = UploadPackageHistory.objects.filter(
+        if UploadPackageHistory.objects.filter(
                 operation_uuid=uuid,
                 package_parent__isnull=True,
-            ).exclude(
-                package_status=2)
-            valid_success = valid_uuids.exclude(
-                package_status=1).count()
-            if valid_uuids.count() != exc_len:
-                time_count += 1
-                time.sleep(5)
-            else:
-                if valid_uuids.count() != 0 and valid_success != 0:
-                    publish_entry(uuid)
-                else:
-                    exec_clear("{0}/*".format(os.path.join(
-                        package_hub, package_dir.get('back_end_verified'))))
-                exc_task = False
+                package_status=0).exists():
+            publish_entry(uuid)
+        else:
+            exec_clear("{0}/*".format(os.path.join(
+                package_hub, package_dir.get('back_end_verified'))))
     finally:
-        re = redis.Redis(host=OMP_REDIS_HOST, port=OMP_REDIS_PORT, db=9,
-                         password=OMP_REDIS_PASSWORD)
-        re.delete('back_end_verified')
+        conn.set(done_key, "published", ex=SCAN_TIMEOUT * 2)
+        conn.delete(SCAN_LOCK_KEY, SCAN_PENDING_KEY.format(uuid))
+        scan_notify(conn, uuid, "published")
+
+
+@shared_task
+def verify_back_end_package(uuid, operation_user, package_name,
+                            random_str, obj_id, total):
+    """
+    后台扫描的单个安装包校验，各安装包在 worker 上并发校验，
+    最后一个完成校验的任务触发发布
+    params:
+    obj_id 上传记录表的id
+    total 本次扫描的安装包个数
+    """
+    try:
+        front_end_verified(uuid, operation_user, package_name, random_str,
+                           package_dir.get("back_end_verified"), obj_id)
+    except Exception as e:
+        logger.error(f"安装包{package_name}校验异常: {e}")
+        UploadPackageHistory.objects.filter(
+            id=obj_id,
+            package_status=UploadPackageHistory.PACKAGE_STATUS_PARSING
+        ).update(package_status=1, error_msg=f"安装包{package_name}校验异常")
+    finally:
+        conn = scan_redis()
+        remaining = conn.decr(SCAN_PENDING_KEY.format(uuid))
+        upload_obj = UploadPackageHistory.objects.filter(id=obj_id).first()
+        scan_notify(
+            conn, uuid, "verified", package=package_name,
+            status=upload_obj.package_status if upload_obj else 1,
+            finished=total - max(remaining, 0), total=total)
+        if remaining <= 0:
+            finish_back_end_scan(uuid)
+
+
+@shared_task
+def publish_bak_end(uuid, exc_len):
+    """
+    后台扫描超时兜底，校验任务异常退出未能触发发布时，
+    将仍在校验中的安装包置为校验失败，并发布其余安装包
+    params:
+    uuid 当前唯一操作id
+    exc_len 扫描到的安装包个数
+    """
+    timeout_count = UploadPackageHistory.objects.filter(
+        operation_uuid=uuid,
+        package_parent__isnull=True,
+        package_status=UploadPackageHistory.PACKAGE_STATUS_PARSING
+    ).update(package_status=1, error_msg="安装包校验超时")
+    if timeout_count:
+        logger.error(f"后台扫描{uuid}共{exc_len}个安装包，"
+                     f"{timeout_count}个校验超时")
+    finish_back_end_scan(uuid)
 
 
 @shared_task
@@ -742,8 +812,12 @@ def publish_entry(uuid):
         valid_dir = os.path.join(project_dir, 'package_hub',
                                  'verified', valid_pk)
         move_tmp = "/".join(valid_name)
-        move_out = public_utils.local_cmd(
-            f'rm -rf {valid_dir} && mv {move_tmp} {valid_dir}')
+        if line.get('package_file'):
+            move_out = extract_package(
+                line['package_file'], valid_name[1], valid_dir)
+        else:
+            move_out = public_utils.local_cmd(
+                f'rm -rf {valid_dir} && mv {move_tmp} {valid_dir}')
         if move_out[2] != 0:
             line['package_name'].package_status = 4
             line['package_name'].save()
@@ -828,6 +902,7 @@ def add_prometheus(main_history_id, queryset=None):
         main_install_history_id=main_history_id,
         install_step_status=DetailInstallHistory.INSTALL_STATUS_SUCCESS
     )
+    service_data_list = list()
     for detail_obj in queryset:
         try:
             _flag, _monitor_dic = check_monitor_data(detail_obj=detail_obj)
@@ -862,8 +937,7 @@ def add_prometheus(main_history_id, queryset=None):
         ser_name = detail_obj.service.service.app_name
         if ser_name == "hadoop":
             ser_name = instance_name.split("_", 1)[0]
-        # 添加服务到 prometheus
-        is_success, message = prometheus.add_service({
+        service_data_list.append({
             "service_name": ser_name,
             "instance_name": instance_name,
             "data_path": data_dir,
@@ -877,11 +951,15 @@ def add_prometheus(main_history_id, queryset=None):
             "username": username,
             "password": password,
         })
+    # 批量添加服务到 prometheus，每个任务只写一次配置并合并重载
+    instance_names = [item["instance_name"] for item in service_data_list]
+    if service_data_list:
+        is_success, message = prometheus.add_services(service_data_list)
         if not is_success:
             logger.error(
-                f"Add Prometheus Failed {instance_name}, error: {message}")
-            continue
-        logger.info(f"Add Prometheus Success {instance_name}")
+                f"Add Prometheus Failed {instance_names}, error: {message}")
+        else:
+            logger.info(f"Add Prometheus Success {instance_names}")
     logger.info("Add Prometheus End")
 
 
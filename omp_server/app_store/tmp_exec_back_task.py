@@ -3,7 +3,11 @@ from utils.parse_config import (
     OMP_REDIS_PORT, OMP_REDIS_PASSWORD, OMP_REDIS_HOST
 )
 import time
-from app_store.tasks import front_end_verified, publish_bak_end
+from celery import group
+from app_store.tasks import (
+    front_end_verified, publish_bak_end, verify_back_end_package,
+    SCAN_PENDING_KEY, SCAN_TIMEOUT
+)
 import redis
 from db_models.models import UploadPackageHistory
 import random
@@ -60,6 +64,13 @@ def back_end_verified_init(operation_user):
     redis_key.lpush("back_end_verified", uuid, ",".join(exec_name))
     # 设置过期时间，同时创建异步校验任务及发布任务
     redis_key.expire("back_end_verified", 3600)
+    if not exec_name:
+        publish_bak_end.delay(uuid, 0)
+        return uuid, exec_name
+    # 记录待校验的安装包数，最后一个完成校验的任务触发发布
+    redis_key.set(SCAN_PENDING_KEY.format(uuid), len(exec_name),
+                  ex=SCAN_TIMEOUT * 2)
+    verify_tasks = []
     for j in exec_name:
         upload_obj = UploadPackageHistory(
             operation_uuid=uuid,
@@ -68,18 +79,28 @@ def back_end_verified_init(operation_user):
             package_md5='1',
             package_path="verified")
         upload_obj.save()
-        front_end_verified_init(uuid, operation_user, j, upload_obj.id)
-    publish_bak_end.delay(uuid, len(exec_name))
+        verify_tasks.append(verify_back_end_package.si(
+            uuid, operation_user, j, random_str(), upload_obj.id,
+            len(exec_name)))
+    # 各安装包在 worker 上并发校验
+    group(verify_tasks).apply_async()
+    # 超时兜底，校验任务异常退出时仍能发布并释放扫描锁
+    publish_bak_end.apply_async(
+        (uuid, len(exec_name)), countdown=SCAN_TIMEOUT)
     return uuid, exec_name
 
 
+def random_str():
+    """ 拼接临时校验目录的随机字符串 """
+    return ''.join(
+        random.sample('abcdefghijklmnopqrstuvwxyz1234567890', 10))
+
+
 def front_end_verified_init(uuid, operation_user, package_name, obj_id, md5=None):
     # 前端发布校验接口
-    random_str = ''.join(
-        random.sample('abcdefghijklmnopqrstuvwxyz1234567890', 10))
     if md5:
         ver_dir = package_dir.get("front_end_verified")
     else:
         ver_dir = package_dir.get("back_end_verified")
     front_end_verified.delay(uuid, operation_user, package_name,
-                             random_str, ver_dir, obj_id)
+                             random_str(), ver_dir, obj_id)
@@ -11,6 +11,7 @@ from rest_framework.routers import DefaultRouter
 from app_store.views import (
     LabelListView, ComponentListView, ServiceListView,
     UploadPackageView, RemovePackageView,
+    UploadChunkInitView, UploadChunkView, UploadChunkCompleteView,
     ComponentDetailView, ServiceDetailView,
     ServicePackPageVerificationView, PublishViewSet,
     ExecuteLocalPackageScanView, LocalPackageScanResultView,
@@ -48,6 +49,11 @@ router.register("labels", LabelListView, basename="labels")
 router.register("components", ComponentListView, basename="components")
 router.register("services", ServiceListView, basename="appServices")
 router.register("upload", UploadPackageView, basename="upload")
+router.register("uploadChunkInit", UploadChunkInitView,
+                basename="uploadChunkInit")
+router.register("uploadChunk", UploadChunkView, basename="uploadChunk")
+router.register("uploadChunkComplete", UploadChunkCompleteView,
+                basename="uploadChunkComplete")
 router.register("remove", RemovePackageView, basename="remove")
 router.register("componentDetail", ComponentDetailView,
                 basename="componentDetail")
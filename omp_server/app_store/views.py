@@ -36,12 +36,14 @@ from app_store.app_store_serializers import (
     UploadPackageHistorySerializer, ExecuteLocalPackageScanSerializer,
     PublishPackageHistorySerializer, DeploymentPlanValidateSerializer,
     DeploymentImportSerializer, DeploymentPlanListSerializer,
-    ExecutionRecordSerializer
+    ExecutionRecordSerializer, UploadChunkInitSerializer,
+    UploadChunkSerializer, UploadChunkCompleteSerializer
 )
 from app_store.app_store_serializers import (
     ProductDetailSerializer, ApplicationDetailSerializer
 )
 from app_store import tmp_exec_back_task
+from app_store.chunk_upload import ChunkUpload
 
 from utils.common.exceptions import OperateError
 from utils.common.views import BaseDownLoadTemplateView
@@ -157,6 +159,63 @@ class UploadPackageView(GenericViewSet, CreateModelMixin):
     post_description = "上传安装包"
 
 
+class UploadChunkInitView(GenericViewSet, CreateModelMixin):
+    """
+        create:
+        初始化分片上传，已存在时返回已上传的分片用于续传
+    """
+    serializer_class = UploadChunkInitSerializer
+    # 操作信息描述
+    post_description = "初始化分片上传"
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = ChunkUpload.init(**serializer.validated_data)
+        return Response(upload.status())
+
+
+class UploadChunkView(GenericViewSet, CreateModelMixin):
+    """
+        create:
+        上传分片，最后一个分片写入后开始安装包校验
+    """
+    serializer_class = UploadChunkSerializer
+    # 操作信息描述
+    post_description = "上传安装包分片"
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        upload = ChunkUpload(data["upload_id"])
+        status = upload.put(
+            data["index"], data["file"].chunks(), data["chunk_md5"])
+        if status["completed"]:
+            upload.complete()
+        return Response(status)
+
+
+class UploadChunkCompleteView(GenericViewSet, CreateModelMixin):
+    """
+        create:
+        完成分片上传，用于最后一个分片上传后自动完成失败时重试
+    """
+    serializer_class = UploadChunkCompleteSerializer
+    # 操作信息描述
+    post_description = "完成分片上传"
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = ChunkUpload(serializer.validated_data["upload_id"])
+        upload_obj = upload.complete()
+        return Response({
+            "upload_id": upload.upload_id,
+            "package_id": upload_obj.id if upload_obj else None
+        })
+
+
 class RemovePackageView(GenericViewSet, CreateModelMixin):
     """
         post:
@@ -1,13 +1,20 @@
 # # -*- coding:utf-8 -*-
 # # Project: backup_service
 # # Author:jerry.zhang
+import hashlib
+import io
+import json
 import logging
 import os
 import random
-import subprocess
+import shlex
+import shutil
 import sys
+import tarfile
+import tempfile
+import threading
 import time
-import json
+from concurrent.futures import ThreadPoolExecutor
 
 if __name__ == '__main__':
     import django
@@ -22,31 +29,120 @@ if __name__ == '__main__':
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "omp_server.settings")
     django.setup()
 
+from django.conf import settings
+
+from backups.chunk_store import ChunkStore, MANIFEST_VERSION
 from db_models.models import (
     BackupHistory, Service,
     Host
 )
-from utils.plugin.salt_client import SaltClient
+from utils.parse_config import BACKUP
+from utils.plugin.crypto import AESCryptor
+from utils.plugin.ssh import SSH
 
 logger = logging.getLogger("server")
 
+# 同时备份的实例数
+MAX_WORKERS = BACKUP.get("max_workers", 4)
+# 单主机同时备份的实例数
+MAX_PER_HOST = BACKUP.get("max_per_host", 1)
+# 单实例备份超时时间，单位秒
+BACKUP_TIMEOUT = BACKUP.get("timeout", 7200)
+# 单次读取备份数据流的大小
+CHUNK_SIZE = 1024 * 1024
+# 归档备份时单实例数据在内存中缓存的大小，超出后写入临时文件
+SPOOL_MEMORY = BACKUP.get("spool_memory", 64) * 1024 * 1024
+# 节点上优先使用 pigz 多线程压缩，输出格式与 gzip 一致
+COMPRESSOR = "$(command -v pigz || command -v gzip) -1 -c"
+# 备份文件内的实例清单
+MANIFEST_NAME = "manifest.json"
+# 备份存储方式，archive: 独立的tar文件，chunk: 分块去重存储
+STORE_ARCHIVE = "archive"
+STORE_CHUNK = "chunk"
+STORE_MODE = BACKUP.get("store", STORE_ARCHIVE)
+
+
+def chunk_store():
+    """ 备份块存储 """
+    return ChunkStore(BACKUP.get("chunk_path") or os.path.join(
+        settings.PROJECT_DIR, "data/backup/chunks"))
+
+
+def backup_file_name(name):
+    """
+    备份记录的文件名，去重存储时为清单文件
+    :param name: 备份名称
+    """
+    if STORE_MODE == STORE_CHUNK:
+        return f"{name}.manifest"
+    return f"{name}.tar"
+
 
-def cmd(command):
-    """执行本地shell命令"""
-    p = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    stdout, stderr = p.communicate()
-    _out, _err, _code = \
-        stdout.decode("utf8"), stderr.decode("utf8"), p.returncode
-    return _out, _err, _code
+def dump_command(app_name, service_dict):
+    """
+    生成将备份数据压缩后输出到标准输出的命令
+    :param app_name: 服务名称
+    :param service_dict: BackupDB.backup_info 获取的备份变量
+    :return: (命令, 备份文件内的文件名)，不支持的服务为 (None, None)
+    """
+    name = "{service_name}-{ip}-{tmp}".format(**service_dict)
+    if app_name == "mysql":
+        command = "{app_dir}/bin/mysqldump --single-transaction " \
+                  "-P{service_port} -u{service_user} {service_pass} " \
+                  "-h'127.0.0.1' --all-databases".format(**service_dict)
+        command, file_name = f"{command} | {COMPRESSOR}", f"{name}.sql.gz"
+    elif app_name == "postgreSql":
+        command = "{app_dir}/bin/pg_dumpall -U {run_user} -h'127.0.0.1' " \
+                  "-p{service_port}".format(**service_dict)
+        command, file_name = f"{command} | {COMPRESSOR}", f"{name}.sql.gz"
+    elif app_name == "arangodb":
+        # arangodump 只能输出到目录，导出后打包输出并清理临时目录
+        dump_dir = os.path.join(service_dict.get("backup_dir"), name)
+        command = "mkdir -p {dump_dir} && {app_dir}/bin/arangodump " \
+                  "--server.endpoint tcp://127.0.0.1:{service_port} " \
+                  "--server.username {service_user} " \
+                  "--server.password {arangodb_pwd} --all-databases true " \
+                  "--output-directory {dump_dir} 1>&2".format(
+                      dump_dir=dump_dir, **service_dict)
+        command = f"{command} && tar -cf - -C {dump_dir} . | {COMPRESSOR}; " \
+                  f"rc=$?; rm -rf {dump_dir}; exit $rc"
+        file_name = f"{name}.tar.gz"
+    else:
+        return None, None
+    return f"bash -o pipefail -c {shlex.quote(command)}", file_name
 
 
 class BackupDB(object):
-    def __init__(self):
-        self.salt_client = SaltClient()
-        self.timeout = 300
-        self.service_names = []
-        self.upload_real_paths = []
+    """
+    数据备份，多个实例并发备份，同一主机上的实例数受 max_per_host 限制，
+    节点上的导出数据压缩后经 ssh 以数据流方式传输到 omp，
+    传输过程中计算大小及 sha256，完成后追加到备份文件中，不再二次压缩；
+    tar 成员需先写入大小，数据先缓存在内存中，超过 spool_memory 时才写入临时文件；
+    store 为 chunk 时数据解压后分块写入去重存储，备份文件为块清单
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST,
+                 store_mode=STORE_MODE):
+        self.timeout = BACKUP_TIMEOUT
+        self.spool_memory = SPOOL_MEMORY
+        self.store_mode = store_mode
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        # 各实例备份结果
+        self.results = []
+        # 备份耗时，单位秒
+        self.duration = 0
+        # 备份速率，单位 MB/s
+        self.throughput = 0
+        # 本次备份实际占用的空间，单位字节
+        self.stored_size = 0
+        self._lock = threading.Lock()
+        self._host_semaphores = {}
+
+    def host_semaphore(self, ip):
+        with self._lock:
+            return self._host_semaphores.setdefault(
+                ip, threading.BoundedSemaphore(self.max_per_host))
 
     @staticmethod
     def backup_info(service_obj):
@@ -87,37 +183,185 @@ class BackupDB(object):
         except Exception as e:
             logger.error(f"获取信息失败请查看service或其账号密码端口是否存在{e}")
 
-    def sync_data_with_omp(self, service_dict):
+    def prepare(self, service_obj):
+        """
+        获取单个实例的备份命令及主机连接信息，数据库查询均在主线程完成
+        :param service_obj: 服务实例
+        :return: 备份任务
+        """
+        task = {
+            "instance": service_obj.service_instance_name,
+            "ip": service_obj.ip,
+            "file": None,
+            "command": None,
+            "ssh": None,
+            "message": "",
+        }
+        service_dict = self.backup_info(service_obj)
+        if not isinstance(service_dict, dict):
+            task["message"] = "获取备份信息失败"
+            return task
+        task["command"], task["file"] = dump_command(
+            service_obj.service.app_name, service_dict)
+        if task["command"] is None:
+            task["message"] = "不支持备份该服务"
+            return task
+        host = Host.objects.filter(ip=service_obj.ip).first()
+        task["ssh"] = {
+            "hostname": host.ip,
+            "port": host.port,
+            "username": host.username,
+            "password": AESCryptor().decode(host.password),
+        }
+        return task
+
+    def dump_instance(self, task, sink):
+        """
+        备份单个实例，数据流写入 sink
+        :param task: prepare 生成的备份任务
+        :param sink: 可写的文件对象
+        :return: 备份结果
+        """
+        result = {
+            "instance": task["instance"],
+            "ip": task["ip"],
+            "file": task["file"],
+            "size": 0,
+            "sha256": "",
+            "duration": 0,
+            "throughput": 0,
+            "result": False,
+            "message": task["message"],
+        }
+        if task["ssh"] is None:
+            return result
+        ssh = SSH(**task["ssh"])
+        hasher = hashlib.sha256()
+
+        def read_func(stdout):
+            while True:
+                chunk = stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                sink.write(chunk)
+                result["size"] += len(chunk)
+
+        with self.host_semaphore(task["ip"]):
+            start_time = time.time()
+            try:
+                flag, message = ssh.cmd_read_stream(
+                    task["command"], read_func, timeout=self.timeout)
+            except Exception as e:
+                flag, message = False, str(e)
+            finally:
+                ssh.close()
+            duration = time.time() - start_time
+        result.update({
+            "sha256": hasher.hexdigest(),
+            "duration": round(duration, 3),
+            "throughput": round(
+                result["size"] / 1024 / 1024 / max(duration, 0.001), 3),
+            "result": flag,
+            "message": "success" if flag else message,
+        })
+        return result
+
+    def add_to_archive(self, tar, file_name, spool):
+        """ 暂存数据追加到备份文件中，多个实例依次写入 """
+        tar_info = tarfile.TarInfo(file_name)
+        tar_info.size = spool.tell()
+        tar_info.mtime = int(time.time())
+        tar_info.mode = 0o644
+        spool.seek(0)
+        with self._lock:
+            tar.addfile(tar_info, spool)
+
+    def run_tasks(self, backup_func, task_ls):
+        """ 并发执行各实例的备份 """
+        with ThreadPoolExecutor(
+                min(self.max_workers, len(task_ls))) as executor:
+            self.results = list(executor.map(backup_func, task_ls))
+
+    def backup_to_archive(self, task_ls, file_path):
+        """
+        备份到独立的tar文件
+        :return: 是否全部备份成功
+        """
+        part_path = f"{file_path}.part"
+        spool_dir = tempfile.mkdtemp(
+            dir=os.path.dirname(file_path), prefix=".backup_")
+        try:
+            with tarfile.open(part_path, "w") as tar:
+
+                def _backup(task):
+                    with tempfile.SpooledTemporaryFile(
+                            max_size=self.spool_memory, dir=spool_dir) as fp:
+                        result = self.dump_instance(task, fp)
+                        if result["result"]:
+                            self.add_to_archive(tar, result["file"], fp)
+                    return result
+
+                self.run_tasks(_backup, task_ls)
+                manifest = json.dumps(
+                    self.results, ensure_ascii=False, indent=2).encode("utf8")
+                tar_info = tarfile.TarInfo(MANIFEST_NAME)
+                tar_info.size = len(manifest)
+                tar_info.mtime = int(time.time())
+                tar.addfile(tar_info, io.BytesIO(manifest))
+            if not all(result["result"] for result in self.results):
+                os.remove(part_path)
+                return False
+            os.replace(part_path, file_path)
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+        self.stored_size = os.path.getsize(file_path)
+        return True
+
+    def backup_to_chunks(self, task_ls, file_path, history_id):
         """
-        同步节点备份数据到omp所在机器
+        备份到去重存储，节点输出的 gzip 数据流解压后分块，
+        备份文件只保存由块组成的清单
+        :return: 是否全部备份成功
         """
-        # 1.先压缩备份目录中备份的数据
-        ip = service_dict.get("ip")
-        file_name = service_dict.get("file_name").replace(".sql", "")
-        # xxx.sql转换 xxx
-        service_dict["dir_name"] = file_name
-        cmd_str = "cd {backup_dir}; tar -zcf {dir_name}.tar.gz {file_name} && " \
-                  "chown -R {run_user}:{run_user} {dir_name}.tar.gz && " \
-                  "rm -rf {file_name}".format(**service_dict)
-        tar_flag, tar_msg = self.salt_client.cmd(
-            target=ip, command=(cmd_str,), timeout=self.timeout
-        )
-        if not tar_flag:
-            return False, tar_msg
-        # 2.将节点备份的数据同步到omp
-        source_path = "{backup_dir}/{dir_name}.tar.gz".format(**service_dict)
-        salt_data = self.salt_client.client.opts.get("root_dir")
-        cp_flag, cp_msg = self.salt_client.cp_push(
-            target=ip, source_path=source_path, upload_path=f"{file_name}.tar.gz"
-        )
-        if not cp_flag:
-            return False, cp_msg
-        self.service_names.append(
-            service_dict.get('service_name'))
-        self.upload_real_paths.append(
-            os.path.join(salt_data, f"var/cache/salt/master/minions/{ip}/files/*"))
-        logger.info(f"成功将节点{source_path}备份的数据同步到omp {file_name}.tar.gz")
-        return True, f"{ip}下{''.join(self.service_names)}备份完成"
+        store = chunk_store()
+        with store.lock(shared=True):
+            try:
+
+                def _backup(task):
+                    writer = store.writer(gzip_input=True)
+                    result = self.dump_instance(task, writer)
+                    if result["result"]:
+                        result["file"] = result["file"][:-len(".gz")]
+                        result["chunk_file"] = dict(
+                            file=result["file"], instance=result["instance"],
+                            **writer.close())
+                    return result
+
+                self.run_tasks(_backup, task_ls)
+                if not all(result["result"] for result in self.results):
+                    store.rollback()
+                    return False
+                manifest = {
+                    "version": MANIFEST_VERSION,
+                    "create_time": int(time.time()),
+                    "history_id": history_id,
+                    "files": [
+                        result.pop("chunk_file") for result in self.results],
+                }
+                new_size = store.new_stored_size
+                store.save_manifest(file_path, manifest)
+                store.commit(manifest)
+            except Exception:
+                store.rollback()
+                raise
+        store.collect()
+        self.stored_size = new_size + os.path.getsize(file_path)
+        return True
 
     def backup_service(self, back_id):
         """
@@ -126,81 +370,43 @@ class BackupDB(object):
         back_obj = BackupHistory.objects.filter(id=back_id).first()
         service_instances = back_obj.content
         omp_backup_dir = back_obj.retain_path
-        for si in service_instances:
-            service_obj = Service.objects.filter(
-                service_instance_name=si).first()
-
-            service_dict = self.backup_info(service_obj)
-            cmd_str = {}
-            if isinstance(service_dict, dict):
-                if service_obj.service.app_name == "mysql":
-                    cmd_str = "test -d {backup_dir} || mkdir -p {backup_dir}&& " \
-                              "chown -R {run_user}:{run_user} {backup_dir} &&" \
-                              " {app_dir}/bin/mysqldump --single-transaction " \
-                              "-P{service_port} -u{service_user} {service_pass} -h'127.0.0.1' --all-databases > " \
-                              "{backup_dir}/{service_name}-{ip}-{tmp}.sql".format(
-                                  **service_dict)
-                    service_dict["file_name"] = "{service_name}-{ip}-{tmp}.sql".format(
-                        **service_dict)
-
-                elif service_obj.service.app_name == "arangodb":
-                    cmd_str = "test -d {backup_dir}/{service_name}-{ip}-{tmp} || " \
-                              "mkdir -p {backup_dir}/{service_name}-{ip}-{tmp}&& " \
-                              "chown -R {run_user}:{run_user} {backup_dir} " \
-                              "&& {app_dir}/bin/arangodump --server.endpoint " \
-                              "tcp://127.0.0.1:{service_port} --server.username {service_user}" \
-                              " --server.password {arangodb_pwd} --all-databases true " \
-                              "--output-directory {backup_dir}/{service_name}-{ip}-{tmp}".format(
-                                  **service_dict)
-                    service_dict["file_name"] = "{service_name}-{ip}-{tmp}".format(
-                        **service_dict)
-                elif service_obj.service.app_name == "postgreSql":
-                    cmd_str = "test -d {backup_dir} || mkdir -p {backup_dir}&& " \
-                              "chown -R {run_user}:{run_user} {backup_dir} &&" \
-                              " {app_dir}/bin/pg_dumpall -U {run_user} -h'127.0.0.1' -p{service_port} > " \
-                              "{backup_dir}/{service_name}-{ip}-{tmp}.sql".format(
-                                  **service_dict)
-                    service_dict["file_name"] = "{service_name}-{ip}-{tmp}.sql".format(
-                        **service_dict)
-                else:
-                    # TODO 应用不合法
-                    pass
-            backup_flag, backup_msg = self.salt_client.cmd(
-                target=service_dict.get("ip"), command=(cmd_str,), timeout=self.timeout
-            )
-            if not backup_flag:
-                message = f'{service_dict.get("ip")}上{service_dict.get("service_name")}备份失败!'
-                logger.error(f"{message}, 详情为：{backup_msg}")
-                return False, message
-            # 同步数据
-            sync_flag, sync_msg = self.sync_data_with_omp(service_dict)
-            # print(cmd_str)
-            if not sync_flag:
-                message = f'{service_dict.get("ip")}上{service_dict.get("service_name")}备份失败!'
-                logger.error(f"{message}, 详情为：{sync_msg}")
-                return False, message
-
-        # 3.将主节点的备份数据同步到备份目录
-        file_name = back_obj.file_name
-        name = file_name.replace(".tar.gz", "")
-        template_dir = os.path.join(
-            omp_backup_dir, name)
-        upload_real_paths = " ".join(self.upload_real_paths)
-        if len(template_dir) <= 5 or len(upload_real_paths) <= 5:
-            return False, "目录异常，防止保护文件丢失触发熔断." \
-                          "template_dir:template_dir:{0},upload_real_paths:{1}".format(
-                              template_dir, upload_real_paths
-                          )
-        cmd_str = "test -d {0} || mkdir -p {0} && cp -rf {1} {0} && rm -rf {1} && cd {2}" \
-                  " && tar -zcf {3} {4} && rm -rf {0}".format(
-                      template_dir, upload_real_paths, omp_backup_dir, file_name, name)
-        _out, _err, _code = cmd(
-            cmd_str
-        )
-        logger.info(f"执行合并备份文件命令{cmd_str}")
-        if int(_code) != 0:
-            return False, _out
-        logger.info(f"{''.join(self.service_names)}备份完成")
+        service_objs = list(Service.objects.filter(
+            service_instance_name__in=service_instances
+        ).select_related("service", "service_connect_info"))
+        missing = set(service_instances) - {
+            service_obj.service_instance_name for service_obj in service_objs}
+        if missing or not service_objs:
+            return False, f"服务实例{','.join(missing)}不存在!"
+        if not os.path.exists(omp_backup_dir):
+            os.makedirs(omp_backup_dir)
+        file_path = os.path.join(omp_backup_dir, back_obj.file_name)
+        task_ls = [self.prepare(service_obj) for service_obj in service_objs]
+        start_time = time.time()
+        try:
+            if self.store_mode == STORE_CHUNK:
+                self.backup_to_chunks(task_ls, file_path, back_id)
+            else:
+                self.backup_to_archive(task_ls, file_path)
+        except Exception as e:
+            logger.error(f"生成备份文件{file_path}失败: {str(e)}")
+            return False, f"生成备份文件失败: {str(e)}"
+
+        failed = [result for result in self.results if not result["result"]]
+        if failed:
+            for result in failed:
+                logger.error(
+                    f'{result["ip"]}上{result["instance"]}备份失败, '
+                    f'详情为：{result["message"]}')
+            return False, "；".join(
+                f'{result["ip"]}上{result["instance"]}备份失败!'
+                for result in failed)
+        self.duration = round(time.time() - start_time, 3)
+        total_size = sum(result["size"] for result in self.results)
+        self.throughput = round(
+            total_size / 1024 / 1024 / max(self.duration, 0.001), 3)
+        logger.info(
+            f"{','.join(service_instances)}备份完成, 耗时{self.duration}s, "
+            f"速率{self.throughput}MB/s, 占用空间{self.stored_size}字节")
         return True, "Success"
 
 
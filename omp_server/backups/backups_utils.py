@@ -9,7 +9,7 @@ import tarfile
 
 from django.conf import settings
 
-from backups.backup_service import BackupDB
+from backups.backup_service import BackupDB, chunk_store
 from db_models.models import BackupHistory, EmailSMTPSetting, ModuleSendEmailSetting, BackupSetting
 from utils.plugin.send_email import ModelSettingEmailBackend, SendBackupHistoryEmailContent, many_send, ResultThread
 
@@ -107,9 +107,9 @@ def backup_service_data(history):
     :return:
     """
 
-    backup_script_func = BackupDB().backup_service
+    backup_obj = BackupDB()
     _thread = ResultThread(
-        target=backup_script_func,
+        target=backup_obj.backup_service,
         args=(history.id,))
     _thread.start()
     _thread.join()
@@ -122,7 +122,8 @@ def backup_service_data(history):
     logger.info(f"备份结果为：{backup_message}")
 
     back_resp = {"backup_flag": backup_flag,
-                 "msg": backup_message, "file_name": history.file_name}
+                 "msg": backup_message, "file_name": history.file_name,
+                 "instances": backup_obj.results}
 
     if not backup_flag:
         history.result = history.FAIL
@@ -133,10 +134,12 @@ def backup_service_data(history):
         err_message += backup_message if not backup_message else f"备份任务{history.backup_name}动作执行失败!"
     else:
         file_path = os.path.join(history.retain_path, history.file_name)
-        size = os.path.getsize(file_path) / 1024 / 1024
+        # 去重存储时为本次备份新增的数据量
+        size = backup_obj.stored_size / 1024 / 1024
         ln_path = os.path.join(
             settings.PROJECT_DIR, "data/backup/", history.file_name)
-        if file_path == ln_path:
+        # 去重存储的清单不能直接下载，通过接口还原后下载，不创建软链
+        if file_path == ln_path or is_manifest(history.file_name):
             history.result = history.SUCCESS
         else:
             cmd_str = f"ln -s {file_path} {ln_path}"
@@ -147,6 +150,8 @@ def backup_service_data(history):
             else:
                 history.result = history.SUCCESS
         history.file_size = "%.3f" % size
+        history.duration = backup_obj.duration
+        history.throughput = backup_obj.throughput
     history.message = {"backup_resp": back_resp, "err_message": err_message}
     history.save()
     email_setting = EmailSMTPSetting.objects.first()
@@ -162,6 +167,50 @@ def backup_service_data(history):
     send_email(history.id, backup_setting.to_users.split(","))
 
 
+def is_manifest(file_name):
+    """ 是否为去重存储的备份清单 """
+    return file_name.endswith(".manifest")
+
+
+def download_file_name(history):
+    """ 下载时的文件名，去重存储的备份还原为 tar 文件 """
+    if is_manifest(history.file_name):
+        return history.file_name[:-len(".manifest")] + ".tar"
+    return history.file_name
+
+
+def iter_backup(history, read_size=1024 * 1024):
+    """
+    逐块读取备份内容，去重存储的备份按清单重新组装为 tar 数据流
+    清单及块在开始读取前加载，文件不存在时直接抛出异常
+    :param history: 备份记录
+    :param read_size: 每次读取的大小
+    :return: bytes 生成器
+    """
+    file_path = os.path.join(history.retain_path, history.file_name)
+    if is_manifest(history.file_name):
+        store = chunk_store()
+        return store.iter_restore(store.load_manifest(file_path), read_size)
+    fp = open(file_path, "rb")
+
+    def read_file():
+        with fp:
+            for data in iter(lambda: fp.read(read_size), b""):
+                yield data
+    return read_file()
+
+
+def restore_backup(history, fileobj):
+    """
+    读取备份内容，去重存储的备份按清单重新组装
+    :param history: 备份记录
+    :param fileobj: 可写的文件对象，写入 tar 数据流
+    :return:
+    """
+    for data in iter_backup(history):
+        fileobj.write(data)
+
+
 def rm_backend_file(ids=None):
     """
     删除过期文件
@@ -179,9 +228,17 @@ def rm_backend_file(ids=None):
     for history in histories:
         expire_file = os.path.join(history.retain_path, history.file_name)
         try:
+            manifest = None
+            if is_manifest(history.file_name) and \
+                    os.path.exists(expire_file):
+                store = chunk_store()
+                manifest = store.load_manifest(expire_file)
             os.remove(expire_file)
             history.file_deleted = True
             history.save()
+            # 清单删除成功后再释放引用，删除失败重试时不会重复释放
+            if manifest is not None:
+                store.release(manifest)
         except Exception as e:
             logger.error(f"删除备份文件{expire_file}失败: {str(e)}")
             if os.path.exists(expire_file):
@@ -191,7 +248,7 @@ def rm_backend_file(ids=None):
                 history.save()
         ln_path = os.path.join(
             settings.PROJECT_DIR, "data/backup/", history.file_name)
-        if expire_file == ln_path:
+        if expire_file == ln_path or is_manifest(history.file_name):
             continue
         try:
             os.remove(ln_path)
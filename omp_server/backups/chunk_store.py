@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# Project: chunk_store
+# Create time: 2022-03-19
+# Introduction:
+
+"""
+备份数据去重存储
+备份数据流按内容定义分块，块以 sha256 命名压缩后存放在块目录中，
+每次备份只记录由块组成的清单文件，未变化的数据不再重复存储；
+块的引用计数保存在 BackupChunk 表中，删除备份时引用归零的块被回收
+"""
+
+import os
+import json
+import zlib
+import fcntl
+import hashlib
+import logging
+import tarfile
+import tempfile
+from contextlib import contextmanager
+
+from django.db.models import F
+
+from db_models.models import BackupChunk
+
+logger = logging.getLogger("server")
+
+# 最小块大小，块边界只在超过该大小后查找
+MIN_CHUNK_SIZE = 256 * 1024
+# 最大块大小，超过后强制分块
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# 计算边界的窗口大小
+WINDOW_SIZE = 64
+# 窗口 crc32 与掩码为 0 时作为块边界
+BOUNDARY_MASK = 0xF
+# 块的压缩级别
+COMPRESS_LEVEL = 3
+# 清单格式版本
+MANIFEST_VERSION = 1
+# 按块查询数据库时的单批数量
+QUERY_BATCH_SIZE = 500
+
+
+def batched(items, size=QUERY_BATCH_SIZE):
+    items = list(items)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+class Chunker(object):
+    """
+    内容定义分块
+    以换行处为候选边界，边界前窗口内容的 crc32 满足掩码时分块，
+    边界只由附近内容决定，数据中间插入或修改后后续的块边界保持不变；
+    导出的 sql、json 数据按行组织，候选边界的查找及校验均由 C 实现完成
+    """
+
+    def __init__(self, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE,
+                 mask=BOUNDARY_MASK):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.mask = mask
+        self.buffer = bytearray()
+        # 下次查找边界的起始位置
+        self._scan = min_size
+
+    def _cut(self):
+        """ 查找缓冲区中的下一个块边界，未找到时为 None """
+        buf = self.buffer
+        limit = min(len(buf), self.max_size)
+        while self._scan < limit:
+            pos = buf.find(b"\n", self._scan, limit)
+            if pos < 0:
+                break
+            end = pos + 1
+            if zlib.crc32(buf[max(end - WINDOW_SIZE, 0):end]) & \
+                    self.mask == 0:
+                return end
+            self._scan = end
+        self._scan = max(self._scan, limit)
+        if len(buf) >= self.max_size:
+            return self.max_size
+        return None
+
+    def feed(self, data):
+        """
+        写入数据
+        :return: 已完成的块
+        """
+        self.buffer.extend(data)
+        while True:
+            end = self._cut()
+            if end is None:
+                return
+            chunk = bytes(self.buffer[:end])
+            del self.buffer[:end]
+            self._scan = self.min_size
+            yield chunk
+
+    def flush(self):
+        """ 剩余数据作为最后一块 """
+        if self.buffer:
+            chunk = bytes(self.buffer)
+            self.buffer = bytearray()
+            self._scan = self.min_size
+            yield chunk
+
+
+class ChunkWriter(object):
+    """ 单个文件写入块存储，记录组成文件的块列表 """
+
+    def __init__(self, store, gzip_input=False):
+        """
+        :param store: ChunkStore
+        :param gzip_input: 写入的数据为 gzip 格式时先解压，按原始内容分块
+        """
+        self.store = store
+        self.chunker = Chunker()
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.chunks = list()
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+            if gzip_input else None
+
+    def _put(self, chunks):
+        for chunk in chunks:
+            self.chunks.append([self.store.put(chunk), len(chunk)])
+
+    def write(self, data):
+        if self._decompressor is not None:
+            raw = self._decompressor.decompress(data)
+            # pigz/gzip 可能输出多个 gzip 成员
+            while self._decompressor.eof and self._decompressor.unused_data:
+                unused = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                raw += self._decompressor.decompress(unused)
+            data = raw
+        self._feed(data)
+
+    def _feed(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        self._put(self.chunker.feed(data))
+
+    def close(self):
+        """
+        :return: 清单中的文件信息
+        """
+        if self._decompressor is not None:
+            self._feed(self._decompressor.flush())
+        self._put(self.chunker.flush())
+        return {
+            "size": self.size,
+            "sha256": self.hasher.hexdigest(),
+            "chunks": self.chunks,
+        }
+
+
+class ChunkReader(object):
+    """ 按清单顺序读取块，还原文件内容 """
+
+    def __init__(self, store, chunks):
+        self.store = store
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.offset = 0
+
+    def read(self, size=-1):
+        parts = list()
+        while size != 0:
+            if self.offset >= len(self.buffer):
+                item = next(self.chunks, None)
+                if item is None:
+                    break
+                self.buffer, self.offset = self.store.get(item[0]), 0
+            if size < 0:
+                data = self.buffer[self.offset:]
+            else:
+                data = self.buffer[self.offset:self.offset + size]
+                size -= len(data)
+            self.offset += len(data)
+            parts.append(data)
+        return b"".join(parts)
+
+
+class ChunkStore(object):
+    """ 备份块存储 """
+
+    def __init__(self, chunk_path):
+        """
+        :param chunk_path: 块目录
+        """
+        self.chunk_path = chunk_path
+        # 本次写入新增的块 {sha256: (原始大小, 压缩后大小)}
+        self.new_chunks = dict()
+
+    @contextmanager
+    def lock(self, shared=False, blocking=True):
+        """
+        块目录文件锁，跨进程有效
+        写入备份持有共享锁，回收块持有排他锁，避免回收正在被引用的块
+        :param shared: 是否为共享锁
+        :param blocking: 是否等待获取锁
+        :return: 是否获取到锁
+        """
+        os.makedirs(self.chunk_path, exist_ok=True)
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        with open(os.path.join(self.chunk_path, ".lock"), "a") as fp:
+            try:
+                fcntl.flock(fp, operation)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def chunk_file(self, sha256):
+        return os.path.join(self.chunk_path, sha256[:2], sha256[2:4], sha256)
+
+    def put(self, chunk):
+        """
+        写入块，已存在的块不再写入
+        :return: 块的 sha256
+        """
+        sha256 = hashlib.sha256(chunk).hexdigest()
+        path = self.chunk_file(sha256)
+        if os.path.exists(path):
+            return sha256
+        dir_name = os.path.dirname(path)
+        os.makedirs(dir_name, exist_ok=True)
+        data = zlib.compress(chunk, COMPRESS_LEVEL)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".chunk.")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+        self.new_chunks[sha256] = (len(chunk), len(data))
+        return sha256
+
+    def get(self, sha256):
+        """ 读取块并校验 """
+        with open(self.chunk_file(sha256), "rb") as fp:
+            chunk = zlib.decompress(fp.read())
+        if hashlib.sha256(chunk).hexdigest() != sha256:
+            raise ValueError(f"备份块{sha256}校验失败")
+        return chunk
+
+    @property
+    def new_stored_size(self):
+        """ 本次新增块占用的空间 """
+        return sum(item[1] for item in self.new_chunks.values())
+
+    def writer(self, gzip_input=False):
+        return ChunkWriter(self, gzip_input=gzip_input)
+
+    @staticmethod
+    def chunk_sizes(manifest):
+        """ 清单引用的块及大小，同一清单内重复的块只计一次 """
+        return {
+            sha256: size
+            for item in manifest.get("files", list())
+            for sha256, size in item.get("chunks", list())
+        }
+
+    def _create_rows(self, size_dic):
+        """ 登记尚未登记的块，引用计数为 0 """
+        BackupChunk.objects.bulk_create([
+            BackupChunk(
+                sha256=sha256, size=size,
+                stored_size=self.new_chunks[sha256][1]
+                if sha256 in self.new_chunks
+                else os.path.getsize(self.chunk_file(sha256)))
+            for sha256, size in size_dic.items()
+        ], ignore_conflicts=True)
+
+    def commit(self, manifest):
+        """ 备份成功后增加清单中块的引用计数，需在写入备份的锁内调用 """
+        size_dic = self.chunk_sizes(manifest)
+        for batch in batched(size_dic):
+            exist_set = set(BackupChunk.objects.filter(
+                sha256__in=batch).values_list("sha256", flat=True))
+            self._create_rows({
+                sha256: size_dic[sha256]
+                for sha256 in batch if sha256 not in exist_set})
+            BackupChunk.objects.filter(sha256__in=batch).update(
+                ref_count=F("ref_count") + 1)
+        self.new_chunks = dict()
+
+    def rollback(self):
+        """
+        备份失败时登记本次新增的块，引用计数为 0，由回收统一删除；
+        并发的其它备份可能复用了这些块，此时不能直接删除文件
+        """
+        for batch in batched(self.new_chunks):
+            self._create_rows({
+                sha256: self.new_chunks[sha256][0] for sha256 in batch})
+        logger.info(f"备份失败，待回收新增的备份块{len(self.new_chunks)}个")
+        self.new_chunks = dict()
+
+    def release(self, manifest):
+        """
+        删除备份时减少清单中块的引用计数，并回收引用归零的块
+        :return: 回收的块数
+        """
+        for batch in batched(self.chunk_sizes(manifest)):
+            BackupChunk.objects.filter(sha256__in=batch).update(
+                ref_count=F("ref_count") - 1)
+        return self.collect()
+
+    def collect(self):
+        """
+        回收引用归零的块，有备份正在写入时跳过，留待下次回收
+        :return: 回收的块数
+        """
+        count = 0
+        with self.lock(blocking=False) as locked:
+            if not locked:
+                logger.info("备份写入中，跳过回收备份块")
+                return count
+            queryset = BackupChunk.objects.filter(ref_count__lte=0)
+            unused = list(queryset.values_list("sha256", flat=True))
+            for batch in batched(unused):
+                for sha256 in batch:
+                    path = self.chunk_file(sha256)
+                    if os.path.exists(path):
+                        os.remove(path)
+                BackupChunk.objects.filter(
+                    sha256__in=batch, ref_count__lte=0).delete()
+                count += len(batch)
+        if count:
+            logger.info(f"回收备份块{count}个")
+        return count
+
+    @staticmethod
+    def save_manifest(path, manifest):
+        dir_name = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".manifest.")
+        with os.fdopen(fd, "w", encoding="utf8") as fp:
+            json.dump(manifest, fp, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load_manifest(path):
+        with open(path, "r", encoding="utf8") as fp:
+            return json.load(fp)
+
+    def iter_restore(self, manifest, read_size=1024 * 1024):
+        """
+        按清单还原备份，逐块生成 tar 数据流，用于流式下载
+        :param manifest: 备份清单
+        :param read_size: 每次生成的数据大小
+        :return: bytes 生成器
+        """
+        total = 0
+        for item in manifest.get("files", list()):
+            tar_info = tarfile.TarInfo(item["file"])
+            tar_info.size = item["size"]
+            tar_info.mtime = manifest.get("create_time", 0)
+            tar_info.mode = 0o644
+            header = tar_info.tobuf(
+                tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+            yield header
+            total += len(header)
+            reader = ChunkReader(self, item["chunks"])
+            remain = item["size"]
+            while remain > 0:
+                data = reader.read(min(read_size, remain))
+                if not data:
+                    raise OSError(f"备份块数据不完整: {item['file']}")
+                remain -= len(data)
+                yield data
+            total += item["size"]
+            # 文件内容按 512 字节块对齐
+            padding = -item["size"] % tarfile.BLOCKSIZE
+            if padding:
+                yield tarfile.NUL * padding
+                total += padding
+        # 结束标记为两个空块，整体按记录大小对齐
+        total += tarfile.BLOCKSIZE * 2
+        yield tarfile.NUL * (
+            tarfile.BLOCKSIZE * 2 + (-total % tarfile.RECORDSIZE))
+
+    def restore(self, manifest, fileobj):
+        """
+        按清单还原备份，以 tar 数据流写入 fileobj
+        :param manifest: 备份清单
+        :param fileobj: 可写的文件对象
+        :return:
+        """
+        for data in self.iter_restore(manifest):
+            fileobj.write(data)
@@ -7,6 +7,7 @@ import logging
 from celery import shared_task
 from celery.utils.log import get_task_logger
 
+from backups.backup_service import backup_file_name
 from backups.backups_utils import rm_backend_file, backup_service_data
 from db_models.models import BackupSetting, BackupHistory
 
@@ -46,7 +47,7 @@ def backup_service(**kwargs):
         expire_time=expire_time,
         message={},
         retain_path=backup_setting.retain_path,
-        file_name=f"数据备份-{name}.tar.gz"
+        file_name=backup_file_name(f"数据备份-{name}")
     )
     # 调备份
     backup_service_data(history)
@@ -7,7 +7,7 @@
 from rest_framework.routers import DefaultRouter
 
 from backups.views import BackupSettingView, BackupOnceView, BackupHistoryView, BackupSendEmailView, \
-    CanBackupInstancesView
+    CanBackupInstancesView, BackupDownloadView
 
 router = DefaultRouter()
 # 获取可备份实例列表
@@ -21,6 +21,9 @@ router.register(r'backupOnce', BackupOnceView, basename='backupOnce')
 # 备份历史记录、删除备份
 router.register(r'backupHistory', BackupHistoryView,
                 basename='backupHistory')
+# 下载备份文件
+router.register(r'backupDownload', BackupDownloadView,
+                basename='backupDownload')
 # 推送备份
 router.register(r'backupSendEmail', BackupSendEmailView,
                 basename='backupSendEmail')
@@ -7,17 +7,21 @@ import json
 import logging
 import os
 import traceback
+from urllib.parse import quote
 
 from django.conf import settings
 from django.core.validators import EmailValidator
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.mixins import ListModelMixin, CreateModelMixin
 from rest_framework.serializers import Serializer
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.response import Response
 
+from backups.backup_service import backup_file_name
 from backups.backups_serializers import BackupHistorySerializer
-from backups.backups_utils import send_email as utils_send_email, rm_backend_file, transfer_week
+from backups.backups_utils import send_email as utils_send_email, rm_backend_file, transfer_week, \
+    iter_backup, download_file_name
 from backups.tasks import backup_service_once
 from db_models.models import BackupSetting, BackupHistory, Env, ModuleSendEmailSetting, Service
 from utils.common.paginations import PageNumberPager
@@ -306,7 +310,8 @@ class BackupOnceView(GenericViewSet, CreateModelMixin):
                 expire_time=expire_time,
                 retain_path=retain_path,
                 operation="手动执行",
-                file_name=f"数据备份-{date_str}{history_count + 1}-{env_id}.tar.gz"
+                file_name=backup_file_name(
+                    f"数据备份-{date_str}{history_count + 1}-{env_id}")
             )
             backup_service_once.delay(history.id)
             return Response({})
@@ -376,6 +381,33 @@ class BackupHistoryView(GenericViewSet, ListModelMixin, CreateModelMixin):
         return Response({})
 
 
+class BackupDownloadView(GenericViewSet, ListModelMixin):
+    """
+    下载备份文件，去重存储的备份按清单流式还原为 tar 文件
+    """
+
+    get_description = "下载备份文件"
+
+    def list(self, request, *args, **kwargs):
+        history_id = request.GET.get("id", "")
+        history = BackupHistory.objects.filter(id=history_id).first() \
+            if history_id.isdigit() else None
+        if not history:
+            return Response(data={"code": 1, "message": "请选择正确的备份记录！"})
+        if history.file_deleted or history.result != history.SUCCESS:
+            return Response(data={"code": 1, "message": "备份文件已被删除！"})
+        try:
+            stream = iter_backup(history)
+        except Exception as e:
+            logger.error(f"读取备份文件{history.file_name}失败：{str(e)}")
+            return Response(data={"code": 1, "message": "备份文件不存在或已损坏！"})
+        response = StreamingHttpResponse(
+            stream, content_type="application/octet-stream")
+        response["Content-Disposition"] = \
+            f"attachment;filename*=UTF-8''{quote(download_file_name(history))}"
+        return response
+
+
 class BackupSendEmailView(GenericViewSet, CreateModelMixin):
     """
     发送备份结果邮件
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.4 on 2022-03-10 15:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0028_auto_20220304_2001'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostMetricSnapshot',
+            fields=[
+                ('host', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metric_snapshot', serialize=False, to='db_models.host', verbose_name='主机')),
+                ('cpu_usage', models.IntegerField(blank=True, db_index=True, help_text='CPU使用率', null=True, verbose_name='CPU使用率')),
+                ('mem_usage', models.IntegerField(blank=True, db_index=True, help_text='内存使用率', null=True, verbose_name='内存使用率')),
+                ('root_disk_usage', models.IntegerField(blank=True, db_index=True, help_text='根分区使用率', null=True, verbose_name='根分区使用率')),
+                ('data_disk_usage', models.IntegerField(blank=True, db_index=True, help_text='数据分区使用率', null=True, verbose_name='数据分区使用率')),
+                ('modified', models.DateTimeField(auto_now=True, help_text='更新时间', verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '主机指标快照',
+                'verbose_name_plural': '主机指标快照',
+                'db_table': 'omp_host_metric_snapshot',
+            },
+        ),
+        migrations.CreateModel(
+            name='ServiceMetricSnapshot',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metric_snapshot', serialize=False, to='db_models.service', verbose_name='服务')),
+                ('cpu_usage', models.IntegerField(blank=True, db_index=True, help_text='CPU使用率', null=True, verbose_name='CPU使用率')),
+                ('mem_usage', models.IntegerField(blank=True, db_index=True, help_text='内存使用率', null=True, verbose_name='内存使用率')),
+                ('modified', models.DateTimeField(auto_now=True, help_text='更新时间', verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '服务指标快照',
+                'verbose_name_plural': '服务指标快照',
+                'db_table': 'omp_service_metric_snapshot',
+            },
+        ),
+    ]
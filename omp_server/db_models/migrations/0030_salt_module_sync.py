@@ -0,0 +1,26 @@
+# Generated by Django 3.1.4 on 2022-03-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0029_metric_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaltModuleSync',
+            fields=[
+                ('minion_id', models.CharField(help_text='minion id', max_length=64, primary_key=True, serialize=False, verbose_name='minion id')),
+                ('module_hash', models.CharField(help_text='_modules 目录的内容哈希', max_length=64, verbose_name='模块版本')),
+                ('modified', models.DateTimeField(auto_now=True, help_text='同步时间', verbose_name='同步时间')),
+            ],
+            options={
+                'verbose_name': 'salt模块同步记录',
+                'verbose_name_plural': 'salt模块同步记录',
+                'db_table': 'omp_salt_module_sync',
+            },
+        ),
+    ]
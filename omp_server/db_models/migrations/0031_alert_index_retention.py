@@ -0,0 +1,112 @@
+# Generated by Django 3.1.4 on 2022-03-16 10:25
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+import django.db.models.deletion
+
+
+def normalize_fingerprint(apps, schema_editor):
+    """ 超过 64 位的告警标识转为 md5，避免缩短字段长度时截断或失败 """
+    Alert = apps.get_model("db_models", "Alert")
+    queryset = Alert.objects.annotate(
+        fingerprint_len=Length("fingerprint")
+    ).filter(fingerprint_len__gt=64).only("id", "fingerprint")
+    for alert in queryset.iterator():
+        Alert.objects.filter(id=alert.id).update(fingerprint=hashlib.md5(
+            alert.fingerprint.encode("utf8")).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0030_salt_module_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='告警日期', verbose_name='告警日期')),
+                ('alert_type', models.CharField(default='', help_text='告警类型，主机host，服务service', max_length=32, verbose_name='告警类型')),
+                ('alert_host_ip', models.CharField(default='', help_text='告警来源主机ip', max_length=64, verbose_name='告警主机ip')),
+                ('alert_service_name', models.CharField(default='', help_text='服务类告警中的服务名称', max_length=128, verbose_name='告警服务名称')),
+                ('alert_instance_name', models.CharField(default='', help_text='告警实例名称', max_length=128, verbose_name='告警实例名称')),
+                ('alert_level', models.CharField(default='', help_text='告警级别', max_length=64, verbose_name='告警级别')),
+                ('alert_count', models.IntegerField(default=0, help_text='告警次数', verbose_name='告警次数')),
+                ('first_alert_time', models.DateTimeField(help_text='当天首次告警时间', verbose_name='当天首次告警时间')),
+                ('last_alert_time', models.DateTimeField(help_text='当天最后告警时间', verbose_name='当天最后告警时间')),
+            ],
+            options={
+                'verbose_name': '告警日汇总',
+                'verbose_name_plural': '告警日汇总',
+                'db_table': 'omp_alert_daily_summary',
+            },
+        ),
+        migrations.RunPython(
+            normalize_fingerprint, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='alert',
+            name='fingerprint',
+            field=models.CharField(blank=True, help_text='告警的唯一标识', max_length=64, null=True, verbose_name='告警的唯一标识'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['create_time'], name='omp_alert_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['alert_time'], name='omp_alert_atime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['fingerprint', 'alert_time'], name='omp_alert_fp_atime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['alert_host_ip', 'alert_time'], name='omp_alert_ip_atime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['is_read', 'create_time'], name='omp_alert_read_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hostoperatelog',
+            index=models.Index(fields=['created'], name='omp_host_log_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hostoperatelog',
+            index=models.Index(fields=['host', 'created'], name='omp_host_log_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operatelog',
+            index=models.Index(fields=['create_time'], name='omp_operate_log_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='selfhealinghistory',
+            index=models.Index(fields=['alert_time'], name='omp_heal_atime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='selfhealinghistory',
+            index=models.Index(fields=['host_ip', 'service_name', 'alert_time'], name='omp_heal_ip_service_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='selfhealinghistory',
+            index=models.Index(fields=['instance_name', 'state'], name='omp_heal_ins_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userloginlog',
+            index=models.Index(fields=['login_time'], name='omp_login_log_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='alertdailysummary',
+            name='env',
+            field=models.ForeignKey(help_text='环境', null=True, on_delete=django.db.models.deletion.SET_NULL, to='db_models.env', verbose_name='环境'),
+        ),
+        migrations.AddIndex(
+            model_name='alertdailysummary',
+            index=models.Index(fields=['date', 'alert_host_ip'], name='omp_alert_sum_date_ip_idx'),
+        ),
+    ]
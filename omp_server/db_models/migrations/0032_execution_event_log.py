@@ -0,0 +1,34 @@
+# Generated by Django 3.1.4 on 2022-03-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0031_alert_index_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecutionEventLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('module', models.CharField(choices=[('install', '安装'), ('tool', '工具执行')], help_text='模块', max_length=16, verbose_name='模块')),
+                ('history_id', models.IntegerField(help_text='执行详情id', verbose_name='执行详情id')),
+                ('step', models.CharField(default='', help_text='执行步骤', max_length=16, verbose_name='执行步骤')),
+                ('seq', models.IntegerField(help_text='日志序号', verbose_name='日志序号')),
+                ('ts', models.DateTimeField(help_text='记录时间', verbose_name='记录时间')),
+                ('line', models.TextField(help_text='日志内容', verbose_name='日志内容')),
+            ],
+            options={
+                'verbose_name': '执行过程日志',
+                'verbose_name_plural': '执行过程日志',
+                'db_table': 'omp_execution_event_log',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='executioneventlog',
+            index=models.Index(fields=['module', 'history_id', 'seq'], name='event_log_history_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.4 on 2022-03-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0032_execution_event_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrometheusTarget',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_name', models.CharField(help_text='任务名称，如 nodeExporter', max_length=128, verbose_name='任务名称')),
+                ('target_key', models.CharField(help_text='任务内目标唯一标识', max_length=255, verbose_name='目标标识')),
+                ('instance', models.CharField(default='', help_text='instance 标签', max_length=64, verbose_name='实例地址')),
+                ('env', models.CharField(default='', help_text='env 标签', max_length=64, verbose_name='环境')),
+                ('targets', models.JSONField(default=list, help_text='抓取地址', verbose_name='抓取地址')),
+                ('labels', models.JSONField(default=dict, help_text='标签', verbose_name='标签')),
+                ('updated', models.DateTimeField(auto_now=True, help_text='更新时间', verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': 'prometheus抓取目标',
+                'verbose_name_plural': 'prometheus抓取目标',
+                'db_table': 'omp_prometheus_target',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prometheustarget',
+            index=models.Index(fields=['job_name', 'instance'], name='omp_prom_target_job_ins_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='prometheustarget',
+            unique_together={('job_name', 'target_key')},
+        ),
+    ]
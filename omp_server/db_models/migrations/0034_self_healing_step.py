@@ -0,0 +1,27 @@
+# Generated by Django 3.1.4 on 2022-03-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0033_prometheus_target'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='selfhealinghistory',
+            name='healing_step',
+            field=models.CharField(choices=[('pending', '等待重启'), ('restarting', '重启中'), ('verifying', '等待校验')], default='pending', help_text='自愈中的记录所处步骤', max_length=16, verbose_name='自愈步骤'),
+        ),
+        migrations.AddField(
+            model_name='selfhealinghistory',
+            name='next_run_time',
+            field=models.DateTimeField(help_text='等待重启、校验的执行时间，重启中的超时时间', null=True, verbose_name='步骤执行时间'),
+        ),
+        migrations.AddIndex(
+            model_name='selfhealinghistory',
+            index=models.Index(fields=['state', 'healing_step', 'next_run_time'], name='omp_heal_state_step_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.4 on 2022-03-19 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0034_self_healing_step'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backuphistory',
+            name='duration',
+            field=models.FloatField(default=0, verbose_name='备份耗时, 秒'),
+        ),
+        migrations.AddField(
+            model_name='backuphistory',
+            name='throughput',
+            field=models.FloatField(default=0, verbose_name='备份速率, MB/s'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.4 on 2022-03-20 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0035_backup_history_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='块sha256')),
+                ('size', models.IntegerField(default=0, verbose_name='块原始大小')),
+                ('stored_size', models.IntegerField(default=0, verbose_name='块压缩后大小')),
+                ('ref_count', models.IntegerField(default=0, verbose_name='引用计数')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '备份块',
+                'verbose_name_plural': '备份块',
+                'db_table': 'omp_backup_chunk',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.1.4 on 2022-03-28 15:40
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_alert(apps, schema_editor):
+    """ 清理并发入库产生的重复告警，每组保留最早的一条 """
+    Alert = apps.get_model("db_models", "Alert")
+    duplicate_queryset = Alert.objects.exclude(
+        fingerprint__isnull=True
+    ).values("fingerprint", "alert_time").annotate(
+        alert_count=Count("id"), keep_id=Min("id")
+    ).filter(alert_count__gt=1)
+    for item in duplicate_queryset.iterator():
+        Alert.objects.filter(
+            fingerprint=item["fingerprint"], alert_time=item["alert_time"]
+        ).exclude(id=item["keep_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('db_models', '0036_backup_chunk'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_alert, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='alert',
+            unique_together={('fingerprint', 'alert_time')},
+        ),
+        migrations.RemoveIndex(
+            model_name='alert',
+            name='omp_alert_fp_atime_idx',
+        ),
+    ]
@@ -1,16 +1,17 @@
-from .backup import BackupSetting, BackupHistory
+from .backup import BackupSetting, BackupHistory, BackupChunk
 from .email import EmailSMTPSetting, ModuleSendEmailSetting
 from .env import Env
-from .execution import ExecutionRecord
-from .host import Host, HostOperateLog
+from .execution import ExecutionRecord, ExecutionEventLog
+from .host import Host, HostOperateLog, HostMetricSnapshot, SaltModuleSync
 from .inspection import InspectionHistory, InspectionCrontab, InspectionReport
 from .install import MainInstallHistory, PreInstallHistory, \
     DetailInstallHistory, PostInstallHistory, DeploymentPlan
 from .monitor import MonitorUrl, Alert, Maintain, GrafanaMainPage, \
-    AlertSendWaySetting
+    AlertSendWaySetting, AlertDailySummary, PrometheusTarget
 from .product import Labels, UploadPackageHistory, ProductHub, \
     ApplicationHub, Product
-from .service import ServiceConnectInfo, ClusterInfo, Service, ServiceHistory
+from .service import ServiceConnectInfo, ClusterInfo, Service, \
+    ServiceHistory, ServiceMetricSnapshot
 from .threshold import HostThreshold, ServiceThreshold, ServiceCustomThreshold,AlertRule,Rule
 from .tool import ToolInfo, ToolExecuteMainHistory, ToolExecuteDetailHistory
 from .upload import UploadFileHistory
@@ -29,6 +30,8 @@ __all__ = [
     # 主机
     Host,
     HostOperateLog,
+    HostMetricSnapshot,
+    SaltModuleSync,
     # 巡检
     InspectionHistory,
     InspectionCrontab,
@@ -45,6 +48,8 @@ __all__ = [
     Maintain,
     GrafanaMainPage,
     AlertSendWaySetting,
+    AlertDailySummary,
+    PrometheusTarget,
     # 产品
     Labels,
     UploadPackageHistory,
@@ -56,6 +61,7 @@ __all__ = [
     ClusterInfo,
     Service,
     ServiceHistory,
+    ServiceMetricSnapshot,
     # 阈值
     HostThreshold,
     ServiceThreshold,
@@ -73,11 +79,13 @@ __all__ = [
     # 备份
     BackupSetting,
     BackupHistory,
+    BackupChunk,
     # 自愈
     SelfHealingHistory,
     SelfHealingSetting,
     # 执行记录
     ExecutionRecord,
+    ExecutionEventLog,
     # 小工具
     ToolInfo,
     ToolExecuteMainHistory,
@@ -57,6 +57,8 @@ class BackupHistory(TimeStampMixin):
     send_email_result = models.IntegerField(
         "邮件推送状态", choices=SEND_RESULT_CHOICES, default=NOT_SEND)
     email_fail_reason = models.TextField("邮件推送失败原因", default="")
+    duration = models.FloatField("备份耗时, 秒", default=0)
+    throughput = models.FloatField("备份速率, MB/s", default=0)
 
     class Meta:
         db_table = 'omp_backup_history'
@@ -73,3 +75,17 @@ class BackupHistory(TimeStampMixin):
     def fetch_file_kwargs(self):
         file_path = os.path.join(self.retain_path, self.file_name)
         return {"path": file_path}
+
+
+class BackupChunk(models.Model):
+    """ 去重存储的备份块，引用计数归零时回收 """
+
+    sha256 = models.CharField("块sha256", max_length=64, unique=True)
+    size = models.IntegerField("块原始大小", default=0)
+    stored_size = models.IntegerField("块压缩后大小", default=0)
+    ref_count = models.IntegerField("引用计数", default=0)
+    created = models.DateTimeField("创建时间", auto_now_add=True)
+
+    class Meta:
+        db_table = 'omp_backup_chunk'
+        verbose_name = verbose_name_plural = '备份块'
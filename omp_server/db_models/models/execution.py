@@ -55,3 +55,35 @@ class ExecutionRecord(TimeStampMixin):
     class Meta:
         db_table = "omp_execution_record"
         verbose_name = verbose_name_plural = '执行记录'
+
+
+class ExecutionEventLog(models.Model):
+    """
+    执行过程日志，仅追加写入
+    安装、工具执行过程中的日志逐行记录，按 seq 增量读取
+    """
+    objects = None
+    MODULE_INSTALL = "install"
+    MODULE_TOOL = "tool"
+    MODULE_CHOICES = (
+        (MODULE_INSTALL, "安装"),
+        (MODULE_TOOL, "工具执行"),
+    )
+    module = models.CharField(
+        "模块", max_length=16, choices=MODULE_CHOICES, help_text="模块")
+    # DetailInstallHistory.id & ToolExecuteDetailHistory.id
+    history_id = models.IntegerField("执行详情id", help_text="执行详情id")
+    step = models.CharField(
+        "执行步骤", max_length=16, default="", help_text="执行步骤")
+    seq = models.IntegerField("日志序号", help_text="日志序号")
+    ts = models.DateTimeField("记录时间", help_text="记录时间")
+    line = models.TextField("日志内容", help_text="日志内容")
+
+    class Meta:
+        db_table = "omp_execution_event_log"
+        verbose_name = verbose_name_plural = "执行过程日志"
+        indexes = [
+            models.Index(
+                fields=["module", "history_id", "seq"],
+                name="event_log_history_seq_idx"),
+        ]
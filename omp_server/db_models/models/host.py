@@ -126,3 +126,54 @@ class HostOperateLog(models.Model):
         db_table = "omp_host_operate_log"
         verbose_name = verbose_name_plural = "主机操作记录"
         ordering = ("-created",)
+        indexes = [
+            models.Index(
+                fields=["created"], name="omp_host_log_created_idx"),
+            models.Index(
+                fields=["host", "created"], name="omp_host_log_host_idx"),
+        ]
+
+
+class HostMetricSnapshot(models.Model):
+    """ 主机指标快照表，由定时任务刷新，用于全量排序 """
+
+    objects = None
+    host = models.OneToOneField(
+        Host, primary_key=True, on_delete=models.CASCADE,
+        related_name="metric_snapshot", verbose_name="主机")
+    cpu_usage = models.IntegerField(
+        "CPU使用率", null=True, blank=True, db_index=True,
+        help_text="CPU使用率")
+    mem_usage = models.IntegerField(
+        "内存使用率", null=True, blank=True, db_index=True,
+        help_text="内存使用率")
+    root_disk_usage = models.IntegerField(
+        "根分区使用率", null=True, blank=True, db_index=True,
+        help_text="根分区使用率")
+    data_disk_usage = models.IntegerField(
+        "数据分区使用率", null=True, blank=True, db_index=True,
+        help_text="数据分区使用率")
+    modified = models.DateTimeField(
+        "更新时间", auto_now=True, help_text="更新时间")
+
+    class Meta:
+        """ 元数据 """
+        db_table = "omp_host_metric_snapshot"
+        verbose_name = verbose_name_plural = "主机指标快照"
+
+
+class SaltModuleSync(models.Model):
+    """ salt自定义模块同步记录表，记录各 minion 最近一次同步的模块版本 """
+
+    objects = None
+    minion_id = models.CharField(
+        "minion id", max_length=64, primary_key=True, help_text="minion id")
+    module_hash = models.CharField(
+        "模块版本", max_length=64, help_text="_modules 目录的内容哈希")
+    modified = models.DateTimeField(
+        "同步时间", auto_now=True, help_text="同步时间")
+
+    class Meta:
+        """ 元数据 """
+        db_table = "omp_salt_module_sync"
+        verbose_name = verbose_name_plural = "salt模块同步记录"
@@ -51,7 +51,7 @@ class Alert(models.Model):
     monitor_log = models.CharField(
         "跳转监控日志路径", max_length=2048, blank=True, null=True, help_text="跳转grafana日志页面路由")
     fingerprint = models.CharField(
-        "告警的唯一标识", max_length=1024, blank=True, null=True, help_text="告警的唯一标识")
+        "告警的唯一标识", max_length=64, blank=True, null=True, help_text="告警的唯一标识")
     env = models.ForeignKey(
         Env, null=True, on_delete=models.SET_NULL,
         verbose_name="环境", help_text="环境")
@@ -60,6 +60,56 @@ class Alert(models.Model):
         """元数据"""
         db_table = 'omp_alert'
         verbose_name = verbose_name_plural = "告警记录"
+        # 告警入库去重，并发推送同一告警时只写入一条
+        unique_together = ("fingerprint", "alert_time")
+        indexes = [
+            # 告警列表默认排序、按入库时间清理
+            models.Index(fields=["create_time"], name="omp_alert_ctime_idx"),
+            models.Index(fields=["alert_time"], name="omp_alert_atime_idx"),
+            # 按主机清理告警、汇总告警
+            models.Index(
+                fields=["alert_host_ip", "alert_time"],
+                name="omp_alert_ip_atime_idx"),
+            models.Index(
+                fields=["is_read", "create_time"],
+                name="omp_alert_read_ctime_idx"),
+        ]
+
+
+class AlertDailySummary(models.Model):
+    """告警日汇总表，超出保留期的告警按天、对象、级别汇总后写入"""
+
+    objects = None
+    date = models.DateField("告警日期", help_text="告警日期")
+    alert_type = models.CharField(
+        "告警类型", max_length=32, default="", help_text="告警类型，主机host，服务service")
+    alert_host_ip = models.CharField(
+        "告警主机ip", max_length=64, default="", help_text="告警来源主机ip")
+    alert_service_name = models.CharField(
+        "告警服务名称", max_length=128, default="", help_text="服务类告警中的服务名称")
+    alert_instance_name = models.CharField(
+        "告警实例名称", max_length=128, default="", help_text="告警实例名称")
+    alert_level = models.CharField(
+        "告警级别", max_length=64, default="", help_text="告警级别")
+    alert_count = models.IntegerField(
+        "告警次数", default=0, help_text="告警次数")
+    first_alert_time = models.DateTimeField(
+        "当天首次告警时间", help_text="当天首次告警时间")
+    last_alert_time = models.DateTimeField(
+        "当天最后告警时间", help_text="当天最后告警时间")
+    env = models.ForeignKey(
+        Env, null=True, on_delete=models.SET_NULL,
+        verbose_name="环境", help_text="环境")
+
+    class Meta:
+        """元数据"""
+        db_table = "omp_alert_daily_summary"
+        verbose_name = verbose_name_plural = "告警日汇总"
+        indexes = [
+            models.Index(
+                fields=["date", "alert_host_ip"],
+                name="omp_alert_sum_date_ip_idx"),
+        ]
 
 
 class Maintain(models.Model):
@@ -166,3 +216,34 @@ class AlertSendWaySetting(models.Model):
         cls.objects.filter(
             way_name="email"
         ).update(used=used, server_url=user_emails)
+
+
+class PrometheusTarget(models.Model):
+    """
+    prometheus 抓取目标表，
+    conf/targets 下的 file_sd 文件均由该表生成
+    """
+
+    objects = None
+    job_name = models.CharField(
+        "任务名称", max_length=128, help_text="任务名称，如 nodeExporter")
+    target_key = models.CharField(
+        "目标标识", max_length=255, help_text="任务内目标唯一标识")
+    instance = models.CharField(
+        "实例地址", max_length=64, default="", help_text="instance 标签")
+    env = models.CharField(
+        "环境", max_length=64, default="", help_text="env 标签")
+    targets = models.JSONField("抓取地址", default=list, help_text="抓取地址")
+    labels = models.JSONField("标签", default=dict, help_text="标签")
+    updated = models.DateTimeField("更新时间", auto_now=True, help_text="更新时间")
+
+    class Meta:
+        """ 元数据 """
+        db_table = "omp_prometheus_target"
+        verbose_name = verbose_name_plural = "prometheus抓取目标"
+        unique_together = ("job_name", "target_key")
+        indexes = [
+            models.Index(
+                fields=["job_name", "instance"],
+                name="omp_prom_target_job_ins_idx"),
+        ]
@@ -43,7 +43,33 @@ class SelfHealingHistory(models.Model):
     alert_content = models.TextField("告警日志内容", default="")
     monitor_log = models.TextField("grafana日志url", default="")
     service_en_type = models.CharField("服务类型，self_dev&component&database", max_length=64, default="")
+    STEP_PENDING = "pending"
+    STEP_RESTARTING = "restarting"
+    STEP_VERIFYING = "verifying"
+    STEP_CHOICES = (
+        (STEP_PENDING, "等待重启"),
+        (STEP_RESTARTING, "重启中"),
+        (STEP_VERIFYING, "等待校验")
+    )
+    healing_step = models.CharField(
+        "自愈步骤", max_length=16, choices=STEP_CHOICES, default=STEP_PENDING,
+        help_text="自愈中的记录所处步骤")
+    next_run_time = models.DateTimeField(
+        "步骤执行时间", null=True, help_text="等待重启、校验的执行时间，重启中的超时时间")
 
     class Meta:
         db_table = "omp_self_healing_history"
         verbose_name = verbose_name_plural = "自愈历史记录"
+        indexes = [
+            models.Index(
+                fields=["alert_time"], name="omp_heal_atime_idx"),
+            models.Index(
+                fields=["host_ip", "service_name", "alert_time"],
+                name="omp_heal_ip_service_idx"),
+            models.Index(
+                fields=["instance_name", "state"],
+                name="omp_heal_ins_state_idx"),
+            models.Index(
+                fields=["state", "healing_step", "next_run_time"],
+                name="omp_heal_state_step_idx"),
+        ]
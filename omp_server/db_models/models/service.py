@@ -379,3 +379,25 @@ class ServiceHistory(models.Model):
             **kwargs
         )
         return service_history
+
+
+class ServiceMetricSnapshot(models.Model):
+    """ 服务指标快照表，由定时任务刷新，用于全量排序 """
+
+    objects = None
+    service = models.OneToOneField(
+        Service, primary_key=True, on_delete=models.CASCADE,
+        related_name="metric_snapshot", verbose_name="服务")
+    cpu_usage = models.IntegerField(
+        "CPU使用率", null=True, blank=True, db_index=True,
+        help_text="CPU使用率")
+    mem_usage = models.IntegerField(
+        "内存使用率", null=True, blank=True, db_index=True,
+        help_text="内存使用率")
+    modified = models.DateTimeField(
+        "更新时间", auto_now=True, help_text="更新时间")
+
+    class Meta:
+        """ 元数据 """
+        db_table = "omp_service_metric_snapshot"
+        verbose_name = verbose_name_plural = "服务指标快照"
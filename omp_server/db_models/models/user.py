@@ -40,6 +40,10 @@ class OperateLog(models.Model):
         """ 元数据 """
         db_table = "omp_user_operate_log"
         verbose_name = verbose_name_plural = "用户操作记录"
+        indexes = [
+            models.Index(
+                fields=["create_time"], name="omp_operate_log_ctime_idx"),
+        ]
 
 
 class UserLoginLog(models.Model):
@@ -59,3 +63,7 @@ class UserLoginLog(models.Model):
     class Meta:
         db_table = "omp_login_log"
         verbose_name = verbose_name_plural = "用户登陆记录"
+        indexes = [
+            models.Index(
+                fields=["login_time"], name="omp_login_log_time_idx"),
+        ]
@@ -1,13 +1,18 @@
 from .execution_record import install_execution_record,\
     upgrade_execution_record, rollback_execution_record
 from .service import update_execution_record
+from .dashboard import host_dashboard_refresh, service_dashboard_refresh, \
+    service_delete_dashboard_refresh
 
 
 __all__ = [
     install_execution_record,
     upgrade_execution_record,
     rollback_execution_record,
-    update_execution_record
+    update_execution_record,
+    host_dashboard_refresh,
+    service_dashboard_refresh,
+    service_delete_dashboard_refresh
 ]
 
 
@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from db_models.models import Host, Service
+
+
+def refresh_dashboard():
+    """ 事务提交后请求刷新仪表盘快照 """
+    from promemonitor.tasks import request_dashboard_refresh
+    transaction.on_commit(request_dashboard_refresh)
+
+
+@receiver(post_save, sender=Host)
+@receiver(post_delete, sender=Host)
+def host_dashboard_refresh(sender, instance, *args, **kwargs):
+    refresh_dashboard()
+
+
+@receiver(post_save, sender=Service)
+def service_dashboard_refresh(sender, instance, created=False,
+                              update_fields=None, *args, **kwargs):
+    # 仅服务新增及状态可能变化时刷新
+    if created or update_fields is None or "service_status" in update_fields:
+        refresh_dashboard()
+
+
+@receiver(post_delete, sender=Service)
+def service_delete_dashboard_refresh(sender, instance, *args, **kwargs):
+    refresh_dashboard()
@@ -4,7 +4,7 @@ from django.dispatch import receiver
 from db_models.mixins import UpgradeStateChoices, RollbackStateChoices
 from db_models.models import Service, MainInstallHistory, \
     ExecutionRecord, UpgradeHistory, RollbackHistory, UpgradeDetail, \
-    RollbackDetail, DetailInstallHistory
+    RollbackDetail, DetailInstallHistory, ExecutionEventLog
 
 
 def update_upgrade_history(history, union_server):
@@ -62,4 +62,9 @@ def update_execution_record(sender, instance, *args, **kwargs):
                 history.upgrade_state != UpgradeStateChoices.UPGRADE_SUCCESS:
             update_upgrade_history(history, union_server)
     # 删除安装记录, 修复卸载产品再重试安装
-    DetailInstallHistory.objects.filter(service=instance).delete()
+    detail_queryset = DetailInstallHistory.objects.filter(service=instance)
+    ExecutionEventLog.objects.filter(
+        module=ExecutionEventLog.MODULE_INSTALL,
+        history_id__in=list(detail_queryset.values_list("id", flat=True))
+    ).delete()
+    detail_queryset.delete()
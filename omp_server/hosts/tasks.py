@@ -27,7 +27,7 @@ from promemonitor.prometheus_utils import PrometheusUtils
 from db_models.models import (
     Host, Service,
     HostOperateLog,
-    Alert
+    Alert, SaltModuleSync
 )
 from utils.plugin.ssh import SSH
 from utils.plugin.monitor_agent import MonitorAgentManager
@@ -35,6 +35,7 @@ from utils.plugin.crypto import AESCryptor
 from utils.plugin.agent_util import Agent
 from app_store.tasks import add_prometheus
 from utils.parse_config import HOSTNAME_PREFIX
+from utils.parse_config import THREAD_POOL_MAX_WORKERS
 from utils.plugin.install_ntpdate import InstallNtpdate
 from omp_server.settings import PROJECT_DIR
 from concurrent.futures import ThreadPoolExecutor
@@ -75,13 +76,15 @@ def deploy_monitor_agent(host_obj, salt_flag=True):
         Host.objects.filter(ip=host_obj.ip).update(monitor_agent=0)
 
 
-def real_deploy_agent(host_obj, need_monitor=True):
+def real_deploy_agent(host_obj, need_monitor=True, bootstrap=False):
     """
     部署主机Agent
     :param host_obj: 主机对象
     :type host_obj Host
     :param need_monitor: 是否部署monitor
     :type need_monitor bool
+    :param bootstrap: 是否使用单通道部署
+    :type bootstrap bool
     :return:
     """
     logger.info(
@@ -96,10 +99,13 @@ def real_deploy_agent(host_obj, need_monitor=True):
         password=AESCryptor().decode(host_obj.password),
         install_dir=host_obj.agent_dir
     )
-    flag, message = _obj.agent_deploy()
+    flag, message = _obj.agent_bootstrap() if bootstrap else \
+        _obj.agent_deploy()
     logger.info(
         f"Deploy Agent for {host_obj.ip}, "
         f"Res Flag: {flag}; Res Message: {message}")
+    # 重新部署后 minion 上的自定义模块需重新同步
+    SaltModuleSync.objects.filter(minion_id=host_obj.ip).delete()
     # 更新主机Agent状态，0 正常；4 部署失败
     # 使用filter查询然后使用update方法进行处理，防止多任务环境
     if flag:
@@ -267,9 +273,14 @@ def init_host(host_id):
             init_status=Host.INIT_FAILED)
 
 
-@shared_task
-def insert_host_celery_task(host_id, init=False):
-    """ 添加主机 celery 任务 """
+def real_insert_host(host_id, init=False, bootstrap=False):
+    """
+    添加主机，依次执行主机初始化、部署 agent、部署 ntpdate
+    :param host_id: 主机id
+    :param init: 是否执行主机初始化
+    :param bootstrap: 是否使用单通道部署 agent
+    :return:
+    """
     # 执行主机初始化
     if init:
         try:
@@ -306,7 +317,7 @@ def insert_host_celery_task(host_id, init=False):
             raise Exception("Host Object not found")
         host_query = Host.objects.filter(id=host_id)
         host_query.update(host_agent=Host.AGENT_DEPLOY_ING)
-        real_deploy_agent(host_obj=host_query.first())
+        real_deploy_agent(host_obj=host_query.first(), bootstrap=bootstrap)
     except Exception as e:
         logger.error(
             f"Deploy Host Agent For {host_id} Failed with error: {str(e)};\n"
@@ -330,6 +341,33 @@ def insert_host_celery_task(host_id, init=False):
             ntpdate_install_status=Host.NTPDATE_INSTALL_FAILED)
 
 
+@shared_task
+def insert_host_celery_task(host_id, init=False):
+    """ 添加主机 celery 任务 """
+    real_insert_host(host_id, init=init)
+
+
+@shared_task
+def batch_insert_host_celery_task(host_init_list):
+    """
+    批量添加主机 celery 任务，有限并发处理各主机，agent 使用单通道部署，
+    各主机进度通过主机的初始化、agent 状态体现
+    :param host_init_list: [[主机id, 是否执行主机初始化]]
+    :return:
+    """
+    logger.info(f"Batch insert host begin, count: {len(host_init_list)}")
+    with ThreadPoolExecutor(THREAD_POOL_MAX_WORKERS) as executor:
+        for host_id, init in host_init_list:
+            executor.submit(
+                real_insert_host, host_id, init=init, bootstrap=True)
+    success_count = Host.objects.filter(
+        id__in=[el[0] for el in host_init_list],
+        host_agent=Host.AGENT_RUNNING).count()
+    logger.info(
+        f"Batch insert host finished, "
+        f"agent success: {success_count}/{len(host_init_list)}")
+
+
 def write_host_log(host_queryset, status, result, username):
     """ 写入主机日志 """
     log_ls = []
@@ -440,6 +478,7 @@ class UninstallHosts(object):
                 print(f"删除{item}获取到stdout: {_out}; stderr: {_err}")
                 self.is_success = False
             logger.info(f"删除{item}获取到哦的stdout: {_out}; stderr: {_err}")
+        SaltModuleSync.objects.filter(minion_id__in=key_list).delete()
 
     @staticmethod
     def del_single_agent(obj):
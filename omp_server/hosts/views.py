@@ -9,7 +9,6 @@ from rest_framework.mixins import (
     ListModelMixin, CreateModelMixin, UpdateModelMixin,
     RetrieveModelMixin
 )
-from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 
@@ -18,7 +17,8 @@ from django_filters.rest_framework.backends import DjangoFilterBackend
 from db_models.models import (Env, Host, HostOperateLog)
 from utils.plugin.crypto import AESCryptor
 from utils.common.paginations import PageNumberPager
-from hosts.tasks import insert_host_celery_task
+from utils.common.filters import MetricOrderingFilter
+from hosts.tasks import batch_insert_host_celery_task
 from hosts.hosts_filters import (HostFilter, HostOperateFilter)
 from hosts.hosts_serializers import (
     HostSerializer, HostMaintenanceSerializer,
@@ -49,11 +49,11 @@ class HostListView(GenericViewSet, ListModelMixin, CreateModelMixin):
     serializer_class = HostSerializer
     pagination_class = PageNumberPager
     # 过滤，排序字段
-    filter_backends = (DjangoFilterBackend, OrderingFilter)
+    filter_backends = (DjangoFilterBackend, MetricOrderingFilter)
     filter_class = HostFilter
     ordering_fields = ("ip", "host_agent", "monitor_agent",
                        "service_num", "alert_num")
-    # 动态排序字段
+    # 动态排序字段，基于指标快照表排序
     dynamic_fields = ("cpu_usage", "mem_usage",
                       "root_disk_usage", "data_disk_usage")
     # 操作描述信息
@@ -61,7 +61,7 @@ class HostListView(GenericViewSet, ListModelMixin, CreateModelMixin):
     post_description = "创建主机"
 
     def list(self, request, *args, **kwargs):
-        # 获取序列化数据列表
+        # 获取序列化数据列表，动态字段排序已由指标快照在数据库中完成
         queryset = self.filter_queryset(self.get_queryset())
         serializer = self.get_serializer(
             self.paginate_queryset(queryset), many=True)
@@ -81,27 +81,7 @@ class HostListView(GenericViewSet, ListModelMixin, CreateModelMixin):
         prometheus_obj = Prometheus()
         serializer_data = prometheus_obj.get_host_info(serializer_data)
 
-        # 获取请求中 ordering 字段
-        query_field = request.query_params.get("ordering", "")
-        reverse_flag = False
-        if query_field.startswith("-"):
-            reverse_flag = True
-            query_field = query_field[1:]
-        # 若排序字段在类视图 dynamic_fields 中，则对根据动态数据进行排序
-        none_ls = list(filter(
-            lambda x: x.get(query_field) is None,
-            serializer_data))
-        exists_ls = list(filter(
-            lambda x: x.get(query_field) is not None,
-            serializer_data))
-        if query_field in self.dynamic_fields:
-            exists_ls = sorted(
-                exists_ls,
-                key=lambda x: x.get(query_field),
-                reverse=reverse_flag)
-        exists_ls.extend(none_ls)
-
-        return self.get_paginated_response(exists_ls)
+        return self.get_paginated_response(serializer_data)
 
 
 class HostReinstallView(GenericViewSet, CreateModelMixin):
@@ -314,16 +294,18 @@ class HostBatchImportView(GenericViewSet, CreateModelMixin):
                 host_instances = Host.objects.filter(
                     instance_name__in=instance_name_list)
                 operate_log_objs = []
+                host_init_list = []
                 for instance in host_instances:
                     operate_log_objs.append(HostOperateLog(
                         username=request.user.username,
                         description="创建主机",
                         host=instance,
                     ))
-                    # 下发异步 celery 任务
-                    insert_host_celery_task.delay(
-                        instance.id, init=host_init_info.get(instance.ip))
+                    host_init_list.append(
+                        [instance.id, host_init_info.get(instance.ip)])
                 HostOperateLog.objects.bulk_create(operate_log_objs)
+                # 下发异步 celery 任务，批量部署主机
+                batch_insert_host_celery_task.delay(host_init_list)
         except Exception as err:
             logger.error(f"batch import host err: {err}")
             import traceback
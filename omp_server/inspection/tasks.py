@@ -10,12 +10,11 @@ from datetime import datetime
 from celery import shared_task
 
 from inspection.inspection_utils import send_email
-from utils.prometheus.thread import MyThread
 from celery.utils.log import get_task_logger
 from db_models.models import Host, Env, Service, ModuleSendEmailSetting
 from db_models.models import InspectionHistory, InspectionReport
 from utils.prometheus.prometheus import back_fill
-from utils.prometheus.target_host import target_host_thread
+from utils.prometheus.target_host import target_hosts_run
 from utils.prometheus.target_service import target_service_run
 from utils.prometheus.create_html_tar import create_html_tar
 from inspection.joint_json_report import joint_json_data
@@ -33,19 +32,10 @@ def get_hosts_data(env, hosts):
     :env: 环境queryset
     :hosts: 主机列表，例：["主机ip"]
     """
-    temp_list = list()
-    threads = list()
-    total_no = error_no = 0     # 总指标数/异常指标数
-    for instance in hosts:
-        total_no += 23          # 总指标数;当前共23个
-        threads.append(MyThread(func=target_host_thread, args=(env, instance)))
-
-    for t in threads:
-        t.start()
-
-    for t in threads:
-        t.join()                    # 用join等待线程执行结束
-        temp_list.append(t.res)     # 组装每个线程的返回值
+    error_no = 0                    # 异常指标数
+    total_no = 23 * len(hosts)      # 总指标数;每台主机当前共23个
+    # 每项指标对全部主机查询一次，再按主机拆分
+    temp_list = target_hosts_run(env, hosts)
 
     scan_result = {
         "all_target_num": total_no, "abnormal_target": error_no, "healthy": ""
@@ -13,6 +13,7 @@ import os
 import random
 import datetime
 from pathlib import Path
+from celery.schedules import crontab
 from utils.parse_config import OMP_MYSQL_HOST, OMP_MYSQL_PORT, \
     OMP_MYSQL_USERNAME, OMP_MYSQL_PASSWORD, TOKEN_EXPIRATION, \
     SSH_CMD_TIMEOUT, PRIVATE_KEY
@@ -175,7 +176,36 @@ CELERY_ENABLE_UTC = False
 CELERY_TIMEZONE = TIME_ZONE
 DJANGO_CELERY_BEAT_TZ_AWARE = False
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
-CELERY_IMPORTS = ("hosts.tasks", "inspection.tasks")
+CELERY_IMPORTS = ("hosts.tasks", "inspection.tasks", "promemonitor.tasks",
+                  "services.self_healing")
+# 主机、服务指标快照刷新周期，单位秒
+METRIC_SNAPSHOT_INTERVAL = 60
+# 仪表盘快照定时刷新周期，单位秒
+DASHBOARD_SNAPSHOT_INTERVAL = 30
+# 仪表盘快照变更触发刷新的合并时间，单位秒
+DASHBOARD_REFRESH_DELAY = 3
+# prometheus 配置变更触发重载的合并时间，单位秒
+PROMETHEUS_RELOAD_DELAY = 5
+CELERY_BEAT_SCHEDULE = {
+    "refresh_metric_snapshot": {
+        "task": "promemonitor.tasks.refresh_metric_snapshot",
+        "schedule": METRIC_SNAPSHOT_INTERVAL,
+    },
+    "refresh_dashboard_snapshot": {
+        "task": "promemonitor.tasks.refresh_dashboard_snapshot",
+        "schedule": DASHBOARD_SNAPSHOT_INTERVAL,
+    },
+    # 恢复丢失的自愈重启、校验任务
+    "dispatch_self_healing": {
+        "task": "services.self_healing.dispatch_self_healing",
+        "schedule": 60,
+    },
+    # 每天凌晨汇总并清理过期告警及操作记录
+    "clean_expired_records": {
+        "task": "promemonitor.tasks.clean_expired_records",
+        "schedule": crontab(hour=2, minute=30),
+    },
+}
 
 LOGGER_CLASS = 'concurrent_log_handler.ConcurrentRotatingFileHandler'
 LOG_BACKUP_SIZE = 1024 * 1024 * 100
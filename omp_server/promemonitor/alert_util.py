@@ -1,10 +1,17 @@
 import datetime
+import hashlib
+import json
 import logging
+import operator
 import traceback
+from collections import Counter
+from functools import reduce
 
 import pytz
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
 from omp_server.settings import TIME_ZONE
-from db_models.models import Host, Service
+from db_models.models import Host, Service, Alert
 from promemonitor.grafana_url import explain_url
 
 logger = logging.getLogger('server')
@@ -96,7 +103,14 @@ class AlertAnalysis:
         self.item = item
         self.labels = self.item.get("labels", {})
         self.annotations = self.item.get("annotations", {})
-        self.fingerprint = self.item.get("fingerprint", "")
+        self.fingerprint = self.item.get("fingerprint") or self.labels_hash(
+            self.labels)
+
+    @staticmethod
+    def labels_hash(labels):
+        """ 未携带 fingerprint 的告警以全部标签的摘要作为唯一标识 """
+        return hashlib.md5(json.dumps(
+            labels, sort_keys=True).encode("utf8")).hexdigest()
 
     @staticmethod
     def _get(items, key):
@@ -152,7 +166,26 @@ class AlertAnalysis:
             start_time = self.item.get("activeAt", "")
         return utc_to_local(utc_time_str=start_time)
 
-    def analysis_labels(self):
+    @staticmethod
+    def monitor_ele(alert_info):
+        """ 拼接 explain_url 所需的告警对象信息 """
+        if alert_info["alert_type"] == "service":
+            return {
+                "ip": alert_info.get("alert_host_ip"),
+                "type": "service",
+                "instance_name": alert_info.get("alert_service_name")
+            }
+        return {
+            "ip": alert_info.get("alert_host_ip"),
+            "type": "host",
+            "instance_name": "node"
+        }
+
+    def analysis_labels(self, with_url=True):
+        """
+        解析告警 labels
+        :param with_url: 是否同时解析监控跳转地址，批量入库时统一解析
+        """
         old_alert_type = self._get(self.labels, "job")
         if old_alert_type == "nodeExporter":
             kwargs = self.node_exporter()
@@ -166,36 +199,9 @@ class AlertAnalysis:
         kwargs["alertname"] = self._get(self.labels, "alertname")
         kwargs["fingerprint"] = self.fingerprint
         kwargs.update(alert_time=self.get_alert_time())
-        if kwargs["alert_type"] == "service":
-            kwargs["monitor"] = get_monitor_url(
-                [{
-                    "ip": kwargs.get("alert_host_ip"),
-                    "type": "service",
-                    "instance_name": kwargs.get("alert_service_name")
-                }]
-            )
-            kwargs["monitor_log"] = get_log_url(
-                [{
-                    "ip": kwargs.get("alert_host_ip"),
-                    "type": "service",
-                    "instance_name": kwargs.get("alert_service_name")
-                }]
-            )
-        else:
-            kwargs["monitor"] = get_monitor_url(
-                [{
-                    "ip": kwargs.get("alert_host_ip"),
-                    "type": "host",
-                    "instance_name": "node"
-                }]
-            )
-            kwargs["monitor_log"] = get_log_url(
-                [{
-                    "ip": kwargs.get("alert_host_ip"),
-                    "type": "host",
-                    "instance_name": "node"
-                }]
-            )
+        if with_url:
+            kwargs["monitor"] = get_monitor_url([self.monitor_ele(kwargs)])
+            kwargs["monitor_log"] = get_log_url([self.monitor_ele(kwargs)])
         return kwargs
 
     def analysis_annotations(self):
@@ -256,3 +262,220 @@ class AlertAnalysis:
         # if env_id and int(env_id) != alert_info["env_id"]:
         #     return {}  # TODO 等待env开发完成
         return alert_info
+
+
+class AlertIngestion:
+    """
+    告警批量入库
+    同批次告警的主机、服务各查询一次，按 (fingerprint, alert_time) 去重后批量写入，
+    主机、服务的告警计数按对象聚合后更新
+    """
+    TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, alerts):
+        """
+        :param alerts: alertmanager webhook 中的 alerts 列表
+        """
+        self.alerts = alerts
+
+    @staticmethod
+    def alert_key(fingerprint, alert_time):
+        """ 告警去重键 """
+        if isinstance(alert_time, datetime.datetime):
+            alert_time = alert_time.strftime(AlertIngestion.TIME_FORMAT)
+        return fingerprint, alert_time
+
+    def analysis(self):
+        """
+        解析本批次告警，关联主机、服务信息，未纳管对象的告警及恢复告警将被忽略
+        :return: [alert_info]，格式同 AlertAnalysis.__call__
+        """
+        info_list = list()
+        for item in self.alerts:
+            alert_analysis = AlertAnalysis(item)
+            alert_info = alert_analysis.analysis_labels(with_url=False)
+            if alert_info.get("status") != "firing":
+                continue
+            alert_info.update(**alert_analysis.analysis_annotations())
+            info_list.append(alert_info)
+
+        host_ips = {info["alert_host_ip"] for info in info_list
+                    if info["alert_type"] == "host"}
+        service_keys = {(info["alert_service_name"], info["alert_host_ip"])
+                        for info in info_list if info["alert_type"] != "host"}
+        host_dic = {
+            ip: (env_id, instance_name)
+            for ip, env_id, instance_name in Host.objects.filter(
+                ip__in=host_ips).values_list("ip", "env_id", "instance_name")
+        }
+        service_dic = dict()
+        if service_keys:
+            for app_name, ip, env_id, instance_name in Service.objects.filter(
+                    ip__in={key[1] for key in service_keys},
+                    service__app_name__in={key[0] for key in service_keys}
+            ).values_list(
+                "service__app_name", "ip", "env_id", "service_instance_name"
+            ):
+                service_dic.setdefault((app_name, ip), (env_id, instance_name))
+
+        result_list = list()
+        for info in info_list:
+            if info["alert_type"] == "host":
+                obj_info = host_dic.get(info["alert_host_ip"])
+            else:
+                obj_info = service_dic.get(
+                    (info["alert_service_name"], info["alert_host_ip"]))
+            if not obj_info:
+                continue
+            info["env_id"], info["alert_instance_name"] = obj_info
+            result_list.append(info)
+        self.fill_monitor_url(result_list)
+        return result_list
+
+    @staticmethod
+    def fill_monitor_url(info_list):
+        """ 相同监控对象只解析一次跳转地址 """
+        ele_dic = dict()
+        for info in info_list:
+            ele = AlertAnalysis.monitor_ele(info)
+            ele_dic.setdefault(
+                (ele["ip"], ele["type"], ele["instance_name"]), ele)
+        if ele_dic:
+            explain_url(list(ele_dic.values()))
+        for info in info_list:
+            ele = AlertAnalysis.monitor_ele(info)
+            ele = ele_dic[(ele["ip"], ele["type"], ele["instance_name"])]
+            info["monitor"] = ele.get("monitor_url")
+            info["monitor_log"] = ele.get("log_url")
+
+    @staticmethod
+    def build_alert(alert_info):
+        """ 根据告警信息生成 Alert 对象 """
+        return Alert(
+            is_read=0,
+            alert_type=alert_info.get('alert_type'),
+            alert_host_ip=alert_info.get('alert_host_ip'),
+            alert_service_name=alert_info.get('alert_service_name'),
+            alert_instance_name=alert_info.get('alert_instance_name'),
+            alert_service_type='',  # TODO 暂时拿不到值
+            alert_level=alert_info.get('alert_level'),
+            alert_describe=alert_info.get('alert_describe'),
+            alert_receiver=alert_info.get('alert_receiver'),
+            alert_resolve='',  # TODO 待后续
+            alert_time=alert_info.get('alert_time'),
+            create_time=datetime.datetime.now().strftime(
+                AlertIngestion.TIME_FORMAT),
+            monitor_path=alert_info.get('monitor'),
+            monitor_log=alert_info.get('monitor_log'),
+            fingerprint=alert_info.get('fingerprint'),
+            # env='default'  # TODO 此版本默认不赋值
+        )
+
+    @staticmethod
+    def increase_counter(queryset_filter, counter, fields, **kwargs):
+        """
+        按增量分组批量更新告警计数
+        :param queryset_filter: 根据对象键列表生成查询集的函数
+        :param counter: {对象键: 增量}
+        :param fields: 需累加的计数字段
+        :param kwargs: 其余需更新的字段值
+        """
+        group_dic = dict()
+        for key, num in counter.items():
+            group_dic.setdefault(num, []).append(key)
+        for num, keys in group_dic.items():
+            update_dic = {field: F(field) + num for field in fields}
+            update_dic.update(kwargs)
+            queryset_filter(keys).update(**update_dic)
+
+    @staticmethod
+    def create_alerts(alert_list):
+        """
+        批量写入新告警，返回实际写入的告警对象
+        (fingerprint, alert_time) 存在唯一约束，并发推送同一告警时批量写入失败，
+        此时逐条写入并跳过已由其他请求写入的告警
+        """
+        try:
+            with transaction.atomic():
+                Alert.objects.bulk_create(alert_list, batch_size=500)
+        except IntegrityError:
+            logger.info("告警批量写入冲突，逐条写入")
+            created_list = list()
+            for alert in alert_list:
+                alert.pk = None
+                try:
+                    with transaction.atomic():
+                        alert.save(force_insert=True)
+                except IntegrityError:
+                    continue
+                created_list.append(alert)
+            return created_list
+        # 批量写入未返回主键时按唯一键回查
+        if alert_list and alert_list[0].pk is None:
+            id_dic = {
+                AlertIngestion.alert_key(fingerprint, alert_time): _id
+                for _id, fingerprint, alert_time in Alert.objects.filter(
+                    fingerprint__in={alert.fingerprint for alert in alert_list},
+                    alert_time__in={alert.alert_time for alert in alert_list}
+                ).values_list("id", "fingerprint", "alert_time")
+            }
+            for alert in alert_list:
+                alert.pk = id_dic.get(
+                    AlertIngestion.alert_key(alert.fingerprint, alert.alert_time))
+        return alert_list
+
+    def save(self):
+        """
+        告警去重入库，已存在的告警仅刷新描述信息
+        :return: 本次新增的告警 id 列表
+        """
+        info_list = self.analysis()
+        if not info_list:
+            return []
+        alert_dic = dict()
+        for info in info_list:
+            key = self.alert_key(info.get("fingerprint"), info["alert_time"])
+            alert_dic[key] = info
+        exists_dic = {
+            self.alert_key(fingerprint, alert_time): _id
+            for _id, fingerprint, alert_time in Alert.objects.filter(
+                fingerprint__in={key[0] for key in alert_dic},
+                alert_time__in={key[1] for key in alert_dic}
+            ).values_list("id", "fingerprint", "alert_time")
+        }
+        update_list = list()
+        new_list = list()
+        for key, info in alert_dic.items():
+            if key in exists_dic:
+                update_list.append(Alert(
+                    id=exists_dic[key],
+                    alert_level=info.get("alert_level"),
+                    alert_describe=info.get("alert_describe")))
+            else:
+                new_list.append(self.build_alert(info))
+
+        with transaction.atomic():
+            created_list = self.create_alerts(new_list)
+            Alert.objects.bulk_update(
+                update_list, ["alert_level", "alert_describe"],
+                batch_size=500)
+            # 告警计数只累加本次实际写入的告警
+            host_counter = Counter()
+            service_counter = Counter()
+            for alert in created_list:
+                if alert.alert_type == "host":
+                    host_counter[alert.alert_host_ip] += 1
+                else:
+                    service_counter[
+                        (alert.alert_instance_name, alert.alert_host_ip)] += 1
+            self.increase_counter(
+                lambda keys: Host.objects.filter(ip__in=keys),
+                host_counter, fields=["alert_num"])
+            self.increase_counter(
+                lambda keys: Service.objects.filter(reduce(operator.or_, [
+                    Q(service_instance_name=name, ip=ip)
+                    for name, ip in keys])),
+                service_counter, fields=["alert_count"],
+                service_status=Service.SERVICE_STATUS_STOP
+            )  # TODO 后续在模型中增加异常字段
+        return [alert.id for alert in created_list if alert.id]
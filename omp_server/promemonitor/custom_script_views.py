@@ -24,6 +24,7 @@ from promemonitor.promemonitor_filters import CustomScriptFilter
 from utils.common.paginations import PageNumberPager
 from promemonitor.prometheus_utils import PrometheusUtils
 from utils.parse_config import MONITOR_PORT
+from utils.prometheus.client import prometheus_client
 from promemonitor.prometheus_utils import CW_TOKEN
 
 logger = logging.getLogger('server')
@@ -266,13 +267,10 @@ class CustomScriptJobInfoView(GenericViewSet, ListModelMixin):
         instance = CustomScript.objects.get(id=cs_id)
         script_job_str = instance.script_name.split('.', 1)[0]
         job_str = f"{script_job_str}Exporter"
-        prometheus_targets_url = f"http://127.0.0.1:{MONITOR_PORT.get('prometheus', '19011')}/api/v1/targets"
         try:
-            res = requests.get(url=prometheus_targets_url,
-                               auth=self.prometheus_util.basic_auth)
-            if res.status_code != 200:
-                return Response(data={"code": 1, "message": "获取自定义脚本任务信息失败！"})
-            active_targets_list = res.json().get("data").get("activeTargets")
+            res = prometheus_client.targets(
+                address=f"127.0.0.1:{MONITOR_PORT.get('prometheus', '19011')}")
+            active_targets_list = res.get("data").get("activeTargets")
             custom_script_job_list = list()
             for active_target in active_targets_list:
                 if active_target.get("scrapePool") == job_str:
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# Project: dashboard
+# Create time: 2022-03-16
+# Introduction:
+
+"""
+仪表盘数据快照
+快照在告警接收、主机及服务变更、定时任务时重新生成并存储至 redis，
+仪表盘接口直接读取快照，快照缺失或过期时才同步生成
+"""
+
+import json
+import logging
+import time
+import traceback
+import uuid
+
+import redis
+
+from db_models.models import Host, Service, ApplicationHub
+from omp_server.settings import DASHBOARD_SNAPSHOT_INTERVAL
+from promemonitor.alert_util import utc_to_local
+from promemonitor.grafana_url import explain_url
+from promemonitor.prometheus import Prometheus
+from utils.parse_config import OMP_REDIS_HOST, OMP_REDIS_PORT, \
+    OMP_REDIS_PASSWORD
+from utils.prometheus.client import prometheus_client
+
+logger = logging.getLogger('server')
+
+# 仪表盘接口轮询频繁，进程内复用 redis 连接
+REDIS_POOL = redis.ConnectionPool(
+    host=OMP_REDIS_HOST,
+    port=OMP_REDIS_PORT,
+    db=15,
+    password=OMP_REDIS_PASSWORD,
+    socket_timeout=1,
+    socket_connect_timeout=1
+)
+
+# 仪表盘统计的服务状态
+DASHBOARD_STATUS_LIST = [
+    Service.SERVICE_STATUS_NORMAL,
+    Service.SERVICE_STATUS_STARTING,
+    Service.SERVICE_STATUS_STOPPING,
+    Service.SERVICE_STATUS_RESTARTING,
+    Service.SERVICE_STATUS_STOP
+]
+
+
+def get_dashboard_querysets():
+    """
+    仪表盘统计的数据库、自研服务、组件查询集
+    :return: database_qs, service_qs, component_qs
+    """
+    database_qs = Service.objects.filter(
+        service__app_type=ApplicationHub.APP_TYPE_COMPONENT).filter(
+        service__app_labels__label_name__contains="数据库").filter(
+        service_status__in=DASHBOARD_STATUS_LIST).filter(
+        service__is_base_env=False)
+    service_qs = Service.objects.filter(
+        service__app_type=ApplicationHub.APP_TYPE_SERVICE).filter(
+        service_status__in=DASHBOARD_STATUS_LIST).filter(
+        service__is_base_env=False).filter(
+        service_controllers__start__isnull=False)
+    component_qs = Service.objects.filter(
+        service__app_type=ApplicationHub.APP_TYPE_COMPONENT).filter(
+        service_status__in=DASHBOARD_STATUS_LIST).filter(
+        service__is_base_env=False)
+    return database_qs, service_qs, component_qs
+
+
+def explain_alert_url(ele_list):
+    """
+    批量解析告警的监控、日志跳转地址，相同对象只解析一次
+    :param ele_list: [{"ip": ip, "type": type, "instance_name": name}]
+    :return: {(ip, type, instance_name): (monitor_url, log_url)}
+    """
+    ele_dic = {
+        (ele["ip"], ele["type"], ele["instance_name"]): dict(ele)
+        for ele in ele_list
+    }
+    if ele_dic:
+        try:
+            explain_url(list(ele_dic.values()))
+        except Exception as e:
+            logger.error(f"解析告警跳转地址失败: {str(e)}")
+    return {
+        key: (ele.get("monitor_url"), ele.get("log_url"))
+        for key, ele in ele_dic.items()
+    }
+
+
+def drop_covered_warning(alert_list):
+    """ 同一主机同一告警项同时存在 warning 与 critical 时，仅保留 critical """
+    critical_set = {
+        (ele.get("ip"), ele.get("alertname")) for ele in alert_list
+        if ele.get("severity") == "critical"
+    }
+    return [
+        ele for ele in alert_list
+        if ele.get("severity") != "warning" or (
+            ele.get("ip"), ele.get("alertname")) not in critical_set
+    ]
+
+
+class DashboardBuilder(object):
+    """ 生成仪表盘数据，数据库查询次数与告警及服务数量无关 """
+
+    CATEGORY_LIST = ("database", "service", "component")
+
+    @staticmethod
+    def get_prometheus_alerts():
+        """
+        请求prometheus alerts接口返回告警内容
+        """
+        try:
+            return True, prometheus_client.alerts()
+        except Exception as e:
+            logger.error("prometheus请求alerts失败：" + str(e))
+            return False, "Failed"
+
+    @staticmethod
+    def instance_list(queryset):
+        """ 服务实例列表，只查询需要的字段 """
+        return [
+            {
+                "ip": ip,
+                "instance_name": instance_name,
+                "app_name": app_name
+            } for ip, instance_name, app_name in queryset.values_list(
+                "ip", "service_instance_name", "service__app_name")
+        ]
+
+    def parse_alerts(self, alerts):
+        """
+        解析 prometheus 当前告警
+        :return: [(告警信息, 告警原始 labels)]
+        """
+        alert_list = list()
+        for ele in alerts:
+            if not isinstance(ele, dict):
+                continue
+            if ele.get("status") == "resolved" or ele.get(
+                    "state") == "resolved":
+                continue
+            labels = ele.get("labels")
+            url_ele = {
+                "ip": labels.get("instance"),
+                "type": "service",
+                "instance_name": labels.get("service_name")
+            }
+            if labels.get("job") == "nodeExporter":
+                url_ele = {
+                    "ip": labels.get("instance"),
+                    "type": "host",
+                    "instance_name": "node"
+                }
+            ele_dict = {
+                "ip": labels.get("instance"),
+                "instance_name": labels.get("instance_name"),
+                "alertname": labels.get("alertname"),
+                "severity": labels.get("severity"),
+                "date": utc_to_local(ele.get("activeAt")),
+                "describe": ele.get("annotations").get("description"),
+            }
+            alert_list.append((ele_dict, labels, url_ele))
+        url_dic = explain_alert_url([item[2] for item in alert_list])
+        for ele_dict, _, url_ele in alert_list:
+            ele_dict["monitor_url"], ele_dict["log_url"] = url_dic.get(
+                (url_ele["ip"], url_ele["type"], url_ele["instance_name"]),
+                (None, None))
+        return [(ele_dict, labels) for ele_dict, labels, _ in alert_list]
+
+    def build(self):
+        """
+        生成仪表盘数据
+        :return: 与原仪表盘接口一致的数据结构
+        """
+        host_list = list(Host.objects.values_list("ip", "instance_name"))
+        instance_dic = dict(zip(self.CATEGORY_LIST, [
+            self.instance_list(qs) for qs in get_dashboard_querysets()]))
+        app_name_dic = {
+            category: {ins["app_name"] for ins in instance_list}
+            for category, instance_list in instance_dic.items()
+        }
+
+        info_list_dic = {
+            category: list() for category in ("host",) + self.CATEGORY_LIST}
+        exc_count_dic = {category: 0 for category in self.CATEGORY_LIST}
+        error_instance_set = set()
+        error_host_set = set()
+        flag, alert_data = self.get_prometheus_alerts()
+        if flag:
+            alerts = alert_data.get('data').get('alerts')
+            for ele_dict, labels in self.parse_alerts(alerts):
+                if labels.get("job") == "nodeExporter":
+                    info_list_dic["host"].append(ele_dict)
+                    error_host_set.add(labels.get("instance"))
+                service_name_str = labels.get("app")
+                if not service_name_str:
+                    continue
+                for category in self.CATEGORY_LIST:
+                    if service_name_str in app_name_dic[category]:
+                        exc_count_dic[category] += 1
+                        info_list_dic[category].append(ele_dict)
+                        error_instance_set.add(labels.get("instance_name"))
+                        break
+        info_list_dic["host"] = drop_covered_warning(info_list_dic["host"])
+
+        _, host_targets = Prometheus().get_all_host_targets()
+        for ip, instance_name in host_list:
+            if ip in error_host_set:
+                continue
+            info_list_dic["host"].append({
+                "ip": ip, "instance_name": instance_name,
+                "severity": "normal" if ip in host_targets else "unmonitored"
+            })
+
+        _, service_targets = Prometheus().get_all_service_targets()
+        for category in self.CATEGORY_LIST:
+            for ins in instance_dic[category]:
+                if ins["instance_name"] in error_instance_set:
+                    continue
+                ins["severity"] = "normal" \
+                    if f"{ins['ip']}_{ins['instance_name']}" in \
+                    service_targets else "unmonitored"
+                info_list_dic[category].append(ins)
+
+        serializer_info = {
+            "host": {
+                "host_info_all_count": len(host_list),
+                "host_info_exc_count": len(error_host_set),
+                "host_info_no_monitor_count": 0,
+                "host_info_list": info_list_dic["host"]
+            }
+        }
+        for category in self.CATEGORY_LIST:
+            serializer_info[category] = {
+                f"{category}_info_all_count": len(instance_dic[category]),
+                f"{category}_info_exc_count": exc_count_dic[category],
+                f"{category}_info_no_monitor_count": 0,
+                f"{category}_info_list": info_list_dic[category]
+            }
+        serializer_info["third"] = {
+            "third_info_all_count": 0,  # TODO 暂为空
+            "third_info_exc_count": 0,
+            "third_info_no_monitor_count": 0,
+            "third_info_list": []
+        }
+        return serializer_info
+
+
+class DashboardSnapshot(object):
+    """
+    redis 中的仪表盘快照
+    快照内容为 {"version": 版本号, "created": 生成时间戳, "data": 仪表盘数据}
+    """
+    SNAPSHOT_KEY = "omp:dashboard:snapshot"
+    VERSION_KEY = "omp:dashboard:version"
+    PENDING_KEY = "omp:dashboard:pending"
+    REBUILD_KEY = "omp:dashboard:rebuild"
+    # 重建锁超时时间及等待重建时的轮询间隔，单位秒
+    REBUILD_TIMEOUT = 30
+    REBUILD_WAIT_INTERVAL = 0.2
+
+    def __init__(self, max_age=None):
+        """
+        :param max_age: 快照最长有效时间，单位秒，超出后读取时同步重新生成
+        """
+        self.max_age = max_age or DASHBOARD_SNAPSHOT_INTERVAL * 3
+        self.conn = redis.Redis(connection_pool=REDIS_POOL)
+
+    def refresh(self):
+        """
+        重新生成快照并写入 redis
+        :return: 快照内容
+        """
+        data = DashboardBuilder().build()
+        snapshot = {"version": 0, "created": time.time(), "data": data}
+        try:
+            snapshot["version"] = self.conn.incr(self.VERSION_KEY)
+            self.conn.set(
+                self.SNAPSHOT_KEY, json.dumps(snapshot),
+                ex=int(self.max_age * 2))
+        except Exception as e:
+            logger.error(
+                f"仪表盘快照写入redis失败: {str(e)}\n{traceback.format_exc()}")
+        return snapshot
+
+    def acquire_rebuild(self):
+        """
+        获取快照重建锁，同一时刻只有一个进程同步重建快照
+        :return: 锁标识，未获取到时为 None；redis 不可用时视为获取成功
+        """
+        token = uuid.uuid4().hex
+        try:
+            if self.conn.set(self.REBUILD_KEY, token, nx=True,
+                             ex=self.REBUILD_TIMEOUT):
+                return token
+            return None
+        except Exception as e:
+            logger.error(f"仪表盘快照重建锁获取失败: {str(e)}")
+            return token
+
+    def release_rebuild(self, token):
+        """ 释放本进程持有的快照重建锁 """
+        try:
+            if self.conn.get(self.REBUILD_KEY) == token.encode("utf8"):
+                self.conn.delete(self.REBUILD_KEY)
+        except Exception as e:
+            logger.error(f"仪表盘快照重建锁释放失败: {str(e)}")
+
+    def load(self):
+        """
+        读取 redis 中的快照
+        :return: 快照内容，不存在或读取失败时为 None
+        """
+        try:
+            content = self.conn.get(self.SNAPSHOT_KEY)
+        except Exception as e:
+            logger.error(f"仪表盘快照读取redis失败: {str(e)}")
+            return None
+        return json.loads(content) if content else None
+
+    def get(self):
+        """
+        读取快照，快照缺失或过期时由获取到重建锁的进程同步生成，
+        其余进程返回过期快照；快照缺失时等待重建完成
+        :return: 快照内容
+        """
+        snapshot = self.load()
+        if snapshot and \
+                time.time() - snapshot.get("created", 0) < self.max_age:
+            return snapshot
+        token = self.acquire_rebuild()
+        if token:
+            try:
+                return self.refresh()
+            finally:
+                self.release_rebuild(token)
+        if snapshot:
+            return snapshot
+        deadline = time.time() + self.REBUILD_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(self.REBUILD_WAIT_INTERVAL)
+            snapshot = self.load()
+            if snapshot:
+                return snapshot
+        logger.warning("等待仪表盘快照重建超时，同步生成")
+        return self.refresh()
+
+    def mark_pending(self, delay):
+        """
+        标记快照待刷新，delay 秒内重复标记无效，用于合并短时间内的多次变更
+        :return: 是否为本次标记
+        """
+        return bool(self.conn.set(self.PENDING_KEY, 1, nx=True, ex=delay))
+
+    def clear_pending(self):
+        """ 清除待刷新标记，刷新过程中发生的变更可再次触发刷新 """
+        self.conn.delete(self.PENDING_KEY)
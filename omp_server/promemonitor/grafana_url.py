@@ -1,12 +1,10 @@
-from db_models.models import GrafanaMainPage, MonitorUrl, Host, ApplicationHub
-import requests
-import json
+from db_models.models import GrafanaMainPage, Host, ApplicationHub
 import logging
 import pytz
 import datetime
 import traceback
 from omp_server.settings import TIME_ZONE
-from utils.parse_config import PROMETHEUS_AUTH
+from utils.prometheus.client import prometheus_client
 
 logger = logging.getLogger('server')
 
@@ -17,16 +15,8 @@ class CurlPrometheus(object):
         """
           请求prometheus接口返回相应json
         """
-        prometheus_auth = (PROMETHEUS_AUTH.get("username"),
-                           PROMETHEUS_AUTH.get("plaintext_password"))
-        monitor_ip = MonitorUrl.objects.filter(name="prometheus")
-        monitor_url = monitor_ip[0].monitor_url if len(
-            monitor_ip) else "127.0.0.1:19013"
         try:
-            url = f"http://{monitor_url}/api/v1/alerts"
-            response = requests.request(
-                "GET", url, headers={}, data="", auth=prometheus_auth)
-            return json.loads(response.text)
+            return prometheus_client.alerts()
         except Exception as e:
             logger.error("prometheus请求alerts失败：" + str(e))
             return {"status": "-1"}
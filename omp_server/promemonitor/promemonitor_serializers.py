@@ -1,16 +1,15 @@
-import datetime
 import logging
 
-from django.db.models import F
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import ModelSerializer, ListSerializer, \
     Serializer
 
-from db_models.models import Host, MonitorUrl, Alert, Maintain, Service, Rule, AlertRule
-from promemonitor.alert_util import AlertAnalysis
+from db_models.models import Host, MonitorUrl, Alert, Maintain, Rule, AlertRule
+from promemonitor.alert_util import AlertIngestion
 from promemonitor.alertmanager import Alertmanager
-from promemonitor.tasks import monitor_agent_restart
+from promemonitor.tasks import monitor_agent_restart, \
+    request_dashboard_refresh
 from utils.common.exceptions import OperateError
 from utils.common.serializers import HostIdsSerializer
 from utils.common.validators import (
@@ -212,44 +211,9 @@ class ReceiveAlertSerializer(Serializer):
 
     def create(self, validated_data):
         alerts = validated_data.get('alerts')
-        alert_obj_list = []
-        for ele in alerts:
-            alert_analysis = AlertAnalysis(ele)
-            alert_info = alert_analysis()
-            if not alert_info:
-                continue
-            if alert_info.get('status') != 'firing':
-                continue
-            alert = Alert(
-                is_read=0,
-                alert_type=alert_info.get('alert_type'),
-                alert_host_ip=alert_info.get('alert_host_ip'),
-                alert_service_name=alert_info.get('alert_service_name'),
-                alert_instance_name=alert_info.get('alert_instance_name'),
-                alert_service_type='',  # TODO 暂时拿不到值
-                alert_level=alert_info.get('alert_level'),
-                alert_describe=alert_info.get('alert_describe'),
-                alert_receiver=alert_info.get('alert_receiver'),
-                alert_resolve='',  # TODO 待后续
-                alert_time=alert_info.get('alert_time'),
-                create_time=datetime.datetime.now().strftime(
-                    "%Y-%m-%d %H:%M:%S"),
-                monitor_path=alert_info.get('monitor'),
-                monitor_log=alert_info.get('monitor_log'),
-                fingerprint=alert_info.get('fingerprint'),
-                # env='default'  # TODO 此版本默认不赋值
-            )
-            alert.save()
-            alert_obj_list.append(alert.id)
-            if alert_info.get('alert_type') == 'host':
-                Host.objects.filter(ip=alert_info.get('alert_host_ip')).update(
-                    alert_num=F("alert_num") + 1)
-            if alert_info.get('alert_type') == 'service':
-                Service.objects.filter(service_instance_name=alert_info.get(
-                    'alert_instance_name')).filter(
-                    ip=alert_info.get('alert_host_ip')).update(
-                    service_status=Service.SERVICE_STATUS_STOP,
-                    alert_count=F("alert_count") + 1)  # TODO 后续在模型中增加异常字段
+        alert_obj_list = AlertIngestion(alerts).save()
+        # 告警变化后刷新仪表盘快照
+        request_dashboard_refresh()
         logger.info("监控接收文件的长度开始{}".format(len(alert_obj_list)))
         self_healing.delay(alert_obj_list)
         logger.info("监控接收文件的信息{}".format((alert_obj_list)))
@@ -1,11 +1,12 @@
 import json
 import logging
 import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
-
-from db_models.models import MonitorUrl
-from utils.parse_config import MONITOR_PORT, PROMETHEUS_AUTH
+from utils.parse_config import THREAD_POOL_MAX_WORKERS
+from utils.prometheus.client import prometheus_client, \
+    PrometheusRequestError
+from utils.prometheus.utils import instance_matcher
 
 logger = logging.getLogger('server')
 
@@ -17,26 +18,26 @@ class Prometheus:
     STATUS = ("normal", "warning", "critical")
 
     def __init__(self):
+        # 查询统一经由进程内共享的 prometheus_client
         self.basic_url = self.get_prometheus_config()
-        self.prometheus_api_query_url = f'http://{self.basic_url}/api/v1/query?query='  # NOQA
-        self.basic_auth = (PROMETHEUS_AUTH.get(
-            "username", "omp"), PROMETHEUS_AUTH.get("plaintext_password", ""))
-        self.headers = {'Content-Type': 'application/json'}
 
     @staticmethod
     def get_prometheus_config():
-        prometheus_url_config = MonitorUrl.objects.filter(
-            name='prometheus').first()
-        if not prometheus_url_config:
-            return f'127.0.0.1:{MONITOR_PORT.get("prometheus", 19011)}'  # 默认值
+        return prometheus_client.address
 
-        monitor_url = prometheus_url_config.monitor_url
-        if monitor_url:
-            return monitor_url
-        return f'127.0.0.1:{MONITOR_PORT.get("prometheus", 19011)}'  # 默认值
+    # 主机指标与告警规则名称的对应关系
+    HOST_RULE_NAMES = {
+        "CPU使用率": "cpu",
+        "内存使用率": "mem",
+        "根分区使用率": "root_disk",
+        "数据分区使用率": "data_disk",
+    }
 
     @staticmethod
-    def get_host_threshold(env_id=1,**kwargs):
+    def get_host_threshold(env_id=1, **kwargs):
+        """
+        一次性加载主机各指标阈值，返回 {指标: (warning, critical)}
+        """
         host_threshold = {
             'cpu': (80, 90),
             'mem': (80, 90),
@@ -44,84 +45,35 @@ class Prometheus:
             'data_disk': (80, 90),
         }
         try:
-
             from db_models.models import AlertRule
-            cpu_warning_ht = AlertRule.objects.filter(env_id=env_id,
-                                                          name="CPU使用率",
-                                                          severity="warning").first()
-            cpu_critical_ht = AlertRule.objects.filter(env_id=env_id,
-                                                           name="CPU使用率",
-                                                           severity="critical").first()
-            mem_warning_ht = AlertRule.objects.filter(env_id=env_id,
-                                                          name="内存使用率",
-                                                          severity="warning").first()
-            mem_critical_ht = AlertRule.objects.filter(env_id=env_id,
-                                                           name="内存使用率",
-                                                           severity="critical").first()
-            root_disk_warning_ht = AlertRule.objects.filter(env_id=env_id,
-                                                                name="根分区使用率",
-                                                                severity="warning").first()
-            root_disk_critical_ht = AlertRule.objects.filter(env_id=env_id,
-                                                                 name="根分区使用率",
-                                                                 severity="critical").first()
-            data_disk_warning_ht = None
-            data_disk_critical_ht = None
-            if kwargs.get("data_dir"):
-                """
-                从指标规则中获取指定路径的数据分区
-                """
-                data_disk_warning_ht = AlertRule.objects.filter(env_id=env_id,
-                                                                    name="数据分区使用率",
-                                                                    severity="warning").first()
-                data_disk_critical_ht = AlertRule.objects.filter(env_id=env_id,
-                                                                     name="数据分区使用率",
-                                                                     severity="critical").first()
-
-
-            #
-            # from db_models.models import HostThreshold
-            # cpu_warning_ht = HostThreshold.objects.filter(env_id=env_id, index_type="cpu_used",
-            #                                               alert_level="warning").first()
-            # cpu_critical_ht = HostThreshold.objects.filter(env_id=env_id, index_type="cpu_used",
-            #                                                alert_level="critical").first()
-            # mem_warning_ht = HostThreshold.objects.filter(env_id=env_id, index_type="memory_used",
-            #                                               alert_level="warning").first()
-            # mem_critical_ht = HostThreshold.objects.filter(env_id=env_id, index_type="memory_used",
-            #                                                alert_level="critical").first()
-            # root_disk_warning_ht = HostThreshold.objects.filter(env_id=env_id, index_type="disk_root_used",
-            #                                                     alert_level="warning").first()
-            # root_disk_critical_ht = HostThreshold.objects.filter(env_id=env_id, index_type="disk_root_used",
-            #                                                      alert_level="critical").first()
-            # data_disk_warning_ht = HostThreshold.objects.filter(env_id=env_id, index_type="disk_data_used",
-            #                                                     alert_level="warning").first()
-            # data_disk_critical_ht = HostThreshold.objects.filter(env_id=env_id, index_type="disk_data_used",
-            #                                                      alert_level="critical").first()
-            host_threshold.update(
-                cpu=(
-                    int(cpu_warning_ht.threshold_value) if cpu_warning_ht else 0,
-                    int(cpu_critical_ht.threshold_value) if cpu_critical_ht else 100,
-                ),
-                mem=(
-                    int(mem_warning_ht.threshold_value) if mem_warning_ht else 0,
-                    int(mem_critical_ht.threshold_value) if mem_critical_ht else 100,
-                ),
-                root_disk=(
-                    int(root_disk_warning_ht.threshold_value) if root_disk_warning_ht else 0,
-                    int(root_disk_critical_ht.threshold_value) if root_disk_critical_ht else 100,
-                ),
-                data_disk=(
-                    int(data_disk_warning_ht.threshold_value) if data_disk_warning_ht else 0,
-                    int(data_disk_critical_ht.threshold_value) if data_disk_critical_ht else 100,
+            rule_names = list(Prometheus.HOST_RULE_NAMES.keys())
+            if not kwargs.get("data_dir"):
+                # 从指标规则中获取指定路径的数据分区
+                rule_names.remove("数据分区使用率")
+            rules = AlertRule.objects.filter(
+                env_id=env_id, name__in=rule_names,
+                severity__in=("warning", "critical")
+            ).order_by("id").values_list("name", "severity", "threshold_value")
+            rule_dict = dict()
+            for name, severity, threshold_value in rules:
+                rule_dict.setdefault((name, severity), threshold_value)
+            for name, metric in Prometheus.HOST_RULE_NAMES.items():
+                warning = rule_dict.get((name, "warning"))
+                critical = rule_dict.get((name, "critical"))
+                host_threshold[metric] = (
+                    int(warning) if warning is not None else 0,
+                    int(critical) if critical is not None else 100,
                 )
-            )
         except Exception as e:
             logger.error(f"获取主机阈值失败，详情为：{e}")
         return host_threshold
 
-    def get_host_metric_status(self, metric, metric_value, **kwargs):
+    def get_host_metric_status(self, metric, metric_value,
+                               host_threshold=None, **kwargs):
         if metric_value is None:
             return None
-        host_threshold = self.get_host_threshold(**kwargs)
+        if host_threshold is None:
+            host_threshold = self.get_host_threshold(**kwargs)
         if metric_value > max(host_threshold.get(metric)):
             status = 'critical'
         elif metric_value < min(host_threshold.get(metric)):
@@ -130,208 +82,264 @@ class Prometheus:
             status = 'warning'
         return status
 
-    def get_host_cpu_usage(self, host_list):
+    # 全量主机查询使用的匹配器
+    FLEET_HOST_MATCHER = 'job="nodeExporter"'
+
+    @staticmethod
+    def instance_matcher(ip_list):
         """
-        获取指定主机cpu使用率
+        将主机ip列表拼接为 instance=~ 匹配器，使用反引号避免转义问题
+        """
+        return instance_matcher(ip_list)
+
+    @staticmethod
+    def host_usage_expr(metric, matcher, mountpoint="/"):
+        """
+        主机指标查询语句，matcher 用于将查询限定在指定主机上
+        """
+        if metric == "cpu":
+            return f'(1 - avg(rate(node_cpu_seconds_total' \
+                   f'{{mode="idle",{matcher}}}[2m])) by (instance))*100'
+        if metric == "mem":
+            return f'(1 - (node_memory_MemAvailable_bytes{{{matcher}}} / ' \
+                   f'(node_memory_MemTotal_bytes{{{matcher}}})))* 100'
+        selector = f'mountpoint="{mountpoint}",{matcher}'
+        free_selector = f'{selector},fstype!="rootfs"' \
+            if metric == "root_disk" else selector
+        return f'(node_filesystem_size_bytes{{{selector}}} - ' \
+               f'node_filesystem_free_bytes{{{free_selector}}}) / ' \
+               f'(node_filesystem_avail_bytes{{{selector}}} - ' \
+               f'node_filesystem_free_bytes{{{selector}}} - ' \
+               f'(-node_filesystem_size_bytes{{{selector}}}))*100'
+
+    @staticmethod
+    def query_result(expr):
+        """
+        通过共享客户端执行即时查询，返回响应 json，请求失败时返回 None
         """
-        query_url = f'{self.prometheus_api_query_url}(1 - avg(rate(node_cpu_seconds_total' \
-                    f'{{mode="idle"}}[2m])) by (instance))*100'
-        # print(query_url)
         try:
-            get_cpu_response = requests.get(
-                url=query_url, headers=self.headers, auth=self.basic_auth)
-            if get_cpu_response.status_code == 200:
-                cpu_usage_dict = get_cpu_response.json()
-                if cpu_usage_dict.get('status') != 'success':
-                    logger.error(get_cpu_response.text)
-                    logger.error('获取主机CPU使用率失败！')
-                    return host_list
-                for index, host in enumerate(host_list.copy()):
-                    for item in cpu_usage_dict.get('data').get('result'):
-                        if item.get('metric').get('instance') == host.get('ip'):
-                            host_list[index]['cpu_usage'] = math.ceil(
-                                float(item.get('value')[1]))
-                            host_list[index]['cpu_status'] = self.get_host_metric_status('cpu', math.ceil(
-                                float(item.get('value')[1])))
-                            break
-                        host_list[index]['cpu_usage'] = None
-                        host_list[index]['cpu_status'] = None  # TODO  待阈值判断
+            return prometheus_client.query(expr)
+        except Exception as e:
+            logger.error(f"prometheus查询 {expr} 失败: {str(e)}")
+            return None
 
-                return host_list
+    def query_vector(self, expr, labels=("instance",)):
+        """
+        执行一次即时查询，返回以 labels 取值为键的向上取整结果，失败时返回 None
+        单个 label 时键为其取值，多个 label 时键为取值元组
+        """
+        res_dic = self.query_result(expr)
+        if res_dic is None:
+            return None
+        if res_dic.get('status') != 'success':
+            logger.error(json.dumps(res_dic))
+            return None
+        vector_dic = dict()
+        for item in res_dic.get('data').get('result'):
+            value = float(item.get('value')[1])
+            if math.isnan(value) or math.isinf(value):
+                continue
+            metric = item.get('metric')
+            if len(labels) == 1:
+                key = metric.get(labels[0])
             else:
-                logger.error(get_cpu_response.text)
-                logger.error('获取主机CPU使用率失败！')
-                return host_list
-        except requests.ConnectionError as e:
-            logger.error(e)
-            logger.error('获取主机CPU使用率失败！')
-            return host_list
-        except Exception as e:
-            logger.error(e)
-            logger.error('获取主机CPU使用率失败！')
-            return host_list
+                key = tuple(metric.get(label) for label in labels)
+            vector_dic.setdefault(key, math.ceil(value))
+        return vector_dic
 
-    def get_host_mem_usage(self, host_list):
+    def fill_host_metric(self, host_list, metric, instance_dic,
+                         host_threshold):
         """
-        获取指定主机内存使用率
+        将按 instance 索引的查询结果回填至主机列表
         """
-        query_url = f'{self.prometheus_api_query_url}(1 - (node_memory_MemAvailable_bytes / ' \
-                    f'(node_memory_MemTotal_bytes)))* 100'
-        # print(query_url)
+        for host in host_list:
+            value = instance_dic.get(host.get('ip'))
+            host[f'{metric}_usage'] = value
+            host[f'{metric}_status'] = self.get_host_metric_status(
+                metric, value, host_threshold=host_threshold)
+        return host_list
 
+    def get_host_metric_usage(self, host_list, metric, error_msg):
+        """
+        获取指定主机单项指标使用率
+        """
         try:
-            get_mem_response = requests.get(
-                url=query_url, headers=self.headers, auth=self.basic_auth)
-            if get_mem_response.status_code == 200:
-                mem_usage_dict = get_mem_response.json()
-                if mem_usage_dict.get('status') != 'success':
-                    logger.error(get_mem_response.text)
-                    logger.error('获取主机内存使用率失败！')
-                    return host_list
-                for index, host in enumerate(host_list.copy()):
-                    for item in mem_usage_dict.get('data').get('result'):
-                        if item.get('metric').get('instance') == host.get('ip'):
-                            host_list[index]['mem_usage'] = math.ceil(
-                                float(item.get('value')[1]))
-                            host_list[index]['mem_status'] = self.get_host_metric_status('mem', math.ceil(
-                                float(item.get('value')[1])))
-                            break
-                        host_list[index]['mem_usage'] = None
-                        host_list[index]['mem_status'] = None  # TODO  待阈值判断
+            ip_list = [host.get('ip') for host in host_list if host.get('ip')]
+            if not ip_list:
                 return host_list
-            else:
-                logger.error(get_mem_response.text)
-                logger.error('获取主机内存使用率失败！')
+            instance_dic = self.query_vector(
+                self.host_usage_expr(metric, self.instance_matcher(ip_list)))
+            if instance_dic is None:
+                logger.error(error_msg)
                 return host_list
-        except requests.ConnectionError as e:
-            logger.error(e)
-            logger.error('获取主机内存使用率失败！')
-            return host_list
+            return self.fill_host_metric(
+                host_list, metric, instance_dic, self.get_host_threshold())
         except Exception as e:
             logger.error(e)
-            logger.error('获取主机内存使用率失败！')
+            logger.error(error_msg)
             return host_list
 
+    def get_host_cpu_usage(self, host_list):
+        """
+        获取指定主机cpu使用率
+        """
+        return self.get_host_metric_usage(
+            host_list, 'cpu', '获取主机CPU使用率失败！')
+
+    def get_host_mem_usage(self, host_list):
+        """
+        获取指定主机内存使用率
+        """
+        return self.get_host_metric_usage(
+            host_list, 'mem', '获取主机内存使用率失败！')
+
     def get_host_root_disk_usage(self, host_list):
         """
         获取指定主机磁盘根分区使用率
         """
-        query_url = f'{self.prometheus_api_query_url}(node_filesystem_size_bytes{{mountpoint="/"}} - ' \
-                    f'node_filesystem_free_bytes{{mountpoint="/",fstype!="rootfs"}}) / ' \
-                    f'(node_filesystem_avail_bytes{{mountpoint="/"}}-node_filesystem_free_bytes{{mountpoint="/"}} - ' \
-                    f'(-node_filesystem_size_bytes{{mountpoint="/"}}))*100'
-        # print(query_url)
+        return self.get_host_metric_usage(
+            host_list, 'root_disk', '获取主机磁盘根分区使用率失败！')
 
+    def get_host_data_disk_usage(self, host_list):
+        """
+        获取指定主机磁盘数据分区使用率，相同数据分区的主机合并为一次查询
+        """
         try:
-            get_root_disk_response = requests.get(
-                url=query_url, headers=self.headers, auth=self.basic_auth)
-            if get_root_disk_response.status_code == 200:
-                root_disk_usage_dict = get_root_disk_response.json()
-                if root_disk_usage_dict.get('status') != 'success':
-                    logger.error(get_root_disk_response.text)
-                    logger.error('获取主机磁盘根分区使用率失败！')
-                    return host_list
-                for index, host in enumerate(host_list.copy()):
-                    for item in root_disk_usage_dict.get('data').get('result'):
-                        if item.get('metric').get('instance') == host.get('ip'):
-                            host_list[index]['root_disk_usage'] = math.ceil(
-                                float(item.get('value')[1]))
-                            host_list[index]['root_disk_status'] = self.get_host_metric_status('root_disk', math.ceil(
-                                float(item.get('value')[1])))
-                            break
-                        host_list[index]['root_disk_usage'] = None
-                        host_list[index]['root_disk_status'] = None  # TODO
-                return host_list
-            else:
-                logger.error(get_root_disk_response.text)
-                logger.error('获取主机磁盘根分区使用率失败！')
-                return host_list
-        except requests.ConnectionError as e:
-            logger.error(e)
-            logger.error('获取主机磁盘根分区使用率失败！')
-            return host_list
+            for host in host_list:
+                host['data_disk_usage'] = None
+                host['data_disk_status'] = None
+            host_threshold = self.get_host_threshold(data_dir=True)
+            for data_folder, hosts in self.group_by_data_folder(
+                    host_list).items():
+                instance_dic = self.query_vector(
+                    self.host_usage_expr(
+                        'data_disk',
+                        self.instance_matcher(h.get('ip') for h in hosts),
+                        mountpoint=data_folder))
+                if instance_dic is None:
+                    logger.error('获取主机磁盘数据分区使用率失败！')
+                    continue
+                self.fill_host_metric(
+                    hosts, 'data_disk', instance_dic, host_threshold)
         except Exception as e:
             logger.error(e)
-            logger.error('获取主机磁盘根分区使用率失败！')
-            return host_list
+            logger.error('获取主机磁盘数据分区使用率失败！')
+        return host_list
 
-    def get_host_data_disk_usage(self, host_list):
+    @staticmethod
+    def group_by_data_folder(host_list):
         """
-        获取指定主机磁盘数据分区使用率
-        """
-        for index, host in enumerate(host_list.copy()):
-            host_ip = host.get('ip')
-            host_data_disk = host.get('data_folder')
-            query_url = f'{self.prometheus_api_query_url}' \
-                        f'(node_filesystem_size_bytes{{mountpoint="{host_data_disk}",instance="{host_ip}"}} - ' \
-                        f'node_filesystem_free_bytes{{mountpoint="{host_data_disk}",instance="{host_ip}"}}) / ' \
-                        f'(node_filesystem_avail_bytes{{mountpoint="{host_data_disk}",instance="{host_ip}"}} - ' \
-                        f'node_filesystem_free_bytes{{mountpoint="{host_data_disk}",instance="{host_ip}"}} - ' \
-                        f'(-node_filesystem_size_bytes{{mountpoint="{host_data_disk}",instance="{host_ip}"}}))*100'
-            try:
-                get_data_disk_response = requests.get(
-                    url=query_url, headers=self.headers, auth=self.basic_auth)
-                if get_data_disk_response.status_code == 200:
-                    data_disk_usage_dict = get_data_disk_response.json()
-                    if data_disk_usage_dict.get('status') != 'success':
-                        logger.error(get_data_disk_response.text)
-                        logger.error('获取主机磁盘数据分区使用率失败！')
-                        continue
-                    if not data_disk_usage_dict.get('data').get('result'):
-                        host_list[index]['data_disk_usage'] = None
-                        host_list[index]['data_disk_status'] = None
-                    for item in data_disk_usage_dict.get('data').get('result'):
-                        if item.get('metric').get('instance') == host.get('ip'):
-                            host_list[index]['data_disk_usage'] = math.ceil(
-                                float(item.get('value')[1]))
-                            host_list[index]['data_disk_status'] = self.get_host_metric_status('data_disk', math.ceil(
-                                float(item.get('value')[1])),data_dir=host_data_disk)
-                            break
-                        host_list[index]['data_disk_usage'] = None
-                        host_list[index]['data_disk_status'] = None
-                else:
-                    logger.error(get_data_disk_response.text)
-                    logger.error('获取主机磁盘数据分区使用率失败！')
-                    continue
-            except requests.ConnectionError as e:
-                logger.error(e)
-                logger.error('获取主机磁盘数据分区使用率失败！')
-                continue
-            except Exception as e:
-                logger.error(e)
-                logger.error('获取主机磁盘数据分区使用率失败！')
+        按数据分区对主机分组，{data_folder: [host, ...]}
+        """
+        folder_dic = dict()
+        for host in host_list:
+            if not host.get('ip') or not host.get('data_folder'):
                 continue
-        return host_list
+            folder_dic.setdefault(host.get('data_folder'), []).append(host)
+        return folder_dic
 
-    def get_host_info(self, host_list):
+    def get_host_info(self, host_list, env_id=1):
         """
         获取主机负载基本信息
+        各项指标以 instance=~ 限定为当前页主机并发查询，阈值仅加载一次
         """
-        for index, host in enumerate(host_list.copy()):
-            host_list[index]['cpu_usage'] = None
-            host_list[index]['cpu_status'] = None
-            host_list[index]['mem_usage'] = None
-            host_list[index]['mem_status'] = None
-            host_list[index]['root_disk_usage'] = None
-            host_list[index]['root_disk_status'] = None
-            host_list[index]['data_disk_usage'] = None
-            host_list[index]['data_disk_status'] = None
-        host_list = self.get_host_cpu_usage(host_list)
-        host_list = self.get_host_mem_usage(host_list)
-        host_list = self.get_host_root_disk_usage(host_list)
-        host_list = self.get_host_data_disk_usage(host_list)
+        for host in host_list:
+            host['cpu_usage'] = None
+            host['cpu_status'] = None
+            host['mem_usage'] = None
+            host['mem_status'] = None
+            host['root_disk_usage'] = None
+            host['root_disk_status'] = None
+            host['data_disk_usage'] = None
+            host['data_disk_status'] = None
+        ip_list = [host.get('ip') for host in host_list if host.get('ip')]
+        if not ip_list:
+            return host_list
+        host_threshold = self.get_host_threshold(env_id=env_id, data_dir=True)
+        matcher = self.instance_matcher(ip_list)
+        # (指标, 待回填主机列表) -> 查询语句
+        query_dic = {
+            (metric, None): self.host_usage_expr(metric, matcher)
+            for metric in ('cpu', 'mem', 'root_disk')
+        }
+        folder_dic = self.group_by_data_folder(host_list)
+        for data_folder, hosts in folder_dic.items():
+            query_dic[('data_disk', data_folder)] = self.host_usage_expr(
+                'data_disk', self.instance_matcher(h.get('ip') for h in hosts),
+                mountpoint=data_folder)
+
+        for (metric, data_folder), instance_dic in self.query_vectors(
+                query_dic).items():
+            if instance_dic is None:
+                logger.error(f"获取主机{metric}使用率失败！")
+                continue
+            hosts = folder_dic.get(data_folder) if data_folder else host_list
+            self.fill_host_metric(hosts, metric, instance_dic, host_threshold)
         return host_list
 
+    def query_vectors(self, query_dic, labels_dic=None):
+        """
+        并发执行多条即时查询
+        :param query_dic: {key: 查询语句}
+        :param labels_dic: {key: 索引结果使用的 labels}，默认按 instance 索引
+        :return: {key: 查询结果}，查询失败时结果为 None
+        """
+        labels_dic = labels_dic or {}
+        result_dic = dict()
+        if not query_dic:
+            return result_dic
+        with ThreadPoolExecutor(
+                min(len(query_dic), THREAD_POOL_MAX_WORKERS)) as executor:
+            future_dic = {
+                executor.submit(
+                    self.query_vector, expr,
+                    labels_dic.get(key, ("instance",))): key
+                for key, expr in query_dic.items()
+            }
+            for future in as_completed(future_dic):
+                key = future_dic[future]
+                try:
+                    result_dic[key] = future.result()
+                except Exception as e:
+                    logger.error(f"执行查询 {query_dic[key]} 失败: {e}")
+                    result_dic[key] = None
+        return result_dic
+
+    def get_host_usage_snapshot(self, host_list):
+        """
+        获取全量主机指标快照，每项指标仅执行一次向量查询
+        :param host_list: [{"ip": ip, "data_folder": data_folder}]
+        :return: {ip: {"cpu_usage": 1, ...}}，任一查询失败时返回 None
+        """
+        query_dic = {
+            (metric, None): self.host_usage_expr(
+                metric, self.FLEET_HOST_MATCHER)
+            for metric in ('cpu', 'mem', 'root_disk')
+        }
+        for data_folder in self.group_by_data_folder(host_list).keys():
+            query_dic[('data_disk', data_folder)] = self.host_usage_expr(
+                'data_disk', self.FLEET_HOST_MATCHER, mountpoint=data_folder)
+        result_dic = self.query_vectors(query_dic)
+        if None in result_dic.values():
+            return None
+        snapshot_dic = dict()
+        for host in host_list:
+            ip = host.get('ip')
+            snapshot_dic[ip] = {
+                f'{metric}_usage': result_dic.get((metric, None)).get(ip)
+                for metric in ('cpu', 'mem', 'root_disk')
+            }
+            snapshot_dic[ip]['data_disk_usage'] = result_dic.get(
+                ('data_disk', host.get('data_folder')), {}).get(ip)
+        return snapshot_dic
+
     def get_all_service_status(self):
         """
         获取服务状态  0-运行; 1-停止
         :return:
         """
-        query_url = f'{self.prometheus_api_query_url}probe_success'
         try:
-            res_body = requests.get(
-                url=query_url, headers=self.headers, auth=self.basic_auth)
-            res_dic = json.loads(res_body.text)
+            res_dic = prometheus_client.query("probe_success")
             if res_dic.get("status") != "success":
                 return False, {}
             service_data = res_dic.get("data", {}).get("result", [])
@@ -351,11 +359,9 @@ class Prometheus:
             return False, {}
 
     def get_all_host_targets(self):
-        query_url = f'{self.basic_url}/api/v1/targets'
         host_targets = list()
         try:
-            res_body = requests.get(url=f"http://{query_url}", headers=self.headers, auth=self.basic_auth)  # NOQA
-            res_dic = json.loads(res_body.text)
+            res_dic = prometheus_client.targets()
             if res_dic.get("status") != "success":
                 return False, {}
             targets_data = res_dic.get("data", {}).get("activeTargets")
@@ -369,11 +375,9 @@ class Prometheus:
             return False, []
 
     def get_all_service_targets(self):
-        query_url = f'{self.basic_url}/api/v1/targets'
         service_targets = list()
         try:
-            res_body = requests.get(url=f"http://{query_url}", headers=self.headers, auth=self.basic_auth)  # NOQA
-            res_dic = json.loads(res_body.text)
+            res_dic = prometheus_client.targets()
             if res_dic.get("status") != "success":
                 return False, {}
             targets_data = res_dic.get("data", {}).get("activeTargets")
@@ -433,15 +437,12 @@ class Prometheus:
         """
         获取服务cpu使用率
         """
-        open_source_query_url = f'{self.prometheus_api_query_url}service_process_cpu_percent'
-        self_service_query_url = f'{self.prometheus_api_query_url}process_cpu_usage * 100'
         try:
-            os_cpu_response = requests.get(
-                url=open_source_query_url, headers=self.headers, auth=self.basic_auth)
-            if os_cpu_response.status_code == 200:
-                os_cpu_usage_dict = os_cpu_response.json()
+            os_cpu_usage_dict = self.query_result(
+                'service_process_cpu_percent')
+            if os_cpu_usage_dict is not None:
                 if os_cpu_usage_dict.get('status') != 'success':
-                    logger.error(os_cpu_response.text)
+                    logger.error(json.dumps(os_cpu_usage_dict))
                     logger.error('获取开源服务CPU使用率失败！')
                     return service_list
                 for index, os_service in enumerate(service_list.copy()):
@@ -462,15 +463,12 @@ class Prometheus:
                         service_list[index]['cpu_status'] = None  # TODO  待阈值判断
 
             else:
-                logger.error(os_cpu_response.text)
                 logger.error('获取开源服务CPU使用率失败！')
 
-            ss_cpu_response = requests.get(
-                url=self_service_query_url, headers=self.headers, auth=self.basic_auth)
-            if ss_cpu_response.status_code == 200:
-                ss_cpu_usage_dict = ss_cpu_response.json()
+            ss_cpu_usage_dict = self.query_result('process_cpu_usage * 100')
+            if ss_cpu_usage_dict is not None:
                 if ss_cpu_usage_dict.get('status') != 'success':
-                    logger.error(ss_cpu_response.text)
+                    logger.error(json.dumps(ss_cpu_usage_dict))
                     logger.error('获取自研服务CPU使用率失败！')
                     return service_list
                 for index, ss_service in enumerate(service_list.copy()):
@@ -489,7 +487,6 @@ class Prometheus:
                         service_list[index]['cpu_status'] = None  # TODO  待阈值判断
 
             else:
-                logger.error(os_cpu_response.text)
                 logger.error('获取自研服务CPU使用率失败！')
             return service_list
         except Exception as e:
@@ -497,16 +494,12 @@ class Prometheus:
             return service_list
 
     def get_service_mem_usage(self, service_list):
-        open_source_query_url = f'{self.prometheus_api_query_url}service_process_memory_percent'
-        jvm_total_bytes_query_url = f'{self.prometheus_api_query_url}sum(jvm_memory_max_bytes{{area="heap"}}) by (instance,job,application,env)'
-        node_total_bytes_query_url = f'{self.prometheus_api_query_url}node_memory_MemTotal_bytes'
         try:
-            os_mem_response = requests.get(
-                url=open_source_query_url, headers=self.headers, auth=self.basic_auth)
-            if os_mem_response.status_code == 200:
-                os_mem_usage_dict = os_mem_response.json()
+            os_mem_usage_dict = self.query_result(
+                'service_process_memory_percent')
+            if os_mem_usage_dict is not None:
                 if os_mem_usage_dict.get('status') != 'success':
-                    logger.error(os_mem_response.text)
+                    logger.error(json.dumps(os_mem_usage_dict))
                     logger.error('获取开源服务内存使用率失败！')
                     return service_list
                 for index, os_service in enumerate(service_list.copy()):
@@ -526,32 +519,27 @@ class Prometheus:
                         # service_list[index]['mem_status'] = None
 
             else:
-                logger.error(os_mem_response.text)
                 logger.error('获取开源服务内存使用率失败！')
 
-            jtb_response = requests.get(
-                url=jvm_total_bytes_query_url, headers=self.headers, auth=self.basic_auth)
-            if jtb_response.status_code == 200:
-                jtb_dict = jtb_response.json()
+            jtb_dict = self.query_result(
+                'sum(jvm_memory_max_bytes{area="heap"}) '
+                'by (instance,job,application,env)')
+            if jtb_dict is not None:
                 if jtb_dict.get('status') != 'success':
-                    logger.error(jtb_response.text)
+                    logger.error(json.dumps(jtb_dict))
                     logger.error('获取自研服务内存使用量失败！')
                     return service_list
             else:
-                logger.error(os_mem_response.text)
                 logger.error('获取自研服务内存使用率失败！')
                 return service_list
 
-            ntb_response = requests.get(
-                url=node_total_bytes_query_url, headers=self.headers, auth=self.basic_auth)
-            if ntb_response.status_code == 200:
-                ntb_dict = ntb_response.json()
+            ntb_dict = self.query_result('node_memory_MemTotal_bytes')
+            if ntb_dict is not None:
                 if ntb_dict.get('status') != 'success':
-                    logger.error(ntb_response.text)
+                    logger.error(json.dumps(ntb_dict))
                     logger.error('获取自研服务内存使用量失败！')
                     return service_list
             else:
-                logger.error(os_mem_response.text)
                 logger.error('获取主机内存资源量失败！')
                 return service_list
 
@@ -588,21 +576,66 @@ class Prometheus:
         service_list = self.get_service_mem_usage(service_list)
         return service_list
 
+    # 开源服务、自研服务指标结果的索引 labels
+    SERVICE_LABELS = ("instance", "app", "env")
+    SELF_SERVICE_LABELS = ("instance", "job", "env")
+
+    def get_service_usage_snapshot(self, service_list):
+        """
+        获取全量服务指标快照，每项指标仅执行一次向量查询
+        匹配规则同 get_service_cpu_usage / get_service_mem_usage
+        :param service_list: [{"id": 1, "ip": ip, "app_name": app_name,
+                               "env": env, "service_instance_name": name}]
+        :return: {id: {"cpu_usage": 1, "mem_usage": 1}}，任一查询失败时返回 None
+        """
+        query_dic = {
+            "os_cpu": "service_process_cpu_percent",
+            "ss_cpu": "process_cpu_usage * 100",
+            "os_mem": "service_process_memory_percent",
+            "ss_mem": 'sum(jvm_memory_max_bytes{area="heap"}) '
+                      'by (instance,job,env) / on (instance) group_left() '
+                      'max(node_memory_MemTotal_bytes) by (instance) * 100',
+        }
+        labels_dic = {
+            "os_cpu": self.SERVICE_LABELS,
+            "os_mem": self.SERVICE_LABELS,
+            "ss_cpu": self.SELF_SERVICE_LABELS,
+            "ss_mem": self.SELF_SERVICE_LABELS,
+        }
+        result_dic = self.query_vectors(query_dic, labels_dic)
+        if None in result_dic.values():
+            return None
+        snapshot_dic = dict()
+        for service in service_list:
+            app_name = service.get('app_name')
+            if app_name == 'hadoop':
+                app_name = service.get(
+                    'service_instance_name', 'hadoop').split('_')[0]
+            os_key = (service.get('ip'), app_name, service.get('env'))
+            ss_key = (service.get('ip'), f"{app_name}Exporter",
+                      service.get('env'))
+            usage_dic = dict()
+            for metric in ('cpu', 'mem'):
+                os_dic = result_dic.get(f"os_{metric}")
+                usage_dic[f'{metric}_usage'] = os_dic.get(os_key) \
+                    if os_key in os_dic \
+                    else result_dic.get(f"ss_{metric}").get(ss_key)
+            snapshot_dic[service.get('id')] = usage_dic
+        return snapshot_dic
+
     def get_quota_res(self,quota):
         """
         获取指标结果
         """
-        query_url = f"{self.prometheus_api_query_url}{quota}"
         try:
-            response = requests.get(
-                    url=query_url, headers=self.headers, auth=self.basic_auth)
-            if response.status_code != 200:
-                logger.error(f"测试promsql错误: 状态码为{response.status_code} 错误{response.text}")
-                return False, response.text
-            print(query_url,response.json())
-            if response.json().get("status") == "success":
-                return True, response.json()["data"]["result"]
-            return False, response.text
+            # 测试 promsql 需要实时结果，不使用缓存
+            res_dic = prometheus_client.query(quota, cache_ttl=0)
+            if res_dic.get("status") == "success":
+                return True, res_dic["data"]["result"]
+            return False, json.dumps(res_dic)
+        except PrometheusRequestError as e:
+            logger.error(f"测试promsql错误: {str(e)}")
+            return False, str(e)
         except Exception as e:
             logger.error(f"测试promsql错误：{e}")
             return False, "访问prometheus错误"
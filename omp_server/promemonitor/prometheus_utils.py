@@ -12,7 +12,6 @@ prometheus更新监控项使用的工具集
 
 import os
 import json
-import pickle
 import shutil
 import logging
 import requests
@@ -24,6 +23,9 @@ from ruamel.yaml import YAML
 
 from db_models.models import HostThreshold, ServiceCustomThreshold, AlertRule
 from omp_server.settings import PROJECT_DIR
+from promemonitor.target_registry import TargetRegistry, atomic_write
+from promemonitor.rule_compiler import RuleCompiler, rule_batch, \
+    current_batch
 from utils.parse_config import MONITOR_PORT, PROMETHEUS_AUTH, LOKI_CONFIG
 
 # from utils.parse_config import MONITOR_PORT
@@ -84,6 +86,8 @@ class PrometheusUtils(object):
             self.prometheus_targets_path,
             "nodeExporter_all.json"
         )
+        self.target_registry = TargetRegistry(self.prometheus_targets_path)
+        self.rule_compiler = RuleCompiler(self.prometheus_rules_path)
         self.agent_request_header = {}
         self.basic_auth = (PROMETHEUS_AUTH.get(
             "username", "omp"), PROMETHEUS_AUTH.get("plaintext_password", ""))
@@ -107,19 +111,6 @@ class PrometheusUtils(object):
         with open(path, "w") as f:
             f.write(data)
 
-    @staticmethod
-    def json_distinct(iterable_lst):
-        """
-        json元素去重
-        :param iterable_lst: 去重对象
-        :return: 去重后的对象
-        """
-        res = []
-        for instance in iterable_lst:
-            res.append(pickle.dumps(instance))
-        res = set(res)
-        return [pickle.loads(i) for i in res]
-
     @staticmethod
     def get_dic_from_yaml(file_path):
         """
@@ -359,39 +350,33 @@ class PrometheusUtils(object):
         if not nodes_data:
             return False, "nodes_data can not be null"
         node_target_list = list()
-        # 遍历主机数据，添加主机层的告警规则
-        for item in nodes_data:
-            node_target_ele = {
-                "targets": [item["ip"] + ":" + str(self.monitor_port)],
-                "labels": {
-                    "instance": item["ip"],
-                    "instance_name": "{}".format(item.get("instance_name")),
-                    "service_type": "host",
-                    "env": item["env"]}
-            }
-            node_target_list.append(node_target_ele)
-            print("添加数据分区", item["data_path"])
-            # 需要像数据库添加数据分区的的规则
-            if item["data_path"]:
-                self.add_data_disk_rules(item["data_path"], item["env"])
-            # # 更新主机node rule
-            # self.add_rules("node", item["env"])
-            # # 更新exporter的告警规则
-            # self.add_rules("exporter", item["env"])
-            # # 更新数据分区的告警规则
-            # if item["data_path"]:
-            #     self.update_node_data_rule(item["data_path"], item["env"])
+        # 遍历主机数据，添加主机层的告警规则，规则文件在全部主机处理后编译一次
+        with self.rule_batch():
+            for item in nodes_data:
+                node_target_ele = {
+                    "targets": [item["ip"] + ":" + str(self.monitor_port)],
+                    "labels": {
+                        "instance": item["ip"],
+                        "instance_name": "{}".format(item.get("instance_name")),
+                        "service_type": "host",
+                        "env": item["env"]}
+                }
+                node_target_list.append(node_target_ele)
+                print("添加数据分区", item["data_path"])
+                # 需要像数据库添加数据分区的的规则
+                if item["data_path"]:
+                    self.add_data_disk_rules(item["data_path"], item["env"])
+                # # 更新主机node rule
+                # self.add_rules("node", item["env"])
+                # # 更新exporter的告警规则
+                # self.add_rules("exporter", item["env"])
+                # # 更新数据分区的告警规则
+                # if item["data_path"]:
+                #     self.update_node_data_rule(item["data_path"], item["env"])
         # 增加主机的target配置文件(prometheus/conf/targets)
-        if os.path.exists(self.node_exporter_targets_file):
-            with open(self.node_exporter_targets_file, "r") as f:
-                content = f.read()
-                if content:
-                    old_node_target_list = json.loads(content)
-                    node_target_list.extend(old_node_target_list)
-        node_target_list = self.json_distinct(node_target_list)
-        with open(self.node_exporter_targets_file, "w") as f2:
-            json.dump(node_target_list, f2, ensure_ascii=False, indent=4)
-        self.reload_prometheus()
+        self.target_registry.upsert("nodeExporter", node_target_list)
+        self.target_registry.write("nodeExporter")
+        self.request_reload()
         return True, "success"
 
     def delete_node(self, nodes_data):
@@ -402,25 +387,11 @@ class PrometheusUtils(object):
         """
         if not nodes_data:
             return False, "nodes_data can not be null"
-        if os.path.exists(self.node_exporter_targets_file):
-            with open(self.node_exporter_targets_file, "r") as f:
-                content = f.read()
-                if content:
-                    node_target_list = json.loads(content)
-                else:
-                    node_target_list = list()
-        else:
+        if not os.path.exists(self.node_exporter_targets_file):
             return False, f"{self.node_exporter_targets_file} not exists!"
-        if not node_target_list:
-            return True, "success"
         for item in nodes_data:
-            ip = item["ip"]
-            for node in node_target_list:
-                if ip in node["labels"]["instance"]:
-                    node_target_list.remove(node)
-                    break
-        with open(self.node_exporter_targets_file, "w") as f2:
-            json.dump(node_target_list, f2, ensure_ascii=False, indent=4)
+            self.target_registry.delete("nodeExporter", item["ip"])
+        self.target_registry.write("nodeExporter")
         return True, "success"
 
     def update_agent_service(self, dest_ip, action, services_data):
@@ -533,73 +504,92 @@ class PrometheusUtils(object):
         """
         if not service_data:
             return False, "args cant be null"
+        return self.add_services([service_data])
 
-        logger.info(f'收到信息：{service_data}')
-        job_name_str = "{}Exporter".format(service_data.get('service_name'))
-        prom_job_dict = {
-            "job_name": job_name_str,
-            "metrics_path": f"/metrics/monitor/{service_data.get('service_name')}",
-            "file_sd_configs": [
-                {
-                    "refresh_interval": "30s",
-                    "files": [
-                        f"targets/{service_data.get('service_name')}Exporter_all.json"
+    def add_services(self, service_data_list):
+        """
+        批量添加服务监控，每个任务只写一次配置，合并为一次重载
+        :param service_data_list: 新增的服务信息列表，格式同 add_service
+        :return:
+        """
+        if not service_data_list:
+            return False, "args cant be null"
+
+        logger.info(f'收到信息：{service_data_list}')
+        # {job_name: [target]}
+        job_target_dic = dict()
+        # {ip: [service_data]}
+        agent_service_dic = dict()
+        for service_data in service_data_list:
+            try:
+                self_target_ele = {
+                    "labels": {
+                        "instance": "{}".format(service_data["ip"]),
+                        "instance_name": "{}".format(service_data.get("instance_name")),
+                        "service_type": "service",
+                        "env": "{}".format(service_data["env"])
+                    },
+                    "targets": [
+                        "{}:{}".format(service_data["ip"], self.monitor_port)
                     ]
                 }
-            ]
-        }
-        with open(self.prometheus_conf_path, "r") as fr:
-            content = yaml.load(fr.read(), yaml.Loader)
-        content.get("scrape_configs").append(prom_job_dict)
-        content["scrape_configs"] = self.json_distinct(
-            content.get("scrape_configs"))
-        with open(self.prometheus_conf_path, "w", encoding="utf8") as fw:
-            yaml.dump(data=content, stream=fw,
-                      allow_unicode=True, sort_keys=False)
-        self_exporter_target_file = os.path.join(self.prometheus_targets_path,
-                                                 "{}Exporter_all.json".format(service_data["service_name"]))
-        self_target_list = list()
-        self_target_ele = ""
-        try:
-            self_target_ele = {
-                "labels": {
-                    "instance": "{}".format(service_data["ip"]),
-                    "instance_name": "{}".format(service_data.get("instance_name")),
-                    "service_type": "service",
-                    "env": "{}".format(service_data["env"])
-                },
-                "targets": [
-                    "{}:{}".format(service_data["ip"], self.monitor_port)
-                ]
-            }
-        except KeyError as func_e:
-            logger.error(func_e)
-        self_target_list.append(self_target_ele)
-
-        if os.path.exists(self_exporter_target_file):
-            with open(self_exporter_target_file, 'r') as f:
-                content = f.read()
-                if content:
-                    old_self_target_list = json.loads(content)
-                    self_target_list.extend(old_self_target_list)
-        self_target_list = self.json_distinct(self_target_list)
-
-        with open(self_exporter_target_file, 'w') as f2:
-            json.dump(self_target_list, f2, ensure_ascii=False, indent=4)
-        flag, msg = self.update_agent_service(
-            service_data.get('ip'), 'add', [service_data])
-        if not flag:
-            return False, msg
+            except KeyError as func_e:
+                logger.error(func_e)
+                continue
+            job_target_dic.setdefault(
+                "{}Exporter".format(service_data.get('service_name')),
+                list()).append(self_target_ele)
+            agent_service_dic.setdefault(
+                service_data.get('ip'), list()).append(service_data)
+
+        self.add_scrape_jobs(job_target_dic.keys())
+        for job_name, target_list in job_target_dic.items():
+            self.target_registry.upsert(job_name, target_list)
+            self.target_registry.write(job_name)
+        # 单个主机的agent更新失败不影响其它主机，配置已写入时始终重载
+        error_msg_list = list()
+        for ip, services_data in agent_service_dic.items():
+            flag, msg = self.update_agent_service(ip, 'add', services_data)
+            if not flag:
+                logger.error(f"更新主机{ip}的监控agent失败: {msg}")
+                error_msg_list.append(f"{ip}: {msg}")
         # self.add_rules('service', service_data.get('env'))
-        reload_prometheus_url = 'http://localhost:19011/-/reload'
-        # TODO 确认重载prometheus动作在哪执行
-        try:
-            requests.post(reload_prometheus_url, auth=self.basic_auth)
-        except Exception as e:
-            logger.error(e)
-            logger.error("重载prometheus配置失败！")
+        self.request_reload()
+        if error_msg_list:
+            return False, "; ".join(error_msg_list)
         return True, "success"
 
+    def add_scrape_jobs(self, job_names):
+        """
+        prometheus.yml 中补充缺失的 exporter 任务，无变化时不写入
+        :param job_names: 任务名称，如 mysqlExporter
+        :return:
+        """
+        with open(self.prometheus_conf_path, "r") as fr:
+            content = yaml.load(fr.read(), yaml.Loader) or dict()
+        scrape_configs = content.setdefault("scrape_configs", list())
+        exist_jobs = {item.get("job_name") for item in scrape_configs}
+        missing_jobs = [
+            job_name for job_name in job_names if job_name not in exist_jobs]
+        if not missing_jobs:
+            return
+        for job_name in missing_jobs:
+            service_name = job_name[:-len("Exporter")]
+            scrape_configs.append({
+                "job_name": job_name,
+                "metrics_path": f"/metrics/monitor/{service_name}",
+                "file_sd_configs": [
+                    {
+                        "refresh_interval": "30s",
+                        "files": [
+                            f"targets/{job_name}_all.json"
+                        ]
+                    }
+                ]
+            })
+        atomic_write(self.prometheus_conf_path, yaml.dump(
+            data=content, allow_unicode=True, sort_keys=False))
+
     def delete_service(self, service_data):
         """
         从自有的exporter中删除对应的服务信息
@@ -609,40 +599,22 @@ class PrometheusUtils(object):
         if not service_data:
             return False, "args cant be null"
 
-        self_exporter_target_file = os.path.join(self.prometheus_targets_path,
-                                                 "{}Exporter_all.json".format(service_data["service_name"]))
-
-        self_target_list = list()
-        if os.path.exists(self_exporter_target_file):
-            with open(self_exporter_target_file, 'r') as f:
-                content = f.read()
-                if content:
-                    self_target_list = json.loads(content)
-        else:
+        job_name = "{}Exporter".format(service_data["service_name"])
+        self_exporter_target_file = self.target_registry.file_path(job_name)
+        if not os.path.exists(self_exporter_target_file):
             logger.error("{}不存在！".format(self_exporter_target_file))
             return False, "Failed"
         try:
-            instance = service_data['ip']
-            env = service_data['env']
-            for service in self_target_list:
-                if (instance == service["labels"]["instance"]) and (env == service["labels"]["env"]):
-                    self_target_list.remove(service)
+            self.target_registry.delete(
+                job_name, service_data['ip'], env=service_data['env'])
         except KeyError as func_e:
             logger.error(func_e)
-
-        with open(self_exporter_target_file, 'w') as f2:
-            json.dump(self_target_list, f2, ensure_ascii=False, indent=4)
+        self.target_registry.write(job_name)
         flag, msg = self.update_agent_service(
             service_data.get('ip'), 'delete', [service_data])
         if not flag:
             return False, msg
-        reload_prometheus_url = 'http://localhost:19011/-/reload'
-        # TODO 确认重载prometheus动作在哪执行
-        try:
-            requests.post(reload_prometheus_url, auth=self.basic_auth)
-        except Exception as e:
-            logger.error(e)
-            logger.error("重载prometheus配置失败！")
+        self.request_reload()
         return True, "success"
 
     def update_host_threshold(self, env="default", env_id=1):
@@ -776,51 +748,28 @@ class PrometheusUtils(object):
                 AlertRule(**data).save()
             except Exception as e:
                 logger.error(f"更新数据分区错误:{e}")
-        self.update_rule_file(env=env)
+        self.update_rule_file()
         return True
 
-    def update_rule_file(self, add_data=None, add=False, update=False, delete=False, env="default", rule_id=0,
-                         env_id=1):
+    def update_rule_file(self):
         """
-        更新规则文件
+        由启用的告警规则编译规则文件，批量修改规则期间合并至批量结束时编译
+        :return: 是否成功
         """
-        rule_file_path = os.path.join(
-            self.prometheus_rules_path, f"{env}_rule.yml")
-        try:
-            all_rules = AlertRule.objects.filter(status=1).all()
-            if delete or update:
-                all_rules = AlertRule.objects.filter(
-                    status=1).exclude(id=rule_id).all()
-            init_data = {"groups": [
-                {
-                    "name": "OMP Alert",
-                    "rules": []
-                }
-            ]}
-            for rule in all_rules:
-                content = {
-                    "alert": rule.alert,
-                    "annotations": {
-                        "description": rule.description,
-                        "summary": rule.summary,
-                    },
-                    "expr": f"{rule.expr} {rule.compare_str} {rule.threshold_value}",
-                    "for": rule.for_time,
-                    "labels": rule.labels,
-                }
-                init_data["groups"][0]["rules"].append(content)
-            if add or update:
-                init_data["groups"][0]["rules"].append(
-                    self.gen_one_rule(**add_data)
-                )
-            my_yaml = YAML()
-            with open(rule_file_path, "w", encoding="utf8") as fp:
-                my_yaml.dump(init_data, fp)
-
+        if current_batch() is not None:
+            current_batch().dirty = True
             return True
-        except Exception as e:
-            logger.error(f"生成规则文件{rule_file_path}失败{e}")
-            return False
+        is_success, _, message = self.rule_compiler.compile()
+        if not is_success:
+            logger.error(f"生成规则文件失败: {message}")
+        return is_success
+
+    def rule_batch(self):
+        """
+        批量修改告警规则，退出时只编译及重载一次
+        with prometheus_utils.rule_batch() as batch: ...
+        """
+        return rule_batch(self.rule_compiler)
 
     def reload_prometheus(self):
         """
@@ -837,3 +786,11 @@ class PrometheusUtils(object):
             logger.error(e)
             logger.error("重载prometheus配置失败！")
             return False
+
+    @staticmethod
+    def request_reload():
+        """
+        请求重载 prometheus，短时间内的多次请求合并为一次
+        """
+        from promemonitor.tasks import request_prometheus_reload
+        request_prometheus_reload()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Project: rule_compiler
+# Create time: 2022-03-18
+# Introduction:
+
+"""
+告警规则编译
+启用的 AlertRule 按环境、规则分组（所属服务）生成 rules/<env>_alert_<group>_rule.yml，
+文件首行记录分组内容的 hash，内容未变化的分组不再校验及写入；
+变化的分组先由 prometheus 校验表达式，再原子替换文件；
+批量修改规则时合并为一次编译及重载
+"""
+
+import os
+import re
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from db_models.models import AlertRule, Env
+from promemonitor.target_registry import atomic_write
+from utils.parse_config import THREAD_POOL_MAX_WORKERS
+from utils.prometheus.client import prometheus_client, PrometheusRequestError
+
+logger = logging.getLogger("server")
+
+# 优先使用 libyaml 生成规则文件
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+# 规则文件首行的 hash 标记
+HASH_PREFIX = "# omp-rule-hash: "
+# 已通过校验的表达式缓存上限
+MAX_VALID_CACHE = 4096
+
+_local = threading.local()
+
+
+class RuleCompiler(object):
+    """ 告警规则编译器 """
+
+    # 已通过校验的表达式，语法校验结果不随时间变化，进程内共享
+    _valid_exprs = set()
+
+    def __init__(self, rules_path, validate=True):
+        """
+        :param rules_path: prometheus conf/rules 目录
+        :param validate: 写入前是否由 prometheus 校验表达式
+        """
+        self.rules_path = rules_path
+        self.validate = validate
+
+    @staticmethod
+    def group_name(service):
+        """ 分组名称，用于文件名 """
+        return re.sub(r"[^\w.-]", "_", service or "") or "default"
+
+    def file_path(self, env, group):
+        return os.path.join(self.rules_path, f"{env}_alert_{group}_rule.yml")
+
+    @staticmethod
+    def make_rule(rule):
+        """
+        单条规则
+        :param rule: AlertRule 或同名字段的字典
+        :return:
+        """
+        if not isinstance(rule, dict):
+            rule = rule.__dict__
+        return {
+            "alert": rule.get("alert"),
+            "annotations": {
+                "description": rule.get("description"),
+                "summary": rule.get("summary"),
+            },
+            "expr": f"{rule.get('expr')} {rule.get('compare_str')} "
+                    f"{rule.get('threshold_value')}",
+            "for": rule.get("for_time"),
+            "labels": rule.get("labels") or dict(),
+        }
+
+    def collect(self):
+        """
+        启用的规则按环境、分组归类
+        :return: {env: {group: [rule]}}
+        """
+        env_dic = dict(Env.objects.values_list("id", "name"))
+        result = {name: dict() for name in env_dic.values()}
+        for rule in AlertRule.objects.filter(status=1).order_by("id"):
+            env = env_dic.get(rule.env_id, "default")
+            result.setdefault(env, dict()).setdefault(
+                self.group_name(rule.service), list()).append(
+                self.make_rule(rule))
+        return result
+
+    @staticmethod
+    def render(env, group, rules):
+        """
+        生成分组规则文件内容
+        :return: (内容, hash)
+        """
+        body = yaml.dump(
+            {"groups": [{"name": f"OMP Alert {env} {group}", "rules": rules}]},
+            Dumper=YAML_DUMPER, allow_unicode=True, sort_keys=False,
+            default_flow_style=False)
+        hash_value = hashlib.md5(body.encode("utf8")).hexdigest()
+        return f"{HASH_PREFIX}{hash_value}\n{body}", hash_value
+
+    @staticmethod
+    def read_hash(path):
+        """ 读取已有规则文件首行的 hash """
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf8") as fp:
+            line = fp.readline().strip()
+        if line.startswith(HASH_PREFIX):
+            return line[len(HASH_PREFIX):]
+        return None
+
+    @classmethod
+    def validate_rules(cls, rules):
+        """
+        由 prometheus 校验规则表达式，prometheus 无法访问时不校验
+        :param rules: make_rule 生成的规则列表
+        :return: (是否通过, 错误信息)
+        """
+        unavailable = threading.Event()
+
+        def _check(expr):
+            if unavailable.is_set():
+                return None
+            try:
+                prometheus_client.query(expr, cache_ttl=0)
+            except PrometheusRequestError as e:
+                return f"{expr}: {str(e)}"
+            except Exception as e:
+                unavailable.set()
+                logger.warning(f"prometheus 无法访问，跳过规则校验: {str(e)}")
+            return None
+
+        expr_set = {rule["expr"] for rule in rules} - cls._valid_exprs
+        if not expr_set:
+            return True, "success"
+        with ThreadPoolExecutor(
+                min(THREAD_POOL_MAX_WORKERS, len(expr_set))) as executor:
+            error_dic = dict(zip(expr_set, executor.map(_check, expr_set)))
+        errors = [error for error in error_dic.values() if error]
+        if errors:
+            return False, "; ".join(errors)
+        if not unavailable.is_set():
+            if len(cls._valid_exprs) + len(expr_set) > MAX_VALID_CACHE:
+                cls._valid_exprs.clear()
+            cls._valid_exprs.update(expr_set)
+        return True, "success"
+
+    def remove_stale(self, env, groups):
+        """ 删除已不存在分组的规则文件及旧版的整体规则文件 """
+        removed = False
+        legacy_path = os.path.join(self.rules_path, f"{env}_rule.yml")
+        prefix, suffix = f"{env}_alert_", "_rule.yml"
+        exist_files = {
+            os.path.basename(self.file_path(env, group)) for group in groups}
+        for name in os.listdir(self.rules_path):
+            path = os.path.join(self.rules_path, name)
+            is_group_file = name.startswith(prefix) and name.endswith(suffix)
+            if path == legacy_path or (
+                    is_group_file and name not in exist_files):
+                os.remove(path)
+                removed = True
+        return removed
+
+    def compile(self):
+        """
+        编译全部规则文件
+        :return: (是否成功, 是否有文件变化, 信息)
+        """
+        if not os.path.exists(self.rules_path):
+            os.makedirs(self.rules_path)
+        changed = False
+        errors = list()
+        for env, group_dic in self.collect().items():
+            error_count = len(errors)
+            for group, rules in group_dic.items():
+                path = self.file_path(env, group)
+                content, hash_value = self.render(env, group, rules)
+                if self.read_hash(path) == hash_value:
+                    continue
+                if self.validate:
+                    is_valid, message = self.validate_rules(rules)
+                    if not is_valid:
+                        logger.error(f"规则文件{path}校验失败: {message}")
+                        errors.append(message)
+                        continue
+                atomic_write(path, content)
+                changed = True
+            # 存在校验失败的分组时保留旧文件
+            if len(errors) == error_count:
+                changed = self.remove_stale(env, group_dic.keys()) or changed
+        if errors:
+            return False, changed, "; ".join(errors)
+        return True, changed, "success"
+
+
+class RuleBatch(object):
+    """ 批量修改规则，期间的规则文件更新在退出时合并为一次编译及重载 """
+
+    def __init__(self, compiler):
+        self.compiler = compiler
+        self.dirty = False
+        self.result = (True, "success")
+
+    def commit(self):
+        if not self.dirty:
+            return
+        is_success, changed, message = self.compiler.compile()
+        self.result = (is_success, message)
+        if changed:
+            from promemonitor.tasks import request_prometheus_reload
+            request_prometheus_reload()
+
+
+def current_batch():
+    """ 当前线程中进行中的批量修改 """
+    return getattr(_local, "batch", None)
+
+
+@contextmanager
+def rule_batch(compiler):
+    """
+    批量修改规则，嵌套时并入最外层
+    :param compiler: RuleCompiler
+    :return: RuleBatch，退出后 result 为编译结果
+    """
+    batch = current_batch()
+    if batch is not None:
+        yield batch
+        return
+    batch = RuleBatch(compiler)
+    _local.batch = batch
+    try:
+        yield batch
+    finally:
+        _local.batch = None
+        batch.commit()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Project: target_registry
+# Create time: 2022-03-18
+# Introduction:
+
+"""
+prometheus 抓取目标注册表
+conf/targets 下的 file_sd 文件统一由 PrometheusTarget 表生成，
+增删按 (任务, 目标标识) 直接更新数据库，批量变更后每个任务只写一次文件，
+文件先写入临时文件再重命名替换，prometheus 重载请求在短时间内合并为一次
+"""
+
+import os
+import json
+import logging
+import tempfile
+import threading
+
+import redis
+
+from db_models.models import PrometheusTarget
+from promemonitor.dashboard import REDIS_POOL
+
+logger = logging.getLogger("server")
+
+# 重载合并标记
+RELOAD_PENDING_KEY = "omp:prometheus:reload_pending"
+# 写入文件后数据库又发生变化时的最大重写次数
+MAX_WRITE_RETRY = 3
+
+
+def atomic_write(path, content):
+    """
+    原子写入文件，prometheus 读取时不会读到写了一半的内容
+    :param path: 文件路径
+    :param content: 文件内容
+    :return:
+    """
+    dir_name = os.path.dirname(path)
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dir_name, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf8") as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def mark_reload_pending(delay):
+    """
+    标记 prometheus 待重载，delay 秒内重复标记无效
+    :return: 是否为本次标记
+    """
+    conn = redis.Redis(connection_pool=REDIS_POOL)
+    return bool(conn.set(RELOAD_PENDING_KEY, 1, nx=True, ex=delay))
+
+
+def clear_reload_pending():
+    """ 清除待重载标记，重载过程中发生的变更可再次触发重载 """
+    redis.Redis(connection_pool=REDIS_POOL).delete(RELOAD_PENDING_KEY)
+
+
+class TargetRegistry(object):
+    """ prometheus 抓取目标注册表，file_sd 文件的唯一写入者 """
+
+    # 进程内同一任务文件的写入锁，{job_name: Lock}
+    _job_locks = dict()
+    _locks_lock = threading.Lock()
+
+    def __init__(self, targets_path):
+        """
+        :param targets_path: prometheus conf/targets 目录
+        """
+        self.targets_path = targets_path
+
+    def file_path(self, job_name):
+        """ 任务对应的 file_sd 文件 """
+        return os.path.join(self.targets_path, f"{job_name}_all.json")
+
+    @classmethod
+    def job_lock(cls, job_name):
+        with cls._locks_lock:
+            return cls._job_locks.setdefault(job_name, threading.Lock())
+
+    @staticmethod
+    def make_key(labels):
+        """
+        目标唯一标识，主机按 ip，服务按 ip 及实例名
+        :param labels: file_sd 中的 labels
+        :return:
+        """
+        instance = labels.get("instance", "")
+        if labels.get("service_type") == "host":
+            return instance
+        return f"{instance}/{labels.get('instance_name', '')}"
+
+    def import_legacy(self, job_name):
+        """
+        数据库中没有该任务的记录时导入已有 targets 文件，兼容升级前生成的配置
+        :param job_name: 任务名称
+        :return:
+        """
+        if PrometheusTarget.objects.filter(job_name=job_name).exists():
+            return
+        path = self.file_path(job_name)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as fp:
+                content = fp.read()
+            target_ls = json.loads(content) if content.strip() else list()
+        except ValueError as e:
+            logger.error(f"导入{path}失败: {str(e)}")
+            return
+        obj_dic = dict()
+        for item in target_ls:
+            if not isinstance(item, dict):
+                continue
+            obj = self.make_obj(job_name, item)
+            obj_dic[obj.target_key] = obj
+        PrometheusTarget.objects.bulk_create(
+            obj_dic.values(), ignore_conflicts=True)
+
+    def make_obj(self, job_name, item):
+        labels = item.get("labels", dict())
+        return PrometheusTarget(
+            job_name=job_name,
+            target_key=self.make_key(labels),
+            instance=labels.get("instance", ""),
+            env=labels.get("env", ""),
+            targets=item.get("targets", list()),
+            labels=labels
+        )
+
+    def upsert(self, job_name, target_ls):
+        """
+        按目标标识新增或更新抓取目标
+        :param job_name: 任务名称
+        :param target_ls: file_sd 格式的目标列表 [{"targets": [], "labels": {}}]
+        :return: 是否有变化
+        """
+        self.import_legacy(job_name)
+        obj_dic = dict()
+        for item in target_ls:
+            obj = self.make_obj(job_name, item)
+            obj_dic[obj.target_key] = obj
+        exist_dic = {
+            obj.target_key: obj for obj in PrometheusTarget.objects.filter(
+                job_name=job_name, target_key__in=obj_dic.keys())
+        }
+        create_ls, update_ls = list(), list()
+        for key, obj in obj_dic.items():
+            exist_obj = exist_dic.get(key)
+            if exist_obj is None:
+                create_ls.append(obj)
+            elif (exist_obj.targets, exist_obj.labels, exist_obj.env) != \
+                    (obj.targets, obj.labels, obj.env):
+                exist_obj.targets = obj.targets
+                exist_obj.labels = obj.labels
+                exist_obj.env = obj.env
+                update_ls.append(exist_obj)
+        if create_ls:
+            PrometheusTarget.objects.bulk_create(
+                create_ls, ignore_conflicts=True)
+        if update_ls:
+            PrometheusTarget.objects.bulk_update(
+                update_ls, ["targets", "labels", "env"])
+        return bool(create_ls or update_ls)
+
+    def delete(self, job_name, instance, env=None):
+        """
+        删除实例地址上的抓取目标
+        :param job_name: 任务名称
+        :param instance: 实例地址
+        :param env: 环境，为空时不区分环境
+        :return: 删除的目标数
+        """
+        self.import_legacy(job_name)
+        queryset = PrometheusTarget.objects.filter(
+            job_name=job_name, instance=instance)
+        if env is not None:
+            queryset = queryset.filter(env=env)
+        count, _ = queryset.delete()
+        return count
+
+    def render(self, job_name):
+        """ 由数据库生成 file_sd 文件内容 """
+        queryset = PrometheusTarget.objects.filter(
+            job_name=job_name).order_by("target_key").values_list(
+            "targets", "labels")
+        return json.dumps(
+            [{"targets": targets, "labels": labels}
+             for targets, labels in queryset],
+            ensure_ascii=False, indent=4)
+
+    def write(self, job_name):
+        """
+        写入任务对应的 file_sd 文件，
+        写入后数据库被其他进程修改时重新生成，保证文件与最后一次修改一致
+        :param job_name: 任务名称
+        :return:
+        """
+        path = self.file_path(job_name)
+        with self.job_lock(job_name):
+            content = self.render(job_name)
+            for _ in range(MAX_WRITE_RETRY):
+                if os.path.exists(path):
+                    with open(path, "r") as fp:
+                        if fp.read() == content:
+                            return
+                atomic_write(path, content)
+                latest = self.render(job_name)
+                if latest == content:
+                    return
+                content = latest
+            logger.warning(f"{path} 写入期间抓取目标持续变化")
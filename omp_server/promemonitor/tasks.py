@@ -13,11 +13,27 @@
 import os
 import logging
 import traceback
+from datetime import datetime, timedelta
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.db import transaction
+from django.db.models import Count, Min, Max, Q
+from django.db.models.functions import TruncDate
 
-from db_models.models import Host
+from db_models.models import Host, Service, HostMetricSnapshot, \
+    ServiceMetricSnapshot, Alert, AlertDailySummary, OperateLog, \
+    UserLoginLog, HostOperateLog, SelfHealingHistory, ExecutionEventLog, \
+    DetailInstallHistory, ToolExecuteDetailHistory
+from omp_server.settings import DASHBOARD_REFRESH_DELAY, \
+    PROMETHEUS_RELOAD_DELAY
+from promemonitor.dashboard import DashboardSnapshot
+from promemonitor.prometheus import Prometheus
+from promemonitor.prometheus_utils import PrometheusUtils
+from promemonitor.target_registry import mark_reload_pending, \
+    clear_reload_pending
+from utils.parse_config import ALERT_RETENTION_DAYS, \
+    OPERATE_LOG_RETENTION_DAYS, RETENTION_CHUNK_SIZE
 from utils.plugin.salt_client import SaltClient
 
 # 屏蔽celery任务日志中的paramiko日志
@@ -75,3 +91,278 @@ def monitor_agent_restart(host_id):
         )
         Host.objects.filter(id=host_id).update(
             monitor_agent=2, monitor_agent_error=str(e))
+
+
+def save_metric_snapshot(model, usage_dic, fields):
+    """
+    将指标快照写入快照表，已存在的批量更新，不存在的批量创建
+    :param model: 快照表 HostMetricSnapshot / ServiceMetricSnapshot
+    :param usage_dic: {主键: {字段: 值}}
+    :param fields: 需要更新的字段
+    :return:
+    """
+    exist_pk_set = set(model.objects.filter(
+        pk__in=usage_dic.keys()).values_list("pk", flat=True))
+    now = datetime.now()
+    create_ls, update_ls = list(), list()
+    for pk, usage in usage_dic.items():
+        snapshot = model(pk=pk, modified=now, **usage)
+        if pk in exist_pk_set:
+            update_ls.append(snapshot)
+        else:
+            create_ls.append(snapshot)
+    model.objects.bulk_create(create_ls, batch_size=500)
+    model.objects.bulk_update(
+        update_ls, list(fields) + ["modified"], batch_size=500)
+
+
+def refresh_host_metric_snapshot(prometheus_obj):
+    """
+    刷新主机指标快照
+    :param prometheus_obj: Prometheus 对象
+    :type prometheus_obj Prometheus
+    :return:
+    """
+    host_list = list(Host.objects.filter(
+        is_deleted=False).values("id", "ip", "data_folder"))
+    snapshot_dic = prometheus_obj.get_host_usage_snapshot(host_list)
+    if snapshot_dic is None:
+        logger.error("Refresh host metric snapshot failed!")
+        return
+    save_metric_snapshot(
+        HostMetricSnapshot,
+        {host.get("id"): snapshot_dic.get(host.get("ip"))
+         for host in host_list},
+        ("cpu_usage", "mem_usage", "root_disk_usage", "data_disk_usage"))
+
+
+def refresh_service_metric_snapshot(prometheus_obj):
+    """
+    刷新服务指标快照
+    :param prometheus_obj: Prometheus 对象
+    :type prometheus_obj Prometheus
+    :return:
+    """
+    service_list = [
+        {
+            "id": service.get("id"),
+            "ip": service.get("ip"),
+            "app_name": service.get("service__app_name"),
+            "env": service.get("env__name"),
+            "service_instance_name": service.get("service_instance_name"),
+        } for service in Service.objects.values(
+            "id", "ip", "service__app_name", "env__name",
+            "service_instance_name")
+    ]
+    snapshot_dic = prometheus_obj.get_service_usage_snapshot(service_list)
+    if snapshot_dic is None:
+        logger.error("Refresh service metric snapshot failed!")
+        return
+    save_metric_snapshot(
+        ServiceMetricSnapshot, snapshot_dic, ("cpu_usage", "mem_usage"))
+
+
+@shared_task
+def refresh_metric_snapshot():
+    """
+    定时刷新主机及服务指标快照，供列表页按指标全量排序使用
+    :return:
+    """
+    try:
+        prometheus_obj = Prometheus()
+        refresh_host_metric_snapshot(prometheus_obj)
+        refresh_service_metric_snapshot(prometheus_obj)
+    except Exception as e:
+        logger.error(
+            f"Refresh metric snapshot failed with error: {str(e)};\n"
+            f"detail: {traceback.format_exc()}")
+
+
+@shared_task
+def refresh_dashboard_snapshot():
+    """
+    重新生成仪表盘快照
+    :return:
+    """
+    try:
+        snapshot_obj = DashboardSnapshot()
+        snapshot_obj.clear_pending()
+        snapshot = snapshot_obj.refresh()
+        logger.info(
+            f"Refresh dashboard snapshot version: {snapshot.get('version')}")
+    except Exception as e:
+        logger.error(
+            f"Refresh dashboard snapshot failed with error: {str(e)};\n"
+            f"detail: {traceback.format_exc()}")
+
+
+def request_dashboard_refresh():
+    """
+    告警、主机、服务变更后请求刷新仪表盘快照，
+    DASHBOARD_REFRESH_DELAY 秒内的多次请求合并为一次刷新
+    :return:
+    """
+    try:
+        if DashboardSnapshot().mark_pending(DASHBOARD_REFRESH_DELAY):
+            refresh_dashboard_snapshot.apply_async(
+                countdown=DASHBOARD_REFRESH_DELAY)
+    except Exception as e:
+        logger.warning(f"Request dashboard refresh failed: {str(e)}")
+
+
+@shared_task
+def reload_prometheus_config():
+    """
+    重载 prometheus 配置
+    :return:
+    """
+    try:
+        clear_reload_pending()
+    except Exception as e:
+        logger.warning(f"Clear prometheus reload pending failed: {str(e)}")
+    PrometheusUtils().reload_prometheus()
+
+
+def request_prometheus_reload():
+    """
+    抓取目标及 prometheus.yml 变更后请求重载，
+    PROMETHEUS_RELOAD_DELAY 秒内的多次请求合并为一次重载，
+    无法合并时直接重载
+    :return:
+    """
+    try:
+        if mark_reload_pending(PROMETHEUS_RELOAD_DELAY):
+            reload_prometheus_config.apply_async(
+                countdown=PROMETHEUS_RELOAD_DELAY)
+        return
+    except Exception as e:
+        logger.warning(f"Request prometheus reload failed: {str(e)}")
+    PrometheusUtils().reload_prometheus()
+
+
+# 告警日汇总的分组字段
+ALERT_SUMMARY_KEYS = (
+    "date", "alert_type", "alert_host_ip", "alert_service_name",
+    "alert_instance_name", "alert_level", "env_id")
+
+
+def save_alert_summary(alert_ids):
+    """
+    将一批告警按天、对象、级别汇总，累加到告警日汇总表
+    :param alert_ids: 告警 id 列表
+    :return:
+    """
+    group_ls = Alert.objects.filter(id__in=alert_ids).annotate(
+        date=TruncDate("alert_time")
+    ).values(*ALERT_SUMMARY_KEYS).annotate(
+        count=Count("id"), first=Min("alert_time"), last=Max("alert_time")
+    ).order_by()
+    group_dic = dict()
+    for group in group_ls:
+        group["alert_level"] = group["alert_level"][:64]
+        key = tuple(group[k] for k in ALERT_SUMMARY_KEYS)
+        if key in group_dic:
+            # 截断后的告警级别可能重复
+            exist = group_dic[key]
+            exist["count"] += group["count"]
+            exist["first"] = min(exist["first"], group["first"])
+            exist["last"] = max(exist["last"], group["last"])
+        else:
+            group_dic[key] = group
+    if not group_dic:
+        return
+    update_ls = list()
+    for summary in AlertDailySummary.objects.filter(
+            date__in={key[0] for key in group_dic},
+            alert_host_ip__in={key[2] for key in group_dic}):
+        group = group_dic.pop(
+            tuple(getattr(summary, k) for k in ALERT_SUMMARY_KEYS), None)
+        if not group:
+            continue
+        summary.alert_count += group["count"]
+        summary.first_alert_time = min(
+            summary.first_alert_time, group["first"])
+        summary.last_alert_time = max(summary.last_alert_time, group["last"])
+        update_ls.append(summary)
+    AlertDailySummary.objects.bulk_update(
+        update_ls, ["alert_count", "first_alert_time", "last_alert_time"],
+        batch_size=500)
+    AlertDailySummary.objects.bulk_create([
+        AlertDailySummary(
+            alert_count=group.pop("count"),
+            first_alert_time=group.pop("first"),
+            last_alert_time=group.pop("last"),
+            **group
+        ) for group in group_dic.values()
+    ], batch_size=500)
+
+
+def clean_in_chunks(queryset, chunk_size, before_delete=None):
+    """
+    按 id 分批删除记录，每批在独立事务中完成，避免长事务及大范围锁
+    :param queryset: 待删除记录的查询集
+    :param chunk_size: 单批删除条数
+    :param before_delete: 删除前对本批 id 的处理函数，与删除在同一事务中
+    :return: 删除条数
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by("id").values_list(
+                "id", flat=True)[:chunk_size])
+            if not ids:
+                break
+            if before_delete is not None:
+                before_delete(ids)
+            queryset.model.objects.filter(id__in=ids).delete()
+        total += len(ids)
+        if len(ids) < chunk_size:
+            break
+    return total
+
+
+@shared_task
+def clean_expired_records(alert_retention_days=ALERT_RETENTION_DAYS,
+                          log_retention_days=OPERATE_LOG_RETENTION_DAYS,
+                          chunk_size=RETENTION_CHUNK_SIZE):
+    """
+    定时清理过期记录
+    超出保留期的告警先汇总至告警日汇总表再删除，操作记录、自愈记录直接删除，
+    执行过程日志按所属安装、工具执行详情的创建时间删除
+    :param alert_retention_days: 告警保留天数
+    :param log_retention_days: 操作记录保留天数
+    :param chunk_size: 单批删除条数
+    :return:
+    """
+    now = datetime.now()
+    alert_deadline = now - timedelta(days=alert_retention_days)
+    log_deadline = now - timedelta(days=log_retention_days)
+    install_log_q = Q(
+        module=ExecutionEventLog.MODULE_INSTALL,
+        history_id__in=DetailInstallHistory.objects.filter(
+            created__lt=log_deadline).values("id"))
+    tool_log_q = Q(
+        module=ExecutionEventLog.MODULE_TOOL,
+        history_id__in=ToolExecuteDetailHistory.objects.filter(
+            created__lt=log_deadline).values("id"))
+    clean_ls = [
+        (Alert.objects.filter(alert_time__lt=alert_deadline),
+         save_alert_summary),
+        (OperateLog.objects.filter(create_time__lt=log_deadline), None),
+        (UserLoginLog.objects.filter(login_time__lt=log_deadline), None),
+        (HostOperateLog.objects.filter(created__lt=log_deadline), None),
+        (SelfHealingHistory.objects.filter(
+            alert_time__lt=log_deadline).exclude(
+            state=SelfHealingHistory.HEALING_ING), None),
+        (ExecutionEventLog.objects.filter(
+            install_log_q | tool_log_q), None),
+    ]
+    for queryset, before_delete in clean_ls:
+        model_name = queryset.model.__name__
+        try:
+            count = clean_in_chunks(queryset, chunk_size, before_delete)
+            logger.info(f"Clean expired {model_name}: {count} rows")
+        except Exception as e:
+            logger.error(
+                f"Clean expired {model_name} failed with error: {str(e)};\n"
+                f"detail: {traceback.format_exc()}")
@@ -2,11 +2,9 @@
 """
 监控相关视图
 """
-import json
 import logging
 import traceback
 
-import requests
 from django.core.validators import EmailValidator
 from django.db import transaction
 from django.db.models import F
@@ -23,13 +21,13 @@ from rest_framework.viewsets import GenericViewSet
 
 from db_models.models import (
     Host, MonitorUrl,
-    Alert, Maintain, ApplicationHub, Service, EmailSMTPSetting,
+    Alert, Maintain, EmailSMTPSetting,
     AlertSendWaySetting, HostThreshold, ServiceThreshold,
     ServiceCustomThreshold, Rule, AlertRule,Env
 )
 from omp_server.settings import CUSTOM_THRESHOLD_SERVICES
 from promemonitor import grafana_url
-from promemonitor.alert_util import utc_to_local, get_monitor_url, get_log_url
+from promemonitor.dashboard import DashboardSnapshot
 from promemonitor.promemonitor_filters import AlertFilter, MyTimeFilter, \
     QuotaFilter
 from promemonitor.promemonitor_serializers import (
@@ -40,7 +38,7 @@ from promemonitor.promemonitor_serializers import (
 from promemonitor.prometheus import Prometheus
 from utils.common.exceptions import OperateError
 from utils.common.paginations import PageNumberPager
-from utils.parse_config import PROMETHEUS_AUTH
+from utils.prometheus.client import prometheus_client
 from promemonitor.prometheus_utils import PrometheusUtils
 
 logger = logging.getLogger('server')
@@ -83,6 +81,8 @@ class MonitorUrlViewSet(ListModelMixin, CreateModelMixin, GenericViewSet):
             serializer.is_valid(raise_exception=True)
             serializer.save()
             instances.append(serializer.data)
+        # 监控地址变更后丢弃旧地址的缓存结果
+        prometheus_client.clear()
         return Response(instances)
 
 
@@ -192,276 +192,12 @@ class InstrumentPanelView(GenericViewSet, ListModelMixin):
     # 操作信息描述
     get_description = "查询仪表盘数据"
 
-    @staticmethod
-    def get_prometheus_alerts():
-        """
-        请求prometheus alerts接口返回告警内容
-        """
-        mu = MonitorUrl.objects.filter(name="prometheus").first()
-        prometheus_url = mu.monitor_url if mu else "127.0.0.1:19011"
-        prometheus_auth = (PROMETHEUS_AUTH.get(
-            "username", "omp"), PROMETHEUS_AUTH.get("plaintext_password", ""))
-        try:
-            prometheus_alerts_url = f"http://{prometheus_url}/api/v1/alerts"
-            # NOQA
-            response = requests.get(prometheus_alerts_url, headers={
-            }, data="", auth=prometheus_auth)
-            return True, json.loads(response.text)
-        except Exception as e:
-            logger.error("prometheus请求alerts失败：" + str(e))
-            return False, "Failed"
-
-    def get_exc_serializer_info(self):
-        host_info_dict = {}
-        database_info_dict = {}
-        service_info_dict = {}
-        component_info_dict = {}
-        third_info_dict = {}
-
-        host_info_list = []
-        database_info_list = []
-        service_info_list = []
-        component_info_list = []
-        third_info_list = []
-
-        host_list = Host.objects.all()
-        ignore_status_list = [Service.SERVICE_STATUS_NORMAL,
-                              Service.SERVICE_STATUS_STARTING,
-                              Service.SERVICE_STATUS_STOPPING,
-                              Service.SERVICE_STATUS_RESTARTING,
-                              Service.SERVICE_STATUS_STOP]
-        database_list = Service.objects.filter(
-            service__app_type=ApplicationHub.APP_TYPE_COMPONENT).filter(
-            service__app_labels__label_name__contains="数据库").filter(
-            service_status__in=ignore_status_list).filter(
-            service__is_base_env=False)
-        service_list = Service.objects.filter(
-            service__app_type=ApplicationHub.APP_TYPE_SERVICE).filter(
-            service_status__in=ignore_status_list).filter(
-            service__is_base_env=False).filter(
-            service_controllers__start__isnull=False)
-        component_list = Service.objects.filter(
-            service__app_type=ApplicationHub.APP_TYPE_COMPONENT).filter(
-            service_status__in=ignore_status_list).filter(
-            service__is_base_env=False)
-        # third_info_all = None  # TODO 暂为空
-
-        host_info_all_count = len(host_list)
-        database_info_all_count = len(database_list)
-        service_info_all_count = len(service_list)
-        component_info_all_count = len(component_list)
-        third_info_all_count = 0  # TODO 暂为空
-
-        # host_info_exc_count = 0
-        database_info_exc_count = 0
-        service_info_exc_count = 0
-        component_info_exc_count = 0
-        third_info_exc_count = 0
-
-        host_info_no_monitor_count = 0
-        database_info_no_monitor_count = 0
-        service_info_no_monitor_count = 0
-        component_info_no_monitor_count = 0
-        third_info_no_monitor_count = 0
-
-        flag, alert_data = self.get_prometheus_alerts()
-        error_instance_list = []
-        error_host_list = []
-        if flag:
-            alerts = alert_data.get('data').get('alerts')
-            for ele in alerts:
-                if not isinstance(ele, dict):
-                    continue
-                if ele.get("status") == "resolved" or ele.get(
-                        "state") == "resolved":
-                    continue
-                ele_dict = {
-                    "ip": ele.get("labels").get("instance"),
-                    "instance_name": ele.get("labels").get("instance_name"),
-                    "alertname": ele.get("labels").get("alertname"),
-                    "severity": ele.get("labels").get("severity"),
-                    "date": utc_to_local(ele.get("activeAt")),
-                    "describe": ele.get("annotations").get("description"),
-                    "monitor_url": get_monitor_url([{
-                        "ip": ele.get("labels").get("instance"),
-                        "type": "service",
-                        "instance_name": ele.get("labels").get("service_name")
-                    }]),
-                    "log_url": get_log_url([{
-                        "ip": ele.get("labels").get("instance"),
-                        "type": "service",
-                        "instance_name": ele.get("labels").get("service_name")
-                    }])
-                }
-                if ele.get("labels").get("job") == "nodeExporter":
-                    ele_dict["monitor_url"] = get_monitor_url([{
-                        "ip": ele.get("labels").get("instance"),
-                        "type": "host",
-                        "instance_name": "node"
-                    }])
-                    ele_dict["log_url"] = get_log_url([{
-                        "ip": ele.get("labels").get("instance"),
-                        "type": "host",
-                        "instance_name": "node"
-                    }])
-                    # host_info_exc_count = host_info_exc_count + 1
-                    host_info_list.append(ele_dict)
-                    error_host_list.append(ele.get("labels").get("instance"))
-                service_name_str = ele.get("labels").get("app")
-                if not service_name_str:
-                    continue
-                if list(filter(
-                        lambda x: x.service.app_name == service_name_str,
-                        list(database_list))):
-                    database_info_exc_count = database_info_exc_count + 1
-                    database_info_list.append(ele_dict)
-                    error_instance_list.append(
-                        ele.get("labels").get("instance_name"))
-                elif list(
-                        filter(lambda x: x.service.app_name ==
-                                         service_name_str,
-                               list(service_list))):
-                    service_info_exc_count = service_info_exc_count + 1
-                    service_info_list.append(ele_dict)
-                    error_instance_list.append(
-                        ele.get("labels").get("instance_name"))
-                elif list(
-                        filter(lambda x: x.service.app_name ==
-                                         service_name_str,
-                               list(component_list))):
-                    component_info_exc_count = component_info_exc_count + 1
-                    component_info_list.append(ele_dict)
-                    error_instance_list.append(
-                        ele.get("labels").get("instance_name"))
-                else:
-                    continue
-
-        for index, hil in enumerate(host_info_list):
-            if hil.get("severity") == "warning":
-                for i, h in enumerate(host_info_list):
-                    if index == i:
-                        continue
-                    if hil.get("ip") == h.get("ip") and hil.get(
-                            "alertname") == h.get("alertname") and h.get(
-                        "severity") == "critical":
-                        host_info_list.pop(index)
-                        break
-            elif hil.get("severity") == "critical":
-                for i, h in enumerate(host_info_list):
-                    if index == i:
-                        continue
-                    if hil.get("ip") == h.get("ip") and hil.get(
-                            "alertname") == h.get("alertname") and h.get(
-                        "severity") == "warning":
-                        host_info_list.pop(i)
-                        break
-
-        _, host_targets = Prometheus().get_all_host_targets()
-        for host in host_list:
-            if host.ip in error_host_list:
-                continue
-            host_dict = {
-                "ip": host.ip, "instance_name": host.instance_name,
-                "severity": "normal"}
-            if host.ip not in host_targets:
-                host_dict = {
-                    "ip": host.ip, "instance_name": host.instance_name,
-                    "severity": "unmonitored"}
-            host_info_list.append(host_dict)
-
-        _, service_targets = Prometheus().get_all_service_targets()
-        for database in database_list:
-            if database.service_instance_name in error_instance_list:
-                continue
-            database_dict = {"ip": database.ip,
-                             "instance_name": database.service_instance_name,
-                             "app_name": database.service.app_name,
-                             "severity": "normal"}
-            database_ip_instance_name_str = \
-                f"{database.ip}_{database.service_instance_name}"
-            if database_ip_instance_name_str not in service_targets:
-                database_dict = {"ip": database.ip,
-                                 "instance_name":
-                                     database.service_instance_name,
-                                 "app_name": database.service.app_name,
-                                 "severity": "unmonitored"}
-            database_info_list.append(database_dict)
-        for service in service_list:
-            if service.service_instance_name in error_instance_list:
-                continue
-            service_dict = {"ip": service.ip,
-                            "instance_name": service.service_instance_name,
-                            "app_name": service.service.app_name,
-                            "severity": "normal"}
-            service_ip_instance_name_str = f"{service.ip}_" \
-                                           f"{service.service_instance_name}"
-            if service_ip_instance_name_str not in service_targets:
-                service_dict = {"ip": service.ip,
-                                "instance_name": service.service_instance_name,
-                                "app_name": service.service.app_name,
-                                "severity": "unmonitored"}
-            service_info_list.append(service_dict)
-        for component in component_list:
-            if component.service_instance_name in error_instance_list:
-                continue
-            component_dict = {"ip": component.ip,
-                              "instance_name": component.service_instance_name,
-                              "app_name": component.service.app_name,
-                              "severity": "normal"}
-            component_ip_instance_name_str = f"{component.ip}_" \
-                                             f"{component.service_instance_name}"
-            if component_ip_instance_name_str not in service_targets:
-                component_dict = {"ip": component.ip,
-                                  "instance_name":
-                                      component.service_instance_name,
-                                  "app_name": component.service.app_name,
-                                  "severity": "unmonitored"}
-            component_info_list.append(component_dict)
-
-        host_info_exc_count = len(set(error_host_list))
-
-        host_info_dict.update({
-            "host_info_all_count": host_info_all_count,
-            "host_info_exc_count": host_info_exc_count,
-            "host_info_no_monitor_count": host_info_no_monitor_count,
-            "host_info_list": host_info_list
-        })
-        database_info_dict.update({
-            "database_info_all_count": database_info_all_count,
-            "database_info_exc_count": database_info_exc_count,
-            "database_info_no_monitor_count": database_info_no_monitor_count,
-            "database_info_list": database_info_list
-        })
-        service_info_dict.update({
-            "service_info_all_count": service_info_all_count,
-            "service_info_exc_count": service_info_exc_count,
-            "service_info_no_monitor_count": service_info_no_monitor_count,
-            "service_info_list": service_info_list
-        })
-        component_info_dict.update({
-            "component_info_all_count": component_info_all_count,
-            "component_info_exc_count": component_info_exc_count,
-            "component_info_no_monitor_count": component_info_no_monitor_count,
-            "component_info_list": component_info_list
-        })
-        third_info_dict.update({
-            "third_info_all_count": third_info_all_count,
-            "third_info_exc_count": third_info_exc_count,
-            "third_info_no_monitor_count": third_info_no_monitor_count,
-            "third_info_list": third_info_list
-        })
-        serializer_info = {
-            "host": host_info_dict,
-            "database": database_info_dict,
-            "service": service_info_dict,
-            "component": component_info_dict,
-            "third": third_info_dict,
-        }
-        return serializer_info
-
     def list(self, request, *args, **kwargs):
-        result = self.get_exc_serializer_info()
-        return Response(result)
+        # 读取预先生成的快照，版本号可用于前端判断数据是否变化
+        snapshot = DashboardSnapshot().get()
+        return Response(
+            snapshot.get("data"),
+            headers={"X-Snapshot-Version": str(snapshot.get("version"))})
 
 
 class GetSendEmailConfig(GenericViewSet, ListModelMixin):
@@ -950,16 +686,23 @@ class QuotaView(ListModelMixin, GenericViewSet, CreateModelMixin,DestroyModelMix
                 "job": '{}Exporter'.format(request.data["service"]),
                 "severity": severity
             }
+            # 写入前校验规则表达式
+            is_valid, message = p.rule_compiler.validate_rules(
+                [p.rule_compiler.make_rule(request.data)])
+            if not is_valid:
+                return Response(data={"code": 1,
+                                      "message": f"指标规则校验失败: {message}"})
             if id != 0:
                 if AlertRule.objects.filter(expr=request.data["expr"],
                                             severity=severity).exclude(id=id).exists():
                     return Response(data={"code": 1,
                                           "message": f"更新指标规则过程中出错: "
                                                      f"同一指标规则级别重复添加"})
-                if not p.update_rule_file(add_data=request.data,update=True, rule_id=id):
-                    return Response(data={"code": 1,
-                                          "message": f"更新指标规则错误"})
-                AlertRule.objects.filter(id=id).update(**request.data)
+                # 规则文件写入失败时回滚数据库变更
+                with transaction.atomic():
+                    AlertRule.objects.filter(id=id).update(**request.data)
+                    if not p.update_rule_file():
+                        raise OperateError("更新指标规则错误")
                 ok = p.reload_prometheus()
                 if not ok:
                     return Response(data={"code":1,"message":"prometheus 重载规则失败，请手动重启prometheus进行重载"})
@@ -969,10 +712,10 @@ class QuotaView(ListModelMixin, GenericViewSet, CreateModelMixin,DestroyModelMix
                 return Response(data={"code": 1,
                                       "message": f"创建指标规则过程中出错: "
                                                  f"同一指标规则级别重复添加"})
-            if not p.update_rule_file(add_data=request.data,add=True):
-                return Response(data={"code": 1,
-                                      "message": f"创建指标规则错误"})
-            AlertRule(**request.data).save()
+            with transaction.atomic():
+                AlertRule(**request.data).save()
+                if not p.update_rule_file():
+                    raise OperateError("创建指标规则错误")
             ok = p.reload_prometheus()
             if not ok:
                 return Response(data={"code": 1,
@@ -989,12 +732,12 @@ class QuotaView(ListModelMixin, GenericViewSet, CreateModelMixin,DestroyModelMix
         """
         id = request.query_params.get("id")
         p = PrometheusUtils()
-        if not p.update_rule_file(delete=True, rule_id=id):
-            return Response(data={"code": 1,
-                                  "message": f"删除指标规则时，更新配置文件失败"})
         num, _ = AlertRule.objects.filter(id=id).delete()
         if num == 0:
             return Response(data={"code": 1, "message": "删除失败"})
+        if not p.update_rule_file():
+            return Response(data={"code": 1,
+                                  "message": f"删除指标规则时，更新配置文件失败"})
         ok = p.reload_prometheus()
         if not ok:
             return Response(data={"code": 1,
@@ -1047,14 +790,12 @@ class BatchUpdateRuleView(GenericViewSet,CreateModelMixin):
         p = PrometheusUtils()
         ids = request.data.get("ids")
         status = request.data.get("status")
-        for id in ids:
-            AlertRule.objects.filter(id=id).update(status=status)
-        if not p.update_rule_file():
+        # 批量修改后只编译及重载一次
+        with p.rule_batch() as batch:
+            AlertRule.objects.filter(id__in=ids).update(status=status)
+            p.update_rule_file()
+        is_success, message = batch.result
+        if not is_success:
             return Response(data={"code": 1,
-                                  "message": f"删除指标规则时，更新配置文件失败"})
-        ok = p.reload_prometheus()
-        if not ok:
-            return Response(data={"code": 1,
-                                  "message": "prometheus 重载规则失败，请手动重启prometheus进行重载"})
-
+                                  "message": f"批量修改指标规则时，更新配置文件失败: {message}"})
         return Response()
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+# Project: action_orchestrator
+# Create time: 2022-03-18
+# Introduction:
+
+"""
+服务启停编排
+根据服务依赖关系及同一主机上的 BASIC_ORDER 排序确定执行顺序，
+同一轮就绪的服务按主机合并为一次 salt 调用，
+执行命令后轮询 monitor_agent 获取真实状态确认完成，
+服务的全部依赖就绪后立即执行，不再等待整层服务完成；
+编排状态为可序列化的字典，等待期间由 celery 延时任务继续执行，不占用 worker
+"""
+
+import re
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from db_models.models import ApplicationHub, Service, ServiceHistory
+from utils.parse_config import (
+    BASIC_ORDER, SERVICE_ACTION, THREAD_POOL_MAX_WORKERS
+)
+from utils.plugin.monitor_agent_client import monitor_agent_client
+from utils.plugin.salt_client import SaltClient
+
+logger = logging.getLogger("server")
+
+# 执行命令后首次查询服务状态的间隔，单位秒
+POLL_INTERVAL = SERVICE_ACTION.get("poll_interval", 2)
+# 服务状态查询最大间隔，单位秒
+MAX_POLL_INTERVAL = SERVICE_ACTION.get("max_poll_interval", 15)
+# 等待服务状态就绪的超时时间，单位秒
+ACTION_TIMEOUT = SERVICE_ACTION.get("timeout", 120)
+# salt 命令超时时间，单位秒
+SALT_TIMEOUT = 600
+# 合并执行时每个服务命令返回码的标记
+RC_MARKER = "omp_action_rc_"
+
+# 页面动作编号
+ACTION_NAMES = {"1": "start", "2": "stop", "3": "restart"}
+# 动作对应的服务状态: (执行中, 成功, 失败)
+ACTION_STATUS = {
+    "start": (Service.SERVICE_STATUS_STARTING,
+              Service.SERVICE_STATUS_NORMAL, Service.SERVICE_STATUS_STOP),
+    "stop": (Service.SERVICE_STATUS_STOPPING,
+             Service.SERVICE_STATUS_STOP, Service.SERVICE_STATUS_NORMAL),
+    "restart": (Service.SERVICE_STATUS_RESTARTING,
+                Service.SERVICE_STATUS_NORMAL, Service.SERVICE_STATUS_STOP),
+}
+# 各阶段的目标状态，monitor_agent 返回 1 为运行
+PHASE_TARGET = {"start": 1, "stop": 0, "restart": 1}
+
+NODE_PENDING = "pending"
+NODE_WAITING = "waiting"
+NODE_DONE = "done"
+NODE_FAILED = "failed"
+NODE_FINISHED = (NODE_DONE, NODE_FAILED)
+
+
+def get_rank(service):
+    """
+    同一主机上的启动顺序，基础组件按 BASIC_ORDER 排序，
+    其余组件其次，自研服务最后
+    """
+    app = service.service
+    for i in range(10):
+        if i not in BASIC_ORDER:
+            break
+        if app.app_name in BASIC_ORDER[i]:
+            return i
+    if app.app_type == ApplicationHub.APP_TYPE_SERVICE:
+        return len(BASIC_ORDER) + 1
+    return len(BASIC_ORDER)
+
+
+class ServiceActionOrchestrator(object):
+    """ 服务启停编排器 """
+
+    def __init__(self, plan):
+        """
+        :param plan: create 生成的编排状态
+        """
+        self.plan = plan
+        self.nodes = plan["nodes"]
+
+    @classmethod
+    def create(cls, action, service_ids, username):
+        """
+        生成编排状态，并将服务置为执行中状态
+        :param action: start/stop/restart 或页面动作编号
+        :param service_ids: 服务实例 id 列表
+        :param username: 操作用户
+        :return: ServiceActionOrchestrator，无可执行的服务时为 None
+        """
+        action = ACTION_NAMES.get(str(action), action)
+        if action not in ACTION_STATUS:
+            raise ValueError("action动作不合法")
+        service_ls = list()
+        controllers_dic = dict()
+        for service in Service.objects.filter(
+                id__in=service_ids).select_related("service", "cluster"):
+            controllers = cls.get_controllers(service, action)
+            if not controllers:
+                logger.error(f"{service.service_instance_name}无{action}动作")
+                continue
+            service_ls.append(service)
+            controllers_dic[service.id] = controllers
+        if not service_ls:
+            return None
+        # 重启时存在需要先停止再启动的服务则分两个阶段执行，
+        # 使用 restart 命令的服务不执行停止阶段，在启动阶段执行 restart 命令
+        phases = [action]
+        if any("stop" in controllers and action == "restart"
+               for controllers in controllers_dic.values()):
+            phases = ["stop", "start"]
+            for controllers in controllers_dic.values():
+                if "restart" in controllers:
+                    controllers["start"] = controllers.pop("restart")
+
+        nodes = {
+            str(service.id): {
+                "ip": service.ip,
+                "name": service.service_instance_name,
+                "controllers": controllers_dic[service.id],
+                "depends": sorted(cls.get_depends(service, service_ls)),
+                "state": NODE_PENDING,
+                "deadline": None,
+            } for service in service_ls
+        }
+        Service.objects.filter(id__in=[
+            service.id for service in service_ls
+        ]).update(service_status=ACTION_STATUS[action][0])
+        return cls({
+            "action": action,
+            "phases": phases,
+            "phase": 0,
+            "username": username,
+            "interval": POLL_INTERVAL,
+            "nodes": nodes,
+        })
+
+    @staticmethod
+    def get_controllers(service, action):
+        """
+        服务执行动作所用的命令
+        重启优先使用服务的 restart 命令，没有时需同时具有 stop 及 start 命令
+        :return: {阶段: 命令}，无法执行时为 None
+        """
+        controllers = service.service_controllers or {}
+        if action != "restart" or controllers.get("restart"):
+            if not controllers.get(action):
+                return None
+            return {action: controllers[action]}
+        if controllers.get("stop") and controllers.get("start"):
+            return {"stop": controllers["stop"], "start": controllers["start"]}
+        return None
+
+    @staticmethod
+    def get_depends(service, service_ls):
+        """
+        服务启动前需要就绪的服务，包含声明的依赖关系及同一主机上排序靠前的服务
+        :return: 服务实例 id 集合
+        """
+        depends = set()
+        for dep in json.loads(service.service_dependence or "[]"):
+            for other in service_ls:
+                if dep.get("instance_name"):
+                    matched = \
+                        other.service_instance_name == dep["instance_name"]
+                elif dep.get("cluster_name"):
+                    matched = other.cluster is not None and \
+                        other.cluster.cluster_name == dep["cluster_name"]
+                else:
+                    matched = other.service.app_name == dep.get("name")
+                if matched:
+                    depends.add(str(other.id))
+        # 同一主机上仅依赖排序紧邻的上一级，更靠前的服务由上一级间接保证
+        rank = get_rank(service)
+        lower_ranks = {
+            get_rank(other) for other in service_ls
+            if other.ip == service.ip and get_rank(other) < rank
+        }
+        if lower_ranks:
+            prev_rank = max(lower_ranks)
+            depends.update(
+                str(other.id) for other in service_ls
+                if other.ip == service.ip and get_rank(other) == prev_rank)
+        depends.discard(str(service.id))
+        return depends
+
+    @property
+    def phase(self):
+        return self.plan["phases"][self.plan["phase"]]
+
+    @property
+    def is_last_phase(self):
+        return self.plan["phase"] == len(self.plan["phases"]) - 1
+
+    def phase_depends(self, node_id):
+        """ 当前阶段需要先完成的服务，停止时依赖关系反向 """
+        if self.phase != "stop":
+            return self.nodes[node_id]["depends"]
+        return [
+            other_id for other_id, node in self.nodes.items()
+            if node_id in node["depends"]
+        ]
+
+    def finish_node(self, node_id, is_success, message=""):
+        """ 服务完成当前阶段，最后阶段完成时更新服务状态及操作记录 """
+        node = self.nodes[node_id]
+        node["state"] = NODE_DONE if is_success else NODE_FAILED
+        logger.info(
+            f"服务{node['name']}执行 [{self.phase}] "
+            f"{'成功' if is_success else '失败'} {message}")
+        if not self.is_last_phase:
+            return
+        action = self.plan["action"]
+        Service.objects.filter(id=int(node_id)).update(
+            service_status=ACTION_STATUS[action][1 if is_success else 2])
+        ServiceHistory.objects.create(
+            username=self.plan["username"],
+            description=f"执行 [{action}] 操作",
+            result="success" if is_success else "failure",
+            created=time.strftime("%Y-%m-%d %H:%M:%S"),
+            service_id=int(node_id)
+        )
+
+    def ready_nodes(self):
+        """
+        依赖已完成的待执行服务，启动阶段依赖失败的服务直接失败
+        :return: 服务实例 id 列表
+        """
+        changed = True
+        while changed:
+            changed = False
+            ready = list()
+            for node_id, node in self.nodes.items():
+                if node["state"] != NODE_PENDING:
+                    continue
+                depends = [
+                    self.nodes[dep_id] for dep_id in
+                    self.phase_depends(node_id) if dep_id in self.nodes
+                ]
+                if any(dep["state"] not in NODE_FINISHED for dep in depends):
+                    continue
+                failed = [
+                    dep["name"] for dep in depends
+                    if dep["state"] == NODE_FAILED]
+                if failed and self.phase == "start":
+                    self.finish_node(
+                        node_id, False, f"依赖服务{','.join(failed)}未就绪")
+                    changed = True
+                    continue
+                ready.append(node_id)
+        if ready:
+            return ready
+        states = [node["state"] for node in self.nodes.values()]
+        if NODE_PENDING in states and NODE_WAITING not in states:
+            # 存在循环依赖时剩余服务一起执行
+            logger.warning("服务依赖关系存在循环，剩余服务同时执行")
+            return [
+                node_id for node_id, node in self.nodes.items()
+                if node["state"] == NODE_PENDING
+            ]
+        return ready
+
+    def execute(self, ip, node_ids):
+        """
+        合并执行同一主机上的服务命令
+        :return: {node_id: 是否成功}
+        """
+        command = "; ".join(
+            f"( {self.nodes[node_id]['controllers'][self.phase]} ); "
+            f"echo {RC_MARKER}{node_id}=$?"
+            for node_id in node_ids
+        )
+        is_success, info = SaltClient().cmd(ip, command, SALT_TIMEOUT)
+        logger.info(f"执行 [{self.phase}] {ip}: {is_success} {info}")
+        rc_dic = dict(re.findall(
+            rf"{RC_MARKER}(\d+)=(\d+)", info if isinstance(info, str) else ""))
+        return {
+            node_id: rc_dic[node_id] == "0" if node_id in rc_dic
+            else bool(is_success)
+            for node_id in node_ids
+        }
+
+    def dispatch(self):
+        """
+        执行依赖已完成的服务，每台主机一次 salt 调用
+        :return: 是否有服务状态变化
+        """
+        ready = self.ready_nodes()
+        if not ready:
+            return False
+        host_dic = dict()
+        for node_id in ready:
+            node = self.nodes[node_id]
+            if not node["controllers"].get(self.phase):
+                self.finish_node(node_id, True, "无该动作命令，跳过")
+                continue
+            host_dic.setdefault(node["ip"], list()).append(node_id)
+        if not host_dic:
+            return True
+        with ThreadPoolExecutor(
+                min(THREAD_POOL_MAX_WORKERS, len(host_dic))) as executor:
+            result_ls = list(executor.map(
+                lambda item: self.execute(*item), host_dic.items()))
+        deadline = time.time() + ACTION_TIMEOUT
+        for result in result_ls:
+            for node_id, is_success in result.items():
+                if not is_success:
+                    self.finish_node(node_id, False, "命令执行失败")
+                    continue
+                self.nodes[node_id]["state"] = NODE_WAITING
+                self.nodes[node_id]["deadline"] = deadline
+        return True
+
+    def poll(self):
+        """
+        查询已执行命令的服务状态
+        无法获取状态的服务以命令执行结果为准
+        :return: 是否有服务完成
+        """
+        waiting = [
+            node_id for node_id, node in self.nodes.items()
+            if node["state"] == NODE_WAITING
+        ]
+        if not waiting:
+            return False
+        request_ls = list()
+        for node_id in waiting:
+            item = {
+                "ip": self.nodes[node_id]["ip"],
+                "service_name": self.nodes[node_id]["name"].split("-")[0]
+            }
+            if item not in request_ls:
+                request_ls.append(item)
+        beans, _ = monitor_agent_client.service_status(
+            request_ls, cache_ttl=0)
+        status_dic = {
+            (bean.get("ip"), bean.get("service_name")): bean.get("status")
+            for bean in beans if bean.get("status") in (0, 1)
+        }
+        target = PHASE_TARGET[self.phase]
+        finished = False
+        for node_id in waiting:
+            node = self.nodes[node_id]
+            status = status_dic.get((node["ip"], node["name"].split("-")[0]))
+            if status is None:
+                self.finish_node(node_id, True, "未获取到服务状态")
+            elif status == target:
+                self.finish_node(node_id, True)
+            elif time.time() > node["deadline"]:
+                self.finish_node(node_id, False, "等待服务状态超时")
+            else:
+                continue
+            finished = True
+        return finished
+
+    def next_phase(self):
+        """ 进入下一阶段，全部服务重新执行 """
+        if self.is_last_phase:
+            return False
+        self.plan["phase"] += 1
+        for node in self.nodes.values():
+            node["state"] = NODE_PENDING
+            node["deadline"] = None
+        return True
+
+    def step(self):
+        """
+        执行一轮编排
+        :return: 下一轮的等待时间，全部完成时为 None
+        """
+        progressed = self.poll()
+        while True:
+            changed = self.dispatch()
+            progressed = changed or progressed
+            states = {node["state"] for node in self.nodes.values()}
+            if states - set(NODE_FINISHED):
+                # 本轮服务均已直接完成时继续执行后续服务
+                if changed and NODE_WAITING not in states:
+                    continue
+                break
+            if not self.next_phase():
+                return None
+            progressed = True
+        if progressed:
+            self.plan["interval"] = POLL_INTERVAL
+        else:
+            self.plan["interval"] = min(
+                self.plan["interval"] * 2, MAX_POLL_INTERVAL)
+        return self.plan["interval"]
+
+    def run(self):
+        """
+        阻塞执行至全部完成，用于命令行脚本
+        :return: {服务实例名: 是否成功}
+        """
+        while True:
+            countdown = self.step()
+            if countdown is None:
+                break
+            time.sleep(countdown)
+        return self.result()
+
+    def result(self):
+        return {
+            node["name"]: node["state"] == NODE_DONE
+            for node in self.nodes.values()
+        }
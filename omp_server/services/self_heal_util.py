@@ -1,42 +1,53 @@
 import logging
-import requests
-import json
-from utils.parse_config import MONITOR_PORT
-from promemonitor.prometheus_utils import CW_TOKEN
+
+from utils.plugin.monitor_agent_client import monitor_agent_client
 
 
 logger = logging.getLogger("server")
 
 
-def get_service_status_direct(service_obj_list):
+def get_service_status_direct(service_obj_list, cache_ttl=0):
     """
     直接从monitor_agent获取服务状态
     param: [{"ip": "127.0.0.1", "service_name": "mysql"}, {"ip": "127.0.0.1", "service_name": "redis"}]
+    param: cache_ttl 状态缓存时间，默认实时查询
+    请求失败主机上的服务原样返回，不带状态
     """
-    service_obj_result = list()
-    monitor_agent_port = MONITOR_PORT.get('monitorAgent', 19031)
-    headers = {"Content-Type": "application/json"}.update(CW_TOKEN)
-    ip_item_list = list()
-    ip_list = list()
-    for ele in service_obj_list:
-        ip_list.append(ele.get("ip"))
-    ip_list = list(set(ip_list))
-    for ip in ip_list:
-        ip_service_list = list()
-        for item in service_obj_list:
-            if ip == item.get("ip"):
-                ip_service_list.append(item)
-        ip_item_list.append(ip_service_list)
+    service_obj_result, failed_hosts = monitor_agent_client.service_status(
+        service_obj_list, cache_ttl=cache_ttl)
+    if failed_hosts:
+        logger.error(f"获取制定服务列表状态失败，主机为：{failed_hosts}")
+        service_obj_result.extend(
+            item for item in service_obj_list
+            if item.get("ip") in failed_hosts)
+    return service_obj_result
+
 
-    try:
-        for ii in ip_item_list:
-            status_url = f"http://{ii[0].get('ip')}:{monitor_agent_port}/service_status"  # NOQA
-            response = requests.request(
-                "POST", status_url, headers=headers, data=json.dumps(ii))
-            if response.status_code != 200:
-                continue
-            service_obj_result.extend(response.json().get("beans"))
-        return service_obj_result
-    except Exception as e:
-        logger.error(f"获取制定服务列表状态失败，详情为：{e}")
-        return service_obj_list
+def get_service_status_dict(service_ls):
+    """
+    从monitor_agent获取服务状态，格式与 Prometheus.get_all_service_status 一致
+    param: [("127.0.0.1", "mysql-1-1")] 主机ip及服务实例名
+    return: (是否成功, {"127.0.0.1_mysql-1-1": True})
+    """
+    request_ls = list()
+    instance_dic = dict()
+    for ip, instance_name in service_ls:
+        service_name = instance_name.split("-")[0]
+        key = (ip, service_name)
+        if key not in instance_dic:
+            request_ls.append({"ip": ip, "service_name": service_name})
+        instance_dic.setdefault(key, list()).append(instance_name)
+    if not request_ls:
+        return False, {}
+    beans, failed_hosts = monitor_agent_client.service_status(request_ls)
+    host_count = len({item.get("ip") for item in request_ls})
+    if len(failed_hosts) >= host_count:
+        return False, {}
+    status_dic = dict()
+    for bean in beans:
+        if bean.get("status") not in (0, 1):
+            continue
+        key = (bean.get("ip"), bean.get("service_name"))
+        for instance_name in instance_dic.get(key, list()):
+            status_dic[f"{key[0]}_{instance_name}"] = bean.get("status") == 1
+    return True, status_dic
@@ -1,21 +1,46 @@
+"""
+服务自愈
+告警触发后生成自愈记录，自愈记录按 等待重启 -> 重启中 -> 等待校验 的步骤流转：
+重启按全局及单主机并发数限制并发下发，重启后通过 celery countdown 延时校验，
+校验按主机批量向 monitor_agent 查询服务状态，未恢复且未达到最多自愈次数时重新等待重启，
+任务中不再等待服务启动
+"""
 import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import redis
+from celery import shared_task
+from django.db.models import F
+from redis.exceptions import LockError
 from db_models.models import Service
 from db_models.models import SelfHealingSetting
 from db_models.models import SelfHealingHistory
 from db_models.models import Alert
 from db_models.models import Host
 from db_models.models import GrafanaMainPage
+from promemonitor.dashboard import REDIS_POOL
+from services.self_heal_util import get_service_status_direct
 from utils.plugin.salt_client import SaltClient
 from utils.plugin.crypto import AESCryptor
-logger = logging.getLogger('server')
-from celery import shared_task
-import time
-import paramiko
+from utils.parse_config import SELF_HEALING
 import sys
-import requests
-import json
-from utils.parse_config import MONITOR_PORT
-from promemonitor.prometheus_utils import CW_TOKEN
+import paramiko
+logger = logging.getLogger('server')
+
+# 同时重启的服务数
+MAX_CONCURRENT = SELF_HEALING.get("max_concurrent", 10)
+# 单主机同时重启的服务数
+MAX_PER_HOST = SELF_HEALING.get("max_per_host", 2)
+# 重启后校验服务状态的等待时间，单位秒
+VERIFY_DELAY = SELF_HEALING.get("verify_delay", 50)
+# 重启超过该时间未完成时重新调度，单位秒
+STEP_TIMEOUT = SELF_HEALING.get("step_timeout", 300)
+# 调度锁，串行统计并发数及认领自愈记录
+DISPATCH_LOCK_KEY = "omp:self_healing:dispatch"
+DISPATCH_LOCK_TIMEOUT = 30
+
+
 @shared_task
 def self_healing(alert_list):
     """ 添加数据入库校验逻辑 添加定时任务"""
@@ -23,7 +48,6 @@ def self_healing(alert_list):
     logger.info("传入id 信息{}".format(alert_list))
     user_healing = SelfHealingSetting.objects.all().values_list("used", "max_healing_count", "env_id")
     healing_mode = user_healing[0][0]
-    max_healing_count = user_healing[0][1]
     env_id = user_healing[0][2]
     host_service_healing = 'monitor_agent进程丢失'
     sudo_check_cmd = "bash /data/omp_monitor_agent/monitor_agent.sh start"
@@ -31,12 +55,7 @@ def self_healing(alert_list):
     grafana_url_log = (grafana_url[0].get("instance_url"))
     # 监控服务集合
     instance_name_list = []
-    # 服务查看时间间隔
-    self_healing_interval=50
-    # 循环自愈服务间隔
-    loop_interval=5
     if len(alert_list) >= 1 and healing_mode == 1:
-        time.sleep(loop_interval)
         for i in range(len(alert_list)):
             host_alert_time = alert_list[i].alert_time
             if alert_list[i].alert_type == 'service':
@@ -70,6 +89,7 @@ def self_healing(alert_list):
                                 service_en_type=0,
                                 instance_name=alert_list[i].alert_instance_name,
                                 start_time=alert_list[i].create_time,
+                                next_run_time=datetime.now(),
                                 healing_log=res_dist,
                                 alert_content=alert_list[i].alert_describe)
                         except Exception as e:
@@ -96,6 +116,7 @@ def self_healing(alert_list):
                     req_monitor_agent.append(req_monitor_agent_[0])
                     logger.info("monitor_agent_res_请求数据类型{} 请求数据内容"
                                 "".format(type(req_monitor_agent),req_monitor_agent))
+                    monitor_agent_res_batch = [{}]
                     try:
                         monitor_agent_res_batch = get_service_status_direct(req_monitor_agent)
                     except Exception as e:
@@ -131,7 +152,8 @@ def self_healing(alert_list):
                                             healing_log=res_dist,
                                             alert_content=alert_list[i].alert_describe,
                                             monitor_log=grafana_url_log+"?var-app={}".format(w[2].split('-')[0]),
-                                            start_time=host_alert_time)
+                                            start_time=host_alert_time,
+                                            next_run_time=datetime.now())
                                 except Exception as e:
                                     logger.info("host_step_6 服务级别入库失败,报错信息".format(e))
                                     return False
@@ -139,77 +161,10 @@ def self_healing(alert_list):
                 if ssh_res[0]==False:
                     logger.info("host_step_2 主机ssh 校验失败退出")
                     break
-        history_queryset = SelfHealingHistory.objects.filter(
-            instance_name__in=instance_name_list, state=2).values("id","healing_log").order_by( "id")
-        logger.info("self_healing_0 需要自愈对象集合 {}".format(history_queryset))
-        if len(history_queryset) > 0:
-            logger.info("self_healing_1 进入自愈逻辑 {}".format(len(history_queryset)))
-            service_replace_list_0 = []
-            for z in history_queryset:
-                healing_dist = {}
-                healing_dist['ip'] = z.get("healing_log").get("ip")
-                healing_dist['start'] = z.get("healing_log").get("start")
-                healing_dist['id'] = z.get("id")
-                healing_dist['service_name'] = z.get("healing_log").get("service_instance_name")
-                service_replace_list_0.append(healing_dist)
-            logger.info("self_healing_2 需要自愈服务列表: {}".format(service_replace_list_0))
-            salt_client = SaltClient()
-            count = 0
-            while (count < max_healing_count):  # 变量
-                logger.info("self_healing_3 进入循环自愈流程")
-                count = count + 1
-                logger.info("self_healing_4  第{}次自愈输出列表{},列表长度为:{}".format(
-                    count, service_replace_list_0, len(service_replace_list_0)))
-                """ 需要修改"""
-                for k in range(len(service_replace_list_0)):
-                    cmd_flag, cmd_msg = salt_client.cmd(
-                        target=service_replace_list_0[k].get("ip"),
-                        command=service_replace_list_0[k].get("start").replace("start","restart"),
-                        timeout=60)
-                    logger.info("self_healing_5 循环自愈服务IP: {}".format(service_replace_list_0[k].get("ip")))
-                    logger.info("self_healing_5 循环自愈服务start :{}".format(service_replace_list_0[k].get("start")))
-                    logger.info("self_healing_5 自愈执行返回状态码:{}".format(cmd_flag))
-                    logger.info("self_healing_5 自愈执行返回结果:{}".format(cmd_msg))
-                    if cmd_flag == True:  # 重试逻辑
-                        """ 查看服务状态   """
-                        time.sleep(self_healing_interval)
-                        loop_request_monitor_agent = []
-                        req_dist = {}
-                        req_dist['ip'] = service_replace_list_0[k].get("ip")
-                        req_dist['service_name'] = service_replace_list_0[k].get("service_name")
-                        loop_request_monitor_agent.append(req_dist)
-                        logger.info("loop_0 第{}次自愈,服务自愈过程-服务状态查看请求数据: {}"
-                                    "".format(count, loop_request_monitor_agent))
-                        try:
-                            monitor_agent_res=get_service_status_direct(loop_request_monitor_agent)
-                        except Exception as e:
-                            logger.info("monitor_agent_res_error 监控报错信息{}".format(e))
-                            break
-                        logger.info("monitor_agent_res 监控返回数据{},数据类型{}"
-                                    "".format(monitor_agent_res, type(monitor_agent_res)))
-                        if monitor_agent_res[0].get("status")==1:
-                            logger.info("monitor_agent_res 服务状态查看正常更新服务状态")
-                            SelfHealingHistory.objects.filter(
-                                id=service_replace_list_0[k].get("id")).update(
-                                state=1, healing_count=count,end_time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
-                            service_replace_list_0.remove(service_replace_list_0[k])
-                            break
-                    if cmd_flag == False:
-                        SelfHealingHistory.objects.filter(
-                            id=service_replace_list_0[k].get("id")) \
-                            .update(healing_count=count,state=0,
-                                    end_time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
-                        service_replace_list_0.remove(service_replace_list_0[k])
-                        break
-                    if len(service_replace_list_0)==0:
-                        break
-            logger.info("self_healing_4 到达循环条件之后仍未自愈服务 : {}".format(service_replace_list_0))
-            if len(service_replace_list_0)!=0:
-                for k1 in range(len(service_replace_list_0)):
-                    SelfHealingHistory.objects.filter(
-                        id=service_replace_list_0[k].get("id")).update(
-                        state=0, healing_count=max_healing_count,
-                        end_time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
+        # 下发重启，重启及校验在各自的异步任务中完成
+        dispatch_self_healing()
+
+
 def self_healing_ssh_verification(host_self_healing_list,sudo_check_cmd):
     host_self_healing_list=host_self_healing_list
     aes_crypto = AESCryptor()
@@ -246,39 +201,153 @@ def self_healing_ssh_verification(host_self_healing_list,sudo_check_cmd):
     return True,2
     transport.close()
 
-def get_service_status_direct(service_obj_list):
+
+def get_max_healing_count():
+    """ 最多自愈次数 """
+    return SelfHealingSetting.objects.values_list(
+        "max_healing_count", flat=True).first() or 5
+
+
+@shared_task
+def dispatch_self_healing():
     """
-    直接从monitor_agent获取服务状态
-    param: [{"ip": "127.0.0.1", "service_name": "mysql"}, {"ip": "127.0.0.1", "service_name": "redis"}]
+    按并发限制下发等待重启的自愈记录，定时执行以恢复丢失的重启、校验任务
+    并发数统计与认领在同一把锁内完成，多个调度任务同时执行时不会超出并发限制
+    :return:
     """
-    service_obj_result = list()
-    monitor_agent_port = MONITOR_PORT.get('monitorAgent', 19031)
-    headers_type = {"Content-Type": "application/json"}
-    headers_authentication = CW_TOKEN
-    headers = dict(headers_type, **headers_authentication)
-    ip_item_list = list()
-    ip_list = list()
-    for ele in service_obj_list:
-        ip_list.append(ele.get("ip"))
-    ip_list = list(set(ip_list))
-    for ip in ip_list:
-        ip_service_list = list()
-        for item in service_obj_list:
-            if ip == item.get("ip"):
-                ip_service_list.append(item)
-        ip_item_list.append(ip_service_list)
+    conn = redis.Redis(connection_pool=REDIS_POOL)
     try:
-        for ii in ip_item_list:
-            status_url = f"http://{ii[0].get('ip')}:{monitor_agent_port}/service_status"  # NOQA
-            response = requests.request(
-                "POST", status_url, headers=headers, data=json.dumps(ii))
-            logger.info("interface_monitor_agent监控接口返回数据:{}".format(response))
-            logger.info("interface_monitor_agent请求地址 {}".format(status_url))
-            if response.status_code != 200:
-                continue
-            logger.info("interface_monitor_agent 接口返回:{}".format(response.json()))
-            service_obj_result.extend(response.json().get("beans"))
-        return service_obj_result
-    except Exception as e:
-        logger.error(f"interface_monitor_agent 获取制定服务列表状态失败，详情为：{e}")
-        return service_obj_list
\ No newline at end of file
+        with conn.lock(DISPATCH_LOCK_KEY, timeout=DISPATCH_LOCK_TIMEOUT,
+                       blocking_timeout=DISPATCH_LOCK_TIMEOUT):
+            _dispatch_self_healing()
+    except LockError:
+        logger.warning("自愈调度等待锁超时，等待下次调度")
+
+
+def _dispatch_self_healing():
+    now = datetime.now()
+    healing_queryset = SelfHealingHistory.objects.filter(
+        state=SelfHealingHistory.HEALING_ING)
+    # 重启超时的记录重新等待重启
+    healing_queryset.filter(
+        healing_step=SelfHealingHistory.STEP_RESTARTING,
+        next_run_time__lt=now
+    ).update(healing_step=SelfHealingHistory.STEP_PENDING)
+    if healing_queryset.filter(
+            healing_step=SelfHealingHistory.STEP_VERIFYING,
+            next_run_time__lte=now).exists():
+        verify_self_healing.delay()
+
+    host_count = Counter(healing_queryset.filter(
+        healing_step=SelfHealingHistory.STEP_RESTARTING
+    ).values_list("host_ip", flat=True))
+    slots = MAX_CONCURRENT - sum(host_count.values())
+    if slots <= 0:
+        return
+    pending_queryset = healing_queryset.filter(
+        healing_step=SelfHealingHistory.STEP_PENDING,
+        next_run_time__lte=now
+    ).order_by("next_run_time", "id").values_list("id", "host_ip")
+    for history_id, host_ip in pending_queryset:
+        if slots <= 0:
+            break
+        if host_count[host_ip] >= MAX_PER_HOST:
+            continue
+        # 条件更新认领记录，避免并发调度时重复下发
+        claimed = SelfHealingHistory.objects.filter(
+            id=history_id,
+            state=SelfHealingHistory.HEALING_ING,
+            healing_step=SelfHealingHistory.STEP_PENDING
+        ).update(
+            healing_step=SelfHealingHistory.STEP_RESTARTING,
+            healing_count=F("healing_count") + 1,
+            next_run_time=now + timedelta(seconds=STEP_TIMEOUT))
+        if not claimed:
+            continue
+        host_count[host_ip] += 1
+        slots -= 1
+        restart_self_healing.delay(history_id)
+
+
+@shared_task
+def restart_self_healing(history_id):
+    """
+    重启服务，成功后延时校验服务状态
+    :param history_id: 自愈记录 id
+    :return:
+    """
+    history_obj = SelfHealingHistory.objects.filter(
+        id=history_id,
+        state=SelfHealingHistory.HEALING_ING,
+        healing_step=SelfHealingHistory.STEP_RESTARTING
+    ).first()
+    if history_obj is None:
+        return
+    healing_log = history_obj.healing_log
+    cmd_flag, cmd_msg = SaltClient().cmd(
+        target=healing_log.get("ip"),
+        command=(healing_log.get("start") or "").replace("start", "restart"),
+        timeout=60)
+    logger.info(
+        f"第{history_obj.healing_count}次自愈 {healing_log.get('ip')} "
+        f"{history_obj.instance_name}, 执行结果: {cmd_flag}, {cmd_msg}")
+    queryset = SelfHealingHistory.objects.filter(
+        id=history_id, state=SelfHealingHistory.HEALING_ING,
+        healing_step=SelfHealingHistory.STEP_RESTARTING)
+    if cmd_flag:
+        queryset.update(
+            healing_step=SelfHealingHistory.STEP_VERIFYING,
+            next_run_time=datetime.now() + timedelta(seconds=VERIFY_DELAY))
+        verify_self_healing.apply_async(countdown=VERIFY_DELAY + 1)
+    else:
+        queryset.update(
+            state=SelfHealingHistory.HEALING_FAIL, end_time=datetime.now())
+    # 释放并发数后继续下发
+    dispatch_self_healing.delay()
+
+
+@shared_task
+def verify_self_healing():
+    """
+    校验已到校验时间的自愈记录，同一主机的服务一次请求 monitor_agent
+    :return:
+    """
+    now = datetime.now()
+    history_ls = list(SelfHealingHistory.objects.filter(
+        state=SelfHealingHistory.HEALING_ING,
+        healing_step=SelfHealingHistory.STEP_VERIFYING,
+        next_run_time__lte=now
+    ).values("id", "healing_count", "healing_log"))
+    if not history_ls:
+        return
+    request_ls = list()
+    for item in history_ls:
+        request_dic = {
+            "ip": item["healing_log"].get("ip"),
+            "service_name": item["healing_log"].get("service_instance_name")
+        }
+        if request_dic not in request_ls:
+            request_ls.append(request_dic)
+    status_dic = {
+        (item.get("ip"), item.get("service_name")): item.get("status")
+        for item in get_service_status_direct(request_ls)
+    }
+    max_healing_count = get_max_healing_count()
+    for item in history_ls:
+        status = status_dic.get((
+            item["healing_log"].get("ip"),
+            item["healing_log"].get("service_instance_name")))
+        queryset = SelfHealingHistory.objects.filter(
+            id=item["id"], state=SelfHealingHistory.HEALING_ING,
+            healing_step=SelfHealingHistory.STEP_VERIFYING)
+        if status == 1:
+            queryset.update(
+                state=SelfHealingHistory.HEALING_SUCCESS, end_time=now)
+        elif item["healing_count"] >= max_healing_count:
+            queryset.update(
+                state=SelfHealingHistory.HEALING_FAIL, end_time=now)
+        else:
+            queryset.update(
+                healing_step=SelfHealingHistory.STEP_PENDING,
+                next_run_time=now)
+    dispatch_self_healing.delay()
@@ -18,6 +18,7 @@ from db_models.models import (
 )
 from django.db.models import F
 from django.db import transaction
+from services.action_orchestrator import ServiceActionOrchestrator
 
 # 屏蔽celery任务日志中的paramiko日志
 logging.getLogger("paramiko").setLevel(logging.WARNING)
@@ -100,10 +101,6 @@ def exec_action(action, instance, operation_user, del_file=False, need_sleep=Tru
         "3": ["restart", 3, 0, 4],
         "4": ["delete", 4]
     }
-    result_json = {
-        True: "success",
-        False: "failure"
-    }
     try:
         service_obj = Service.objects.get(id=instance)
     except Exception as e:
@@ -173,29 +170,41 @@ def exec_action(action, instance, operation_user, del_file=False, need_sleep=Tru
                 ).delete()
         return None
 
-    exe_action = service_controllers.get(action[0])
-    if exe_action:
-        salt_obj = SaltClient()
-        service_obj.service_status = action[1]
-        service_obj.save()
-        time_array = time.localtime(int(time.time()))
-        time_style = time.strftime("%Y-%m-%d %H:%M:%S", time_array)
-        is_success, info = salt_obj.cmd(ip, exe_action, 600)
-        # TODO 服务状态维护问题，临时解决方案，休眠保持中间态
-        if need_sleep:
-            time.sleep(35)
-        service_obj.service_status = action[2] if is_success else action[3]
-        service_obj.save()
-        logger.info(f"执行 [{action[0]}] 操作 {is_success}，原因: {info}")
-        ServiceHistory.objects.create(
-            username=operation_user,
-            description=f"执行 [{action[0]}] 操作",
-            result=result_json.get(is_success),
-            created=time_style,
-            service=service_obj
-        )
-        logger.info(f"服务操作详情:{info}")
-        return ip, info
-    else:
+    # 执行后轮询服务真实状态确认完成，need_sleep 不再使用
+    orchestrator = ServiceActionOrchestrator.create(
+        action[0], [service_obj.id], operation_user)
+    if orchestrator is None:
         logger.error(f"数据库无{action[0]}动作")
         raise ValueError(f"数据库无{action[0]}动作")
+    result = orchestrator.run()
+    logger.info(f"执行 [{action[0]}] 操作结果: {result}")
+    return ip, result
+
+
+def start_service_action(action, service_ids, operation_user):
+    """
+    批量启停服务，按依赖关系编排执行
+    :param action: start/stop/restart 或页面动作编号
+    :param service_ids: 服务实例 id 列表
+    :param operation_user: 操作用户
+    :return:
+    """
+    orchestrator = ServiceActionOrchestrator.create(
+        action, service_ids, operation_user)
+    if orchestrator is not None:
+        run_service_action.delay(orchestrator.plan)
+
+
+@shared_task
+def run_service_action(plan):
+    """
+    执行一轮服务启停编排，未完成时延时继续执行
+    :param plan: ServiceActionOrchestrator 编排状态
+    :return:
+    """
+    orchestrator = ServiceActionOrchestrator(plan)
+    countdown = orchestrator.step()
+    if countdown is None:
+        logger.info(f"服务 [{plan['action']}] 编排完成: {orchestrator.result()}")
+        return
+    run_service_action.apply_async((orchestrator.plan,), countdown=countdown)
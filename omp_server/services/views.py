@@ -12,12 +12,13 @@ from rest_framework.mixins import (
     CreateModelMixin
 )
 from rest_framework.response import Response
-from rest_framework.filters import OrderingFilter
 
 from db_models.models import Service, ApplicationHub, MainInstallHistory
 from service_upgrade.update_data_json import DataJsonUpdate
 from services.permission import GetDataJsonAuthenticated
-from services.tasks import exec_action
+from services.tasks import exec_action, start_service_action
+from services.action_orchestrator import ACTION_NAMES
+from services.self_heal_util import get_service_status_dict
 from services.services_filters import ServiceFilter
 from services.services_serializers import (
     ServiceSerializer, ServiceDetailSerializer,
@@ -28,10 +29,20 @@ from promemonitor.prometheus import Prometheus
 from promemonitor.grafana_url import explain_url
 from utils.common.exceptions import OperateError
 from utils.common.paginations import PageNumberPager
+from utils.common.filters import MetricOrderingFilter
 
 logger = logging.getLogger('server')
 
 
+def monitored_service_keys(service_ls):
+    """ 需要获取实时状态的服务的 (ip, 实例名) 列表 """
+    return [
+        (service.ip, service.service_instance_name) for service in service_ls
+        if service.service_status in (
+            Service.SERVICE_STATUS_NORMAL, Service.SERVICE_STATUS_STOP)
+    ]
+
+
 class ServiceListView(GenericViewSet, ListModelMixin):
     """
         list:
@@ -41,10 +52,10 @@ class ServiceListView(GenericViewSet, ListModelMixin):
     serializer_class = ServiceSerializer
     pagination_class = PageNumberPager
     # 过滤，排序字段
-    filter_backends = (DjangoFilterBackend, OrderingFilter)
+    filter_backends = (DjangoFilterBackend, MetricOrderingFilter)
     filter_class = ServiceFilter
     ordering_fields = ("ip", "service_instance_name")
-    # 动态排序字段
+    # 动态排序字段，基于指标快照表排序
     dynamic_fields = ("cpu_usage", "mem_usage")
     # 操作描述信息
     get_description = "查询服务列表"
@@ -80,8 +91,12 @@ class ServiceListView(GenericViewSet, ListModelMixin):
                     ing_ls.append(service)
             real_query = stop_ls + ing_ls + natural_ls + no_monitor_ls
 
-        serializer = self.get_serializer(
-            self.paginate_queryset(real_query), many=True)
+        page = self.paginate_queryset(real_query)
+        # prometheus 不可用时只从 monitor_agent 获取当前页服务的状态
+        if not is_success:
+            is_success, prometheus_dict = get_service_status_dict(
+                monitored_service_keys(page))
+        serializer = self.get_serializer(page, many=True)
         serializer_data = serializer.data
 
         # 若获取成功，则动态覆盖服务状态
@@ -107,24 +122,7 @@ class ServiceListView(GenericViewSet, ListModelMixin):
             serializer_data, is_service=True)
 
         serializer_data = prometheus_obj.get_service_info(serializer_data)
-        reverse_flag = False
-        if query_field.startswith("-"):
-            reverse_flag = True
-            query_field = query_field[1:]
-        # 若排序字段在类视图 dynamic_fields 中，则对根据动态数据进行排序
-        none_ls = list(filter(
-            lambda x: x.get(query_field) is None,
-            serializer_data))
-        exists_ls = list(filter(
-            lambda x: x.get(query_field) is not None,
-            serializer_data))
-        if query_field in self.dynamic_fields:
-            exists_ls = sorted(
-                exists_ls,
-                key=lambda x: x.get(query_field),
-                reverse=reverse_flag)
-        exists_ls.extend(none_ls)
-        return self.get_paginated_response(exists_ls)
+        return self.get_paginated_response(serializer_data)
 
 
 class ServiceDetailView(GenericViewSet, RetrieveModelMixin):
@@ -149,6 +147,8 @@ class ServiceActionView(GenericViewSet, CreateModelMixin):
 
     def create(self, request, *args, **kwargs):
         many_data = self.request.data.get('data')
+        # 启停操作按 (动作, 用户) 合并为一次编排
+        action_dic = dict()
         for data in many_data:
             action = data.get("action")
             instance = data.get("id")
@@ -173,9 +173,18 @@ class ServiceActionView(GenericViewSet, CreateModelMixin):
                     except Exception as e:
                         logger.error(f"service实例id，不存在{instance}:{e}")
                         return Response("执行异常")
-                exec_action.delay(action, instance, operation_user, del_file)
+                if str(action) == "4":
+                    exec_action.delay(
+                        action, instance, operation_user, del_file)
+                    continue
+                if str(action) not in ACTION_NAMES:
+                    raise OperateError("action动作不合法")
+                action_dic.setdefault(
+                    (str(action), operation_user), list()).append(instance)
             else:
                 raise OperateError("请输入action或id")
+        for (action, operation_user), instances in action_dic.items():
+            start_service_action(action, instances, operation_user)
         return Response("执行成功")
 
 
@@ -237,6 +246,7 @@ class ServiceStatusView(GenericViewSet, ListModelMixin):
     queryset = Service.objects.filter(
         service__is_base_env=False)
     serializer_class = ServiceStatusSerializer
+    pagination_class = PageNumberPager
     authentication_classes = ()
     permission_classes = ()
     # 操作描述信息
@@ -269,7 +279,15 @@ class ServiceStatusView(GenericViewSet, ListModelMixin):
                     ing_ls.append(service)
             real_query = stop_ls + ing_ls + natural_ls + no_monitor_ls
 
-        serializer = self.get_serializer(real_query, many=True)
+        # 传入 page 参数时分页返回，否则返回全部服务
+        is_paged = self.paginator.page_query_param in request.query_params
+        page = self.paginate_queryset(real_query) if is_paged \
+            else list(real_query)
+        # prometheus 不可用时只从 monitor_agent 获取本次返回服务的状态
+        if not is_success:
+            is_success, prometheus_dict = get_service_status_dict(
+                monitored_service_keys(page))
+        serializer = self.get_serializer(page, many=True)
         serializer_data = serializer.data
 
         # 若获取成功，则动态覆盖服务状态
@@ -284,6 +302,8 @@ class ServiceStatusView(GenericViewSet, ListModelMixin):
                     key_name = f"{service_obj.get('ip')}_{service_obj.get('service_instance_name')}"
                     status = prometheus_dict.get(key_name, None)
                     service_obj["service_status"] = status
+        if is_paged:
+            return self.get_paginated_response(serializer_data)
         return Response(serializer_data)
 
 
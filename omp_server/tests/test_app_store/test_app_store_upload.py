@@ -1,3 +1,10 @@
+import hashlib
+import io
+import json
+import shutil
+import tarfile
+import tempfile
+
 from rest_framework.reverse import reverse
 
 from db_models.models import (
@@ -10,7 +17,8 @@ from app_store.tasks import front_end_verified
 from utils.plugin import public_utils
 from app_store.tasks import (
     ExplainYml, PublicAction,
-    publish_bak_end, publish_entry,
+    publish_bak_end, publish_entry, verify_back_end_package,
+    finish_back_end_scan,
     exec_clear
 )
 from unittest.mock import patch, mock_open
@@ -171,39 +179,37 @@ class PackageUploadTest(AutoLoginTest):
             package_md5='test-md5',
             package_path="verified"
         ).save()
-
-    @mock.patch.object(public_utils, "local_cmd", return_value="")
-    @mock.patch(
-        "os.mkdir",
-        return_value=None)
-    @mock.patch(
-        "os.path.exists",
-        return_value="")
-    @mock.patch(
-        "app_store.tasks.ExplainYml.explain_yml",
-        return_value=""
-    )
-    @mock.patch(
-        "os.listdir",
-        return_value=["jenkins-2.303.2.tar.gz"]
-    )
-    @mock.patch(
-        "os.path.isfile",
-        return_value=True
-    )
-    def test_app_store_upload(self, isfile, listdir, explain, exists, mkdir, local_cmd):
-        # 正向前端发布
+        self.package_hub = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.package_hub, "front_end_verified"))
+        self.hub_patch = mock.patch(
+            "app_store.tasks.package_hub", self.package_hub)
+        self.hub_patch.start()
+
+    def tearDown(self):
+        self.hub_patch.stop()
+        shutil.rmtree(self.package_hub)
+        super(PackageUploadTest, self).tearDown()
+
+    def make_package(self, members=None, content=None):
+        """ 生成待校验的安装包，返回安装包内容 """
+        file_name = os.path.join(
+            self.package_hub, "front_end_verified",
+            "jenkins-1.0.0-test-md5.tar.gz")
+        if content is None:
+            with tarfile.open(file_name, "w:gz") as tar:
+                for name, data in members.items():
+                    tar_info = tarfile.TarInfo(name)
+                    tar_info.size = len(data)
+                    tar.addfile(tar_info, io.BytesIO(data))
+        else:
+            with open(file_name, "wb") as fp:
+                fp.write(content)
+        with open(file_name, "rb") as fp:
+            return fp.read()
+
+    def verify(self):
         upload_obj = UploadPackageHistory.objects.get(
             operation_uuid='test-uuid')
-        local_cmd.side_effect = [
-            ("test-md5 jenkins-1.0.0-test-md5.tar.gz", "", 0),
-            ("success", "", 0),
-            ("test-md6 jenkins01-1.0.0.tar.gz", "", 0)
-        ]
-        exists.side_effect = [
-            True, False, True
-        ]
-        explain.side_effect = [(True, test_product), (True, test_service)]
         front_end_verified(upload_obj.operation_uuid,
                            upload_obj.operation_user,
                            upload_obj.package_name,
@@ -211,182 +217,74 @@ class PackageUploadTest(AutoLoginTest):
                            "front_end_verified",
                            upload_obj.id)
         upload_obj.refresh_from_db()
+        return upload_obj
+
+    def test_app_store_upload(self):
+        # 正向前端发布，只解出yaml及图片，服务包md5在读取时生成
+        package = self.make_package({
+            "jenkins/jenkins.yaml": product_yml.encode("utf8"),
+            "jenkins/jenkins.svg": b"this-is-image",
+            "jenkins/jenkins/jenkins.yaml": service_yml.encode("utf8"),
+            "jenkins/jenkins-2.303.2.tar.gz": b"service-package",
+            "jenkins/docs/readme.md": b"readme",
+        })
+        upload_obj = self.verify()
         clear_file = os.path.join(
             project_dir, 'data', "middle_data-test-uuid.json")
+        with open(clear_file, "r", encoding="utf8") as fp:
+            middle_data = json.loads(fp.readline())
         os.remove(clear_file)
-        res = upload_obj.package_status
-        self.assertEqual(res, 0)
-
-    @mock.patch.object(public_utils, "local_cmd",
-                       return_value=("test-md5 jenkins-1.0.0-test-md5.tar.gz", "", 1))
-    def test_app_store_upload_md5(self, local_cmd):
-        # 反向md5校验失败
-        upload_obj = UploadPackageHistory.objects.get(
-            operation_uuid='test-uuid')
-        front_end_verified(upload_obj.operation_uuid,
-                           upload_obj.operation_user,
-                           upload_obj.package_name,
-                           "RandomStr",
-                           "front_end_verified",
-                           upload_obj.id)
-        upload_obj.refresh_from_db()
-        res = upload_obj.package_status
-        self.assertEqual(res, 1)
-
-    @mock.patch.object(public_utils, "local_cmd",
-                       return_value="")
-    @mock.patch(
-        "os.mkdir",
-        return_value=None)
-    def test_app_store_upload_tar(self, mkdir, local_cmd):
-        # 反向tar解压失败
-        upload_obj = UploadPackageHistory.objects.get(
-            operation_uuid='test-uuid')
-        local_cmd.side_effect = [
-            ("test-md5 jenkins-1.0.0-test-md5.tar.gz", "", 0),
-            ("false", "", 1)
-        ]
-        front_end_verified(upload_obj.operation_uuid,
-                           upload_obj.operation_user,
-                           upload_obj.package_name,
-                           "RandomStr",
-                           "front_end_verified",
-                           upload_obj.id)
-        upload_obj.refresh_from_db()
-        res = upload_obj.package_status
-        self.assertEqual(res, 1)
-
-    @mock.patch.object(
-        public_utils,
-        "local_cmd",
-        return_value=""
-    )
-    @mock.patch(
-        "os.path.exists",
-        return_value=False)
-    @mock.patch(
-        "os.mkdir",
-        return_value=None)
-    def test_app_store_upload_file_check(self, mkdir, exists, local_cmd):
+        self.assertEqual(upload_obj.package_status, 0)
+        self.assertEqual(
+            upload_obj.package_md5, hashlib.md5(package).hexdigest())
+        self.assertEqual(middle_data["image"], "this-is-image")
+        self.assertEqual(
+            middle_data["package_file"],
+            os.path.join(self.package_hub, "front_end_verified",
+                         upload_obj.package_name))
+        service_obj = UploadPackageHistory.objects.get(
+            package_parent=upload_obj)
+        self.assertEqual(
+            service_obj.package_name, "jenkins-2.303.2.tar.gz")
+        self.assertEqual(
+            service_obj.package_md5,
+            hashlib.md5(b"service-package").hexdigest())
+        tmp_dir = middle_data["tmp_dir"][0]
+        self.assertTrue(os.path.exists(
+            os.path.join(tmp_dir, "jenkins", "jenkins.yaml")))
+        self.assertFalse(os.path.exists(
+            os.path.join(tmp_dir, "jenkins-2.303.2.tar.gz")))
+        self.assertFalse(os.path.exists(os.path.join(tmp_dir, "docs")))
+
+    def test_app_store_upload_missing(self):
+        # 反向安装包不存在
+        upload_obj = self.verify()
+        self.assertEqual(upload_obj.package_status, 1)
+
+    def test_app_store_upload_tar(self):
+        # 反向tar解压失败，md5仍然生成
+        package = self.make_package(content=b"this-is-not-tar")
+        upload_obj = self.verify()
+        self.assertEqual(upload_obj.package_status, 1)
+        self.assertEqual(
+            upload_obj.package_md5, hashlib.md5(package).hexdigest())
+
+    def test_app_store_upload_file_check(self):
         # 产品或组建yaml文件检测文件存在
-        upload_obj = UploadPackageHistory.objects.get(
-            operation_uuid='test-uuid')
-        local_cmd.side_effect = [
-            ("test-md5 jenkins-1.0.0-test-md5.tar.gz", "", 0),
-            ("false", "", 0)
-        ]
-        front_end_verified(upload_obj.operation_uuid,
-                           upload_obj.operation_user,
-                           upload_obj.package_name,
-                           "RandomStr",
-                           "front_end_verified",
-                           upload_obj.id)
-        upload_obj.refresh_from_db()
-        res = upload_obj.package_status
-        self.assertEqual(res, 1)
+        self.make_package({"jenkins/readme.md": b"readme"})
+        upload_obj = self.verify()
+        self.assertEqual(upload_obj.package_status, 1)
+        self.assertIn("jenkins.yaml文件不存在", upload_obj.error_msg)
 
-    @mock.patch.object(
-        public_utils,
-        "local_cmd",
-        return_value=""
-    )
-    @mock.patch(
-        "os.path.exists",
-        return_value="")
-    @patch(
-        "builtins.open",
-        new_callable=mock_open,
-        read_data="this-is-image"
-    )
-    @mock.patch(
-        "app_store.tasks.ExplainYml.explain_yml",
-        return_value=(True, test_product)
-    )
-    @mock.patch(
-        "os.listdir",
-        return_value=["jenkins-2.303.2.tar.gz"]
-    )
-    @mock.patch(
-        "os.path.isfile",
-        return_value=True
-    )
-    @mock.patch(
-        "os.mkdir",
-        return_value=None)
-    def test_app_store_upload_file_service(self, mkdir, isfile, listdir, explain, image, exists, local_cmd):
+    def test_app_store_upload_file_service(self):
         # 服务yaml文件检测文件存在
-        upload_obj = UploadPackageHistory.objects.get(
-            operation_uuid='test-uuid')
-        local_cmd.side_effect = [
-            ("test-md5 jenkins-1.0.0-test-md5.tar.gz", "", 0),
-            ("false", "", 0),
-            ("false", "", 1)
-        ]
-        exists.side_effect = [
-            True, True, False
-        ]
-        front_end_verified(upload_obj.operation_uuid,
-                           upload_obj.operation_user,
-                           upload_obj.package_name,
-                           "RandomStr",
-                           "front_end_verified",
-                           upload_obj.id)
-        upload_obj.refresh_from_db()
-        res = upload_obj.package_status
-        self.assertEqual(res, 1)
-
-    @mock.patch.object(
-        public_utils,
-        "local_cmd",
-        return_value=""
-    )
-    @mock.patch(
-        "os.path.exists",
-        return_value="")
-    @patch(
-        "builtins.open",
-        new_callable=mock_open,
-        read_data="this-is-image"
-    )
-    @mock.patch(
-        "app_store.tasks.ExplainYml.explain_yml",
-        return_value=""
-    )
-    @mock.patch(
-        "os.listdir",
-        return_value=["jenkins-2.303.2.tar.gz"]
-    )
-    @mock.patch(
-        "os.path.isfile",
-        return_value=True
-    )
-    @mock.patch(
-        "os.mkdir",
-        return_value=None)
-    def test_app_store_upload_file_md5(self, mkdir, isfile, listdir, explain, image, exists, local_cmd):
-        # 服务md5sum校验失败
-        upload_obj = UploadPackageHistory.objects.get(
-            operation_uuid='test-uuid')
-        local_cmd.side_effect = [
-            ("test-md5 jenkins-1.0.0-test-md5.tar.gz", "", 0),
-            ("false", "", 0)
-        ]
-        exists.side_effect = [
-            True, True, False
-        ]
-        explain.side_effect = [
-            (True, test_product),
-            (True, test_service)
-        ]
-        front_end_verified(upload_obj.operation_uuid,
-                           upload_obj.operation_user,
-                           upload_obj.package_name,
-                           "RandomStr",
-                           "front_end_verified",
-                           upload_obj.id)
-        upload_obj.refresh_from_db()
-        res = upload_obj.package_status
-        self.assertEqual(res, 1)
+        self.make_package({
+            "jenkins/jenkins.yaml": product_yml.encode("utf8"),
+            "jenkins/jenkins-2.303.2.tar.gz": b"service-package",
+        })
+        upload_obj = self.verify()
+        self.assertEqual(upload_obj.package_status, 1)
+        self.assertIn("jenkins.yaml文件不存在", upload_obj.error_msg)
 
     @patch("builtins.open", new_callable=mock_open, read_data=service_yml)
     def test_app_store_explain_service(self, with_open):
@@ -435,6 +333,9 @@ class SimulationRedis(object):
     def lindex(self, key, index):
         return 'test_redis'
 
+    def set(self, key, value, **kwargs):
+        return True
+
 
 publish_info = """\
 {"kind": "product", "name": "jenkins", "version": "1.0.0", "description": "描述",\
@@ -527,37 +428,64 @@ class PackagePublishTest(AutoLoginTest):
         self.assertEqual(pro_count, 1)
         self.assertEqual(label_count, 1)
 
-    @mock.patch(
-        "redis.Redis.delete",
-        return_value=""
-    )
+    @mock.patch("app_store.tasks.scan_redis")
     @mock.patch(
         "app_store.tasks.publish_entry",
         return_value=""
     )
     def test_app_store_publish_back_true(self, publish, redis):
-        # 正向后端发布等待
-
+        # 正向后端发布，超时兜底时仍在校验的安装包置为失败
+        redis.return_value.set.return_value = True
         res = publish_bak_end('test-uuid', 1)
         self.assertEqual(res, None)
+        publish.assert_called_once_with('test-uuid')
+        redis.return_value.delete.assert_called_once()
 
     @mock.patch(
         "app_store.tasks.exec_clear",
         return_value=""
     )
-    @mock.patch(
-        "redis.Redis.delete",
-        return_value=""
-    )
+    @mock.patch("app_store.tasks.scan_redis")
     def test_app_store_publish_back(self, redis, exe_clear):
-        # 反向后端发布等待
+        # 反向后端发布，无校验成功的安装包时清理
+        redis.return_value.set.return_value = True
         upload_obj = UploadPackageHistory.objects.get(operation_uuid='test-uuid',
                                                       package_parent__isnull=True
                                                       )
-        upload_obj.package_status = 1
+        upload_obj.package_status = 2
         upload_obj.save()
         res = publish_bak_end('test-uuid', 1)
         self.assertEqual(res, None)
+        upload_obj.refresh_from_db()
+        self.assertEqual(upload_obj.package_status, 1)
+        exe_clear.assert_called_once()
+
+    @mock.patch("app_store.tasks.finish_back_end_scan")
+    @mock.patch("app_store.tasks.front_end_verified")
+    @mock.patch("app_store.tasks.scan_redis")
+    def test_app_store_verify_back(self, redis, front, finish):
+        # 后端扫描校验，最后一个完成校验的任务触发发布
+        redis.return_value.decr.side_effect = [1, 0]
+        verify_back_end_package('test-uuid', 'admin', 'a.tar.gz',
+                                'abc', 1, 2)
+        finish.assert_not_called()
+        front.side_effect = Exception("error")
+        verify_back_end_package('test-uuid', 'admin', 'b.tar.gz',
+                                'abc', 1, 2)
+        finish.assert_called_once_with('test-uuid')
+        self.assertEqual(redis.return_value.publish.call_count, 2)
+
+    @mock.patch(
+        "app_store.tasks.publish_entry",
+        return_value=""
+    )
+    @mock.patch("app_store.tasks.scan_redis")
+    def test_app_store_finish_back_once(self, redis, publish):
+        # 发布只执行一次
+        redis.return_value.set.side_effect = [True, True, None]
+        finish_back_end_scan('test-uuid')
+        finish_back_end_scan('test-uuid')
+        publish.assert_called_once_with('test-uuid')
 
     @mock.patch(
         "app_store.tasks.publish_entry.delay",
@@ -617,11 +545,14 @@ class PackagePublishTest(AutoLoginTest):
         "app_store.tasks.front_end_verified.delay",
         return_value="")
     @mock.patch(
-        "app_store.tasks.publish_bak_end.delay",
+        "app_store.tasks.publish_bak_end.apply_async",
         return_value="")
-    def test_app_store_scan(self, bak, front, isfile, listdir, redis):
+    @mock.patch("app_store.tmp_exec_back_task.group")
+    def test_app_store_scan(self, group, bak, front, isfile, listdir, redis):
         uuid, exec_name = back_end_verified_init('admin')
         count = UploadPackageHistory.objects.filter(
             operation_uuid=uuid).count()
         self.assertEqual(count, 1)
         self.assertEqual(exec_name[0], "jdk-1.8.1.tar.gz")
+        group.return_value.apply_async.assert_called_once()
+        bak.assert_called_once()
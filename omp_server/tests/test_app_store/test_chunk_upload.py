@@ -0,0 +1,155 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.reverse import reverse
+
+from app_store import chunk_upload
+from app_store.chunk_upload import ChunkUpload
+from db_models.models import UploadPackageHistory
+from tests.base import AutoLoginTest
+from utils.common.exceptions import OperateError
+
+CHUNK_SIZE = chunk_upload.MIN_CHUNK_SIZE
+
+
+class ChunkUploadTest(AutoLoginTest):
+    """ 安装包分片上传测试类 """
+
+    def setUp(self):
+        super(ChunkUploadTest, self).setUp()
+        self.upload_path = tempfile.mkdtemp()
+        self.dir_patch = mock.patch.object(
+            chunk_upload, "upload_dir", return_value=self.upload_path)
+        self.dir_patch.start()
+        self.verify_patch = mock.patch.object(
+            chunk_upload, "front_end_verified_init")
+        self.mock_verify = self.verify_patch.start()
+        self.content = os.urandom(CHUNK_SIZE * 2 + 100)
+        self.md5 = hashlib.md5(self.content).hexdigest()
+
+    def tearDown(self):
+        self.dir_patch.stop()
+        self.verify_patch.stop()
+        shutil.rmtree(self.upload_path)
+        super(ChunkUploadTest, self).tearDown()
+
+    def chunk(self, index):
+        return self.content[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+    def init(self):
+        return ChunkUpload.init(
+            "test-uuid", "admin", "jenkins-1.0.0.tar.gz",
+            len(self.content), self.md5, chunk_size=CHUNK_SIZE)
+
+    def put(self, upload, index, data=None):
+        data = self.chunk(index) if data is None else data
+        return upload.put(
+            index, [data[:1000], data[1000:]], hashlib.md5(data).hexdigest())
+
+    def test_resume(self):
+        """ 分片乱序上传，重新初始化后返回已上传分片 """
+        upload = self.init()
+        self.assertEqual(upload.status()["chunk_count"], 3)
+        self.put(upload, 2)
+        # 分片校验失败时不记录
+        with self.assertRaises(OperateError):
+            upload.put(1, [self.chunk(1)], "wrong-md5")
+        with self.assertRaises(OperateError):
+            self.put(upload, 1, self.chunk(1)[:-1])
+
+        upload = self.init()
+        self.assertEqual(upload.received(), [2])
+        self.put(upload, 0)
+        status = self.put(upload, 1)
+        self.assertTrue(status["completed"])
+
+        upload_obj = upload.complete()
+        self.assertEqual(upload_obj.package_md5, self.md5)
+        with open(os.path.join(
+                self.upload_path, "jenkins-1.0.0.tar.gz"), "rb") as fp:
+            self.assertEqual(fp.read(), self.content)
+        self.mock_verify.assert_called_once_with(
+            "test-uuid", "admin", "jenkins-1.0.0.tar.gz",
+            upload_obj.id, self.md5)
+        self.assertFalse(os.path.exists(upload.path))
+        # 已完成的上传不能重复完成
+        with self.assertRaises(OperateError):
+            upload.complete()
+
+    def test_digest_read_once(self):
+        """ 按顺序到达的分片不再从文件读取，其余分片在完成时只读取一次 """
+        upload = self.init()
+        with mock.patch.object(
+                ChunkUpload, "_read_chunk", autospec=True,
+                side_effect=ChunkUpload._read_chunk) as mock_read:
+            self.put(upload, 0)
+            self.put(upload, 2)
+            self.put(upload, 1)
+            self.put(upload, 1)
+            mock_read.assert_not_called()
+            upload_obj = upload.complete()
+            self.assertEqual(upload_obj.package_md5, self.md5)
+            self.assertEqual(
+                [call[0][2] for call in mock_read.call_args_list], [2])
+
+    def test_digest_other_process(self):
+        """ 分片由其它进程接收时，完成上传的进程补齐计算 """
+        upload = self.init()
+        self.put(upload, 0)
+        # 模拟后续分片由其它进程接收
+        chunk_upload._digests.clear()
+        self.put(upload, 1)
+        self.put(upload, 2)
+        chunk_upload._digests.clear()
+        self.assertEqual(upload.complete().package_md5, self.md5)
+
+    def test_complete_md5_failed(self):
+        """ 整个文件md5不一致时上传失败 """
+        self.md5 = hashlib.md5(b"other").hexdigest()
+        upload = self.init()
+        with self.assertRaises(OperateError):
+            upload.complete()
+        for index in range(3):
+            self.put(upload, index)
+        with self.assertRaises(OperateError):
+            upload.complete()
+        self.assertFalse(UploadPackageHistory.objects.exists())
+        self.assertFalse(os.path.exists(upload.path))
+
+    def test_upload_api(self):
+        """ 最后一个分片上传后自动开始校验 """
+        resp = self.post(reverse("uploadChunkInit-list"), {
+            "uuid": "test-uuid", "operation_user": "admin",
+            "file_name": "../jenkins-1.0.0.tar.gz",
+            "file_size": len(self.content), "md5": self.md5}).json()
+        self.assertEqual(resp["code"], 1)
+
+        resp = self.post(reverse("uploadChunkInit-list"), {
+            "uuid": "test-uuid", "operation_user": "admin",
+            "file_name": "jenkins-1.0.0.tar.gz",
+            "file_size": len(self.content), "md5": self.md5,
+            "chunk_size": CHUNK_SIZE}).json()
+        self.assertEqual(resp["code"], 0)
+        upload_id = resp["data"]["upload_id"]
+        self.assertEqual(resp["data"]["received"], [])
+
+        for index in (1, 0, 2):
+            resp = self.client.post(reverse("uploadChunk-list"), data={
+                "upload_id": upload_id, "index": index,
+                "chunk_md5": hashlib.md5(self.chunk(index)).hexdigest(),
+                "file": SimpleUploadedFile("chunk", self.chunk(index))
+            }).json()
+            self.assertEqual(resp["code"], 0)
+        self.assertTrue(resp["data"]["completed"])
+        self.assertEqual(
+            UploadPackageHistory.objects.get(
+                package_name="jenkins-1.0.0.tar.gz").package_md5, self.md5)
+        self.mock_verify.assert_called_once()
+
+        resp = self.post(reverse("uploadChunkComplete-list"), {
+            "upload_id": upload_id}).json()
+        self.assertEqual(resp["code"], 1)
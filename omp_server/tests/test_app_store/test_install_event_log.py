@@ -0,0 +1,76 @@
+from unittest import mock
+
+from rest_framework.reverse import reverse
+
+from app_store.install_exec import InstallServiceExecutor
+from db_models.models import DetailInstallHistory
+from utils.plugin.salt_client import SaltClient
+from tests.base import AutoLoginTest
+from tests.mixin import InstallHistoryResourceMixin
+
+
+class InstallEventLogTest(AutoLoginTest, InstallHistoryResourceMixin):
+    """ 安装过程日志测试类 """
+
+    def setUp(self):
+        super(InstallEventLogTest, self).setUp()
+        self.log_url = reverse("showSingleServiceInstallLog-list")
+        self.main_obj, detail_obj_ls = self.get_install_history(number=1)
+        self.detail_obj = detail_obj_ls.first()
+
+    def tearDown(self):
+        super(InstallEventLogTest, self).tearDown()
+        self.destroy_install_history()
+
+    def get_log(self, since=None):
+        data = {
+            "unique_key": self.main_obj.operation_uuid,
+            "app_name": self.detail_obj.service.service.app_name,
+            "ip": self.detail_obj.service.ip,
+        }
+        if since is not None:
+            data["since"] = since
+        return self.get(self.log_url, data).json().get("data")
+
+    def test_step_log(self):
+        """ 步骤日志写入执行过程日志，详情表日志随状态保存 """
+        executor = InstallServiceExecutor(self.main_obj.id, "admin")
+        with mock.patch.object(SaltClient, "cp_file") as mock_cp_file:
+            mock_cp_file.return_value = True, "success"
+            is_success, _ = executor.send(self.detail_obj)
+        self.assertTrue(is_success)
+        detail_obj = DetailInstallHistory.objects.get(id=self.detail_obj.id)
+        self.assertEqual(detail_obj.send_flag, 2)
+        self.assertIn("成功发送服务包", detail_obj.send_msg)
+
+        data = self.get_log()
+        self.assertEqual(data["seq"], 2)
+        self.assertIn("开始发送服务包", data["log"])
+        self.assertIn("成功发送服务包", data["log"])
+
+        # 增量读取
+        data = self.get_log(since=1)
+        self.assertNotIn("开始发送服务包", data["log"])
+        self.assertIn("成功发送服务包", data["log"])
+        self.assertEqual(self.get_log(since=2)["log"], "")
+
+    def test_step_start_log(self):
+        """ 步骤开始日志在执行命令前写入，执行过程中即可读取 """
+        executor = InstallServiceExecutor(self.main_obj.id, "admin")
+
+        def cp_file(*args, **kwargs):
+            data = self.get_log()
+            self.assertEqual(data["seq"], 1)
+            self.assertIn("开始发送服务包", data["log"])
+            return True, "success"
+
+        with mock.patch.object(SaltClient, "cp_file", side_effect=cp_file):
+            is_success, _ = executor.send(self.detail_obj)
+        self.assertTrue(is_success)
+
+    def test_history_log(self):
+        """ 无执行过程日志的历史记录读取详情表日志 """
+        DetailInstallHistory.objects.filter(id=self.detail_obj.id).update(
+            send_msg="history send\n")
+        data = self.get_log()
+        self.assertEqual((data["log"], data["seq"]), ("history send\n", 0))
@@ -0,0 +1,136 @@
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+from app_store.new_install_utils import (
+    RemotePreCheck, ValidateInstallService, ValidateInstallServicePortArgs
+)
+from tests.mixin import HostsResourceMixin
+
+
+class FakeSaltClient(object):
+    """ 在本机执行检查命令，记录每台主机的执行次数 """
+    calls = dict()
+    offline = set()
+    lock = threading.Lock()
+
+    def cmd(self, target, command, timeout, real_timeout=None):
+        with self.lock:
+            self.calls[target] = self.calls.get(target, 0) + 1
+        if target in self.offline:
+            return False, "agent offline"
+        res = subprocess.run(
+            ["bash", "-c", command], stdout=subprocess.PIPE, timeout=timeout)
+        return True, res.stdout.decode()
+
+
+class RemotePreCheckTest(TestCase, HostsResourceMixin):
+    """ 远程端口及路径预检查测试类 """
+
+    def setUp(self):
+        self.ips = sorted(host.ip for host in self.get_hosts(number=3))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.used_port = self.server.getsockname()[1]
+        FakeSaltClient.calls = dict()
+        FakeSaltClient.offline = set()
+        self.salt_patch = mock.patch(
+            "app_store.new_install_utils.SaltClient", FakeSaltClient)
+        self.salt_patch.start()
+
+    def tearDown(self):
+        self.salt_patch.stop()
+        self.server.close()
+        shutil.rmtree(self.tmp_dir)
+        self.destroy_hosts()
+
+    def test_pre_check(self):
+        """ 每台主机执行一次检查，结果按端口及路径返回 """
+        pre_check = RemotePreCheck()
+        pre_check.add_port("127.0.0.1", self.used_port)
+        pre_check.add_port("127.0.0.1", 1)
+        pre_check.add_path("127.0.0.1", self.tmp_dir)
+        pre_check.add_path("127.0.0.1", f"{self.tmp_dir}/it's new")
+        pre_check.add_path("127.0.0.2", self.tmp_dir)
+        FakeSaltClient.offline.add("127.0.0.2")
+        pre_check.run()
+        self.assertEqual(
+            FakeSaltClient.calls, {"127.0.0.1": 1, "127.0.0.2": 1})
+        self.assertTrue(pre_check.port_used("127.0.0.1", self.used_port))
+        self.assertFalse(pre_check.port_used("127.0.0.1", 1))
+        self.assertTrue(pre_check.path_exists("127.0.0.1", self.tmp_dir))
+        self.assertFalse(
+            pre_check.path_exists("127.0.0.1", f"{self.tmp_dir}/it's new"))
+        self.assertIsNone(pre_check.path_exists("127.0.0.2", self.tmp_dir))
+        self.assertFalse(pre_check.port_used("127.0.0.2", self.used_port))
+
+    def make_service(self, ip, index, port, path):
+        return {
+            "ip": ip,
+            "instance_name": f"test-pre-check-{index}",
+            "ports": [{"key": "service_port", "default": port}],
+            "install_args": [
+                {"key": "instance_name",
+                 "default": f"test-pre-check-{index}"},
+                {"key": "base_dir", "dir_key": "{data_path}",
+                 "default": path},
+            ]
+        }
+
+    def test_validate_service(self):
+        """ 多个服务的检查结果映射回各自的字段 """
+        data = [
+            self.make_service(
+                ip, index, self.used_port if index == 0 else 1,
+                self.tmp_dir if index == 1 else f"{self.tmp_dir}/{index}")
+            for index, ip in enumerate(self.ips * 2)
+        ]
+        data.append(self.make_service("127.0.1.1", 9, "abc", self.tmp_dir))
+        FakeSaltClient.offline.add(self.ips[2])
+        result = ValidateInstallServicePortArgs(data=data).run()
+        self.assertEqual(len(FakeSaltClient.calls), 3)
+        self.assertTrue(all(
+            count == 1 for count in FakeSaltClient.calls.values()))
+        self.assertEqual(len(result), len(data))
+        self.assertIn("已被占用", result[0]["ports"][0]["error_msg"])
+        self.assertFalse(result[0]["ports"][0]["check_flag"])
+        self.assertIn("已存在", result[1]["install_args"][1]["error_msg"])
+        self.assertIn(
+            "无法确定该路径状态", result[2]["install_args"][1]["error_msg"])
+        self.assertFalse(result[2]["install_args"][1]["check_flag"])
+        for item in result[3:5]:
+            self.assertNotIn("error_msg", item["ports"][0])
+            self.assertNotIn("error_msg", item["install_args"][1])
+        self.assertEqual(result[6]["error_msg"], "主机 127.0.1.1 不存在")
+        self.assertFalse(result[6]["check_flag"])
+        self.assertNotIn("error_msg", data[0]["ports"][0])
+
+    def test_validate_service_warning(self):
+        """ 端口占用、路径状态未知及主机不存在仅提示，路径已存在时检查不通过 """
+        data = [{
+            "ip": ip,
+            "app_port": [{"key": "service_port", "default": self.used_port}],
+            "app_install_args": [
+                {"key": "base_dir", "dir_key": "{data_path}",
+                 "default": self.tmp_dir}]
+        } for ip in self.ips[:2]]
+        data.append({"ip": "127.0.1.1", "app_port": [],
+                     "app_install_args": []})
+        FakeSaltClient.offline.add(self.ips[1])
+        result = ValidateInstallService(data=data).run()
+        self.assertIn("已被占用", result[0]["app_port"][0]["error_msg"])
+        self.assertNotIn("check_flag", result[0]["app_port"][0])
+        self.assertIn("已存在", result[0]["app_install_args"][0]["error_msg"])
+        self.assertFalse(result[0]["app_install_args"][0]["check_flag"])
+        self.assertIn(
+            "无法确定该路径状态", result[1]["app_install_args"][0]["error_msg"])
+        self.assertNotIn("check_flag", result[1]["app_install_args"][0])
+        self.assertEqual(result[2]["error_msg"], "主机 127.0.1.1 不存在")
+        self.assertNotIn("check_flag", result[2])
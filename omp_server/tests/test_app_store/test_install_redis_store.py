@@ -0,0 +1,113 @@
+import pickle
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.exceptions import ValidationError
+
+from app_store.new_install_utils import RedisDB, BaseRedisData
+
+
+class SimulationRedis(object):
+    """ 内存模拟的redis，记录批量删除的调用 """
+
+    def __init__(self):
+        self.data = dict()
+        self.delete_calls = list()
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self):
+        return []
+
+    def set(self, name, value, ex=None):
+        self.data[name] = value
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def delete(self, *names):
+        self.delete_calls.append(names)
+        for name in names:
+            self.data.pop(name, None)
+
+    def expire(self, name, timeout):
+        return True
+
+    def hset(self, name, mapping):
+        self.data.setdefault(name, dict()).update(
+            {key.encode("utf8"): value for key, value in mapping.items()})
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def hmget(self, name, fields):
+        _hash = self.data.get(name, {})
+        return [_hash.get(field.encode("utf8")) for field in fields]
+
+    def scan_iter(self, match, count=None):
+        return [key for key in list(self.data)
+                if key.startswith(match.rstrip("*"))]
+
+
+class InstallRedisStoreTest(TestCase):
+    """ 安装流程redis存储测试类 """
+
+    def setUp(self):
+        self.conn = SimulationRedis()
+        self.redis_patch = mock.patch("redis.Redis", return_value=self.conn)
+        self.redis_patch.start()
+        self.store = BaseRedisData("test-key")
+
+    def tearDown(self):
+        self.redis_patch.stop()
+
+    def test_serialize(self):
+        """ 大数据压缩存储，不识别的格式读取失败 """
+        data = {"services": [{"name": f"ser{i}"} for i in range(500)]}
+        value = RedisDB.dumps(data)
+        self.assertEqual(value[:1], RedisDB.FORMAT_ZLIB_JSON)
+        self.assertLess(len(value), len(str(data)) / 5)
+        self.assertEqual(RedisDB.loads(value), data)
+        self.assertEqual(RedisDB.dumps({"a": 1}), b'\x01{"a":1}')
+        self.conn.data["old"] = pickle.dumps(data)
+        self.assertEqual(RedisDB().get("old"), (False, None))
+
+    def test_hash_step(self):
+        """ 映射数据按字段读取 """
+        host_service_map = {
+            "10.0.0.1": ["doucApi", "kafka"],
+            "10.0.0.2": ["mysql"]
+        }
+        self.store.step_5_set_host_and_service_map(
+            host_list=list(host_service_map), host_service_map=host_service_map)
+        self.assertEqual(
+            self.store.get_step_5_host_service_map(), host_service_map)
+        self.assertEqual(
+            self.store.get_step_5_host_service_map(ips=["10.0.0.2", "x"]),
+            {"10.0.0.2": ["mysql"]})
+        self.assertEqual(
+            self.store.get_step_5_host_list(), ["10.0.0.1", "10.0.0.2"])
+        # 覆盖存储时删除旧的字段
+        self.store.step_5_set_host_and_service_map(
+            host_list=[], host_service_map={})
+        self.assertEqual(self.store.get_step_5_host_service_map(), {})
+        with self.assertRaises(ValidationError):
+            BaseRedisData("other-key").get_step_5_host_service_map()
+
+    def test_delete_all_keys(self):
+        """ 批量删除流程相关的key """
+        for index in range(RedisDB.DELETE_BATCH + 10):
+            self.conn.set(f"test-key_{index}", b"")
+        self.conn.set("other-key", b"")
+        self.store.delete_all_keys()
+        self.assertEqual(list(self.conn.data), ["other-key"])
+        self.assertEqual(
+            [len(names) for names in self.conn.delete_calls],
+            [RedisDB.DELETE_BATCH, 10])
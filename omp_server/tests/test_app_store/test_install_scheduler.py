@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from django.test import TestCase
+
+from app_store.install_scheduler import InstallScheduler
+from db_models.models import ApplicationHub
+
+
+class FakeDetail(SimpleNamespace):
+    """ 模拟安装详情对象 """
+
+    def save(self, **kwargs):
+        pass
+
+
+def make_detail(_id, ip, name, app_name, dependence=None,
+                app_type=ApplicationHub.APP_TYPE_COMPONENT):
+    return FakeDetail(
+        id=_id,
+        install_step_status=None,
+        service=SimpleNamespace(
+            ip=ip,
+            service_instance_name=name,
+            cluster=None,
+            service_dependence=json.dumps([
+                {"name": dep, "instance_name": None, "cluster_name": None}
+                for dep in dependence or []
+            ]),
+            service=SimpleNamespace(
+                app_name=app_name,
+                app_type=app_type,
+                extend_fields={"level": "0"},
+                app_dependence=None
+            )
+        )
+    )
+
+
+class FakeExecutor:
+    """ 模拟安装执行器，记录各服务的开始、结束时间 """
+
+    def __init__(self, cost_dic, failed=()):
+        self.cost_dic = cost_dic
+        self.failed = failed
+        self.lock = threading.Lock()
+        self.running = dict()
+        self.max_running = dict()
+        self.record = dict()
+
+    def single_service_executor(self, detail_obj):
+        name = detail_obj.service.service_instance_name
+        ip = detail_obj.service.ip
+        with self.lock:
+            self.running[ip] = self.running.get(ip, 0) + 1
+            self.max_running[ip] = max(
+                self.max_running.get(ip, 0), self.running[ip])
+        start = time.monotonic()
+        time.sleep(self.cost_dic.get(name, 0.01))
+        with self.lock:
+            self.running[ip] -= 1
+            self.record[name] = (start, time.monotonic())
+        if name in self.failed:
+            return False, "failed"
+        return True, "success"
+
+
+class InstallSchedulerTest(TestCase):
+    """ 安装调度器测试类 """
+
+    def setUp(self):
+        self.detail_ls = [
+            make_detail(1, "10.0.0.1", "kafka1", "kafka"),
+            make_detail(2, "10.0.0.2", "mysql1", "mysql"),
+            make_detail(
+                3, "10.0.0.2", "app1", "app", dependence=["mysql"],
+                app_type=ApplicationHub.APP_TYPE_SERVICE),
+            make_detail(
+                4, "10.0.0.3", "app2", "app2", dependence=["kafka"],
+                app_type=ApplicationHub.APP_TYPE_SERVICE),
+        ]
+
+    def test_run_by_dependence(self):
+        """ 服务依赖安装完成后立即开始，不等待无关的慢服务 """
+        executor = FakeExecutor({"kafka1": 0.5})
+        scheduler = InstallScheduler(executor, self.detail_ls)
+        self.assertTrue(scheduler.build())
+        self.assertTrue(scheduler.run())
+        record = executor.record
+        self.assertLess(record["app1"][0], record["kafka1"][1])
+        self.assertGreaterEqual(record["app1"][0], record["mysql1"][1])
+        self.assertGreaterEqual(record["app2"][0], record["kafka1"][1])
+        report = scheduler.report()
+        self.assertIn("kafka1", report)
+        self.assertIn("app2", report)
+        self.assertNotIn("mysql1", report)
+
+    def test_failed_skip_dependents(self):
+        """ 安装失败服务的下游服务被跳过，其他服务继续安装 """
+        executor = FakeExecutor({}, failed=("kafka1",))
+        scheduler = InstallScheduler(executor, self.detail_ls)
+        self.assertTrue(scheduler.build())
+        self.assertFalse(scheduler.run())
+        self.assertNotIn("app2", executor.record)
+        self.assertIn("app1", executor.record)
+
+    def test_host_concurrent(self):
+        """ 单主机并发数限制 """
+        detail_ls = [
+            make_detail(i, "10.0.0.1", f"app{i}", f"app{i}",
+                        app_type=ApplicationHub.APP_TYPE_SERVICE)
+            for i in range(6)
+        ]
+        executor = FakeExecutor({f"app{i}": 0.05 for i in range(6)})
+        scheduler = InstallScheduler(
+            executor, detail_ls, max_workers=10, host_max_workers=2)
+        self.assertTrue(scheduler.build())
+        self.assertTrue(scheduler.run())
+        self.assertEqual(len(executor.record), 6)
+        self.assertEqual(executor.max_running["10.0.0.1"], 2)
+
+    def test_cycle(self):
+        """ 依赖关系有环 """
+        detail_ls = [
+            make_detail(1, "10.0.0.1", "a1", "a", dependence=["b"]),
+            make_detail(2, "10.0.0.2", "b1", "b", dependence=["a"]),
+        ]
+        scheduler = InstallScheduler(FakeExecutor({}), detail_ls)
+        self.assertFalse(scheduler.build())
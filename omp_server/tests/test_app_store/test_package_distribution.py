@@ -0,0 +1,162 @@
+import re
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase
+
+from app_store.package_distribution import PackageDistributor
+from utils.plugin.salt_client import SaltClient
+from tests.mixin import HostsResourceMixin
+
+
+def make_detail(ip, package_name, md5, send_flag=0):
+    return SimpleNamespace(
+        send_flag=send_flag,
+        service=SimpleNamespace(
+            ip=ip,
+            service=SimpleNamespace(
+                app_package=SimpleNamespace(
+                    package_name=package_name,
+                    package_path="verified/test",
+                    package_md5=md5
+                )
+            )
+        )
+    )
+
+
+class FakeSalt:
+    """ 模拟各主机上的安装包文件 """
+
+    def __init__(self, files=None, peer_failed=(), peer_raise=()):
+        # {(ip, path): md5}
+        self.files = dict(files or {})
+        self.peer_failed = peer_failed
+        self.peer_raise = peer_raise
+        self.lock = threading.Lock()
+        self.cp_list = list()
+        self.peer_list = list()
+        self.commands = list()
+
+    def cmd(self, target, command, timeout, real_timeout=None):
+        with self.lock:
+            self.commands.append((target, command))
+        if command.startswith("md5sum"):
+            paths = command.split()[1:-3]
+            return True, "\n".join(
+                f"{self.files[(target, path)]}  {path}"
+                for path in paths if (target, path) in self.files)
+        if "peer_pid" in command:
+            if target in self.peer_raise:
+                raise RuntimeError("salt error")
+            return True, "peer_pid:1000"
+        if "curl" in command:
+            source, name = re.search(
+                r"http://(.*?):\d+/\w+/(\S+)", command).groups()
+            md5 = re.search(r"echo '(\w+)", command).group(1)
+            with self.lock:
+                self.peer_list.append((source, target, name))
+            if source in self.peer_failed:
+                return False, "failed"
+            with self.lock:
+                self.files[(target, f"/data/omp_packages/{name}")] = md5
+        return True, ""
+
+    def cp_file(self, target, source_path, target_path, makedirs=True):
+        with self.lock:
+            self.cp_list.append((target, target_path))
+            self.files[(target, target_path)] = "md5_" + \
+                source_path.split("/")[-1]
+        return True, target_path
+
+
+class PackageDistributorTest(TestCase, HostsResourceMixin):
+    """ 安装包分发测试类 """
+
+    def setUp(self):
+        self.ips = [host.ip for host in self.get_hosts(number=8)]
+
+    def run_distributor(self, detail_ls, fake_salt, **kwargs):
+        with mock.patch.object(SaltClient, "cmd", fake_salt.cmd), \
+                mock.patch.object(SaltClient, "cp_file", fake_salt.cp_file):
+            distributor = PackageDistributor(detail_ls, **kwargs)
+            return distributor, distributor.run()
+
+    def test_dedup_and_exists(self):
+        """ 同一主机只发送一次，已存在且 md5 一致的主机不再发送 """
+        ip_1, ip_2, ip_3 = self.ips[:3]
+        detail_ls = [
+            make_detail(ip_1, "a.tar.gz", "md5_a.tar.gz"),
+            make_detail(ip_1, "a.tar.gz", "md5_a.tar.gz"),
+            make_detail(ip_2, "a.tar.gz", "md5_a.tar.gz"),
+            make_detail(ip_3, "a.tar.gz", "md5_a.tar.gz"),
+            make_detail(ip_3, "b.tar.gz", "md5_b.tar.gz", send_flag=2),
+        ]
+        fake_salt = FakeSalt(files={
+            (ip_2, "/data/omp_packages/a.tar.gz"): "md5_a.tar.gz",
+            (ip_3, "/data/omp_packages/a.tar.gz"): "changed",
+        })
+        distributor, result = self.run_distributor(
+            detail_ls, fake_salt, peer_enabled=False)
+        self.assertEqual(
+            sorted(fake_salt.cp_list),
+            sorted([(ip_1, "/data/omp_packages/a.tar.gz"),
+                    (ip_3, "/data/omp_packages/a.tar.gz")]))
+        self.assertEqual(len(result), 3)
+        self.assertTrue(all(flag for flag, _ in result.values()))
+        self.assertNotIn((ip_3, "b.tar.gz"), result)
+        self.assertIn("已存在 1", distributor.report())
+
+    def test_peer_fanout(self):
+        """ 节点间分发，服务端每轮最多发送 fanout 台，节点失败后由服务端补发 """
+        detail_ls = [
+            make_detail(ip, "a.tar.gz", "md5_a.tar.gz") for ip in self.ips]
+        fake_salt = FakeSalt()
+        _, result = self.run_distributor(
+            detail_ls, fake_salt, peer_enabled=True, fanout=2)
+        self.assertTrue(all(flag for flag, _ in result.values()))
+        # 8 台主机两轮完成: 服务端 2 + 2，节点间 4
+        self.assertEqual(len(fake_salt.cp_list), 4)
+        self.assertEqual(
+            len(fake_salt.cp_list) + len(fake_salt.peer_list), len(self.ips))
+
+        fake_salt = FakeSalt(peer_failed=self.ips)
+        _, result = self.run_distributor(
+            detail_ls, fake_salt, peer_enabled=True, fanout=2)
+        self.assertTrue(all(flag for flag, _ in result.values()))
+        self.assertEqual(len(fake_salt.cp_list), len(self.ips))
+
+    def test_peer_server(self):
+        """ 临时文件服务只提供安装包所在的随机目录，按进程号关闭 """
+        ip_1, ip_2 = self.ips[:2]
+        detail_ls = [
+            make_detail(ip, "a.tar.gz", "md5_a.tar.gz") for ip in self.ips]
+        fake_salt = FakeSalt(files={
+            (ip_1, "/data/omp_packages/a.tar.gz"): "md5_a.tar.gz"})
+        distributor, result = self.run_distributor(
+            detail_ls, fake_salt, peer_enabled=True, fanout=1)
+        self.assertTrue(all(flag for flag, _ in result.values()))
+        server = distributor.peer_servers[ip_1]
+        start_command = [
+            command for ip, command in fake_salt.commands
+            if ip == ip_1 and "peer_pid" in command][0]
+        self.assertIn(
+            f"ln -f /data/omp_packages/a.tar.gz {server['root']}/"
+            f"{server['token']}/a.tar.gz", start_command)
+        self.assertIn(f"cd {server['root']} &&", start_command)
+        self.assertIn(f"--bind {ip_1}", start_command)
+        self.assertIn(f"{ip_1} 19099", start_command)
+        self.assertIn(
+            (ip_1, f"kill 1000 2>/dev/null; rm -rf {server['root']}"),
+            fake_salt.commands)
+
+        # 分发源异常时由服务端补发
+        fake_salt = FakeSalt(files={
+            (ip_1, "/data/omp_packages/a.tar.gz"): "md5_a.tar.gz"},
+            peer_raise=self.ips)
+        distributor, result = self.run_distributor(
+            detail_ls[:2], fake_salt, peer_enabled=True, fanout=1)
+        self.assertEqual(result[(ip_2, "a.tar.gz")][0], True)
+        self.assertEqual(
+            fake_salt.cp_list, [(ip_2, "/data/omp_packages/a.tar.gz")])
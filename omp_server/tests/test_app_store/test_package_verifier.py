@@ -0,0 +1,120 @@
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+from app_store.package_verifier import PackageVerifier
+from app_store.tasks import extract_package
+
+
+class PackageVerifierTest(TestCase):
+    """ 安装包流式校验测试类 """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, "jenkins-5.2.0.tar.gz")
+        with tarfile.open(self.file_name, "w:gz") as tar:
+            for name, data in (
+                    ("./jenkins/jenkins.yaml", b"kind: product"),
+                    ("./jenkins/jenkins.svg", b"<svg/>"),
+                    ("./jenkins/jenkins/jenkins.yaml", b"kind: service"),
+                    ("./jenkins/jenkins-2.303.2.tar.gz", b"service" * 1000),
+                    ("./jenkins/bin/start.sh", b"echo start"),
+                    ("../evil.yaml", b"evil")):
+                tar_info = tarfile.TarInfo(name)
+                tar_info.size = len(data)
+                tar.addfile(tar_info, io.BytesIO(data))
+            tar_info = tarfile.TarInfo("./jenkins/bin/run.sh")
+            tar_info.type = tarfile.LNKTYPE
+            tar_info.linkname = "./jenkins/bin/start.sh"
+            tar.addfile(tar_info)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_verify(self):
+        """ 读取一次安装包，只解出yaml及图片 """
+        target_dir = os.path.join(self.tmp_dir, "check")
+        verifier = PackageVerifier(self.file_name, "jenkins")
+        self.assertTrue(verifier.verify(target_dir))
+        with open(self.file_name, "rb") as fp:
+            self.assertEqual(verifier.md5, hashlib.md5(fp.read()).hexdigest())
+        self.assertEqual(verifier.packages, {
+            "jenkins-2.303.2.tar.gz": hashlib.md5(
+                b"service" * 1000).hexdigest()})
+        extracted = sorted(
+            os.path.relpath(os.path.join(root, name), target_dir)
+            for root, _, files in os.walk(target_dir) for name in files)
+        self.assertEqual(extracted, [
+            "jenkins/jenkins.svg", "jenkins/jenkins.yaml",
+            "jenkins/jenkins/jenkins.yaml"])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmp_dir, "evil.yaml")))
+
+    def test_verify_invalid(self):
+        """ 非tar格式的安装包校验失败，md5仍然生成 """
+        file_name = os.path.join(self.tmp_dir, "bad.tar.gz")
+        with open(file_name, "wb") as fp:
+            fp.write(b"not a tar file")
+        verifier = PackageVerifier(file_name, "bad")
+        self.assertFalse(verifier.verify(self.tmp_dir))
+        self.assertEqual(
+            verifier.md5, hashlib.md5(b"not a tar file").hexdigest())
+
+    def test_extract_package(self):
+        """ 发布时直接解压至目标路径 """
+        valid_dir = os.path.join(self.tmp_dir, "verified", "jenkins-5.2.0")
+        os.makedirs(valid_dir)
+        with open(os.path.join(valid_dir, "old.txt"), "w") as fp:
+            fp.write("old")
+        self.assertEqual(
+            extract_package(self.file_name, "jenkins", valid_dir)[2], 0)
+        self.assertFalse(os.path.exists(os.path.join(valid_dir, "old.txt")))
+        with open(os.path.join(valid_dir, "bin", "run.sh"), "rb") as fp:
+            self.assertEqual(fp.read(), b"echo start")
+        self.assertTrue(os.path.exists(
+            os.path.join(valid_dir, "jenkins-2.303.2.tar.gz")))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmp_dir, "verified", "evil.yaml")))
+
+        self.assertEqual(extract_package(
+            os.path.join(self.tmp_dir, "missing.tar.gz"), "jenkins",
+            valid_dir)[2], 1)
+
+    def test_extract_symlink(self):
+        """ 指向目标路径以外的符号链接及其下的文件不解压 """
+        outside_dir = os.path.join(self.tmp_dir, "outside")
+        os.makedirs(outside_dir)
+        file_name = os.path.join(self.tmp_dir, "evil-1.0.tar.gz")
+        with tarfile.open(file_name, "w:gz") as tar:
+            for name, link in (("evil/x", outside_dir),
+                               ("evil/y", "../../outside"),
+                               ("evil/bin/run.sh", "start.sh")):
+                tar_info = tarfile.TarInfo(name)
+                tar_info.type = tarfile.SYMTYPE
+                tar_info.linkname = link
+                tar.addfile(tar_info)
+            for name in ("evil/x/file", "evil/y/file", "evil/bin/start.sh"):
+                tar_info = tarfile.TarInfo(name)
+                tar_info.size = 4
+                tar.addfile(tar_info, io.BytesIO(b"data"))
+        for use_filter in (True, False):
+            valid_dir = os.path.join(self.tmp_dir, f"verified-{use_filter}")
+
+            def mock_hasattr(obj, name):
+                # 不使用过滤器时按真实路径检查
+                return hasattr(obj, name) if use_filter else False
+
+            with mock.patch("app_store.package_verifier.hasattr",
+                            create=True, side_effect=mock_hasattr):
+                PackageVerifier(file_name, "evil").extract_to(valid_dir)
+            self.assertEqual(os.listdir(outside_dir), [])
+            self.assertFalse(os.path.islink(os.path.join(valid_dir, "x")))
+            self.assertFalse(os.path.islink(os.path.join(valid_dir, "y")))
+            with open(os.path.join(valid_dir, "bin", "run.sh"), "rb") as fp:
+                self.assertEqual(fp.read(), b"data")
@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import hashlib
+from unittest import mock
+
+from django.test import TestCase
+
+from backups.backup_service import BackupDB, MANIFEST_NAME
+from db_models.models import (
+    ApplicationHub, BackupHistory, Env, Host, Service, ServiceConnectInfo
+)
+from utils.plugin.crypto import AESCryptor
+from utils.plugin.ssh import SSH
+
+
+class BackupDBTest(TestCase):
+    """ 数据备份测试类 """
+
+    def setUp(self):
+        self.retain_path = tempfile.mkdtemp()
+        env = Env.objects.create(name="default")
+        app = ApplicationHub.objects.create(
+            app_name="mysql", app_version="5.7.31",
+            app_install_args=json.dumps([
+                {"key": "base_dir", "default": "{data_path}/app/mysql"},
+                {"key": "data_dir", "default": "{data_path}/mysql/data"},
+                {"key": "run_user", "default": "mysql"},
+            ]))
+        connect_info = ServiceConnectInfo.objects.create(
+            service_name="mysql", service_username="root",
+            service_password="123456")
+        for index in range(1, 4):
+            ip = f"10.0.0.{index}"
+            Host.objects.create(
+                instance_name=f"host_{index}", ip=ip, port=22,
+                username="root", password=AESCryptor().encode("password"),
+                data_folder="/data", env=env)
+            Service.objects.create(
+                ip=ip, service_instance_name=f"mysql-{index}",
+                service=app, env=env, service_connect_info=connect_info,
+                service_port=json.dumps(
+                    [{"key": "service_port", "default": "3306"}]))
+        self.history = BackupHistory.objects.create(
+            backup_name="数据备份-test",
+            content=["mysql-1", "mysql-2", "mysql-3"],
+            retain_path=self.retain_path, file_name="数据备份-test.tar")
+
+        # 备份失败的主机
+        self.fail_ip = None
+
+    def tearDown(self):
+        shutil.rmtree(self.retain_path)
+
+    def read_stream(self, ssh_obj, command, read_func, timeout):
+        """ 模拟节点输出压缩后的导出数据 """
+        read_func(io.BytesIO(ssh_obj.hostname.encode("utf8") * 1000))
+        if ssh_obj.hostname == self.fail_ip:
+            return False, "access denied"
+        return True, ""
+
+    def test_backup_service(self):
+        """ 并发备份，数据流直接写入备份文件并记录校验值 """
+        with mock.patch.object(
+                SSH, "cmd_read_stream", autospec=True,
+                side_effect=self.read_stream) \
+                as mock_stream:
+            backup_obj = BackupDB(max_workers=3)
+            # 超出内存缓存的数据写入临时文件
+            backup_obj.spool_memory = 1024
+            self.assertEqual(
+                backup_obj.backup_service(self.history.id),
+                (True, "Success"))
+        self.assertEqual(mock_stream.call_count, 3)
+        command = mock_stream.call_args[0][1]
+        self.assertTrue(command.startswith("bash -o pipefail -c "))
+        self.assertIn("--all-databases | $(command -v pigz", command)
+
+        file_path = os.path.join(self.retain_path, self.history.file_name)
+        self.assertEqual(os.listdir(self.retain_path), [
+            self.history.file_name])
+        with tarfile.open(file_path) as tar:
+            manifest = json.load(tar.extractfile(MANIFEST_NAME))
+            self.assertEqual(len(manifest), 3)
+            for item in manifest:
+                data = tar.extractfile(item["file"]).read()
+                self.assertTrue(item["file"].endswith(".sql.gz"))
+                self.assertEqual(item["size"], len(data))
+                self.assertEqual(
+                    item["sha256"], hashlib.sha256(data).hexdigest())
+        self.assertEqual(
+            sorted(result["instance"] for result in backup_obj.results),
+            ["mysql-1", "mysql-2", "mysql-3"])
+        self.assertGreater(backup_obj.throughput, 0)
+
+    def test_backup_failed(self):
+        """ 任一实例失败时不保留备份文件 """
+        self.fail_ip = "10.0.0.3"
+        with mock.patch.object(
+                SSH, "cmd_read_stream", autospec=True,
+                side_effect=self.read_stream):
+            is_success, message = BackupDB().backup_service(self.history.id)
+        self.assertFalse(is_success)
+        self.assertEqual(message, "10.0.0.3上mysql-3备份失败!")
+        self.assertEqual(os.listdir(self.retain_path), [])
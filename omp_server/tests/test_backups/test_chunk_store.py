@@ -0,0 +1,226 @@
+import gzip
+import io
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from backups import backup_service
+from backups.backup_service import BackupDB
+from backups.backups_utils import restore_backup, rm_backend_file
+from backups.chunk_store import Chunker, ChunkStore
+from db_models.models import BackupChunk, BackupHistory, UserProfile
+from tests.test_backups import test_backup_service
+from utils.plugin.ssh import SSH
+
+
+def dump_data(seed, lines=60000):
+    """ 生成按行组织的导出数据 """
+    rand = random.Random(seed)
+    return b"".join(
+        f"INSERT INTO t VALUES ({index}, '{rand.random()}');\n".encode()
+        for index in range(lines))
+
+
+class ChunkStoreTest(TestCase):
+    """ 备份去重存储测试类 """
+
+    def setUp(self):
+        self.chunk_path = tempfile.mkdtemp()
+        self.store = ChunkStore(self.chunk_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.chunk_path)
+
+    def write(self, data, gzip_input=False):
+        writer = self.store.writer(gzip_input=gzip_input)
+        for index in range(0, len(data), 100000):
+            writer.write(data[index:index + 100000])
+        return dict(file="dump.sql", **writer.close())
+
+    def test_chunker_resync(self):
+        """ 数据中间插入内容后，后续块边界保持不变 """
+        data = dump_data(1)
+        chunker = Chunker(min_size=4096, max_size=65536)
+        chunks = list(chunker.feed(data)) + list(chunker.flush())
+        self.assertEqual(b"".join(chunks), data)
+        self.assertTrue(all(len(chunk) <= 65536 for chunk in chunks))
+
+        middle = len(data) // 2
+        changed = data[:middle] + b"-- inserted\n" + data[middle:]
+        chunker = Chunker(min_size=4096, max_size=65536)
+        changed_chunks = list(chunker.feed(changed)) + list(chunker.flush())
+        self.assertEqual(b"".join(changed_chunks), changed)
+        self.assertLessEqual(
+            len(set(changed_chunks) - set(chunks)), 2)
+
+    def test_dedup_and_release(self):
+        """ 未变化的数据只保存一次，删除备份时按引用计数回收 """
+        data = dump_data(2)
+        first = {"files": [self.write(gzip.compress(data), True)]}
+        self.assertEqual(first["files"][0]["size"], len(data))
+        self.store.commit(first)
+        self.assertTrue(BackupChunk.objects.exists())
+        self.assertFalse(
+            BackupChunk.objects.exclude(ref_count=1).exists())
+
+        middle = len(data) // 2
+        second = {"files": [self.write(
+            data[:middle] + b"-- changed\n" + data[middle:])]}
+        new_chunks = set(self.store.new_chunks)
+        self.assertLessEqual(len(new_chunks), 2)
+        self.store.commit(second)
+
+        # 删除第一份备份只回收第二份未引用的块
+        self.store.release(first)
+        removed = set(self.store.chunk_sizes(first)) - set(
+            self.store.chunk_sizes(second))
+        self.assertTrue(removed)
+        for sha256 in removed:
+            self.assertFalse(os.path.exists(self.store.chunk_file(sha256)))
+        self.assertEqual(
+            set(BackupChunk.objects.values_list("sha256", flat=True)),
+            set(self.store.chunk_sizes(second)))
+
+        self.store.release(second)
+        self.assertFalse(BackupChunk.objects.exists())
+
+    def test_rollback(self):
+        """ 备份失败时新增的块待回收，不影响已有备份 """
+        data = dump_data(3, lines=20000)
+        manifest = {"files": [self.write(data)]}
+        self.store.commit(manifest)
+        self.write(data + dump_data(4, lines=20000))
+        self.store.rollback()
+        self.assertTrue(BackupChunk.objects.filter(ref_count=0).exists())
+
+        # 有备份写入时不回收
+        with self.store.lock(shared=True):
+            with mock.patch("fcntl.flock", side_effect=[BlockingIOError]):
+                self.assertEqual(self.store.collect(), 0)
+        self.assertGreater(self.store.collect(), 0)
+        self.assertEqual(
+            set(BackupChunk.objects.values_list("sha256", flat=True)),
+            set(self.store.chunk_sizes(manifest)))
+
+
+class ChunkBackupTest(test_backup_service.BackupDBTest):
+    """ 去重存储方式的数据备份测试类 """
+
+    def setUp(self):
+        super(ChunkBackupTest, self).setUp()
+        self.chunk_path = tempfile.mkdtemp()
+        self.config_patch = mock.patch.dict(
+            backup_service.BACKUP, {"chunk_path": self.chunk_path})
+        self.config_patch.start()
+        self.history.file_name = "数据备份-test.manifest"
+        self.history.save()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.chunk_path)
+        super(ChunkBackupTest, self).tearDown()
+
+    def read_stream(self, ssh_obj, command, read_func, timeout):
+        """ 模拟节点输出多个 gzip 成员组成的数据流 """
+        data = dump_data(ssh_obj.hostname, lines=20000)
+        middle = len(data) // 2
+        read_func(io.BytesIO(
+            gzip.compress(data[:middle]) + gzip.compress(data[middle:])))
+        if ssh_obj.hostname == self.fail_ip:
+            return False, "access denied"
+        return True, ""
+
+    def backup(self):
+        backup_obj = BackupDB(max_workers=3, store_mode="chunk")
+        with mock.patch.object(
+                SSH, "cmd_read_stream", autospec=True,
+                side_effect=self.read_stream):
+            return backup_obj, backup_obj.backup_service(self.history.id)
+
+    def test_backup_service(self):
+        """ 备份文件为块清单，按清单还原备份内容 """
+        backup_obj, result = self.backup()
+        self.assertEqual(result, (True, "Success"))
+        self.assertGreater(backup_obj.stored_size, 0)
+        self.assertTrue(all(
+            "chunk_file" not in item for item in backup_obj.results))
+
+        fileobj = io.BytesIO()
+        restore_backup(self.history, fileobj)
+        fileobj.seek(0)
+        with tarfile.open(fileobj=fileobj) as tar:
+            names = sorted(tar.getnames())
+            self.assertEqual(len(names), 3)
+            member = [name for name in names if "10.0.0.1" in name][0]
+            self.assertTrue(member.endswith(".sql"))
+            self.assertEqual(
+                tar.extractfile(member).read(),
+                dump_data("10.0.0.1", lines=20000))
+
+        # 相同数据再次备份不新增块
+        history = BackupHistory.objects.create(
+            backup_name="数据备份-test2", content=self.history.content,
+            retain_path=self.retain_path,
+            file_name="数据备份-test2.manifest")
+        chunk_count = BackupChunk.objects.count()
+        backup_obj = BackupDB(store_mode="chunk")
+        with mock.patch.object(
+                SSH, "cmd_read_stream", autospec=True,
+                side_effect=self.read_stream):
+            self.assertEqual(
+                backup_obj.backup_service(history.id), (True, "Success"))
+        self.assertEqual(BackupChunk.objects.count(), chunk_count)
+        self.assertFalse(BackupChunk.objects.exclude(ref_count=2).exists())
+
+        # 清单删除失败时不释放引用，重试时只释放一次
+        with mock.patch("os.remove", side_effect=PermissionError):
+            self.assertEqual(
+                rm_backend_file(ids=[self.history.id]),
+                [self.history.file_name])
+        self.assertFalse(BackupChunk.objects.exclude(ref_count=2).exists())
+        self.assertEqual(rm_backend_file(ids=[self.history.id]), [])
+        self.assertFalse(BackupChunk.objects.exclude(ref_count=1).exists())
+        self.assertEqual(rm_backend_file(ids=[history.id]), [])
+        self.assertFalse(BackupChunk.objects.exists())
+
+    def test_download(self):
+        """ 通过接口流式下载还原后的备份，不创建清单软链 """
+        self.assertEqual(self.backup()[1], (True, "Success"))
+        self.history.result = BackupHistory.SUCCESS
+        self.history.save()
+        client = APIClient()
+        client.force_authenticate(
+            UserProfile.objects.create_user(username="admin", password="pwd"))
+        url = reverse("backupDownload-list")
+        resp = client.get(url, {"id": self.history.id})
+        self.assertIn(
+            "filename*=UTF-8''%E6%95%B0%E6%8D%AE%E5%A4%87%E4%BB%BD-test.tar",
+            resp["Content-Disposition"])
+        fileobj = io.BytesIO(b"".join(resp.streaming_content))
+        with tarfile.open(fileobj=fileobj) as tar:
+            member = [name for name in tar.getnames() if "10.0.0.2" in name][0]
+            self.assertEqual(
+                tar.extractfile(member).read(),
+                dump_data("10.0.0.2", lines=20000))
+        self.assertEqual(len(fileobj.getvalue()) % tarfile.RECORDSIZE, 0)
+
+        self.history.file_deleted = True
+        self.history.save()
+        self.assertEqual(client.get(url, {"id": self.history.id}).json()["code"], 1)
+        self.assertEqual(client.get(url, {"id": "x"}).json()["code"], 1)
+
+    def test_backup_failed(self):
+        """ 任一实例备份失败时不生成清单，不增加引用 """
+        self.fail_ip = "10.0.0.2"
+        backup_obj, result = self.backup()
+        self.assertEqual(result, (False, "10.0.0.2上mysql-2备份失败!"))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.retain_path, self.history.file_name)))
+        self.assertFalse(BackupChunk.objects.exclude(ref_count=0).exists())
@@ -13,11 +13,11 @@ from tests.mixin import (
 )
 from hosts.views import HostListView
 from hosts.tasks import (
-    host_agent_restart, insert_host_celery_task
+    host_agent_restart, insert_host_celery_task,
+    batch_insert_host_celery_task
 )
-from hosts.hosts_serializers import HostSerializer
 from db_models.models import (
-    Host, HostOperateLog
+    Host, HostOperateLog, HostMetricSnapshot
 )
 from utils.plugin.ssh import SSH
 from utils.plugin.crypto import AESCryptor
@@ -403,30 +403,6 @@ class ListHostTest(AutoLoginTest, HostsResourceMixin, GrafanaMainPageResourceMix
         super(ListHostTest, self).tearDown()
         self.destroy_hosts()
 
-    @staticmethod
-    def mock_prometheus_info(host_obj_ls):
-        """ 模拟 prometheus 返回数据 """
-        for host in host_obj_ls:
-            host.update({
-                "cpu_usage": random.choice(
-                    [None, random.randint(0, 100)]),
-                "mem_usage": random.choice(
-                    [None, random.randint(0, 100)]),
-                "root_disk_usage": random.choice(
-                    [None, random.randint(0, 100)]),
-                "data_disk_status": random.choice(
-                    [None, random.randint(0, 100)]),
-                "cpu_status": random.choice(
-                    [None, random.choice(Prometheus.STATUS)]),
-                "mem_status": random.choice(
-                    [None, random.choice(Prometheus.STATUS)]),
-                "data_disk_usage": random.choice(
-                    [None, random.choice(Prometheus.STATUS)]),
-                "root_disk_status": random.choice(
-                    [None, random.choice(Prometheus.STATUS)]),
-            })
-        return host_obj_ls
-
     def test_hosts_list_filter(self):
         """ 测试主机列表过滤 """
 
@@ -483,28 +459,32 @@ class ListHostTest(AutoLoginTest, HostsResourceMixin, GrafanaMainPageResourceMix
             reverse=True if reverse_flag else False)
         self.assertEqual(res_ls, sorted_res_ls)
 
-        # 指定动态排序字段 -> 返回值为None的不参与排序
+        # 指定动态排序字段 -> 依据指标快照全量排序，空值排在末尾
         reverse_flag = random.choice(("", "-"))
         order_field = random.choice(HostListView.dynamic_fields)
-        host_obj_ls = HostSerializer(Host.objects.all(), many=True).data
-        with mock.patch.object(Prometheus, "get_host_info") as mock_prometheus_info:
-            mock_prometheus_info.return_value = self.mock_prometheus_info(
-                host_obj_ls)
+        HostMetricSnapshot.objects.bulk_create([
+            HostMetricSnapshot(host=host, **{
+                order_field: random.choice([None, random.randint(0, 100)])
+            }) for host in self.host_obj_ls
+        ])
+        snapshot_dic = dict(HostMetricSnapshot.objects.values_list(
+            "host__ip", order_field))
+        with mock.patch.object(
+                Prometheus, "get_host_info", side_effect=lambda x: x):
             resp = self.get(self.list_host_url, {
-                "ordering": f"{reverse_flag}{order_field}"
+                "ordering": f"{reverse_flag}{order_field}",
+                "size": len(self.host_obj_ls),
             }).json()
-            # 返回值为 None 的数据不参与排序，排在末尾位置
-            res_ls = list(map(lambda x: x.get(order_field),
-                              resp.get("data").get("results")))
-            none_number = res_ls.count(None)
-            self.assertTrue(not any(res_ls[-none_number:]))
-            res_ls = list(filter(lambda x: x is not None, res_ls))
-            sorted_res_ls = res_ls[:]
-            random.shuffle(sorted_res_ls)
-            sorted_res_ls = sorted(
-                sorted_res_ls,
-                reverse=True if reverse_flag else False)
-            self.assertEqual(res_ls, sorted_res_ls)
+        res_ls = list(map(lambda x: snapshot_dic.get(x.get("ip")),
+                          resp.get("data").get("results")))
+        # 全量数据参与排序，返回值为 None 的数据排在末尾位置
+        self.assertEqual(len(res_ls), len(self.host_obj_ls))
+        none_number = res_ls.count(None)
+        self.assertTrue(all(
+            x is None for x in res_ls[len(res_ls) - none_number:]))
+        res_ls = res_ls[:len(res_ls) - none_number]
+        self.assertEqual(res_ls, sorted(
+            res_ls, reverse=True if reverse_flag else False))
 
 
 class HostDetailTest(AutoLoginTest, HostsResourceMixin):
@@ -1159,7 +1139,7 @@ class HostBatchImportTest(AutoLoginTest, HostsResourceMixin, HostBatchRequestMix
     @mock.patch.object(SSH, "check", return_value=(True, ""))
     @mock.patch.object(SSH, "is_sudo", return_value=(True, "is sudo"))
     @mock.patch.object(SSH, "cmd", return_value=(True, ""))
-    @mock.patch.object(insert_host_celery_task, "delay", return_value=None)
+    @mock.patch.object(batch_insert_host_celery_task, "delay", return_value=None)
     def test_error_format(self, celery_task_mock, cmd_mock, is_sudo, ssh_mock):
         """ 测试错误格式 """
 
@@ -1176,7 +1156,7 @@ class HostBatchImportTest(AutoLoginTest, HostsResourceMixin, HostBatchRequestMix
     @mock.patch.object(SSH, "check", return_value=(True, ""))
     @mock.patch.object(SSH, "is_sudo", return_value=(True, "is sudo"))
     @mock.patch.object(SSH, "cmd", return_value=(True, ""))
-    @mock.patch.object(insert_host_celery_task, "delay", return_value=None)
+    @mock.patch.object(batch_insert_host_celery_task, "delay", return_value=None)
     def test_batch_import(self, celery_task_mock, cmd_mock, is_sudo, ssh_mock):
         """ 测试批量添加主机 """
 
@@ -1188,3 +1168,6 @@ class HostBatchImportTest(AutoLoginTest, HostsResourceMixin, HostBatchRequestMix
             "message": "success",
             "data": "添加成功"
         })
+        # 批量部署任务只下发一次
+        celery_task_mock.assert_called_once()
+        self.assertEqual(len(celery_task_mock.call_args[0][0]), 10)
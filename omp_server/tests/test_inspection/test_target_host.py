@@ -0,0 +1,87 @@
+# !/usr/bin/python3
+# -*-coding:utf-8-*-
+# Description: 主机巡检指标分组查询
+import json
+from unittest import mock
+
+import requests
+from django.test import TestCase
+
+from db_models.models import Host, Env, MonitorUrl
+from utils.plugin.salt_client import SaltClient
+from utils.prometheus.client import prometheus_client
+from utils.prometheus.target_host import target_hosts_run, HostCrawl
+
+
+class MockResponse:
+    """
+    自定义mock response类
+    """
+    status_code = 200
+
+    def __init__(self, data):
+        self.text = json.dumps(data)
+
+
+class TargetHostTest(TestCase):
+
+    def setUp(self):
+        prometheus_client.clear()
+        MonitorUrl.objects.create(
+            name="prometheus", monitor_url="127.0.0.1:19011")
+        self.env = Env.objects.create(id=1, name="default")
+        self.hosts = [f"10.0.0.{i}" for i in range(1, 6)]
+        for ip in self.hosts:
+            Host.objects.create(
+                instance_name=ip, ip=ip, username="root", password="pwd",
+                operate_system="CentOS", data_folder="/data",
+                disk={"/": 50, "/data": 100}, env=self.env)
+
+    def mock_get(self, *args, **kwargs):
+        # 前三台主机有数据，其余主机缺失指标
+        return MockResponse({"status": "success", "data": {
+            "resultType": "vector", "result": [
+                {"metric": {"instance": ip}, "value": [1646900000, "12.345"]}
+                for ip in self.hosts[:3]]}})
+
+    def mock_fun_for_multi(self, target, *args, **kwargs):
+        # 最后一台主机 agent 离线
+        return {
+            ip: {"retcode": 0, "ret": json.dumps({"umask": "0022"})}
+            for ip in target[:-1]}
+
+    @mock.patch.object(SaltClient, "__init__", return_value=None)
+    @mock.patch.object(SaltClient, "sync_stale_modules")
+    @mock.patch.object(SaltClient, "fun_for_multi")
+    @mock.patch.object(requests.Session, "get")
+    def test_target_hosts_run(self, session_get, salt_fun, salt_sync, *args):
+        session_get.side_effect = self.mock_get
+        salt_fun.side_effect = self.mock_fun_for_multi
+        host_data = target_hosts_run(self.env, self.hosts)
+        # 查询次数与主机数无关: 15 项公共指标 + 1 个数据分区
+        query_count = len(HostCrawl(
+            env=self.env.name, hosts=self.hosts).query_exprs())
+        self.assertEqual(query_count, 16)
+        self.assertEqual(session_get.call_count, query_count)
+        for call in session_get.call_args_list:
+            self.assertIn("by (instance)", call[1]["params"]["query"])
+        # 模块同步与 host_check.main 均对全部主机只执行一次
+        salt_sync.assert_called_once_with(self.hosts)
+        salt_fun.assert_called_once_with(
+            self.hosts, "host_check.main", tgt_type="list")
+
+        self.assertEqual(
+            [item.get("host_ip") for item in host_data], self.hosts)
+        first, last = host_data[0], host_data[-1]
+        self.assertEqual(first.get("cpu_usage"), "12.35%")
+        self.assertEqual(first.get("disk_usage_data"), "12.35%")
+        self.assertEqual(first.get("sys_load"), "12.345,12.345,12.345")
+        self.assertEqual(last.get("cpu_usage"), "0.0%")
+        self.assertEqual(last.get("disk_usage_data"), "_")
+        self.assertEqual(last.get("release_version"), "CentOS")
+        basic_dic = {item["name"]: item["value"] for item in first["basic"]}
+        self.assertEqual(basic_dic.get("umask"), "0022")
+        self.assertEqual(last.get("memory_top"), [])
+        self.assertEqual(
+            basic_dic.get("bandwidth"),
+            {"receive": "12.35kb/s", "transmit": "12.35kb/s"})
@@ -6,13 +6,18 @@
 # Version: 1.0
 # Introduction:
 
+from datetime import datetime, timedelta
 from unittest import mock
 
 from tests.base import BaseTest
-from db_models.models import Host
+from db_models.models import Host, HostMetricSnapshot, Alert, \
+    AlertDailySummary, OperateLog, DetailInstallHistory, ExecutionEventLog
 from utils.plugin.salt_client import SaltClient
+from promemonitor.prometheus import Prometheus
 from promemonitor.tasks import monitor_agent_restart
 from promemonitor.tasks import real_monitor_agent_restart
+from promemonitor.tasks import refresh_metric_snapshot
+from promemonitor.tasks import clean_expired_records
 
 
 class MonitorAgentRestartCeleryTaskTest(BaseTest):
@@ -79,3 +84,144 @@ class MonitorAgentRestartCeleryTaskTest(BaseTest):
         :return:
         """
         self.assertEqual(real_monitor_agent_restart(self.host), None)
+
+
+class RefreshMetricSnapshotTaskTest(BaseTest):
+    """ 指标快照刷新任务测试类 """
+
+    def setUp(self):
+        super(RefreshMetricSnapshotTaskTest, self).setUp()
+        self.host_ls = [
+            Host.objects.create(
+                instance_name=f"snapshot_host_{index}",
+                ip=f"127.0.1.{index}",
+                username="root",
+                password="uea_xeU_d_6YHCCY7Q-e2xZolSw2z2C3KGhLY6iMdnI",
+                data_folder="/data",
+                operate_system="CentOS",
+            ) for index in range(1, 4)
+        ]
+
+    def test_refresh_host_metric_snapshot(self):
+        """
+        测试刷新主机指标快照，已存在快照更新，不存在的创建
+        :return:
+        """
+        HostMetricSnapshot.objects.create(host=self.host_ls[0], cpu_usage=1)
+        snapshot_dic = {
+            host.ip: {
+                "cpu_usage": index * 10,
+                "mem_usage": None,
+                "root_disk_usage": index,
+                "data_disk_usage": None,
+            } for index, host in enumerate(self.host_ls)
+        }
+        with mock.patch.object(Prometheus, "__init__", return_value=None), \
+                mock.patch.object(
+                    Prometheus, "get_host_usage_snapshot",
+                    return_value=snapshot_dic), \
+                mock.patch.object(
+                    Prometheus, "get_service_usage_snapshot",
+                    return_value={}):
+            refresh_metric_snapshot()
+        self.assertEqual(
+            dict(HostMetricSnapshot.objects.values_list(
+                "host__ip", "cpu_usage")),
+            {host.ip: index * 10 for index, host in enumerate(self.host_ls)})
+
+    def test_refresh_metric_snapshot_failed(self):
+        """
+        测试查询失败时保留原有快照
+        :return:
+        """
+        HostMetricSnapshot.objects.create(host=self.host_ls[0], cpu_usage=1)
+        with mock.patch.object(Prometheus, "__init__", return_value=None), \
+                mock.patch.object(
+                    Prometheus, "get_host_usage_snapshot",
+                    return_value=None), \
+                mock.patch.object(
+                    Prometheus, "get_service_usage_snapshot",
+                    return_value=None):
+            refresh_metric_snapshot()
+        self.assertEqual(
+            HostMetricSnapshot.objects.get(host=self.host_ls[0]).cpu_usage, 1)
+
+
+class CleanExpiredRecordsTaskTest(BaseTest):
+    """ 过期记录汇总清理的测试类 """
+
+    def setUp(self):
+        super(CleanExpiredRecordsTaskTest, self).setUp()
+        now = datetime.now()
+        self.old_day = (now - timedelta(days=100)).replace(
+            hour=10, minute=0, second=0, microsecond=0)
+        alert_ls = [
+            Alert(alert_type="host", alert_host_ip="10.0.0.1",
+                  alert_instance_name="host_1", alert_level="critical",
+                  alert_time=self.old_day + timedelta(minutes=i),
+                  fingerprint=f"old{i}")
+            for i in range(5)
+        ]
+        alert_ls.append(Alert(
+            alert_type="service", alert_host_ip="10.0.0.1",
+            alert_service_name="mysql", alert_instance_name="mysql_1",
+            alert_level="warning", alert_time=self.old_day,
+            fingerprint="old_service"))
+        alert_ls.append(Alert(
+            alert_type="host", alert_host_ip="10.0.0.1",
+            alert_instance_name="host_1", alert_level="critical",
+            alert_time=now, fingerprint="new"))
+        Alert.objects.bulk_create(alert_ls)
+        OperateLog.objects.create(
+            username="admin", request_method="GET", request_url="/",
+            description="查询")
+        OperateLog.objects.update(create_time=now - timedelta(days=200))
+        self.old_detail = DetailInstallHistory.objects.create()
+        DetailInstallHistory.objects.filter(id=self.old_detail.id).update(
+            created=now - timedelta(days=200))
+        self.new_detail = DetailInstallHistory.objects.create()
+        ExecutionEventLog.objects.bulk_create([
+            ExecutionEventLog(
+                module=module, history_id=detail.id, seq=i, ts=now,
+                line=f"line {i}")
+            for detail in (self.old_detail, self.new_detail)
+            for module in (ExecutionEventLog.MODULE_INSTALL,
+                           ExecutionEventLog.MODULE_TOOL)
+            for i in range(3)
+        ])
+
+    def test_clean_expired_records(self):
+        """ 过期告警按天汇总后分批删除，重复执行不重复累计 """
+        clean_expired_records(chunk_size=2)
+        self.assertEqual(
+            list(Alert.objects.values_list("fingerprint", flat=True)),
+            ["new"])
+        self.assertFalse(OperateLog.objects.exists())
+        # 仅删除过期安装详情的执行过程日志
+        self.assertEqual(sorted(set(ExecutionEventLog.objects.values_list(
+            "module", "history_id"))), [
+            (ExecutionEventLog.MODULE_INSTALL, self.new_detail.id),
+            (ExecutionEventLog.MODULE_TOOL, self.old_detail.id),
+            (ExecutionEventLog.MODULE_TOOL, self.new_detail.id)])
+        host_summary = AlertDailySummary.objects.get(alert_type="host")
+        self.assertEqual(host_summary.alert_count, 5)
+        self.assertEqual(host_summary.date, self.old_day.date())
+        self.assertEqual(host_summary.first_alert_time, self.old_day)
+        self.assertEqual(
+            host_summary.last_alert_time, self.old_day + timedelta(minutes=4))
+        self.assertEqual(AlertDailySummary.objects.get(
+            alert_type="service").alert_count, 1)
+
+        # 同一天补入的过期告警累加到已有汇总
+        Alert.objects.create(
+            alert_type="host", alert_host_ip="10.0.0.1",
+            alert_instance_name="host_1", alert_level="critical",
+            alert_time=self.old_day - timedelta(hours=1), fingerprint="late")
+        clean_expired_records(chunk_size=2)
+        clean_expired_records(chunk_size=2)
+        host_summary.refresh_from_db()
+        self.assertEqual(host_summary.alert_count, 6)
+        self.assertEqual(
+            host_summary.first_alert_time,
+            self.old_day - timedelta(hours=1))
+        self.assertEqual(AlertDailySummary.objects.count(), 2)
@@ -1,11 +1,19 @@
 import json
+import time
 from unittest import mock
 
+import redis
 import requests
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.reverse import reverse
 
 from tests.base import AutoLoginTest
+from tests.mixin import ServicesResourceMixin
 from db_models.models import MonitorUrl
+from promemonitor.dashboard import DashboardBuilder, DashboardSnapshot, \
+    drop_covered_warning, get_dashboard_querysets
+from utils.prometheus.client import prometheus_client
 
 
 class MockResponse:
@@ -25,6 +33,7 @@ class InstrumentPanelTest(AutoLoginTest):
 
     def setUp(self):
         super(InstrumentPanelTest, self).setUp()
+        prometheus_client.clear()
         MonitorUrl.objects.create(
             name='prometheus', monitor_url='127.0.0.1:19011')
         self.instrument_panel_url = reverse("instrumentPanel-list")
@@ -136,7 +145,7 @@ class InstrumentPanelTest(AutoLoginTest):
             })
         return prometheus_alerts_response
 
-    @mock.patch.object(requests, 'get', return_value='')
+    @mock.patch.object(requests.Session, 'get', return_value='')
     def test_instrument_panel(self, mock_get):
         mock_get.return_value = self.return_prometheus_alerts_response()
         resp = self.get(self.instrument_panel_url).json()
@@ -146,3 +155,123 @@ class InstrumentPanelTest(AutoLoginTest):
 
     def tearDown(self):
         super(InstrumentPanelTest, self).tearDown()
+
+
+class DashboardSnapshotTest(AutoLoginTest, ServicesResourceMixin):
+    """ 仪表盘快照测试类 """
+
+    def setUp(self):
+        super(DashboardSnapshotTest, self).setUp()
+        prometheus_client.clear()
+        MonitorUrl.objects.create(
+            name='prometheus', monitor_url='127.0.0.1:19011')
+        self.instrument_panel_url = reverse("instrumentPanel-list")
+        self.service_ls = self.get_services()
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_build(self, mock_get):
+        """ 统计数量与查询集一致，数据库查询次数与服务数量无关 """
+        mock_get.return_value = \
+            InstrumentPanelTest.return_prometheus_alerts_response()
+        with CaptureQueriesContext(connection) as ctx:
+            result = DashboardBuilder().build()
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+        database_qs, service_qs, component_qs = get_dashboard_querysets()
+        self.assertEqual(
+            result["service"]["service_info_all_count"], service_qs.count())
+        self.assertEqual(
+            result["component"]["component_info_all_count"],
+            component_qs.count())
+        self.assertEqual(result["host"]["host_info_exc_count"], 1)
+        self.assertEqual(
+            len(result["service"]["service_info_list"]), service_qs.count())
+
+    def test_drop_covered_warning(self):
+        alert_list = [
+            {"ip": "10.0.0.1", "alertname": "cpu", "severity": "warning"},
+            {"ip": "10.0.0.1", "alertname": "cpu", "severity": "critical"},
+            {"ip": "10.0.0.1", "alertname": "mem", "severity": "warning"},
+            {"ip": "10.0.0.2", "alertname": "cpu", "severity": "warning"},
+        ]
+        self.assertEqual(
+            [(ele["ip"], ele["alertname"], ele["severity"])
+             for ele in drop_covered_warning(alert_list)],
+            [("10.0.0.1", "cpu", "critical"), ("10.0.0.1", "mem", "warning"),
+             ("10.0.0.2", "cpu", "warning")])
+
+    def mock_redis(self, store):
+        """ 以字典模拟快照相关的 redis 操作 """
+
+        def mock_set(name, value, *args, **kwargs):
+            if kwargs.get("nx") and name in store:
+                return None
+            store[name] = value
+            return True
+
+        def mock_get(name):
+            value = store.get(name)
+            return value.encode("utf8") if isinstance(value, str) else value
+
+        def mock_incr(name, *args, **kwargs):
+            store[name] = store.get(name, 0) + 1
+            return store[name]
+
+        def mock_delete(*names):
+            for name in names:
+                store.pop(name, None)
+
+        patches = [
+            mock.patch.object(redis.Redis, "get", side_effect=mock_get),
+            mock.patch.object(redis.Redis, "set", side_effect=mock_set),
+            mock.patch.object(redis.Redis, "incr", side_effect=mock_incr),
+            mock.patch.object(redis.Redis, "delete", side_effect=mock_delete)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    @mock.patch.object(requests.Session, 'get')
+    def test_snapshot_cached(self, mock_get):
+        """ 快照有效期内直接返回 redis 中的快照，过期后重新生成 """
+        mock_get.return_value = \
+            InstrumentPanelTest.return_prometheus_alerts_response()
+        store = dict()
+        self.mock_redis(store)
+        first = self.get(self.instrument_panel_url)
+        call_count = mock_get.call_count
+        second = self.get(self.instrument_panel_url)
+        self.assertEqual(mock_get.call_count, call_count)
+        self.assertEqual(first["X-Snapshot-Version"], "1")
+        self.assertEqual(second["X-Snapshot-Version"], "1")
+        self.assertEqual(first.json(), second.json())
+        # 快照过期
+        snapshot = json.loads(store[DashboardSnapshot.SNAPSHOT_KEY])
+        snapshot["created"] -= 3600
+        store[DashboardSnapshot.SNAPSHOT_KEY] = json.dumps(snapshot)
+        self.assertEqual(
+            self.get(self.instrument_panel_url)["X-Snapshot-Version"], "2")
+        self.assertNotIn(DashboardSnapshot.REBUILD_KEY, store)
+
+    @mock.patch("promemonitor.dashboard.time.sleep")
+    @mock.patch("promemonitor.dashboard.DashboardBuilder")
+    def test_snapshot_single_flight(self, mock_builder, mock_sleep):
+        """ 其他进程重建快照时返回过期快照，快照缺失时等待重建结果 """
+        store = dict()
+        self.mock_redis(store)
+        stale = {"version": 1, "created": time.time() - 3600, "data": {}}
+        store[DashboardSnapshot.SNAPSHOT_KEY] = json.dumps(stale)
+        store[DashboardSnapshot.REBUILD_KEY] = "other"
+        self.assertEqual(DashboardSnapshot().get(), stale)
+        mock_builder.assert_not_called()
+
+        fresh = {"version": 2, "created": time.time(), "data": {}}
+        del store[DashboardSnapshot.SNAPSHOT_KEY]
+        mock_sleep.side_effect = lambda _: store.update(
+            {DashboardSnapshot.SNAPSHOT_KEY: json.dumps(fresh)})
+        self.assertEqual(DashboardSnapshot().get(), fresh)
+        mock_builder.assert_not_called()
+        self.assertEqual(store[DashboardSnapshot.REBUILD_KEY], "other")
+
+    def tearDown(self):
+        super(DashboardSnapshotTest, self).tearDown()
+        self.destroy_services()
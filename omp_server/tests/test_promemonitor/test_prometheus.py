@@ -4,6 +4,7 @@ import requests
 from django.test import TestCase
 
 from promemonitor.prometheus import Prometheus
+from utils.prometheus.client import prometheus_client
 from db_models.models import MonitorUrl
 from unittest import mock
 from db_models.models import HostThreshold
@@ -25,6 +26,7 @@ class MockResponse:
 class TestPrometheus(TestCase):
 
     def setUp(self):
+        prometheus_client.clear()
         MonitorUrl.objects.create(
             name='prometheus', monitor_url='127.0.0.1:19011')
         hts = list()
@@ -73,7 +75,7 @@ class TestPrometheus(TestCase):
             1633782875.771, "11.04166666666666"]}
     ]}}
 
-    @mock.patch.object(requests, 'get', return_value='')
+    @mock.patch.object(requests.Session, 'get', return_value='')
     def test_get_prometheus_info(self, mock_post):
         mock_post.return_value = MockResponse(self.request_get_response)
         prometheus = Prometheus()
@@ -93,7 +95,7 @@ class TestPrometheus(TestCase):
         result_warning = p.get_host_metric_status('cpu', 81)
         self.assertEqual(result_warning, 'warning')
 
-    @mock.patch.object(requests, 'get', return_value='')
+    @mock.patch.object(requests.Session, 'get', return_value='')
     def test_error_get_host_arg_usage(self, mock_get):
         mock_get.return_value = MockResponse(self.error_request_get_response)
         p = Prometheus()
@@ -150,6 +152,28 @@ class TestPrometheus(TestCase):
         self.assertEqual(result_get_host_data_disk_usage, [{'1': 1, 'data_disk_usage': None, 'data_disk_status': None},
                                                            {'2': 2, 'data_disk_usage': None, 'data_disk_status': None}])
 
+    @mock.patch.object(requests.Session, 'get', return_value='')
+    def test_get_host_info_batched(self, mock_get):
+        mock_get.return_value = MockResponse(self.request_get_response)
+        host_list = [
+            {'ip': '10.0.3.71', 'data_folder': '/data'},
+            {'ip': '10.0.3.72', 'data_folder': '/data'},
+        ]
+        result = Prometheus().get_host_info(host_list)
+        # cpu/mem/根分区各一次，相同数据分区合并为一次
+        self.assertEqual(mock_get.call_count, 4)
+        for call in mock_get.call_args_list:
+            self.assertIn(
+                r'instance=~`10\.0\.3\.71|10\.0\.3\.72`',
+                call[1]["params"]["query"])
+        self.assertEqual(result[0].get("cpu_usage"), 12)
+        self.assertEqual(result[1].get("data_disk_usage"), 12)
+
+    def test_instance_matcher(self):
+        matcher = Prometheus.instance_matcher(
+            ["10.0.3.72", "10.0.3.71", "10.0.3.71"])
+        self.assertEqual(matcher, r'instance=~`10\.0\.3\.71|10\.0\.3\.72`')
+
     def tearDown(self):
         MonitorUrl.objects.filter(name='prometheus').delete()
         HostThreshold.objects.filter(env_id=1).delete()
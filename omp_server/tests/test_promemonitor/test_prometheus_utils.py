@@ -19,6 +19,7 @@ import requests
 
 from tests.base import BaseTest
 from omp_server.settings import PROJECT_DIR
+from promemonitor import tasks as promemonitor_tasks
 from promemonitor.prometheus_utils import PrometheusUtils
 
 
@@ -285,6 +286,101 @@ class PrometheusUtilsTest(BaseTest):
         self.assertEqual(flag, True)
         h2.delete()
 
+    def read_targets(self, job_name):
+        with open(self.prometheus_obj.target_registry.file_path(job_name)) as fp:
+            return json.load(fp)
+
+    @mock.patch.object(requests, 'post', return_value='')
+    def test_add_services_batch(self, mock_post):
+        """
+        测试批量添加服务，每个任务写一次文件，每台主机通知一次，重载合并
+        :return:
+        """
+        mock_post.return_value = MockResponse(
+            {"return_code": 0, "message": "success"})
+        service_data_list = [
+            {"service_name": "mysql", "instance_name": f"mysql_{ip}",
+             "env": "default", "ip": ip, "listen_port": "3306"}
+            for ip in ("10.0.0.1", "10.0.0.2")
+        ] + [{"service_name": "redis", "instance_name": "redis_1",
+              "env": "default", "ip": "10.0.0.1", "listen_port": "6379"}]
+        with mock.patch.object(
+                promemonitor_tasks, "mark_reload_pending",
+                side_effect=[True, False]), \
+                mock.patch.object(promemonitor_tasks.reload_prometheus_config,
+                                  "apply_async") as mock_reload:
+            self.assertEqual(
+                self.prometheus_obj.add_services(service_data_list)[0], True)
+            self.assertEqual(
+                self.prometheus_obj.add_services(service_data_list[:1])[0],
+                True)
+        mock_reload.assert_called_once()
+        # 每台主机通知一次 monitor agent
+        self.assertEqual(mock_post.call_count, 2 + 1)
+        self.assertEqual(
+            [item["labels"]["instance"]
+             for item in self.read_targets("mysqlExporter")],
+            ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(len(self.read_targets("redisExporter")), 1)
+        conf = self.prometheus_obj.get_dic_from_yaml(
+            self.prometheus_obj.prometheus_conf_path)
+        self.assertEqual(
+            [item["job_name"] for item in conf["scrape_configs"]],
+            ["mysqlExporter", "redisExporter"])
+        # 原子写入不残留临时文件
+        self.assertEqual(
+            sorted(os.listdir(self.prometheus_obj.prometheus_targets_path)),
+            ["mysqlExporter_all.json", "redisExporter_all.json"])
+
+    def test_add_services_agent_failed(self):
+        """
+        测试批量添加服务时单台主机的agent更新失败，其余主机继续更新并重载
+        :return:
+        """
+        service_data_list = [
+            {"service_name": "mysql", "instance_name": f"mysql_{ip}",
+             "env": "default", "ip": ip, "listen_port": "3306"}
+            for ip in ("10.0.0.1", "10.0.0.2")
+        ]
+        with mock.patch.object(
+                self.prometheus_obj, "update_agent_service",
+                side_effect=[(False, "timeout"), (True, "success")]
+        ) as mock_update, mock.patch.object(
+                self.prometheus_obj, "request_reload") as mock_reload:
+            flag, msg = self.prometheus_obj.add_services(service_data_list)
+        self.assertEqual(flag, False)
+        self.assertEqual(msg, "10.0.0.1: timeout")
+        self.assertEqual(mock_update.call_count, 2)
+        mock_reload.assert_called_once()
+        self.assertEqual(len(self.read_targets("mysqlExporter")), 2)
+
+    def test_delete_node_with_legacy_file(self):
+        """
+        测试删除升级前生成的 targets 文件中的主机
+        :return:
+        """
+        legacy = [
+            {"targets": [f"{ip}:19031"],
+             "labels": {"instance": ip, "instance_name": ip,
+                        "service_type": "host", "env": "default"}}
+            for ip in ("10.0.0.1", "10.0.0.2")
+        ]
+        with open(self.prometheus_obj.node_exporter_targets_file, "w") as fp:
+            json.dump(legacy, fp)
+        flag, _ = self.prometheus_obj.delete_node(
+            [{"ip": "10.0.0.1", "env": "default"}])
+        self.assertEqual(flag, True)
+        self.assertEqual(self.read_targets("nodeExporter"), legacy[1:])
+        # 重复添加同一主机只保留一条
+        with mock.patch.object(PrometheusUtils, "request_reload"):
+            self.prometheus_obj.add_node(
+                [{"ip": "10.0.0.2", "env": "default", "data_path": "",
+                  "instance_name": "node_2"}] * 2)
+        target_list = self.read_targets("nodeExporter")
+        self.assertEqual(len(target_list), 1)
+        self.assertEqual(
+            target_list[0]["labels"]["instance_name"], "node_2")
+
     def tearDown(self) -> None:
         """
         测试结束操作
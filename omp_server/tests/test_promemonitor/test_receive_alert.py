@@ -1,9 +1,12 @@
+import copy
 import json
+from unittest import mock
 
 from rest_framework.reverse import reverse
 
 from tests.base import AutoLoginTest
 from db_models.models import Host, Alert
+from promemonitor.alert_util import AlertIngestion
 
 
 class MockResponse:
@@ -127,6 +130,85 @@ class ReceiveAlertTest(AutoLoginTest):
         self.assertEqual(resp.get("message"), "success")
         self.assertIsNotNone(resp.get('data'))
 
+    @mock.patch("promemonitor.promemonitor_serializers.self_healing")
+    def test_receive_alerts_dedup(self, mock_self_healing):
+        """
+        同批次及重复推送的告警按 (fingerprint, alert_time) 去重，告警计数聚合更新
+        """
+        data = copy.deepcopy(self.origin_alert_str)
+        data["alerts"].append(copy.deepcopy(data["alerts"][0]))
+        resolved = copy.deepcopy(data["alerts"][0])
+        resolved.update(status="resolved", fingerprint="resolved0000")
+        data["alerts"].append(resolved)
+        cpu_alert = copy.deepcopy(data["alerts"][0])
+        cpu_alert.update(
+            startsAt="2021-06-26T09:13:32.950510932Z",
+            fingerprint="aaaa0000bbbb1111")
+        data["alerts"].append(cpu_alert)
+        resp = self.post(self.receive_alert_url, data).json()
+        self.assertEqual(resp.get("code"), 0)
+        queryset = Alert.objects.filter(alert_host_ip="10.0.7.146")
+        self.assertEqual(queryset.count(), 2)
+        self.assertEqual(
+            Host.objects.get(ip="10.0.7.146").alert_num, 2)
+        new_ids = mock_self_healing.delay.call_args[0][0]
+        self.assertEqual(
+            sorted(new_ids), sorted(queryset.values_list("id", flat=True)))
+
+        # 重复推送不再入库，仅刷新告警描述
+        data["alerts"][-1]["annotations"]["description"] = "updated"
+        self.post(self.receive_alert_url, data)
+        self.assertEqual(queryset.count(), 2)
+        self.assertEqual(
+            Host.objects.get(ip="10.0.7.146").alert_num, 2)
+        self.assertEqual(mock_self_healing.delay.call_args[0][0], [])
+        self.assertTrue(
+            queryset.filter(alert_describe="updated").exists())
+
+    @mock.patch("promemonitor.promemonitor_serializers.self_healing")
+    def test_receive_alerts_without_fingerprint(self, mock_self_healing):
+        """
+        未携带 fingerprint 的告警按标签区分，返回全部新增告警 id
+        """
+        data = copy.deepcopy(self.origin_alert_str)
+        data["alerts"] = data["alerts"][:1]
+        mem_alert = copy.deepcopy(data["alerts"][0])
+        mem_alert["labels"]["alertname"] = "host mem_used critical alert"
+        data["alerts"].append(mem_alert)
+        for item in data["alerts"]:
+            item.pop("fingerprint")
+        self.post(self.receive_alert_url, data)
+        queryset = Alert.objects.filter(alert_host_ip="10.0.7.146")
+        self.assertEqual(queryset.count(), 2)
+        self.assertEqual(
+            sorted(mock_self_healing.delay.call_args[0][0]),
+            sorted(queryset.values_list("id", flat=True)))
+        self.post(self.receive_alert_url, data)
+        self.assertEqual(queryset.count(), 2)
+        self.assertEqual(mock_self_healing.delay.call_args[0][0], [])
+
+    def test_create_alerts_conflict(self):
+        """
+        并发写入同一告警时跳过冲突的告警，仅返回本次写入的告警
+        """
+        alert_info = {
+            "alert_type": "host", "alert_host_ip": "10.0.7.146",
+            "alert_service_name": "", "alert_instance_name": "mysql_instance_1",
+            "alert_level": "critical", "alert_describe": "", "alert_receiver": "",
+            "alert_time": "2021-06-26 16:13:32", "fingerprint": "fp0"
+        }
+        exists_alert = AlertIngestion.build_alert(alert_info)
+        exists_alert.save()
+        alert_list = [AlertIngestion.build_alert(alert_info)]
+        alert_info["fingerprint"] = "fp1"
+        alert_list.append(AlertIngestion.build_alert(alert_info))
+        created_list = AlertIngestion.create_alerts(alert_list)
+        self.assertEqual(
+            [alert.fingerprint for alert in created_list], ["fp1"])
+        self.assertEqual(
+            created_list[0].id, Alert.objects.get(fingerprint="fp1").id)
+        self.assertEqual(Alert.objects.filter(fingerprint="fp0").count(), 1)
+
     def test_alert_util_exception(self):
         """测试alert_util中的异常处理"""
         from promemonitor.alert_util import get_monitor_url, get_log_url, utc_to_local
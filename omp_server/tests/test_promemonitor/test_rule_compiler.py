@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import yaml
+from django.test import TestCase
+from rest_framework.reverse import reverse
+
+from db_models.models import AlertRule, Env
+from promemonitor import rule_compiler
+from promemonitor.prometheus_utils import PrometheusUtils
+from promemonitor.rule_compiler import RuleCompiler, rule_batch
+from tests.base import AutoLoginTest
+from utils.prometheus.client import PrometheusRequestError
+
+
+class RuleCompilerTest(TestCase):
+    """ 告警规则编译测试类 """
+
+    def setUp(self):
+        self.rules_path = tempfile.mkdtemp()
+        self.env = Env.objects.create(name="default")
+        self.compiler = RuleCompiler(self.rules_path)
+        self.query_patch = mock.patch.object(
+            rule_compiler.prometheus_client, "query", return_value={})
+        self.mock_query = self.query_patch.start()
+        RuleCompiler._valid_exprs.clear()
+
+    def tearDown(self):
+        self.query_patch.stop()
+        shutil.rmtree(self.rules_path)
+
+    def create_rule(self, service, expr, status=1):
+        return AlertRule.objects.create(
+            env_id=self.env.id, expr=expr, threshold_value=80,
+            compare_str=">=", for_time="60s", severity="warning",
+            alert=f"{service} alert", service=service, status=status,
+            labels={"job": f"{service}Exporter", "severity": "warning"})
+
+    def test_compile_group(self):
+        """ 按环境、分组生成文件，未变化的分组不再写入 """
+        self.create_rule("node", "node_load1")
+        mysql_rule = self.create_rule("mysql", "mysql_up")
+        self.create_rule("mysql", "mysql_disabled", status=0)
+        legacy_path = os.path.join(self.rules_path, "default_rule.yml")
+        with open(legacy_path, "w") as fp:
+            fp.write("groups: []\n")
+
+        self.assertEqual(self.compiler.compile(), (True, True, "success"))
+        self.assertEqual(sorted(os.listdir(self.rules_path)), [
+            "default_alert_mysql_rule.yml", "default_alert_node_rule.yml"])
+        with open(self.compiler.file_path("default", "mysql")) as fp:
+            content = yaml.safe_load(fp)
+        rules = content["groups"][0]["rules"]
+        self.assertEqual(
+            [rule["expr"] for rule in rules], ["mysql_up >= 80.0"])
+
+        self.mock_query.reset_mock()
+        with mock.patch.object(rule_compiler, "atomic_write") as mock_write:
+            self.assertEqual(
+                self.compiler.compile(), (True, False, "success"))
+            mock_write.assert_not_called()
+
+            AlertRule.objects.filter(id=mysql_rule.id).update(
+                threshold_value=90)
+            self.compiler.compile()
+            mock_write.assert_called_once()
+            self.assertEqual(
+                mock_write.call_args[0][0],
+                self.compiler.file_path("default", "mysql"))
+        # 校验过的表达式不再重复校验
+        self.assertEqual(
+            [call[0][0] for call in self.mock_query.call_args_list],
+            ["mysql_up >= 90.0"])
+
+        AlertRule.objects.filter(service="mysql").update(status=0)
+        self.assertEqual(self.compiler.compile(), (True, True, "success"))
+        self.assertEqual(
+            os.listdir(self.rules_path), ["default_alert_node_rule.yml"])
+
+    def test_validate_failed(self):
+        """ 表达式校验失败的分组不写入 """
+        self.create_rule("node", "node_load1")
+        self.create_rule("mysql", "mysql_up{")
+
+        def query(expr, **kwargs):
+            if "{" in expr:
+                raise PrometheusRequestError("parse error")
+            return {}
+
+        self.mock_query.side_effect = query
+        is_success, changed, message = self.compiler.compile()
+        self.assertEqual((is_success, changed), (False, True))
+        self.assertIn("parse error", message)
+        self.assertEqual(
+            os.listdir(self.rules_path), ["default_alert_node_rule.yml"])
+
+    def test_batch(self):
+        """ 批量修改只编译及重载一次 """
+        self.create_rule("node", "node_load1")
+        with mock.patch.object(
+                RuleCompiler, "compile",
+                return_value=(True, True, "success")) as mock_compile, \
+                mock.patch("promemonitor.tasks.request_prometheus_reload") \
+                as mock_reload:
+            with rule_batch(self.compiler) as batch:
+                for _ in range(3):
+                    with rule_batch(self.compiler) as inner_batch:
+                        self.assertIs(inner_batch, batch)
+                        inner_batch.dirty = True
+                mock_compile.assert_not_called()
+            mock_compile.assert_called_once()
+            mock_reload.assert_called_once()
+        self.assertEqual(batch.result, (True, "success"))
+
+
+class QuotaViewTest(AutoLoginTest):
+    """ 指标规则接口测试类 """
+
+    def setUp(self):
+        super(QuotaViewTest, self).setUp()
+        self.env = Env.objects.create(name="default")
+        self.quota_url = reverse("quota-list")
+
+    @mock.patch.object(PrometheusUtils, "reload_prometheus", return_value=True)
+    @mock.patch.object(RuleCompiler, "validate_rules",
+                       return_value=(True, "success"))
+    def test_create_rollback(self, mock_validate, mock_reload):
+        """ 规则文件写入失败时不保存规则，可重新添加 """
+        data = {
+            "env_id": self.env.id, "quota_type": 1, "expr": "mysql_up",
+            "threshold_value": 1, "compare_str": "<", "for_time": "60s",
+            "severity": "critical", "alert": "mysql down",
+            "service": "mysql", "status": 1}
+        with mock.patch.object(
+                PrometheusUtils, "update_rule_file", return_value=False):
+            resp = self.post(self.quota_url, data=dict(data)).json()
+        self.assertEqual(resp.get("code"), 1)
+        self.assertFalse(AlertRule.objects.filter(expr="mysql_up").exists())
+
+        with mock.patch.object(
+                PrometheusUtils, "update_rule_file", return_value=True):
+            resp = self.post(self.quota_url, data=dict(data)).json()
+        self.assertEqual(resp.get("code"), 0)
+        self.assertTrue(AlertRule.objects.filter(expr="mysql_up").exists())
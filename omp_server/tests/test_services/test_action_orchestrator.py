@@ -0,0 +1,175 @@
+import re
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from db_models.models import ApplicationHub, Service, ServiceHistory
+from services import action_orchestrator
+from services.action_orchestrator import ServiceActionOrchestrator
+from utils.plugin.salt_client import SaltClient
+
+
+class ServiceActionOrchestratorTest(TestCase):
+    """ 服务启停编排测试类 """
+
+    def setUp(self):
+        mysql_app = ApplicationHub.objects.create(
+            app_name="mysql", app_version="5.7.31")
+        redis_app = ApplicationHub.objects.create(
+            app_name="redis", app_version="5.0.1")
+        test_app = ApplicationHub.objects.create(
+            app_name="test_app", app_version="1.0.0",
+            app_type=ApplicationHub.APP_TYPE_SERVICE)
+        self.mysql = self.create_service("10.0.0.1", "mysql-0-1", mysql_app)
+        self.redis = self.create_service("10.0.0.2", "redis-0-2", redis_app)
+        self.test_app = self.create_service(
+            "10.0.0.2", "test_app-0-2", test_app,
+            service_dependence=json.dumps([{
+                "name": "mysql", "instance_name": "mysql-0-1",
+                "cluster_name": None}]))
+        # {(ip, service_name): status}
+        self.status_dic = dict()
+        self.status_patch = mock.patch.object(
+            action_orchestrator.monitor_agent_client, "service_status",
+            side_effect=self.service_status)
+        self.status_patch.start()
+
+    def tearDown(self):
+        self.status_patch.stop()
+
+    @staticmethod
+    def create_service(ip, name, app, **kwargs):
+        return Service.objects.create(
+            ip=ip, service_instance_name=name, service=app,
+            service_status=Service.SERVICE_STATUS_STOP,
+            service_controllers={
+                "start": f"bash /data/{name}/start",
+                "stop": f"bash /data/{name}/stop"},
+            **kwargs)
+
+    def service_status(self, request_ls, **kwargs):
+        beans = [
+            dict(item, status=self.status_dic[
+                (item["ip"], item["service_name"])])
+            for item in request_ls
+            if (item["ip"], item["service_name"]) in self.status_dic
+        ]
+        return beans, list()
+
+    @staticmethod
+    def mock_cmd(rc_dic=None):
+        """ 按命令中的返回码标记返回执行结果 """
+        rc_dic = rc_dic or dict()
+
+        def cmd(target, command, timeout):
+            info = "\n".join(
+                f"{action_orchestrator.RC_MARKER}{node_id}="
+                f"{rc_dic.get(node_id, 0)}"
+                for node_id in re.findall(
+                    rf"echo {action_orchestrator.RC_MARKER}(\d+)", command))
+            return True, info
+        return mock.patch.object(SaltClient, "cmd", side_effect=cmd)
+
+    def test_start_by_dependence(self):
+        """ 依赖服务状态就绪后立即启动，每台主机一次调用 """
+        orchestrator = ServiceActionOrchestrator.create(
+            "1", [self.mysql.id, self.redis.id, self.test_app.id], "admin")
+        self.assertEqual(
+            Service.objects.filter(
+                service_status=Service.SERVICE_STATUS_STARTING).count(), 3)
+        self.status_dic = {
+            ("10.0.0.1", "mysql"): 0, ("10.0.0.2", "redis"): 0}
+        with self.mock_cmd() as mock_cmd:
+            countdown = orchestrator.step()
+            self.assertEqual(
+                sorted(call[0][0] for call in mock_cmd.call_args_list),
+                ["10.0.0.1", "10.0.0.2"])
+            self.assertEqual(countdown, action_orchestrator.POLL_INTERVAL)
+
+            # 状态未就绪时查询间隔加倍
+            countdown = orchestrator.step()
+            self.assertEqual(
+                countdown, action_orchestrator.POLL_INTERVAL * 2)
+
+            # mysql 未就绪时不启动 test_app
+            self.status_dic[("10.0.0.2", "redis")] = 1
+            orchestrator.step()
+            self.assertEqual(mock_cmd.call_count, 2)
+            self.redis.refresh_from_db()
+            self.assertEqual(
+                self.redis.service_status, Service.SERVICE_STATUS_NORMAL)
+
+            self.status_dic[("10.0.0.1", "mysql")] = 1
+            orchestrator.step()
+            self.assertEqual(mock_cmd.call_count, 3)
+            self.assertIn("test_app-0-2", mock_cmd.call_args[0][1])
+
+            self.status_dic[("10.0.0.2", "test_app")] = 1
+            self.assertIsNone(orchestrator.step())
+        self.assertEqual(
+            Service.objects.filter(
+                service_status=Service.SERVICE_STATUS_NORMAL).count(), 3)
+        self.assertEqual(ServiceHistory.objects.count(), 3)
+
+    def test_start_failed(self):
+        """ 命令执行失败的服务及依赖它的服务启动失败 """
+        orchestrator = ServiceActionOrchestrator.create(
+            "start", [self.mysql.id, self.test_app.id], "admin")
+        with self.mock_cmd({str(self.mysql.id): 1}) as mock_cmd:
+            self.assertEqual(orchestrator.run(), {
+                "mysql-0-1": False, "test_app-0-2": False})
+            mock_cmd.assert_called_once()
+        self.assertEqual(
+            Service.objects.filter(
+                service_status=Service.SERVICE_STATUS_STOP).count(), 3)
+        self.assertEqual(
+            ServiceHistory.objects.filter(result="failure").count(), 2)
+
+    def test_restart(self):
+        """ 重启时先按依赖反向停止，再按依赖启动 """
+        orchestrator = ServiceActionOrchestrator.create(
+            "restart", [self.mysql.id, self.test_app.id], "admin")
+        with self.mock_cmd() as mock_cmd:
+            self.assertEqual(orchestrator.run(), {
+                "mysql-0-1": True, "test_app-0-2": True})
+        self.assertEqual(
+            [call[0][1].split(";")[0] for call in mock_cmd.call_args_list], [
+                "( bash /data/test_app-0-2/stop )",
+                "( bash /data/mysql-0-1/stop )",
+                "( bash /data/mysql-0-1/start )",
+                "( bash /data/test_app-0-2/start )"])
+        self.assertEqual(ServiceHistory.objects.count(), 2)
+
+    def test_restart_controller(self):
+        """ 具有 restart 命令的服务直接执行 restart，不具有停止命令的服务不重启 """
+        self.mysql.service_controllers = {
+            "restart": "bash /data/mysql-0-1/restart"}
+        self.mysql.save()
+        self.redis.service_controllers = {
+            "start": "bash /data/redis-0-2/start"}
+        self.redis.save()
+        orchestrator = ServiceActionOrchestrator.create(
+            "restart", [self.mysql.id, self.redis.id], "admin")
+        self.assertEqual(orchestrator.plan["phases"], ["restart"])
+        with self.mock_cmd() as mock_cmd:
+            self.assertEqual(orchestrator.run(), {"mysql-0-1": True})
+        self.assertEqual(
+            [call[0][1].split(";")[0] for call in mock_cmd.call_args_list],
+            ["( bash /data/mysql-0-1/restart )"])
+
+    def test_restart_mixed_controller(self):
+        """ 同时重启时 restart 命令在启动阶段按依赖执行 """
+        self.mysql.service_controllers = {
+            "restart": "bash /data/mysql-0-1/restart"}
+        self.mysql.save()
+        orchestrator = ServiceActionOrchestrator.create(
+            "restart", [self.mysql.id, self.test_app.id], "admin")
+        with self.mock_cmd() as mock_cmd:
+            self.assertEqual(orchestrator.run(), {
+                "mysql-0-1": True, "test_app-0-2": True})
+        self.assertEqual(
+            [call[0][1].split(";")[0] for call in mock_cmd.call_args_list], [
+                "( bash /data/test_app-0-2/stop )",
+                "( bash /data/mysql-0-1/restart )",
+                "( bash /data/test_app-0-2/start )"])
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.test import TestCase
+from redis.exceptions import LockError
+
+from db_models.models import SelfHealingHistory, SelfHealingSetting
+from services import self_healing
+from utils.plugin.salt_client import SaltClient
+
+
+class FakeRedis(object):
+    """ 记录调度锁持有状态的 redis """
+
+    def __init__(self):
+        self.held = False
+        self.locked = False
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        if self.locked:
+            raise LockError("lock timeout")
+        return self
+
+    def __enter__(self):
+        self.held = True
+        return self
+
+    def __exit__(self, *args):
+        self.held = False
+        return False
+
+
+class SelfHealingStateTest(TestCase):
+    """ 服务自愈状态流转测试类 """
+
+    def setUp(self):
+        SelfHealingSetting.objects.create(used=True, max_healing_count=2)
+        self.patchers = [
+            mock.patch.object(self_healing.restart_self_healing, "delay"),
+            mock.patch.object(self_healing.verify_self_healing, "delay"),
+            mock.patch.object(self_healing.verify_self_healing, "apply_async"),
+            mock.patch.object(self_healing.dispatch_self_healing, "delay"),
+        ]
+        self.mock_restart, self.mock_verify, self.mock_verify_async, \
+            self.mock_dispatch = [patcher.start() for patcher in self.patchers]
+        self.redis = FakeRedis()
+        self.patchers.append(
+            mock.patch("redis.Redis", return_value=self.redis))
+        self.patchers[-1].start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    @staticmethod
+    def create_history(ip, name, **kwargs):
+        data = {
+            "host_ip": ip,
+            "instance_name": name,
+            "service_name": name,
+            "next_run_time": datetime.now() - timedelta(seconds=1),
+            "healing_log": {
+                "ip": ip, "start": f"bash /data/{name}/bin/start",
+                "service_instance_name": name},
+        }
+        data.update(kwargs)
+        return SelfHealingHistory.objects.create(**data)
+
+    @mock.patch.object(self_healing, "MAX_CONCURRENT", 3)
+    @mock.patch.object(self_healing, "MAX_PER_HOST", 2)
+    def test_dispatch_limit(self):
+        """ 按全局及单主机并发数下发重启 """
+        for index in range(4):
+            self.create_history("10.0.0.1", f"a_{index}")
+        self.create_history("10.0.0.2", "b_0")
+        self.create_history("10.0.0.2", "b_1")
+        self_healing.dispatch_self_healing()
+        restarting = SelfHealingHistory.objects.filter(
+            healing_step=SelfHealingHistory.STEP_RESTARTING)
+        self.assertEqual(
+            sorted(restarting.values_list("instance_name", flat=True)),
+            ["a_0", "a_1", "b_0"])
+        self.assertEqual(self.mock_restart.call_count, 3)
+        self.assertEqual(
+            set(restarting.values_list("healing_count", flat=True)), {1})
+
+        # 并发数已满时不再下发
+        self_healing.dispatch_self_healing()
+        self.assertEqual(self.mock_restart.call_count, 3)
+
+    def test_dispatch_lock(self):
+        """ 持有调度锁时才认领记录，获取锁超时不下发 """
+        history = self.create_history("10.0.0.1", "a")
+        self.redis.locked = True
+        self_healing.dispatch_self_healing()
+        self.mock_restart.assert_not_called()
+        self.redis.locked = False
+        self.mock_restart.side_effect = \
+            lambda *args: self.assertTrue(self.redis.held)
+        self_healing.dispatch_self_healing()
+        self.mock_restart.assert_called_once_with(history.id)
+        self.assertFalse(self.redis.held)
+
+    def test_restart(self):
+        """ 重启成功后延时校验，失败后结束自愈 """
+        history_ok = self.create_history(
+            "10.0.0.1", "a", healing_step=SelfHealingHistory.STEP_RESTARTING)
+        history_failed = self.create_history(
+            "10.0.0.1", "b", healing_step=SelfHealingHistory.STEP_RESTARTING)
+        with mock.patch.object(
+                SaltClient, "cmd",
+                side_effect=[(True, "ok"), (False, "failed")]) as mock_cmd:
+            self_healing.restart_self_healing(history_ok.id)
+            self_healing.restart_self_healing(history_failed.id)
+        self.assertEqual(
+            mock_cmd.call_args_list[0][1]["command"],
+            "bash /data/a/bin/restart")
+        history_ok.refresh_from_db()
+        history_failed.refresh_from_db()
+        self.assertEqual(
+            history_ok.healing_step, SelfHealingHistory.STEP_VERIFYING)
+        self.assertEqual(history_failed.state, SelfHealingHistory.HEALING_FAIL)
+        self.mock_verify_async.assert_called_once_with(
+            countdown=self_healing.VERIFY_DELAY + 1)
+        self.assertEqual(self.mock_dispatch.call_count, 2)
+
+    def test_verify(self):
+        """ 同一主机批量校验，未恢复的服务重新等待重启或达到次数后失败 """
+        step = SelfHealingHistory.STEP_VERIFYING
+        history_ok = self.create_history(
+            "10.0.0.1", "a", healing_step=step, healing_count=1)
+        history_retry = self.create_history(
+            "10.0.0.1", "b", healing_step=step, healing_count=1)
+        history_failed = self.create_history(
+            "10.0.0.1", "c", healing_step=step, healing_count=2)
+        history_later = self.create_history(
+            "10.0.0.1", "d", healing_step=step,
+            next_run_time=datetime.now() + timedelta(seconds=60))
+        with mock.patch.object(
+                self_healing, "get_service_status_direct",
+                return_value=[
+                    {"ip": "10.0.0.1", "service_name": "a", "status": 1},
+                    {"ip": "10.0.0.1", "service_name": "b", "status": 0},
+                ]) as mock_status:
+            self_healing.verify_self_healing()
+        mock_status.assert_called_once()
+        self.assertEqual(len(mock_status.call_args[0][0]), 3)
+        for history_obj in (
+                history_ok, history_retry, history_failed, history_later):
+            history_obj.refresh_from_db()
+        self.assertEqual(history_ok.state, SelfHealingHistory.HEALING_SUCCESS)
+        self.assertEqual(
+            history_retry.healing_step, SelfHealingHistory.STEP_PENDING)
+        self.assertEqual(history_retry.state, SelfHealingHistory.HEALING_ING)
+        self.assertEqual(history_failed.state, SelfHealingHistory.HEALING_FAIL)
+        self.assertEqual(history_later.healing_step, step)
+        self.mock_dispatch.assert_called_once()
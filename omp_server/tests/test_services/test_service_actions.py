@@ -138,9 +138,10 @@ class ListActionTest(AutoLoginTest, ServicesResourceMixin):
         self.assertEqual(history_count, 0)
         self.assertEqual(new_service, 0)
 
+    @mock.patch("services.views.start_service_action")
     @mock.patch("services.tasks.exec_action.delay",
                 return_value=True)
-    def test_service_action_post(self, tasks):
+    def test_service_action_post(self, tasks, start_service_action):
         # 参数正常 -> 成功
         resp = self.post(self.create_action_url, {"data": [{
             "action": "1",
@@ -148,6 +149,7 @@ class ListActionTest(AutoLoginTest, ServicesResourceMixin):
             "operation_user": "admin",
         }]}).json()
         self.assertEqual(resp.get("code"), 0)
+        start_service_action.assert_called_once_with("1", ["1"], "admin")
         # 参数缺失 -> 失败
         resp = self.post(self.create_action_url, {"data": [{
             "action": "1",
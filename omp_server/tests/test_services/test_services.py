@@ -1,4 +1,6 @@
 import random
+from unittest import mock
+
 from rest_framework.reverse import reverse
 
 from db_models.models import Service
@@ -121,6 +123,42 @@ class ListServiceTest(AutoLoginTest, ServicesResourceMixin):
                 "service_instance_name", flat=True))[:10]
         self.assertEqual(instance_name_ls, target_instance_name_ls)
 
+    @mock.patch("services.views.get_service_status_dict",
+                return_value=(True, {}))
+    @mock.patch("promemonitor.prometheus.Prometheus.get_all_service_status",
+                return_value=(False, {}))
+    def test_services_status_fallback(self, mock_prometheus, mock_status):
+        """ prometheus 不可用时只获取当前页服务的状态 """
+        resp = self.get(self.list_service_url, {"size": 5}).json()
+        self.assertEqual(resp.get("code"), 0)
+        status_ls = (
+            Service.SERVICE_STATUS_NORMAL, Service.SERVICE_STATUS_STOP)
+        page_keys = [
+            (service.ip, service.service_instance_name)
+            for service in Service.objects.filter(
+                service_instance_name__in=[
+                    item.get("service_instance_name")
+                    for item in resp.get("data").get("results")],
+                service_status__in=status_ls)
+        ]
+        self.assertEqual(
+            sorted(mock_status.call_args[0][0]), sorted(page_keys))
+
+        # 服务状态接口传入 page 参数时分页返回
+        status_url = reverse("serviceStatus-list")
+        resp = self.get(status_url, {"page": 1, "size": 5}).json()
+        self.assertEqual(len(resp.get("data").get("results")), 5)
+        self.assertLessEqual(len(mock_status.call_args[0][0]), 5)
+        resp = self.get(status_url).json()
+        self.assertEqual(
+            len(resp.get("data")),
+            Service.objects.filter(service__is_base_env=False).count())
+        self.assertEqual(
+            len(mock_status.call_args[0][0]),
+            Service.objects.filter(
+                service__is_base_env=False,
+                service_status__in=status_ls).count())
+
 
 class ServiceDetailTest(AutoLoginTest, ServicesResourceMixin):
     """ 服务详情测试类 """
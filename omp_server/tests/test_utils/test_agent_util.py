@@ -10,8 +10,11 @@
 主机Agent使用的测试代码
 """
 
+import io
 import os
 import shutil
+import tarfile
+import tempfile
 from unittest import mock
 
 from tests.base import BaseTest
@@ -227,3 +230,49 @@ class AgentUtilTest(BaseTest):
         """
         self.assertEqual(self.agent.agent_manage(
             "test", "/data/omp_salt_agent")[0], False)
+
+    def test_write_bundle(self):
+        """
+        测试单通道部署 tar 包内容
+        :return:
+        """
+        with tempfile.NamedTemporaryFile(suffix=".tar.gz") as fp:
+            fp.write(b"agent")
+            fp.flush()
+            self.agent.agent_file_path = fp.name
+            buffer = io.BytesIO()
+            self.agent.write_bundle(buffer)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer, mode="r") as tar:
+            self.assertEqual(tar.getnames(), [
+                ".omp_bootstrap/omp_salt_agent.tar.gz",
+                ".omp_bootstrap/minion",
+                ".omp_bootstrap/omp_salt_agent"
+            ])
+            minion = tar.extractfile(".omp_bootstrap/minion").read().decode()
+            self.assertIn("id: 127.0.0.1", minion)
+            script = tar.getmember(".omp_bootstrap/omp_salt_agent")
+            self.assertEqual(script.mode, 0o755)
+
+    @mock.patch.object(
+        SSH, "cmd_stream", return_value=(True, "INIT_OMP_SALT_AGENT_SUCCESS"))
+    def test_agent_bootstrap_success(self, cmd_stream):
+        """
+        测试单通道部署成功
+        :return:
+        """
+        self.assertEqual(self.agent.agent_bootstrap()[0], True)
+        command = cmd_stream.call_args[0][0]
+        self.assertIn("cd /data && tar xmf -", command)
+        self.assertEqual(cmd_stream.call_args[0][1], self.agent.write_bundle)
+
+    @mock.patch.object(SSH, "cmd_stream", return_value=(False, "failed"))
+    def test_agent_bootstrap_failed(self, cmd_stream):
+        """
+        测试单通道部署失败
+        :return:
+        """
+        self.assertEqual(self.agent.agent_bootstrap(), (False, "failed"))
+        cmd_stream.side_effect = Exception("connect failed")
+        self.assertEqual(
+            self.agent.agent_bootstrap(), (False, "connect failed"))
@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from db_models.models import ExecutionEventLog
+from utils.plugin.event_log import EventLogWriter, read_event_log
+
+
+class EventLogWriterTest(TestCase):
+    """ 执行过程日志测试类 """
+
+    def test_batch_write(self):
+        """ 缓冲区满后批量写入，flush 写入剩余日志 """
+        writer = EventLogWriter(
+            ExecutionEventLog.MODULE_INSTALL, flush_size=3, flush_interval=60)
+        for index in range(4):
+            writer.append(1, "send", f"line {index}\n")
+        self.assertEqual(ExecutionEventLog.objects.count(), 3)
+        writer.flush()
+        self.assertEqual(ExecutionEventLog.objects.count(), 4)
+
+    def test_read_since(self):
+        """ 按序号增量读取，重试时序号接续 """
+        writer = EventLogWriter(ExecutionEventLog.MODULE_INSTALL)
+        writer.append(1, "send", "a\n")
+        writer.append(2, "send", "other\n")
+        writer.append(1, "unzip", "b\n")
+        writer.flush()
+        log, seq = read_event_log(ExecutionEventLog.MODULE_INSTALL, 1)
+        self.assertEqual((log, seq), ("a\nb\n", 2))
+
+        writer = EventLogWriter(ExecutionEventLog.MODULE_INSTALL)
+        writer.append(1, "install", "c\n")
+        writer.flush()
+        self.assertEqual(
+            read_event_log(ExecutionEventLog.MODULE_INSTALL, 1, since=seq),
+            ("c\n", 3))
+        self.assertEqual(
+            read_event_log(ExecutionEventLog.MODULE_TOOL, 1, since=0),
+            ("", 0))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Project: test_monitor_agent_client
+# Create time: 2022-03-18
+# Introduction:
+
+"""
+monitor_agent 服务状态查询客户端单元测试代码
+"""
+
+import json
+from unittest import mock
+
+import requests
+from django.test import TestCase
+
+from services.self_heal_util import get_service_status_dict
+from utils.plugin.monitor_agent_client import MonitorAgentClient
+
+
+class MockResponse:
+    """
+    自定义mock response类
+    """
+
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(data)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def mock_post(url, data=None, **kwargs):
+    """ 10.0.0.2 无法访问，其他主机返回服务正常 """
+    if "10.0.0.2" in url:
+        raise requests.exceptions.ConnectTimeout("timeout")
+    beans = [dict(item, status=1) for item in json.loads(data)]
+    return MockResponse({"beans": beans})
+
+
+class MonitorAgentClientTest(TestCase):
+    service_list = [
+        {"ip": "10.0.0.1", "service_name": "mysql"},
+        {"ip": "10.0.0.1", "service_name": "redis"},
+        {"ip": "10.0.0.2", "service_name": "mysql"},
+        {"ip": "10.0.0.3", "service_name": "mysql"},
+    ]
+
+    def setUp(self):
+        self.client = MonitorAgentClient(timeout=2, cache_ttl=60)
+
+    @mock.patch.object(requests.Session, "post", side_effect=mock_post)
+    def test_service_status(self, mock_post_obj):
+        """ 按主机并发请求，失败主机不影响其他主机 """
+        beans, failed_hosts = self.client.service_status(self.service_list)
+        self.assertEqual(failed_hosts, ["10.0.0.2"])
+        self.assertEqual(
+            sorted((item["ip"], item["service_name"]) for item in beans),
+            [("10.0.0.1", "mysql"), ("10.0.0.1", "redis"),
+             ("10.0.0.3", "mysql")])
+        # 每台主机一次请求，并设置单主机超时
+        self.assertEqual(mock_post_obj.call_count, 3)
+        self.assertEqual(mock_post_obj.call_args[1]["timeout"], (1, 2))
+
+        # 成功的结果缓存，失败主机重新请求
+        mock_post_obj.reset_mock()
+        beans, failed_hosts = self.client.service_status(self.service_list)
+        self.assertEqual(len(beans), 3)
+        self.assertEqual(mock_post_obj.call_count, 1)
+        self.assertIn("10.0.0.2", mock_post_obj.call_args[0][0])
+
+        # 不使用缓存时全部重新请求
+        mock_post_obj.reset_mock()
+        self.client.service_status(self.service_list, cache_ttl=0)
+        self.assertEqual(mock_post_obj.call_count, 3)
+
+    @mock.patch.object(requests.Session, "post", side_effect=mock_post)
+    def test_service_status_dict(self, mock_post_obj):
+        """ 服务实例状态与 prometheus 格式一致 """
+        with mock.patch(
+                "services.self_heal_util.monitor_agent_client",
+                self.client):
+            is_success, status_dic = get_service_status_dict([
+                ("10.0.0.1", "mysql-1-1"), ("10.0.0.1", "mysql-1-2"),
+                ("10.0.0.2", "redis-1-1")])
+            self.assertTrue(is_success)
+            self.assertEqual(status_dic, {
+                "10.0.0.1_mysql-1-1": True, "10.0.0.1_mysql-1-2": True})
+            self.assertEqual(mock_post_obj.call_count, 2)
+            self.assertEqual(
+                get_service_status_dict([("10.0.0.2", "redis-1-1")]),
+                (False, {}))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Project: test_prometheus_client
+# Create time: 2022-03-14
+# Introduction:
+
+"""
+prometheus 共享查询客户端单元测试代码
+"""
+
+import json
+import threading
+import time
+from unittest import mock
+
+import requests
+from django.test import TestCase
+
+from db_models.models import MonitorUrl
+from utils.prometheus.client import PrometheusClient, PrometheusRequestError
+
+
+class MockResponse:
+    """
+    自定义mock response类
+    """
+
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(data)
+
+
+class PrometheusClientTest(TestCase):
+    success_response = {"status": "success", "data": {
+        "resultType": "vector", "result": [
+            {"metric": {"instance": "10.0.3.71"},
+             "value": [1633782875.771, "1"]}]}}
+
+    def setUp(self):
+        MonitorUrl.objects.create(
+            name="prometheus", monitor_url="10.0.0.1:19011")
+        self.client = PrometheusClient(timeout=5, cache_ttl=60)
+
+    @mock.patch.object(requests.Session, "get")
+    def test_query_cached(self, mock_get):
+        mock_get.return_value = MockResponse(self.success_response)
+        first = self.client.query("probe_success")
+        # 调用方修改返回值不影响缓存
+        first["status"] = "changed"
+        second = self.client.query("probe_success")
+        self.assertEqual(second, self.success_response)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(
+            mock_get.call_args[1]["url"],
+            "http://10.0.0.1:19011/api/v1/query")
+        # 不同的查询时间为不同的缓存键
+        self.client.query("probe_success", query_time=1633782875)
+        self.assertEqual(mock_get.call_count, 2)
+        stats = self.client.stats()
+        self.assertEqual(stats.get("hit"), 1)
+        self.assertEqual(stats.get("miss"), 2)
+
+    @mock.patch.object(requests.Session, "get")
+    def test_failure_not_cached(self, mock_get):
+        mock_get.return_value = MockResponse({"status": "error"})
+        self.assertEqual(
+            self.client.alerts().get("status"), "error")
+        mock_get.return_value = MockResponse("", status_code=503)
+        self.assertRaises(PrometheusRequestError, self.client.alerts)
+        mock_get.return_value = MockResponse(self.success_response)
+        self.client.alerts()
+        self.client.alerts()
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(self.client.stats().get("error"), 1)
+
+    @mock.patch.object(requests.Session, "get")
+    def test_no_cache(self, mock_get):
+        mock_get.return_value = MockResponse(self.success_response)
+        self.client.query("up", cache_ttl=0)
+        self.client.query("up", cache_ttl=0)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch.object(requests.Session, "get")
+    def test_in_flight_coalesced(self, mock_get):
+        release = threading.Event()
+
+        def slow_get(*args, **kwargs):
+            release.wait(5)
+            return MockResponse(self.success_response)
+
+        mock_get.side_effect = slow_get
+        # 预先解析地址，避免子线程访问数据库
+        self.assertEqual(self.client.address, "10.0.0.1:19011")
+        results = list()
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(self.client.alerts()))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        deadline = time.monotonic() + 5
+        while self.client.stats().get("coalesced") < 4 and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0], self.success_response)
@@ -9,12 +9,15 @@
 """
 salt client相关测试
 """
+import os
+import tempfile
 from unittest import mock
 
 import salt.client
 
+from db_models.models import SaltModuleSync
 from tests.base import BaseTest
-from utils.plugin.salt_client import SaltClient
+from utils.plugin.salt_client import SaltClient, get_salt_module_hash
 
 
 class SaltClientUtilTest(BaseTest):
@@ -231,3 +234,78 @@ class SaltClientUtilTest(BaseTest):
         :return:
         """
         self.assertEqual(self.obj.cp_file("*", "aa", "aa")[0], False)
+
+    @mock.patch("utils.plugin.salt_client.get_salt_module_hash",
+                return_value="hash_v1")
+    @mock.patch.object(salt.client.LocalClient, "cmd")
+    def test_sync_stale_modules(self, local_client, module_hash):
+        """
+        测试仅向模块版本落后的minion同步模块
+        :return:
+        """
+        local_client.return_value = {
+            "10.0.0.1": {'ret': [], 'retcode': 0},
+            "10.0.0.2": False,
+        }
+        flag, ret_dic = self.obj.sync_stale_modules(["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(flag, True)
+        self.assertEqual(ret_dic, {"10.0.0.1": True, "10.0.0.2": False})
+        self.assertEqual(local_client.call_args[1].get("tgt_type"), "list")
+        self.assertEqual(
+            list(SaltModuleSync.objects.values_list(
+                "minion_id", "module_hash")), [("10.0.0.1", "hash_v1")])
+
+        # 版本未变化时仅同步上次失败的minion
+        local_client.return_value = {"10.0.0.2": {'ret': [], 'retcode': 0}}
+        self.obj.sync_stale_modules(["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(local_client.call_args[1].get("tgt"), ["10.0.0.2"])
+        local_client.reset_mock()
+        flag, ret_dic = self.obj.sync_stale_modules(["10.0.0.1", "10.0.0.2"])
+        local_client.assert_not_called()
+        self.assertEqual(ret_dic, {"10.0.0.1": True, "10.0.0.2": True})
+
+        # 模块内容变化后全部重新同步
+        module_hash.return_value = "hash_v2"
+        local_client.return_value = {
+            "10.0.0.1": {'ret': [], 'retcode': 0},
+            "10.0.0.2": {'ret': [], 'retcode': 0},
+        }
+        self.obj.sync_stale_modules(["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(
+            local_client.call_args[1].get("tgt"), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(SaltModuleSync.objects.filter(
+            module_hash="hash_v2").count(), 2)
+
+    @mock.patch("utils.plugin.salt_client.get_salt_module_hash",
+                return_value="hash_v2")
+    @mock.patch.object(salt.client.LocalClient, "cmd")
+    def test_sync_stale_modules_concurrent(self, local_client, module_hash):
+        """
+        测试同步过程中其它任务已写入同步记录时不报主键冲突
+        :return:
+        """
+        def concurrent_sync(*args, **kwargs):
+            SaltModuleSync.objects.create(
+                minion_id="10.0.0.1", module_hash="hash_v1")
+            return {"10.0.0.1": {'ret': [], 'retcode': 0}}
+
+        local_client.side_effect = concurrent_sync
+        flag, ret_dic = self.obj.sync_stale_modules(["10.0.0.1"])
+        self.assertEqual((flag, ret_dic), (True, {"10.0.0.1": True}))
+        self.assertEqual(
+            list(SaltModuleSync.objects.values_list(
+                "minion_id", "module_hash")), [("10.0.0.1", "hash_v2")])
+
+    def test_get_salt_module_hash(self):
+        """
+        测试模块哈希随内容变化
+        :return:
+        """
+        with tempfile.TemporaryDirectory() as module_dir:
+            with open(os.path.join(module_dir, "a_check.py"), "w") as f:
+                f.write("a = 1")
+            first = get_salt_module_hash(module_dir)
+            self.assertEqual(first, get_salt_module_hash(module_dir))
+            with open(os.path.join(module_dir, "a_check.py"), "w") as f:
+                f.write("a = 2")
+            self.assertNotEqual(first, get_salt_module_hash(module_dir))
@@ -11,13 +11,16 @@ ssh 单元测试代码
 # TODO 待完善，与环境隔离
 """
 
+import io
+import threading
 from unittest import mock
 
 from scp import SCPClient
 from paramiko import SSHClient
 
 from tests.base import BaseTest
-from utils.plugin.ssh import SSH
+from utils.plugin.ssh import SSH, SSHConnectionPool, SSHSession, \
+    STDERR_TAIL_SIZE
 
 
 def get_ssh_obj(username="root"):
@@ -43,6 +46,12 @@ class ChannelMock(object):
         :return:
         """
 
+    def close(self):
+        """
+        模拟方法
+        :return:
+        """
+
 
 class StdoutMock(object):
     """ 模拟输出 """
@@ -275,3 +284,190 @@ class SshUtilTest(BaseTest):
         # ssh_obj = get_ssh_obj("aaa")
         # self.assertEqual(ssh_obj.make_remote_path_exist("/tmp"), None)
         pass
+
+
+class TransportMock(object):
+    """ 模拟transport """
+
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        """
+        模拟方法
+        :return:
+        """
+        return self.active
+
+    def set_keepalive(self, interval):
+        """
+        模拟方法
+        :return:
+        """
+
+
+class StreamChannelMock(ChannelMock):
+    """ 模拟数据流命令的channel """
+
+    def __init__(self, exit_status):
+        self.exit_status = exit_status
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+
+class StderrMock(io.BytesIO):
+    """ 模拟错误输出，读取完毕后才继续输出标准输出 """
+
+    def __init__(self, content):
+        super(StderrMock, self).__init__(content)
+        self.drained = threading.Event()
+
+    def read(self, size=-1):
+        data = super(StderrMock, self).read(size)
+        if not data:
+            self.drained.set()
+        return data
+
+
+class StdoutStreamMock(io.BytesIO):
+    """ 模拟标准输出，错误输出未读取时阻塞 """
+
+    def __init__(self, content, stderr, exit_status):
+        super(StdoutStreamMock, self).__init__(content)
+        self.stderr = stderr
+        self.channel = StreamChannelMock(exit_status)
+
+    def read(self, size=-1):
+        if not self.stderr.drained.wait(5):
+            raise TimeoutError("stderr not drained")
+        return super(StdoutStreamMock, self).read(size)
+
+
+@mock.patch.object(SSHClient, "set_missing_host_key_policy", return_value=None)
+@mock.patch.object(SSHClient, "close", return_value=None)
+class SshPoolTest(BaseTest):
+    """ ssh连接池测试类 """
+
+    def setUp(self):
+        super(SshPoolTest, self).setUp()
+        self.pool = SSHConnectionPool(
+            max_per_host=2, max_channels=1, idle_timeout=60)
+        patcher = mock.patch("utils.plugin.ssh.ssh_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(SSHClient, "connect", return_value=None)
+    @mock.patch.object(SSHClient, "get_transport",
+                       side_effect=lambda: TransportMock())
+    @mock.patch.object(SSHClient, "exec_command")
+    def test_reuse_and_sudo_cache(self, exec_command, get_transport,
+                                  connect, *args):
+        """
+        测试多个ssh对象复用连接，sudo权限在连接内缓存
+        :return:
+        """
+        exec_command.side_effect = lambda *a, **k: (
+            "", StdoutMock("success"), StdoutMock(""))
+        for _ in range(3):
+            ssh = get_ssh_obj("common")
+            self.assertEqual(ssh.is_sudo()[0], True)
+            self.assertEqual(ssh.cmd("ls")[0], True)
+            ssh.close()
+        self.assertEqual(connect.call_count, 1)
+        # sudo 检查仅执行一次，其余为 cmd
+        self.assertEqual(exec_command.call_count, 4)
+        stats = self.pool.stats()
+        self.assertEqual(stats["connect_count"], 1)
+        self.assertEqual(stats["exec_count"], 4)
+        self.assertEqual(stats["sessions"], 1)
+
+        # 密码变更后不再复用原连接
+        ssh = SSH("127.0.0.1", 22, "common", "changed", timeout=1)
+        ssh.check()
+        self.assertEqual(connect.call_count, 2)
+
+    @mock.patch.object(SSHClient, "connect", return_value=None)
+    @mock.patch.object(SSHClient, "get_transport",
+                       side_effect=lambda: TransportMock())
+    def test_max_per_host_and_evict(self, get_transport, connect, *args):
+        """
+        测试单主机连接数上限及空闲连接回收
+        :return:
+        """
+        sessions, channels = list(), list()
+        for _ in range(3):
+            session = self.pool.get("127.0.0.1", 22, "root", "root")
+            sessions.append(session)
+            if session.channels == 0:
+                channels.append(self.pool.channel(session))
+                channels[-1].__enter__()
+        self.assertEqual(connect.call_count, 2)
+        self.assertIn(sessions[2], sessions[:2])
+
+        self.pool.idle_timeout = 0
+        self.pool.evict_idle(force=True)
+        self.assertEqual(self.pool.stats()["sessions"], 2)
+        for channel in channels:
+            channel.__exit__(None, None, None)
+        self.pool.evict_idle(force=True)
+        self.assertEqual(self.pool.stats()["sessions"], 0)
+
+    @mock.patch.object(SSHClient, "connect", return_value=None)
+    @mock.patch.object(SSHClient, "get_transport",
+                       side_effect=lambda: TransportMock())
+    def test_inactive_session(self, get_transport, connect, *args):
+        """
+        测试断开的连接不再复用
+        :return:
+        """
+        session = self.pool.get("127.0.0.1", 22, "root", "root")
+        session.transport.active = False
+        self.assertIsNot(
+            self.pool.get("127.0.0.1", 22, "root", "root"), session)
+        self.assertEqual(connect.call_count, 2)
+
+    @mock.patch.object(SSHClient, "connect", return_value=None)
+    @mock.patch.object(SSHClient, "get_transport",
+                       side_effect=lambda: TransportMock())
+    def test_stale_session_close(self, get_transport, connect, *args):
+        """
+        测试移出连接池的连接在最后一个通道释放后关闭，释放通道时回收空闲连接
+        :return:
+        """
+        session = self.pool.get("127.0.0.1", 22, "root", "root")
+        idle_session = self.pool.get("127.0.0.2", 22, "root", "root")
+        with mock.patch.object(SSHSession, "close") as mock_close:
+            with self.pool.channel(session):
+                new_session = self.pool.get(
+                    "127.0.0.1", 22, "root", "changed")
+                self.assertIsNot(new_session, session)
+                self.assertTrue(session.stale)
+                mock_close.assert_not_called()
+                self.pool.idle_timeout = 0
+                self.pool.last_evict = 0
+            self.assertEqual(mock_close.call_count, 3)
+        self.assertEqual(self.pool.stats()["sessions"], 0)
+        self.assertNotIn(("127.0.0.2", 22, "root"), self.pool.session_dic)
+        self.assertFalse(idle_session.stale)
+
+    @mock.patch.object(SSHClient, "connect", return_value=None)
+    @mock.patch.object(SSHClient, "get_transport",
+                       side_effect=lambda: TransportMock())
+    @mock.patch.object(SSHClient, "exec_command")
+    def test_cmd_read_stream_stderr(self, exec_command, *args):
+        """
+        测试数据流命令同时读取错误输出，只保留最后的错误输出
+        :return:
+        """
+        for exit_status in (0, 1):
+            stderr = StderrMock(b"x" * STDERR_TAIL_SIZE * 3 + b"end")
+            stdout = StdoutStreamMock(b"data", stderr, exit_status)
+            exec_command.return_value = ("", stdout, stderr)
+            output = io.BytesIO()
+            flag, message = get_ssh_obj().cmd_read_stream(
+                "dump", lambda fp: output.write(fp.read()))
+            self.assertEqual(flag, exit_status == 0)
+            self.assertEqual(output.getvalue(), b"data")
+            self.assertTrue(message.endswith("end"))
+            self.assertEqual(len(message), STDERR_TAIL_SIZE)
@@ -6,9 +6,10 @@ import string
 from django.db import transaction
 from rest_framework import serializers
 from db_models.models import ToolExecuteMainHistory, ToolInfo, Host, Service, \
-    ToolExecuteDetailHistory, UploadFileHistory
+    ToolExecuteDetailHistory, UploadFileHistory, ExecutionEventLog
 from tool.tasks import exec_tools_main
 from utils.common.exceptions import GeneralError
+from utils.plugin.event_log import read_event_log
 
 
 class ToolInfoSerializer(serializers.ModelSerializer):
@@ -66,11 +67,16 @@ class ToolDetailSerializer(serializers.ModelSerializer):
             url = ""
             if obj.output:
                 url = f"tool/download_data/{obj.output.get('file')[0]}"
+            log = obj.execute_log
+            if obj.status == ToolExecuteDetailHistory.STATUS_RUNNING:
+                # 执行中的日志随状态保存，从执行过程日志中读取
+                log = read_event_log(
+                    ExecutionEventLog.MODULE_TOOL, obj.id)[0] or log
             tool_list.append(
                 {
                     "ip": obj.target_ip,
                     "status": obj.status,
-                    "log": obj.execute_log,
+                    "log": log,
                     "url": url
                 }
             )
@@ -11,7 +11,10 @@ from django.utils import timezone
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from db_models.models import ToolExecuteMainHistory, ToolExecuteDetailHistory
+from db_models.models import ToolExecuteMainHistory, ToolExecuteDetailHistory, \
+    ExecutionEventLog
+
+from utils.plugin.event_log import EventLogWriter
 
 from utils.plugin.salt_client import SaltClient
 from utils.plugin import public_utils
@@ -30,6 +33,8 @@ class ThreadUtils:
         self.salt = SaltClient()
         self.salt_data = self.salt.client.opts.get("root_dir")
         self.count = 0
+        # 执行日志，多线程共享批量写入
+        self.event_log = EventLogWriter(ExecutionEventLog.MODULE_TOOL)
 
     def check_result(self, future_list):
         """
@@ -41,17 +46,24 @@ class ThreadUtils:
                 self.error = True
             self.count += 1
 
-    @staticmethod
-    def send_message(tool_detail_obj, index=None, message=None):
+    def send_message(self, tool_detail_obj, index=None, message=None):
         """
-        标准打印日志
+        标准打印日志，逐行追加至执行过程日志，执行日志字段随状态一并保存
         """
         message_info = ["占位", "开始执行工具包", "开始获取输出文件", "工具执行成功", "开始发送工具包"]
         if index:
             message = message_info[index]
-        tool_detail_obj.execute_log += "{1} {0}\n".format(
-            message, timezone.now())
-        tool_detail_obj.save()
+        line = "{1} {0}\n".format(message, timezone.now())
+        tool_detail_obj.execute_log += line
+        self.event_log.append(tool_detail_obj.id, "execute", line)
+
+    def save_status(self, tool_detail_obj):
+        """
+        仅更新执行状态及执行日志字段
+        """
+        self.event_log.flush()
+        tool_detail_obj.save(
+            update_fields=["status", "execute_log", "modified"])
 
     def receive_file(self, tool_detail_obj, receive_files, ip):
         """
@@ -87,6 +99,16 @@ class ThreadUtils:
         执行单个工具任务函数
         """
         tool_detail_obj.status = ToolExecuteDetailHistory.STATUS_RUNNING
+        self.save_status(tool_detail_obj)
+        try:
+            return self.execute_tool(tool_detail_obj)
+        finally:
+            self.save_status(tool_detail_obj)
+
+    def execute_tool(self, tool_detail_obj):
+        """
+        执行工具任务，执行状态由 single_tool_executor 保存
+        """
         # 发送文件
         ip = tool_detail_obj.target_ip
         self.send_message(tool_detail_obj, 4)
@@ -131,7 +153,6 @@ class ThreadUtils:
             return False, "执行失败"
         self.send_message(tool_detail_obj, 3)
         tool_detail_obj.status = ToolExecuteDetailHistory.STATUS_SUCCESS
-        tool_detail_obj.save()
         return True, "执行成功"
 
 
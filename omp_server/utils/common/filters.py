@@ -0,0 +1,40 @@
+"""
+公共过滤器
+"""
+
+from django.db.models import F
+from rest_framework.filters import OrderingFilter
+
+
+class MetricOrderingFilter(OrderingFilter):
+    """
+    指标排序过滤器
+    视图 dynamic_fields 中的字段关联指标快照表(metric_snapshot)排序，
+    在数据库中完成全量排序及分页，空值始终排在末尾
+    """
+    snapshot_field = "metric_snapshot"
+
+    def get_valid_fields(self, queryset, view, context={}):
+        valid_fields = super(MetricOrderingFilter, self).get_valid_fields(
+            queryset, view, context)
+        return valid_fields + [
+            (field, field) for field in getattr(view, "dynamic_fields", ())]
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if not ordering:
+            return queryset
+        dynamic_fields = getattr(view, "dynamic_fields", ())
+        order_by = list()
+        for field in ordering:
+            field_name = field.lstrip("-")
+            if field_name not in dynamic_fields:
+                order_by.append(field)
+                continue
+            expression = F(f"{self.snapshot_field}__{field_name}")
+            # MySQL 降序时空值本就在末尾，保持直接按索引列排序
+            if field.startswith("-"):
+                order_by.append(expression.desc())
+            else:
+                order_by.append(expression.asc(nulls_last=True))
+        return queryset.order_by(*order_by)
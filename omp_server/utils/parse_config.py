@@ -33,7 +33,19 @@ GLOBAL_RUNUSER = CONFIG_DIC.get("global_runuser")
 LOCAL_IP = CONFIG_DIC.get("local_ip")
 SSH_CMD_TIMEOUT = CONFIG_DIC.get("ssh_cmd_timeout", 60)
 SSH_CHECK_TIMEOUT = CONFIG_DIC.get("ssh_check_timeout", 10)
+SSH_POOL = CONFIG_DIC.get("ssh_pool", {})
 THREAD_POOL_MAX_WORKERS = CONFIG_DIC.get("thread_pool_max_workers", 20)
+INSTALL_CONCURRENT_ONE_HOST = CONFIG_DIC.get("install_concurrent_one_host", 4)
+PACKAGE_DISTRIBUTION = CONFIG_DIC.get("package_distribution", {})
+PROMETHEUS_QUERY_TIMEOUT = CONFIG_DIC.get("prometheus_query_timeout", 10)
+PROMETHEUS_CACHE_TTL = CONFIG_DIC.get("prometheus_cache_ttl", 5)
+ALERT_RETENTION_DAYS = CONFIG_DIC.get("alert_retention_days", 90)
+OPERATE_LOG_RETENTION_DAYS = CONFIG_DIC.get("operate_log_retention_days", 180)
+RETENTION_CHUNK_SIZE = CONFIG_DIC.get("retention_chunk_size", 5000)
+SELF_HEALING = CONFIG_DIC.get("self_healing", {})
+MONITOR_AGENT_CLIENT = CONFIG_DIC.get("monitor_agent_client", {})
+SERVICE_ACTION = CONFIG_DIC.get("service_action", {})
+BACKUP = CONFIG_DIC.get("backup", {})
 SALT_RET_PORT = CONFIG_DIC.get("salt_master", {}).get("ret_port", 19005)
 TOKEN_EXPIRATION = CONFIG_DIC.get("token_expiration", 1)
 MONITOR_PORT = CONFIG_DIC.get("monitor_port")
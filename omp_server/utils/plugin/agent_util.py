@@ -10,7 +10,9 @@
 安装主机Agent的方法
 """
 
+import io
 import os
+import tarfile
 
 import yaml
 from celery.utils.log import get_task_logger
@@ -46,6 +48,8 @@ class Agent(object):
         self.master_port = SALT_RET_PORT
         self.install_dir = install_dir
         self.agent_name = "omp_salt_agent"
+        # 单通道部署时安装包及配置文件在目标主机上的临时目录
+        self.bootstrap_dir = ".omp_bootstrap"
         self.package_hub = os.path.join(PROJECT_DIR, "package_hub")
         self.agent_file_path = os.path.join(
             self.package_hub, "omp_salt_agent.tar.gz")
@@ -56,6 +60,33 @@ class Agent(object):
             password=self.password
         )
 
+    def render_conf(self):
+        """
+        生成agent的配置文件内容
+        :return:
+        """
+        agent_conf_dic = {
+            "master": self.master_ip,
+            "master_port": self.master_port,
+            "user": self.run_user,
+            "id": self.host,
+            "root_dir": os.path.join(self.install_dir, f"{self.agent_name}/data/"),
+            "conf_file": os.path.join(self.install_dir, f"{self.agent_name}/conf/minion"),
+            "rejected_retry": True
+        }
+        return yaml.dump(agent_conf_dic, Dumper=yaml.SafeDumper)
+
+    def render_script(self):
+        """
+        生成agent的控制脚本内容
+        :return:
+        """
+        with open(os.path.join(PROJECT_DIR, "scripts/source/omp_salt_agent"), "r") as fp:
+            _script_content = fp.read()
+        _content = _script_content.replace(
+            "UNIQUE_INSTALL_DIR_FLAG", self.install_dir)
+        return _content.replace("RUNUSER", self.run_user)
+
     def generate_conf(self):
         """
         生成agent的配置文件
@@ -63,17 +94,8 @@ class Agent(object):
         """
         try:
             logger.info(f"Generate Conf For {self.host}!")
-            agent_conf_dic = {
-                "master": self.master_ip,
-                "master_port": self.master_port,
-                "user": self.run_user,
-                "id": self.host,
-                "root_dir": os.path.join(self.install_dir, f"{self.agent_name}/data/"),
-                "conf_file": os.path.join(self.install_dir, f"{self.agent_name}/conf/minion"),
-                "rejected_retry": True
-            }
             with open(os.path.join(self.package_hub, self.host, "minion"), "w") as fp:
-                yaml.dump(agent_conf_dic, fp, Dumper=yaml.SafeDumper)
+                fp.write(self.render_conf())
             return True, "generate success."
         except Exception as error:
             return False, str(error)
@@ -141,13 +163,8 @@ class Agent(object):
 
         # step6: make and push scripts
         logger.info(f"push script to {self.host}!")
-        with open(os.path.join(PROJECT_DIR, "scripts/source/omp_salt_agent"), "r") as fp:
-            _script_content = fp.read()
         with open(os.path.join(config_tmp_dir, "omp_salt_agent"), "w") as fp:
-            _content = _script_content.replace(
-                "UNIQUE_INSTALL_DIR_FLAG", self.install_dir)
-            _content = _content.replace("RUNUSER", self.run_user)
-            fp.write(_content)
+            fp.write(self.render_script())
         script_push_state, script_push_msg = self.ssh.file_push(
             os.path.join(config_tmp_dir, "omp_salt_agent"),
             os.path.join(self.install_dir, '{}/bin/'.format(self.agent_name))
@@ -173,6 +190,74 @@ class Agent(object):
         logger.info(f"success deploy agent for {self.host}!")
         return True, "agent deploy success."
 
+    def write_bundle(self, fileobj):
+        """
+        以流的方式写出单通道部署使用的 tar 包，
+        包含 agent 安装包以及在内存中生成的配置文件、控制脚本
+        :param fileobj: 远程命令的标准输入
+        :return:
+        """
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+            tar.add(
+                self.agent_file_path,
+                arcname=f"{self.bootstrap_dir}/{self.agent_name}.tar.gz")
+            for name, content, mode in (
+                    ("minion", self.render_conf(), 0o644),
+                    (self.agent_name, self.render_script(), 0o755)):
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(f"{self.bootstrap_dir}/{name}")
+                info.size = len(data)
+                info.mode = mode
+                tar.addfile(info, io.BytesIO(data))
+
+    def bootstrap_command(self):
+        """
+        单通道部署的远程命令，停止原有agent、解压、写入配置及初始化在一次执行中完成
+        :return:
+        """
+        omp_salt = os.path.join(self.install_dir, self.agent_name)
+        bootstrap = os.path.join(self.install_dir, self.bootstrap_dir)
+        return \
+            f"sed -i '/omp_salt_agent/d' /var/spool/cron/{self.username} " \
+            f"2>/dev/null; " \
+            f"bash {omp_salt}/bin/omp_salt_agent stop </dev/null " \
+            f">/dev/null 2>&1; /bin/rm -rf {omp_salt}/data/*; " \
+            f"(test -d {self.install_dir} || " \
+            f"(sudo -n mkdir -p {self.install_dir} && sudo -n chown " \
+            f"{self.run_user}.{self.run_user} {self.install_dir}) " \
+            f"2>/dev/null || mkdir -p {self.install_dir}) && " \
+            f"cd {self.install_dir} && tar xmf - && " \
+            f"tar xmf {bootstrap}/{self.agent_name}.tar.gz && " \
+            f"mv -f {bootstrap}/minion {omp_salt}/conf/minion && " \
+            f"mv -f {bootstrap}/{self.agent_name} " \
+            f"{omp_salt}/bin/{self.agent_name} && " \
+            f"rm -rf {bootstrap} && " \
+            f"chown -R {self.run_user}:{self.run_user} {self.agent_name} && " \
+            f"bash {self.agent_name}/bin/{self.agent_name} init"
+
+    def agent_bootstrap(self):
+        """
+        单通道部署agent，安装包及配置文件通过一个 ssh 通道写入远程 tar 命令，
+        不再逐个发送文件及在本地生成配置文件
+        :return:
+        """
+        logger.info(f"bootstrap agent for {self.host}!")
+        try:
+            cmd_exec_state, cmd_exec_msg = self.ssh.cmd_stream(
+                self.bootstrap_command(), self.write_bundle, timeout=300)
+        except Exception as error:
+            logger.error(
+                f"Error while bootstrap agent for {self.host}: {error}")
+            return False, str(error)
+        if "INIT_OMP_SALT_AGENT_SUCCESS" in cmd_exec_msg:
+            logger.info(f"success bootstrap agent for {self.host}!")
+            return True, "agent deploy success."
+        if not cmd_exec_state:
+            logger.error(
+                f"Error while bootstrap agent for {self.host}: {cmd_exec_msg}")
+            return False, cmd_exec_msg
+        return True, "agent deploy success."
+
     def agent_manage(self, action, install_app_dir):
         """
         manage salt agent, start stop status
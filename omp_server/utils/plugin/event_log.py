@@ -0,0 +1,97 @@
+"""
+执行过程日志
+安装、工具执行过程中的日志按行追加至 ExecutionEventLog，多线程共享缓冲区批量写入，
+避免每条日志都重写执行详情记录中的全部日志字段
+"""
+import time
+import logging
+import threading
+
+from django.db.models import Max
+from django.utils import timezone
+
+from db_models.models import ExecutionEventLog
+
+logger = logging.getLogger("server")
+
+# 缓冲日志条数达到该值时写入
+FLUSH_SIZE = 50
+# 距上次写入超过该时间时写入，单位秒
+FLUSH_INTERVAL = 1
+
+
+class EventLogWriter:
+    """ 执行过程日志批量写入 """
+
+    def __init__(self, module, flush_size=FLUSH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        """
+        :param module: ExecutionEventLog.MODULE_*
+        :param flush_size: 缓冲日志条数上限
+        :param flush_interval: 缓冲最长时间，单位秒
+        """
+        self.module = module
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = list()
+        # {history_id: 最新 seq}
+        self.seq_dic = dict()
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def next_seq(self, history_id):
+        """ 日志序号，重试时接续已有日志 """
+        if history_id not in self.seq_dic:
+            self.seq_dic[history_id] = ExecutionEventLog.objects.filter(
+                module=self.module, history_id=history_id
+            ).aggregate(seq=Max("seq"))["seq"] or 0
+        self.seq_dic[history_id] += 1
+        return self.seq_dic[history_id]
+
+    def append(self, history_id, step, line):
+        """ 追加一条日志，缓冲区满或超时后批量写入 """
+        with self.lock:
+            self.buffer.append(ExecutionEventLog(
+                module=self.module,
+                history_id=history_id,
+                step=step,
+                seq=self.next_seq(history_id),
+                ts=timezone.now(),
+                line=line
+            ))
+            if len(self.buffer) < self.flush_size and \
+                    time.monotonic() - self.last_flush < self.flush_interval:
+                return
+            self._flush()
+
+    def flush(self):
+        """ 写入缓冲区中的全部日志 """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        event_ls, self.buffer = self.buffer, list()
+        try:
+            ExecutionEventLog.objects.bulk_create(event_ls)
+        except Exception as e:
+            logger.error(f"Write execution event log failed: {str(e)}")
+
+
+def read_event_log(module, history_id, since=0):
+    """
+    增量读取执行过程日志
+    :param module: ExecutionEventLog.MODULE_*
+    :param history_id: 执行详情 id
+    :param since: 已读取的最大 seq
+    :return: (日志内容, 最大 seq)
+    """
+    queryset = ExecutionEventLog.objects.filter(
+        module=module, history_id=history_id, seq__gt=since
+    ).order_by("seq").values_list("seq", "line")
+    seq, lines = since, list()
+    for seq, line in queryset:
+        lines.append(line)
+    return "".join(lines), seq
@@ -11,8 +11,6 @@
 """
 import json
 import os
-import time
-import random
 import logging
 from concurrent.futures import ThreadPoolExecutor
 
@@ -144,8 +142,7 @@ class MonitorAgentManager(object):
             func=self._install)
         if not flag:
             return flag, msg
-        # 更新监控Server端配置，暂时靠sleep解决文件并发操作
-        time.sleep(random.randint(1, 5))
+        # 更新监控Server端配置
         _pro_obj = PrometheusUtils()
         _pro_obj.add_node(self.parse_hosts_data())
         return True, "success!"
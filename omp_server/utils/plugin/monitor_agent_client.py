@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Project: monitor_agent_client
+# Create time: 2022-03-18
+# Introduction:
+
+"""
+monitor_agent 服务状态查询客户端
+按主机分组后并发请求各主机的 monitor_agent，复用 keep-alive 连接，
+单主机超时或失败不影响其他主机的结果，服务状态缓存 cache_ttl 秒
+"""
+
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from promemonitor.prometheus_utils import CW_TOKEN
+from utils.parse_config import MONITOR_PORT, MONITOR_AGENT_CLIENT
+
+logger = logging.getLogger("server")
+
+
+class MonitorAgentClient(object):
+    """ monitor_agent 服务状态查询客户端 """
+    # 缓存条目上限
+    MAX_CACHE_SIZE = 10000
+    # 保留 keep-alive 连接的主机数上限
+    MAX_POOL_HOSTS = 1000
+
+    def __init__(self,
+                 max_workers=MONITOR_AGENT_CLIENT.get("max_workers", 50),
+                 connect_timeout=MONITOR_AGENT_CLIENT.get(
+                     "connect_timeout", 1),
+                 timeout=MONITOR_AGENT_CLIENT.get("timeout", 5),
+                 cache_ttl=MONITOR_AGENT_CLIENT.get("cache_ttl", 5)):
+        """
+        :param max_workers: 同时请求的主机数
+        :param connect_timeout: 单主机连接超时时间，单位秒
+        :param timeout: 单主机响应超时时间，单位秒
+        :param cache_ttl: 服务状态缓存时间，单位秒，0 表示不缓存
+        """
+        self.max_workers = max_workers
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.port = (MONITOR_PORT or {}).get("monitorAgent", 19031)
+        self.headers = dict({"Content-Type": "application/json"}, **CW_TOKEN)
+        self.session = requests.Session()
+        # 每台主机一个连接池，保留全部主机的 keep-alive 连接
+        self.session.mount("http://", HTTPAdapter(
+            pool_connections=self.MAX_POOL_HOSTS,
+            pool_maxsize=2))
+        self._lock = threading.Lock()
+        # {(ip, service_name): (过期时间, 状态)}
+        self._cache = dict()
+
+    def clear(self):
+        """ 清空状态缓存 """
+        with self._lock:
+            self._cache.clear()
+
+    def _purge(self, now):
+        """ 缓存超出上限时清理过期条目，调用方需持有锁 """
+        if len(self._cache) < self.MAX_CACHE_SIZE:
+            return
+        for key in [k for k, v in self._cache.items() if v[0] <= now]:
+            self._cache.pop(key)
+        if len(self._cache) >= self.MAX_CACHE_SIZE:
+            self._cache.clear()
+
+    def _request(self, ip, service_list, timeout):
+        """
+        请求单台主机的 monitor_agent
+        :return: 服务状态列表，失败时为 None
+        """
+        url = f"http://{ip}:{self.port}/service_status"
+        try:
+            response = self.session.post(
+                url, headers=self.headers, data=json.dumps(service_list),
+                timeout=(self.connect_timeout, timeout))
+            if response.status_code != 200:
+                logger.error(
+                    f"请求{url}失败: {response.status_code} {response.text}")
+                return None
+            return response.json().get("beans") or list()
+        except Exception as e:
+            logger.error(f"请求{url}失败: {str(e)}")
+            return None
+
+    def service_status(self, service_list, cache_ttl=None, timeout=None):
+        """
+        查询服务状态
+        :param service_list: [{"ip": "127.0.0.1", "service_name": "mysql"}]
+        :param cache_ttl: 缓存时间，默认为 self.cache_ttl，0 表示不使用缓存
+        :param timeout: 单主机响应超时时间，默认为 self.timeout
+        :return: (服务状态列表, 请求失败的主机列表)，
+            失败主机上的服务不在服务状态列表中
+        """
+        cache_ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+        timeout = timeout or self.timeout
+        now = time.monotonic()
+        result = list()
+        # {ip: [service]}
+        host_dic = dict()
+        with self._lock:
+            for item in service_list:
+                key = (item.get("ip"), item.get("service_name"))
+                entry = self._cache.get(key) if cache_ttl > 0 else None
+                if entry and entry[0] > now:
+                    result.append(dict(entry[1]))
+                    continue
+                services = host_dic.setdefault(key[0], list())
+                if item not in services:
+                    services.append(item)
+        if not host_dic:
+            return result, list()
+
+        failed_hosts = list()
+        with ThreadPoolExecutor(
+                min(self.max_workers, len(host_dic))) as executor:
+            future_dic = {
+                ip: executor.submit(self._request, ip, services, timeout)
+                for ip, services in host_dic.items()
+            }
+        expire = time.monotonic() + cache_ttl
+        with self._lock:
+            self._purge(now)
+            for ip, future in future_dic.items():
+                beans = future.result()
+                if beans is None:
+                    failed_hosts.append(ip)
+                    continue
+                for bean in beans:
+                    result.append(bean)
+                    if cache_ttl > 0:
+                        self._cache[(bean.get("ip", ip), bean.get(
+                            "service_name"))] = (expire, dict(bean))
+        return result, failed_hosts
+
+
+monitor_agent_client = MonitorAgentClient()
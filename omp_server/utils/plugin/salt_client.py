@@ -11,13 +11,18 @@ salt 封装的相关模块或方法
 """
 
 import os
+import hashlib
 import logging
 import traceback
+from datetime import datetime
 import salt.client
 
+from db_models.models import SaltModuleSync
 from omp_server.settings import PROJECT_DIR
 
 salt_master_config = os.path.join(PROJECT_DIR, "config/salt/master")
+# salt 自定义模块目录，对应 file_roots 下的 _modules
+salt_modules_dir = os.path.join(PROJECT_DIR, "package_hub/_modules")
 
 logger = logging.getLogger('server')
 
@@ -25,6 +30,25 @@ SALT_ERROR_MSG = "Salt 执行错误，请检查相关配置是否正确！"
 AGENT_OFFLINE_MSG = "当前目标主机不在线或该目标主机未纳管！"
 
 
+def get_salt_module_hash(module_dir=salt_modules_dir):
+    """
+    计算 salt 自定义模块目录的内容哈希，作为模块版本号
+    :param module_dir: 模块目录
+    :return: sha256 十六进制字符串
+    """
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(module_dir):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".pyc"):
+                continue
+            path = os.path.join(root, name)
+            sha.update(os.path.relpath(path, module_dir).encode("utf8"))
+            with open(path, "rb") as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
 class SaltClient(object):
     """本地salt管理接口"""
 
@@ -39,15 +63,18 @@ class SaltClient(object):
         self.client = salt.client.LocalClient(
             c_path=self.config_path, auto_reconnect=True)
 
-    def salt_module_update(self):
+    def salt_module_update(self, target="*", tgt_type="glob"):
         """
         用于更新salt的自定义模块
+        :param target: 目标主机，默认为全部 minion
+        :param tgt_type: 匹配target的格式，glob正则匹配 or list匹配
         :return:
         """
         try:
             cmd_res = self.client.cmd(
-                tgt="*",
+                tgt=target,
                 fun="saltutil.sync_modules",
+                tgt_type=tgt_type,
             )
             """
             # {'192.168.175.149': {'ret': [], 'retcode': 0, 'jid': '20210113213356939481'}, 'ruban-dev': False}
@@ -65,6 +92,39 @@ class SaltClient(object):
         except Exception as e:
             return False, f"在同步salt模块的过程中出错: {str(e)}"
 
+    def sync_stale_modules(self, targets):
+        """
+        仅向模块版本落后的 minion 同步salt自定义模块
+        模块版本为 _modules 目录的内容哈希，同步成功后记录至 SaltModuleSync
+        :param targets: minion id 列表
+        :return: (是否执行成功, {minion id: 模块是否为最新版本})
+        """
+        targets = list(dict.fromkeys(targets))
+        module_hash = get_salt_module_hash()
+        synced = set(SaltModuleSync.objects.filter(
+            minion_id__in=targets, module_hash=module_hash
+        ).values_list("minion_id", flat=True))
+        stale = [target for target in targets if target not in synced]
+        if not stale:
+            return True, {target: True for target in targets}
+        flag, ret_dic = self.salt_module_update(
+            target=stale, tgt_type="list")
+        if not flag:
+            return False, ret_dic
+        success = [target for target in stale if ret_dic.get(target)]
+        if success:
+            # 并发同步同一 minion 时忽略主键冲突，再统一更新为当前版本
+            SaltModuleSync.objects.bulk_create([
+                SaltModuleSync(minion_id=target, module_hash=module_hash)
+                for target in success
+            ], ignore_conflicts=True)
+            SaltModuleSync.objects.filter(minion_id__in=success).update(
+                module_hash=module_hash, modified=datetime.now())
+        return True, {
+            target: target in synced or bool(ret_dic.get(target))
+            for target in targets
+        }
+
     def fun_for_multi(self, target, fun, arg=(), kwarg=None, timeout=None, tgt_type="glob"):
         """
         可自行执行模块的命令，适用于批量执行操作，需要自行判断函数执行结果
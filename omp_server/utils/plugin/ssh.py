@@ -2,20 +2,236 @@
 ssh相关操作
 """
 import os
+import time
 import logging
+import threading
+from contextlib import contextmanager
 
 import paramiko
 from scp import SCPClient
 
 from utils.parse_config import (
-    SSH_CMD_TIMEOUT, SSH_CHECK_TIMEOUT
+    SSH_CMD_TIMEOUT, SSH_CHECK_TIMEOUT, SSH_POOL
 )
 
 logger = logging.getLogger("server")
 
+# 数据流命令单次读取错误输出的大小，及保留的错误输出大小
+STDERR_READ_SIZE = 32 * 1024
+STDERR_TAIL_SIZE = 64 * 1024
+
+
+class SSHSession(object):
+    """ 连接池中的单个 SSH 连接，多个通道复用同一 transport """
+
+    def __init__(self, key, password, ssh_client, max_channels):
+        self.key = key
+        self.password = password
+        self.ssh_client = ssh_client
+        self.transport = ssh_client.get_transport()
+        self.last_used = time.monotonic()
+        # 当前打开的通道数，受 max_channels 限制
+        self.channels = 0
+        self.channel_semaphore = threading.BoundedSemaphore(max_channels)
+        # 用户是否具有 sudo 权限，连接内缓存
+        self.sudo = None
+        # 已移出连接池，最后一个通道释放后关闭
+        self.stale = False
+
+    def is_active(self):
+        return self.transport is not None and self.transport.is_active()
+
+    def close(self):
+        try:
+            self.ssh_client.close()
+        except Exception as error:
+            logger.info(f"SSH close {self.key} failed: {error}")
+
+
+class SSHConnectionPool(object):
+    """
+    进程内 SSH 连接池，按 (主机, 端口, 用户) 复用连接
+    每个连接上可同时打开多个通道执行命令，空闲超时的连接自动关闭
+    """
+
+    def __init__(self, max_per_host=SSH_POOL.get("max_per_host", 2),
+                 max_channels=SSH_POOL.get("max_channels", 8),
+                 idle_timeout=SSH_POOL.get("idle_timeout", 300),
+                 keepalive=SSH_POOL.get("keepalive", 30)):
+        """
+        :param max_per_host: 单主机单用户最大连接数
+        :param max_channels: 单连接最大并发通道数
+        :param idle_timeout: 连接空闲超时时间，单位秒
+        :param keepalive: 连接保活间隔，单位秒
+        """
+        self.max_per_host = max_per_host
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.lock = threading.Condition()
+        # {(hostname, port, username): [SSHSession]}
+        self.session_dic = dict()
+        # 正在建立中的连接数
+        self.connecting_dic = dict()
+        self.pid = os.getpid()
+        self.last_evict = time.monotonic()
+        self.metrics = {
+            "connect_count": 0, "connect_failed": 0,
+            "connect_time": 0.0, "connect_max": 0.0,
+            "exec_count": 0, "exec_time": 0.0, "exec_max": 0.0,
+        }
+
+    def _check_pid(self):
+        """ fork 后的子进程不使用父进程的连接 """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.session_dic = dict()
+            self.connecting_dic = dict()
+
+    def _record(self, name, seconds):
+        self.metrics[f"{name}_count"] += 1
+        self.metrics[f"{name}_time"] += seconds
+        self.metrics[f"{name}_max"] = max(
+            self.metrics[f"{name}_max"], seconds)
+
+    def _usable(self, session, password):
+        return session.is_active() and session.password == password
+
+    def _connect(self, key, password, timeout):
+        """ 建立新连接 """
+        hostname, port, username = key
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        start = time.monotonic()
+        try:
+            ssh_client.connect(
+                hostname=hostname,
+                port=port,
+                username=username,
+                password=password,
+                timeout=timeout
+            )
+        except Exception:
+            with self.lock:
+                self.metrics["connect_failed"] += 1
+            ssh_client.close()
+            raise
+        session = SSHSession(key, password, ssh_client, self.max_channels)
+        if session.transport is not None and self.keepalive:
+            session.transport.set_keepalive(self.keepalive)
+        with self.lock:
+            self._record("connect", time.monotonic() - start)
+        return session
+
+    def get(self, hostname, port, username, password,
+            timeout=SSH_CHECK_TIMEOUT):
+        """
+        获取可用连接，优先复用已有连接中通道数最少的，
+        均已满载且未达到连接数上限时建立新连接
+        :return: SSHSession
+        """
+        key = (hostname, port, username)
+        with self.lock:
+            self._check_pid()
+            self.evict_idle()
+            sessions = self.session_dic.setdefault(key, list())
+            # 清理已断开或密码变更的连接，仍有通道占用的待释放后关闭
+            for session in [
+                    el for el in sessions if not self._usable(el, password)]:
+                sessions.remove(session)
+                if session.channels == 0:
+                    session.close()
+                else:
+                    session.stale = True
+            idle = [el for el in sessions if el.channels < self.max_channels]
+            if idle:
+                return min(idle, key=lambda x: x.channels)
+            if sessions and len(sessions) + self.connecting_dic.get(
+                    key, 0) >= self.max_per_host:
+                return min(sessions, key=lambda x: x.channels)
+            self.connecting_dic[key] = self.connecting_dic.get(key, 0) + 1
+        try:
+            session = self._connect(key, password, timeout)
+        finally:
+            with self.lock:
+                self.connecting_dic[key] -= 1
+        with self.lock:
+            self.session_dic.setdefault(key, list()).append(session)
+        return session
+
+    @contextmanager
+    def channel(self, session, timeout=SSH_CMD_TIMEOUT):
+        """ 在连接上占用一个通道，连接通道数已满时等待 """
+        if not session.channel_semaphore.acquire(timeout=timeout):
+            raise TimeoutError(f"SSH channel wait timeout: {session.key}")
+        with self.lock:
+            session.channels += 1
+        start = time.monotonic()
+        try:
+            yield session
+        finally:
+            with self.lock:
+                session.channels -= 1
+                session.last_used = time.monotonic()
+                self._record("exec", session.last_used - start)
+                close = session.stale and session.channels == 0
+            session.channel_semaphore.release()
+            if close:
+                session.close()
+            self.evict_idle()
+
+    def discard(self, session):
+        """ 移除异常连接 """
+        with self.lock:
+            sessions = self.session_dic.get(session.key, [])
+            if session in sessions:
+                sessions.remove(session)
+        session.close()
+
+    def evict_idle(self, force=False):
+        """ 关闭空闲超时的连接，非强制时每 10 秒最多执行一次 """
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_evict < 10:
+                return
+            self.last_evict = now
+            for key, sessions in list(self.session_dic.items()):
+                for session in list(sessions):
+                    expired = now - session.last_used > self.idle_timeout
+                    if session.channels == 0 and (
+                            expired or not session.is_active()):
+                        sessions.remove(session)
+                        session.close()
+                if not sessions:
+                    self.session_dic.pop(key)
+
+    def close_all(self):
+        """ 关闭全部连接 """
+        with self.lock:
+            for sessions in self.session_dic.values():
+                for session in sessions:
+                    session.close()
+            self.session_dic = dict()
+
+    def stats(self):
+        """ 连接池状态及连接、执行耗时统计 """
+        with self.lock:
+            data = dict(self.metrics)
+            data["sessions"] = sum(len(el) for el in self.session_dic.values())
+            data["channels"] = sum(
+                session.channels for sessions in self.session_dic.values()
+                for session in sessions)
+        for name in ("connect", "exec"):
+            count = data[f"{name}_count"]
+            data[f"{name}_avg"] = data[f"{name}_time"] / count if count else 0
+        return data
+
+
+ssh_pool = SSHConnectionPool()
+
 
 class SSH(object):
-    """ SSH 工具类 """
+    """ SSH 工具类，连接由进程内连接池复用 """
 
     def __init__(self, hostname, port, username, password, timeout=SSH_CHECK_TIMEOUT):
         """
@@ -34,7 +250,7 @@ class SSH(object):
         self.password = password
         self.timeout = timeout
         # 连接对象
-        self.connect = None
+        self.session = None
         self.ssh_client = None
         self.scp_client = None
         # 错误信息
@@ -43,26 +259,21 @@ class SSH(object):
 
     def _get_connection(self):
         """ 获取连接对象 """
-        if not self.connect:
-            try:
-                ssh_client = paramiko.SSHClient()
-                ssh_client.set_missing_host_key_policy(
-                    paramiko.AutoAddPolicy())
-                ssh_client.connect(
-                    hostname=self.hostname,
-                    port=self.port,
-                    username=self.username,
-                    password=self.password,
-                    timeout=self.timeout
-                )
-                scp_client = SCPClient(ssh_client.get_transport())
-            except Exception as error:
-                self.is_error = True
-                self.error_message = error
-                self.close()
-                return
-            self.ssh_client = ssh_client
-            self.scp_client = scp_client
+        if self.session is not None and self.session.is_active():
+            return
+        try:
+            session = ssh_pool.get(
+                self.hostname, self.port, self.username, self.password,
+                timeout=self.timeout)
+        except Exception as error:
+            self.is_error = True
+            self.error_message = error
+            self.close()
+            return
+        self.session = session
+        self.ssh_client = session.ssh_client
+        self.is_error = None
+        self.error_message = None
 
     def check(self):
         """
@@ -72,24 +283,30 @@ class SSH(object):
         self._get_connection()
         if self.is_error:
             return False, str(self.error_message)
-        _, stdout, _ = self.ssh_client.exec_command("whoami")
-        who = stdout.readline().strip()
+        with ssh_pool.channel(self.session):
+            _, stdout, _ = self.ssh_client.exec_command("whoami")
+            who = stdout.readline().strip()
+            stdout.channel.close()
         if who == self.username:
             return True, "check passed"
         return False, f"stdout: {who}"
 
     def is_sudo(self):
         """
-        检查用户是否具有sudo权限
+        检查用户是否具有sudo权限，结果在连接内缓存
         :return: is_sudo, message
         """
         self._get_connection()
         if self.is_error:
             return False, str(self.error_message)
-        _, stdout, _ = self.ssh_client.exec_command(
-            "sudo -n echo 'success'", get_pty=True)
-        res = stdout.readline().strip()
-        if res == "success":
+        if self.session.sudo is None:
+            with ssh_pool.channel(self.session):
+                _, stdout, _ = self.ssh_client.exec_command(
+                    "sudo -n echo 'success'", get_pty=True)
+                res = stdout.readline().strip()
+                stdout.channel.close()
+            self.session.sudo = res == "success"
+        if self.session.sudo:
             return True, "is sudo"
         return False, "not sudo"
 
@@ -104,15 +321,88 @@ class SSH(object):
         self._get_connection()
         if self.is_error:
             return False, str(self.error_message)
-        _, stdout, stderr = self.ssh_client.exec_command(
-            command, get_pty=get_pty, timeout=timeout)
-        stdout.channel.recv_exit_status()
-        res_stdout = stdout.readlines()
-        res_stderr = stderr.readlines()
+        with ssh_pool.channel(self.session, timeout=timeout):
+            _, stdout, stderr = self.ssh_client.exec_command(
+                command, get_pty=get_pty, timeout=timeout)
+            stdout.channel.recv_exit_status()
+            res_stdout = stdout.readlines()
+            res_stderr = stderr.readlines()
+            # 连接复用，通道使用后及时关闭
+            stdout.channel.close()
         if len(res_stderr) != 0:
             return False, res_stderr[0].strip() + " " + str(stdout)
         return True, "\n".join(res_stdout)
 
+    def cmd_stream(self, command, write_func, timeout=SSH_CMD_TIMEOUT):
+        """
+        执行shell命令，并将数据流写入命令的标准输入，
+        用于在单个通道上完成文件传输与命令执行
+        :param command: shell命令，如 tar xmf -
+        :param write_func: 写入函数，参数为标准输入文件对象
+        :param timeout: 超时时间
+        :return: 命令退出码为 0 时为 True，以及命令输出
+        """
+        self._get_connection()
+        if self.is_error:
+            return False, str(self.error_message)
+        with ssh_pool.channel(self.session, timeout=timeout):
+            stdin, stdout, stderr = self.ssh_client.exec_command(
+                command, timeout=timeout)
+            try:
+                write_func(stdin)
+                stdin.channel.shutdown_write()
+                exit_status = stdout.channel.recv_exit_status()
+                res_stdout = stdout.read().decode("utf-8", "ignore")
+                res_stderr = stderr.read().decode("utf-8", "ignore")
+            finally:
+                stdout.channel.close()
+        if exit_status != 0:
+            return False, f"{res_stdout}\n{res_stderr}".strip()
+        return True, res_stdout
+
+    def cmd_read_stream(self, command, read_func, timeout=SSH_CMD_TIMEOUT):
+        """
+        执行shell命令，并由读取函数直接消费命令的标准输出，
+        用于将远端命令输出以数据流的方式传输到本地；
+        错误输出在单独的线程中同时读取，只保留最后 STDERR_TAIL_SIZE 字节，
+        避免错误输出占满通道窗口导致标准输出阻塞
+        :param command: shell命令，如 tar cf - data
+        :param read_func: 读取函数，参数为标准输出文件对象
+        :param timeout: 超时时间
+        :return: 命令退出码为 0 时为 True，以及命令错误输出
+        """
+        self._get_connection()
+        if self.is_error:
+            return False, str(self.error_message)
+        with ssh_pool.channel(self.session, timeout=timeout):
+            _, stdout, stderr = self.ssh_client.exec_command(
+                command, timeout=timeout)
+            stderr_tail = bytearray()
+
+            def drain_stderr():
+                try:
+                    while True:
+                        data = stderr.read(STDERR_READ_SIZE)
+                        if not data:
+                            break
+                        stderr_tail.extend(data)
+                        del stderr_tail[:-STDERR_TAIL_SIZE]
+                except Exception as e:
+                    logger.warning(f"读取命令错误输出失败: {str(e)}")
+
+            stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+            stderr_thread.start()
+            try:
+                read_func(stdout)
+                exit_status = stdout.channel.recv_exit_status()
+                stderr_thread.join(timeout)
+            finally:
+                stdout.channel.close()
+        res_stderr = bytes(stderr_tail).decode("utf-8", "ignore")
+        if exit_status != 0:
+            return False, res_stderr.strip()
+        return True, res_stderr
+
     def make_remote_path_exist(self, remote_path):
         """
         mkdir -p remote_path
@@ -147,8 +437,10 @@ class SSH(object):
             return False, str(self.error_message)
         try:
             self.make_remote_path_exist(remote_path)
-            self.scp_client.put(file, recursive=True,
-                                remote_path=remote_file_full_path)
+            with ssh_pool.channel(self.session):
+                self.scp_client = SCPClient(self.session.transport)
+                self.scp_client.put(file, recursive=True,
+                                    remote_path=remote_file_full_path)
         except Exception as error:
             import traceback
             logger.error(traceback.format_exc())
@@ -157,8 +449,11 @@ class SSH(object):
         return True, "push success: {}".format(remote_file_full_path)
 
     def close(self):
-        """ 关闭连接对象 """
-        if self.ssh_client:
-            self.ssh_client.close()
+        """ 释放连接对象，连接归还连接池，已断开的连接从连接池中移除 """
         if self.scp_client:
             self.scp_client.close()
+            self.scp_client = None
+        if self.session is not None and not self.session.is_active():
+            ssh_pool.discard(self.session)
+        self.session = None
+        self.ssh_client = None
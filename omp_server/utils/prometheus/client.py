@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Project: client
+# Create time: 2022-03-14
+# Introduction:
+
+"""
+进程内共享的 prometheus 查询客户端
+连接池复用、短时结果缓存、相同请求合并，并统计命中及耗时
+"""
+
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from db_models.models import MonitorUrl
+from utils.parse_config import MONITOR_PORT, PROMETHEUS_AUTH, \
+    THREAD_POOL_MAX_WORKERS, PROMETHEUS_QUERY_TIMEOUT, PROMETHEUS_CACHE_TTL
+
+logger = logging.getLogger("server")
+
+
+class PrometheusRequestError(Exception):
+    """ prometheus 请求失败，message 为响应内容 """
+    pass
+
+
+class _InFlight(object):
+    """ 正在进行中的上游请求，供相同请求的其他线程等待结果 """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.content = None
+        self.error = None
+
+
+class PrometheusClient(object):
+    """
+    prometheus 查询客户端
+    结果按 (地址, 接口, 参数) 缓存 cache_ttl 秒，仅缓存 status 为 success 的响应；
+    缓存未命中时相同请求只向上游发送一次，其余请求等待其结果
+    """
+    # prometheus 地址缓存时间，单位秒
+    ADDRESS_TTL = 60
+    # 缓存条目上限
+    MAX_CACHE_SIZE = 1024
+
+    def __init__(self, timeout=PROMETHEUS_QUERY_TIMEOUT,
+                 cache_ttl=PROMETHEUS_CACHE_TTL):
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.basic_auth = (PROMETHEUS_AUTH.get(
+            "username", "omp"), PROMETHEUS_AUTH.get("plaintext_password", ""))
+        self.headers = {"Content-Type": "application/json"}
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(
+            pool_connections=THREAD_POOL_MAX_WORKERS,
+            pool_maxsize=THREAD_POOL_MAX_WORKERS))
+        self._lock = threading.Lock()
+        self._cache = dict()
+        self._in_flight = dict()
+        self._address = None
+        self._address_expire = 0
+        self._counter = dict()
+        self.reset_stats()
+
+    @property
+    def address(self):
+        """ prometheus 的 ip:port，MonitorUrl 查询结果缓存 ADDRESS_TTL 秒 """
+        now = time.monotonic()
+        if self._address is None or self._address_expire <= now:
+            monitor_url = MonitorUrl.objects.filter(
+                name="prometheus").values_list(
+                "monitor_url", flat=True).first()
+            self._address = monitor_url or \
+                f'127.0.0.1:{MONITOR_PORT.get("prometheus", 19011)}'
+            self._address_expire = now + self.ADDRESS_TTL
+        return self._address
+
+    def reset_stats(self):
+        """ 清空统计计数 """
+        with self._lock:
+            self._counter = {
+                "hit": 0,
+                "miss": 0,
+                "coalesced": 0,
+                "error": 0,
+                "upstream_seconds": 0.0,
+                "max_upstream_seconds": 0.0,
+            }
+
+    def stats(self):
+        """
+        统计信息
+        hit: 缓存命中次数; miss: 上游请求次数; coalesced: 合并到进行中请求的次数;
+        error: 上游请求失败次数; avg/max_upstream_seconds: 上游请求平均/最大耗时
+        """
+        with self._lock:
+            counter = dict(self._counter)
+            counter["cache_size"] = len(self._cache)
+        counter["avg_upstream_seconds"] = \
+            counter["upstream_seconds"] / counter["miss"] \
+            if counter["miss"] else 0.0
+        return counter
+
+    def clear(self):
+        """ 清空结果缓存及 prometheus 地址缓存 """
+        with self._lock:
+            self._cache.clear()
+            self._address = None
+            self._address_expire = 0
+
+    def _purge(self, now):
+        """ 清理过期条目，超出上限时淘汰最早过期的条目，调用方需持有锁 """
+        for key in [k for k, v in self._cache.items() if v[0] <= now]:
+            self._cache.pop(key)
+        overflow = len(self._cache) - self.MAX_CACHE_SIZE + 1
+        if overflow > 0:
+            for key, _ in sorted(
+                    self._cache.items(), key=lambda x: x[1][0])[:overflow]:
+                self._cache.pop(key)
+
+    def _fetch(self, url, params, timeout):
+        """ 向上游发送请求，返回响应内容及是否可以缓存 """
+        start = time.monotonic()
+        try:
+            response = self.session.get(
+                url=url, params=params, headers=self.headers,
+                auth=self.basic_auth, timeout=timeout)
+        finally:
+            cost = time.monotonic() - start
+            with self._lock:
+                self._counter["upstream_seconds"] += cost
+                self._counter["max_upstream_seconds"] = max(
+                    self._counter["max_upstream_seconds"], cost)
+        if response.status_code != 200:
+            raise PrometheusRequestError(response.text)
+        content = response.text
+        return content, json.loads(content).get("status") == "success"
+
+    def get(self, path, params=None, address=None, cache_ttl=None,
+            timeout=None):
+        """
+        请求 prometheus 接口，返回解析后的 json
+        :param path: 接口路径，如 /api/v1/query
+        :param params: 请求参数
+        :param address: prometheus 的 ip:port，默认为 MonitorUrl 中的地址
+        :param cache_ttl: 缓存时间，默认为 self.cache_ttl，0 表示不缓存
+        :param timeout: 请求超时时间，默认为 self.timeout
+        :return: dict，每次调用返回新的对象，调用方可自由修改
+        """
+        address = address or self.address
+        cache_ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+        timeout = timeout or self.timeout
+        url = f"http://{address}{path}"
+        key = (url, tuple(sorted((params or {}).items())))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._counter["hit"] += 1
+                return json.loads(entry[1])
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlight()
+                self._in_flight[key] = call
+                self._counter["miss"] += 1
+            else:
+                self._counter["coalesced"] += 1
+
+        if not is_leader:
+            if not call.event.wait(timeout):
+                raise PrometheusRequestError(f"等待请求 {url} 超时")
+            if call.error is not None:
+                raise call.error
+            return json.loads(call.content)
+
+        cacheable = False
+        try:
+            call.content, cacheable = self._fetch(url, params, timeout)
+            return json.loads(call.content)
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._counter["error"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if cacheable and cache_ttl > 0:
+                    now = time.monotonic()
+                    self._purge(now)
+                    self._cache[key] = (now + cache_ttl, call.content)
+            call.event.set()
+
+    def query(self, expr, query_time=None, **kwargs):
+        """ 即时查询，缓存键为 (expr, query_time) """
+        params = {"query": expr}
+        if query_time is not None:
+            params["time"] = query_time
+        return self.get("/api/v1/query", params=params, **kwargs)
+
+    def alerts(self, **kwargs):
+        """ 查询当前告警 """
+        return self.get("/api/v1/alerts", **kwargs)
+
+    def targets(self, **kwargs):
+        """ 查询采集目标 """
+        return self.get("/api/v1/targets", **kwargs)
+
+
+prometheus_client = PrometheusClient()
@@ -3,13 +3,11 @@
 # Author: len chen
 # CreateDate: 2021/10/14 4:01 下午
 # Description:
-import json
 import logging
-import requests
 from datetime import datetime
-from db_models.models import MonitorUrl
 from db_models.models import InspectionHistory, InspectionReport
 from utils.parse_config import PROMETHEUS_AUTH
+from utils.prometheus.client import prometheus_client
 
 
 logger = logging.getLogger("server")
@@ -23,20 +21,19 @@ class Prometheus(object):
 
     def __init__(self):
         # prometheus 的 ip:port
-        self.address = MonitorUrl.objects.get(name='prometheus').monitor_url
+        self.address = prometheus_client.address
         self.basic_auth = (PROMETHEUS_AUTH.get(
             "username", "omp"), PROMETHEUS_AUTH.get("plaintext_password", ""))
 
-    def query(self, expr):
+    def query(self, expr, **kwargs):
         """
         请求prometheus开放接口，执行prosql，查询数据
         :para expr: 需要执行的sql
+        :para kwargs: 透传至 prometheus_client，如 timeout
         :return: 查询到的实时数据
         """
-        url = f"http://{self.address}/api/v1/query?query={expr}"
         try:
-            rsp = json.loads(requests.get(url=url, timeout=0.5, auth=self.basic_auth
-                                          ).content.decode('utf8', 'ignore'))
+            rsp = prometheus_client.query(expr, **kwargs)
             if rsp.get('status') == 'success':
                 return True, rsp.get('data')
             else:
@@ -87,10 +84,8 @@ class Prometheus(object):
             return 0
 
     def query_alerts(self):
-        url = f'http://{self.address}/api/v1/alerts'
         try:
-            rsp = json.loads(requests.get(url=url, timeout=0.5, auth=self.basic_auth
-                                          ).content.decode('utf8', 'ignore'))
+            rsp = prometheus_client.alerts()
             if rsp.get('status') == 'success':
                 # 处理重复级别告警问题 jon.liu
                 alerts = rsp.get('data').get('alerts')
@@ -6,26 +6,69 @@
 import json
 import logging
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from db_models.models import Host
+from utils.parse_config import THREAD_POOL_MAX_WORKERS
 from utils.plugin.salt_client import SaltClient
 from utils.prometheus.prometheus import Prometheus
-from utils.prometheus.utils import get_host_data_folder
+from utils.prometheus.utils import instance_matcher, get_data_path
 
 logger = logging.getLogger("server")
 
+# 巡检单项指标查询超时时间，单位秒；指标按主机分组查询，数据量较即时查询大
+QUERY_TIMEOUT = 30
 
-def target_host_thread(env, instance):
+
+def format_run_time(value):
+    """ 将运行秒数格式化为 x天x小时x分钟x秒 """
+    _ = float(value) if value else 0
+    minutes, seconds = divmod(_, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if int(days) > 0:
+        return f"{int(days)}天{int(hours)}小时{int(minutes)}分钟{int(seconds)}秒"
+    elif int(hours) > 0:
+        return f"{int(hours)}小时{int(minutes)}分钟{int(seconds)}秒"
+    return f"{int(minutes)}分钟{int(seconds)}秒"
+
+
+def format_percent(value):
+    """ 百分比保留两位小数 """
+    return f"{round(float(value), 2)}%"
+
+
+def format_rate(value):
+    """ 速率保留两位小数 """
+    return f"{round(float(value), 2)}kb/s"
+
+
+def target_hosts_run(env, hosts):
     """
-    主机巡检，多线程执行
+    主机巡检，每项指标对全部主机只查询一次
     :env: 环境 queryset 对象
+    :hosts: 主机ip列表
+    :return: 按 hosts 顺序排列的主机巡检数据
+    """
+    h_w_obj = HostCrawl(env=env.name, hosts=hosts)
+    h_w_obj.run()
+    host_dic = {
+        h.ip: h for h in Host.objects.filter(ip__in=hosts)}
+    return [
+        host_inspection_data(instance, h_w_obj.ret.get(instance, {}),
+                             host_dic.get(instance))
+        for instance in hosts
+    ]
+
+
+def host_inspection_data(instance, _p, _h):
+    """
+    组装单台主机巡检数据
     :instance: 主机ip地址
+    :_p: HostCrawl 查询到的该主机指标
+    :_h: 主机 Host 对象
     """
     temp = dict()
-    # 主机 prometheus 数据请求
-    h_w_obj = HostCrawl(env=env.name, instance=instance)
-    h_w_obj.run()
-    _p = h_w_obj.ret
     temp['id'] = random.randint(1, 99999999)
     temp['mem_usage'] = _p.get('mem_usage')
     temp['cpu_usage'] = _p.get('cpu_usage')
@@ -38,7 +81,6 @@ def target_host_thread(env, instance):
     temp['cpu_top'] = _p.get('cpu_top', [])
     temp['kernel_parameters'] = _p.get('kernel_parameters', [])
     # 操作系统
-    _h = Host.objects.filter(ip=instance).first()
     temp['release_version'] = _h.operate_system if _h else ''
     # 配置信息
     host_massage = \
@@ -74,217 +116,204 @@ def target_host_thread(env, instance):
 class HostCrawl(Prometheus):
     """
     查询 prometheus 主机指标
+    每项指标以 by (instance) 向量对全部主机查询一次，再按主机拆分结果
     """
 
-    def __init__(self, env, instance):
-        self.ret = {}
+    def __init__(self, env, hosts):
         self.env = env  # 环境
-        self.instance = instance  # 主机ip
+        self.hosts = list(hosts)  # 主机ip列表
+        self.ret = {instance: {} for instance in self.hosts}
         self._obj = SaltClient()
         Prometheus.__init__(self)
 
-    @staticmethod
-    def unified_job(is_success, ret):
+    def selector(self, hosts=None, **labels):
         """
-        实例方法 返回值统一处理
-        :ret: 返回值
-        :is_success: 请求是否成功
+        拼接 label 选择器，限定环境及主机
+        :hosts: 主机ip列表，默认为全部巡检主机
+        :labels: 额外的 label 条件，值为 PromQL 匹配表达式，如 mode="='idle'"
         """
-        if is_success:
-            if ret.get('result'):
-                return ret['result'][0].get('value')[1]
-            else:
-                return 0
-        else:
-            return 0
-
-    def run_status(self):
-        """运行状态"""
-        expr = f"round(up{{env='{self.env}', instance='{self.instance}', " \
-               f"job='nodeExporter'}})"
-        self.ret['run_status'] = self.unified_job(*self.query(expr))
-
-    def run_time(self):
-        """运行时间"""
-        expr = f"avg(time() - node_boot_time_seconds{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}})"
-        _ = self.unified_job(*self.query(expr))
-        _ = float(_) if _ else 0
-        minutes, seconds = divmod(_, 60)
-        hours, minutes = divmod(minutes, 60)
-        days, hours = divmod(hours, 24)
-        if int(days) > 0:
-            self.ret['run_time'] = \
-                f"{int(days)}天{int(hours)}小时{int(minutes)}分钟{int(seconds)}秒"
-        elif int(hours) > 0:
-            self.ret['run_time'] = \
-                f"{int(hours)}小时{int(minutes)}分钟{int(seconds)}秒"
-        else:
-            self.ret['run_time'] = f"{int(minutes)}分钟{int(seconds)}秒"
-
-    def cpu_usage(self):
-        """总cpu使用率"""
-        expr = f"100 - (avg(rate(node_cpu_seconds_total" \
-               f"{{env='{self.env}'," \
-               f"instance=~'{self.instance}'," \
-               f"mode='idle'}}[5m])) * 100)"
-        self.ret['cpu_usage'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}%"
+        items = [f"env='{self.env}'",
+                 instance_matcher(hosts or self.hosts)]
+        items.extend(f"{k}{v}" for k, v in labels.items())
+        return ",".join(items)
 
-    def iowait(self):
-        """IO wait使用率"""
-        expr = f"avg(rate(node_cpu_seconds_total{{env='{self.env}'," \
-               f"instance=~'{self.instance}',mode='iowait'}}[5m])) * 100"
-        self.ret['iowait'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}%"
-
-    def mem_usage(self):
-        """内存使用率"""
-        expr = f"(1 - (node_memory_MemAvailable_bytes" \
-               f"{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}} / " \
-               f"(node_memory_MemTotal_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}})))* 100"
-        self.ret['mem_usage'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}%"
-
-    def disk_usage_root(self):
-        """根分区使用率"""
-        expr = f"(node_filesystem_size_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}'," \
-               f"fstype=~'ext.*|xfs',mountpoint='/'}} - " \
-               f"node_filesystem_avail_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}'," \
-               f"fstype=~'ext.*|xfs',mountpoint='/'}}) / " \
-               f"node_filesystem_size_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}'," \
-               f"fstype=~'ext.*|xfs',mountpoint='/'}} * 100"
-        self.ret['disk_usage_root'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}%"
-
-    def disk_usage_data(self):
-        """数据分区使用率"""
-        # 数据分区应该由主机表中的data_folder目录决定
-        # 并协同disk信息判断出数据分区挂载点是哪个
-        _data_path = get_host_data_folder(self.instance)
-        if not _data_path:
-            return "_"
-        expr = f"(1-(node_filesystem_free_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}',mountpoint='{_data_path}', " \
-               f"fstype=~'ext.*|xfs'}}" \
-               f" / node_filesystem_size_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}',mountpoint='{_data_path}', " \
-               f"fstype=~'ext.*|xfs'}}))" \
-               f" * 100"
-        _ = self.unified_job(*self.query(expr))
-        self.ret['disk_usage_data'] = f"{round(float(_), 2)}%" if _ else '_'
-
-    def rate_exchange_disk(self):
-        """交换分区使用率"""
-        expr = f"(1 - (node_memory_SwapFree_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}} / " \
-               f"node_memory_SwapTotal_bytes{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}})) * 100"
-        self.ret['rate_exchange_disk'] = self.unified_job(*self.query(expr))
+    def query_exprs(self):
+        """
+        巡检指标与 PromQL 的对应关系，结果均按 instance 分组
+        """
+        sel = self.selector()
+        fs_sel = self.selector(fstype="=~'ext.*|xfs'", mountpoint="='/'")
+        inode_sel = self.selector(fstype="=~'xfs|ext4'", mountpoint="='/'")
+        eth_sel = self.selector(device="=~'eth0'")
+        up_sel = self.selector(job="='nodeExporter'")
+        idle_sel = self.selector(mode="='idle'")
+        iowait_sel = self.selector(mode="='iowait'")
+        query_dic = {
+            "run_status": f"max by (instance) (round(up{{{up_sel}}}))",
+            "run_time": f"avg by (instance) "
+                        f"(time() - node_boot_time_seconds{{{sel}}})",
+            "cpu_usage": f"100 - (avg by (instance) (rate("
+                         f"node_cpu_seconds_total{{{idle_sel}}}[5m])) * 100)",
+            "iowait": f"avg by (instance) (rate("
+                      f"node_cpu_seconds_total{{{iowait_sel}}}[5m])) * 100",
+            "mem_usage": f"max by (instance) ((1 - ("
+                         f"node_memory_MemAvailable_bytes{{{sel}}} / "
+                         f"node_memory_MemTotal_bytes{{{sel}}})) * 100)",
+            "disk_usage_root": f"max by (instance) (("
+                               f"node_filesystem_size_bytes{{{fs_sel}}} - "
+                               f"node_filesystem_avail_bytes{{{fs_sel}}}) / "
+                               f"node_filesystem_size_bytes{{{fs_sel}}} "
+                               f"* 100)",
+            "inode_usage": f"max by (instance) ((1 - "
+                           f"node_filesystem_files_free{{{inode_sel}}} / "
+                           f"node_filesystem_files{{{inode_sel}}}) * 100)",
+            "max_openfile": f"avg by (instance) "
+                            f"(node_filefd_maximum{{{sel}}})",
+            "load1": f"max by (instance) (node_load1{{{sel}}})",
+            "load5": f"max by (instance) (node_load5{{{sel}}})",
+            "load15": f"max by (instance) (node_load15{{{sel}}})",
+            "receive": f"sum by (instance) (rate("
+                       f"node_network_receive_bytes_total{{{eth_sel}}}"
+                       f"[2m]) * 8 / 1024)",
+            "transmit": f"sum by (instance) (rate("
+                        f"node_network_transmit_bytes_total{{{eth_sel}}}"
+                        f"[2m]) * 8 / 1024)",
+            "read": f"sum by (instance) "
+                    f"(rate(node_disk_read_bytes_total{{{sel}}}[2m])) / 1024",
+            "write": f"sum by (instance) "
+                     f"(rate(node_disk_written_bytes_total{{{sel}}}[2m])) "
+                     f"/ 1024",
+        }
+        # 数据分区挂载点因主机而异，相同挂载点的主机合并为一次查询
+        for data_path, hosts in self.group_by_data_path().items():
+            data_sel = self.selector(
+                hosts=hosts, mountpoint=f"='{data_path}'",
+                fstype="=~'ext.*|xfs'")
+            query_dic[("disk_usage_data", data_path)] = \
+                f"max by (instance) ((1 - (" \
+                f"node_filesystem_free_bytes{{{data_sel}}} / " \
+                f"node_filesystem_size_bytes{{{data_sel}}})) * 100)"
+        return query_dic
 
-    def rate_cpu_io_wait(self):
-        """cpu io wait"""
-        expr = f"avg(rate(node_cpu_seconds_total" \
-               f"{{instance=~'{self.instance}',mode='iowait'}}[5m])) * 100"
-        self.ret['rate_cpu_io_wait'] = self.unified_job(*self.query(expr))
+    def group_by_data_path(self):
+        """
+        数据分区应该由主机表中的data_folder目录决定
+        并协同disk信息判断出数据分区挂载点是哪个
+        :return: {数据分区挂载点: [主机ip]}
+        """
+        group_dic = dict()
+        for ip, data_folder, disk in Host.objects.filter(
+                ip__in=self.hosts).values_list("ip", "data_folder", "disk"):
+            data_path = get_data_path(data_folder, disk)
+            if data_path:
+                group_dic.setdefault(data_path, []).append(ip)
+        return group_dic
 
-    def inode_usage(self):
-        """inode使用率"""
-        expr = f"(1-node_filesystem_files_free{{fstype=~'xfs|ext4'," \
-               f"mountpoint='/', env='{self.env}'," \
-               f"instance=~'{self.instance}'}} / " \
-               f"node_filesystem_files{{fstype=~'xfs|ext4',mountpoint='/', " \
-               f"env='{self.env}',instance=~'{self.instance}'}})*100"
-        self.ret['inode_usage'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}%"
+    def query_vector(self, expr):
+        """
+        执行一次分组查询，返回 {instance: value}，失败时返回空字典
+        """
+        is_success, ret = self.query(expr, timeout=QUERY_TIMEOUT)
+        if not is_success:
+            return {}
+        return {
+            item.get('metric', {}).get('instance'): item.get('value')[1]
+            for item in ret.get('result', [])
+        }
 
-    def max_openfile(self):
-        """总文件描述符"""
-        expr = f"avg(node_filefd_maximum{{instance=~'{self.instance}'}})"
-        self.ret['max_openfile'] = self.unified_job(*self.query(expr))
+    def collect(self):
+        """
+        在有界线程池中执行全部指标查询，耗时取决于指标数而非主机数
+        :return: {指标: {instance: value}}
+        """
+        query_dic = self.query_exprs()
+        vector_dic = dict()
+        with ThreadPoolExecutor(
+                min(len(query_dic), THREAD_POOL_MAX_WORKERS)) as executor:
+            future_dic = {
+                executor.submit(self.query_vector, expr): key
+                for key, expr in query_dic.items()
+            }
+            for future in as_completed(future_dic):
+                vector_dic[future_dic[future]] = future.result()
+        return vector_dic
 
-    def sys_load(self):
-        """系统平均负载"""
-        # 1分钟负载
-        expr = f"node_load1{{env='{self.env}',instance=~'{self.instance}'}}"
-        load1 = self.unified_job(*self.query(expr))
-        # 5分钟负载
-        expr = f"node_load5{{env='{self.env}',instance=~'{self.instance}'}}"
-        load5 = self.unified_job(*self.query(expr))
-        # 15分钟负载
-        expr = f"node_load15{{env='{self.env}',instance=~'{self.instance}'}}"
-        load15 = self.unified_job(*self.query(expr))
-        self.ret['sys_load'] = f"{load1},{load5},{load15}"
+    def fill_metrics(self, vector_dic):
+        """ 按主机拆分查询结果，缺失的指标按 0 处理 """
+        data_path_dic = {
+            ip: key[1] for key, value in vector_dic.items()
+            if isinstance(key, tuple) for ip in value}
 
-    def bandwidth(self):
-        """网络带宽使用"""
-        # eth0 下载
-        expr = f"sum(rate(node_network_receive_bytes_total{{env='{self.env}'," \
-               f"instance=~'{self.instance}',device=~'eth0'}}[2m])*8/1024)"
-        self.ret['bandwidth'] = {
-            'receive': f"{round(float(self.unified_job(*self.query(expr))), 2)}"
-                       f"kb/s"}
-        # eth0 上传
-        expr = f"sum(rate(node_network_transmit_bytes_total" \
-               f"{{env='{self.env}',instance=~'{self.instance}'," \
-               f"device=~'eth0'}}[2m])*8/1024)"
-        self.ret['bandwidth']['transmit'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}kb/s"
+        def _get(metric, instance):
+            return vector_dic.get(metric, {}).get(instance, 0)
 
-    def throughput(self):
-        """磁盘io"""
-        # 读
-        expr = f"sum(rate(node_disk_read_bytes_total{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}}[2m])) / 1024"
-        self.ret['throughput'] = \
-            {'read': f"{round(float(self.unified_job(*self.query(expr))), 2)}"
-                     f"kb/s"}
-        # 写
-        expr = f"sum(rate(node_disk_written_bytes_total" \
-               f"{{env='{self.env}'," \
-               f"instance=~'{self.instance}'}}[2m])) / 1024"
-        self.ret['throughput']['write'] = \
-            f"{round(float(self.unified_job(*self.query(expr))), 2)}kb/s"
+        for instance, ret in self.ret.items():
+            ret['run_status'] = _get('run_status', instance)
+            ret['run_time'] = format_run_time(_get('run_time', instance))
+            ret['max_openfile'] = _get('max_openfile', instance)
+            for metric in ('cpu_usage', 'iowait', 'mem_usage',
+                           'disk_usage_root', 'inode_usage'):
+                ret[metric] = format_percent(_get(metric, instance))
+            ret['sys_load'] = ",".join(
+                str(_get(metric, instance))
+                for metric in ('load1', 'load5', 'load15'))
+            ret['bandwidth'] = {
+                'receive': format_rate(_get('receive', instance)),
+                'transmit': format_rate(_get('transmit', instance))}
+            ret['throughput'] = {
+                'read': format_rate(_get('read', instance)),
+                'write': format_rate(_get('write', instance))}
+            data_usage = vector_dic.get(
+                ('disk_usage_data', data_path_dic.get(instance)), {}
+            ).get(instance)
+            ret['disk_usage_data'] = \
+                format_percent(data_usage) if data_usage is not None else '_'
 
     def salt_json(self):
+        """
+        通过 salt 获取主机进程、内核等信息
+        仅向模块版本落后的主机同步模块，host_check.main 对全部主机批量执行一次
+        """
+        cmd_res = dict()
         try:
-            self._obj.salt_module_update()
-            ret = self._obj.fun(self.instance, "host_check.main")
-            if ret and ret[0]:
-                ret = json.loads(ret[1])
-            else:
-                ret = {}
+            self._obj.sync_stale_modules(self.hosts)
+            cmd_res = self._obj.fun_for_multi(
+                self.hosts, "host_check.main", tgt_type="list")
         except Exception as e:
             logger.error(f"Salt host_check.main failed with error: {str(e)}")
-            ret = {}
+        if not isinstance(cmd_res, dict):
+            logger.error(f"Salt host_check.main failed with error: {cmd_res}")
+            cmd_res = dict()
 
-        self.ret['memory_top'] = ret.get('memory_top', [])
-        self.ret['cpu_top'] = ret.get('cpu_top', [])
-        self.ret['kernel_parameters'] = ret.get('kernel_parameters', [])
-        self.ret['kernel_version'] = ret.get('kernel_version')
-        self.ret['selinux'] = ret.get('selinux')
-        self.ret['run_process'] = ret.get('run_process')
-        self.ret['umask'] = ret.get('umask')
-        self.ret['zombies_process'] = ret.get('zombies_process')
+        for instance in self.hosts:
+            res = cmd_res.get(instance)
+            ret = {}
+            if isinstance(res, dict) and res.get("retcode") == 0:
+                try:
+                    ret = json.loads(res.get("ret"))
+                except Exception as e:
+                    logger.error(
+                        f"Salt host_check.main on {instance} returned "
+                        f"invalid json: {str(e)}")
+            _ret = self.ret[instance]
+            _ret['memory_top'] = ret.get('memory_top', [])
+            _ret['cpu_top'] = ret.get('cpu_top', [])
+            _ret['kernel_parameters'] = ret.get('kernel_parameters', [])
+            _ret['kernel_version'] = ret.get('kernel_version')
+            _ret['selinux'] = ret.get('selinux')
+            _ret['run_process'] = ret.get('run_process')
+            _ret['umask'] = ret.get('umask')
+            _ret['zombies_process'] = ret.get('zombies_process')
 
     def run(self):
-        """统一执行实例方法"""
-        # target为实例方法，目的是统一执行实例方法并统一返回值
-        target = ['mem_usage', 'cpu_usage', 'disk_usage_root',
-                  'disk_usage_data', 'sys_load', 'run_time', 'max_openfile',
-                  'inode_usage', 'iowait', 'bandwidth', 'throughput',
-                  'salt_json', 'run_status']
-        for t in target:
-            if getattr(self, t):
-                getattr(self, t)()
+        """统一执行指标查询及 salt 信息采集"""
+        if not self.hosts:
+            return
+        self.fill_metrics(self.collect())
+        self.salt_json()
 
 
 if __name__ == '__main__':
-    h = HostCrawl(env='default', instance='10.0.14.224')
+    h = HostCrawl(env='default', hosts=['10.0.14.224'])
     h.run()
     print(h.ret)
@@ -14,7 +14,7 @@ def salt_json(instance, func):
     ret = {}
     try:
         _obj = SaltClient()
-        _obj.salt_module_update()
+        _obj.sync_stale_modules([instance])
         ret = _obj.fun(instance, func)
         if ret and ret[0]:
             ret = json.loads(ret[1])
@@ -62,7 +62,7 @@ class ServiceGottyCrawl(Prometheus):
 
     def salt_json(self):
         try:
-            self._obj.salt_module_update()
+            self._obj.sync_stale_modules([self.instance])
             ret = self._obj.fun(self.instance, "gotty_check.main")
             if ret and ret[0]:
                 ret = json.loads(ret[1])
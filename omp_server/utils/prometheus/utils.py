@@ -10,9 +10,39 @@
 公共数据问题
 """
 
+import re
+
 from db_models.models import Host
 
 
+def instance_matcher(ip_list):
+    """
+    将主机ip列表拼接为 instance=~ 匹配器，使用反引号避免转义问题
+    """
+    ip_regex = "|".join(re.escape(ip) for ip in sorted(set(ip_list)))
+    return f'instance=~`{ip_regex}`'
+
+
+def get_data_path(data_folder, disk_info):
+    """
+    根据主机数据目录及磁盘分区信息，获取数据分区挂载点
+    :param data_folder: 主机数据目录
+    :param disk_info: 磁盘分区信息，例：{"/": 90, "/data": 100}
+    :return:
+    """
+    data_path = ""
+    if disk_info and isinstance(disk_info, dict):
+        for key, _ in disk_info.items():
+            if key == "/":
+                continue
+            _check_data_folder = data_folder.rstrip("/") + "/"
+            _check_key = key.rstrip("/") + "/"
+            if _check_data_folder.startswith(_check_key):
+                data_path = key
+                break
+    return data_path
+
+
 def get_host_data_folder(instance):
     """
     解析主机数据，获取主机磁盘分区数据
@@ -27,14 +57,4 @@ def get_host_data_folder(instance):
     _disk_info = item.disk
     if not _disk_info:
         _disk_info = Host.objects.get(id=item.id).disk
-    data_path = ""
-    if _disk_info and isinstance(_disk_info, dict):
-        for key, _ in _disk_info.items():
-            if key == "/":
-                continue
-            _check_data_folder = _data_folder.rstrip("/") + "/"
-            _check_key = key.rstrip("/") + "/"
-            if _check_data_folder.startswith(_check_key):
-                data_path = key
-                break
-    return data_path
+    return get_data_path(_data_folder, _disk_info)
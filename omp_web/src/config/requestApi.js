@@ -259,6 +259,8 @@ export const apiRequest = {
     backupOnce: "/api/backups/backupOnce/",
     // 删除备份文件
     deleteBackupFile: "/api/backups/backupHistory/",
+    // 下载备份文件
+    downloadBackup: "/api/backups/backupDownload/",
     // 推送备份记录
     pushEmail: "/api/backups/backupSendEmail/",
   },
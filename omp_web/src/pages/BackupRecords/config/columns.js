@@ -195,7 +195,7 @@ const getColumnsConfig = (setRow, setDeleteOneModal, pushData) => {
                     onClick={() => {
                       if (record.file_name || record.result === 1) {
                         let a = document.createElement("a");
-                        a.href = `/download-backup/${record.file_name}`;
+                        a.href = `${apiRequest.dataBackup.downloadBackup}?id=${record.id}`;
                         document.body.appendChild(a);
                         a.click();
                         document.body.removeChild(a);
@@ -238,7 +238,7 @@ const BackupRecords = () => {
                   a.setAttribute("id", `${idx}-downA`);
                   document.body.appendChild(a);
                   let dom = document.getElementById(`${idx}-downA`);
-                  dom.href = `/download-backup/${item.file_name}`;
+                  dom.href = `${apiRequest.dataBackup.downloadBackup}?id=${item.id}`;
                   dom.click();
                   setTimeout(() => {
                     document.body.removeChild(dom);
@@ -1,4 +1,5 @@
 # -*- coding:utf-8 -*-
+import json
 import os
 import sys
 import time
@@ -16,6 +17,7 @@ django.setup()
 from utils.plugin.public_utils import local_cmd
 from app_store.tmp_exec_back_task import back_end_verified_init
 from app_store.tmp_exec_back_task import RedisLock
+from app_store.tasks import SCAN_DONE_KEY, SCAN_EVENT_CHANNEL, SCAN_TIMEOUT
 from utils.parse_config import (
     OMP_REDIS_PORT, OMP_REDIS_PASSWORD, OMP_REDIS_HOST
 )
@@ -30,21 +32,7 @@ def log_print(message, level="info"):
 
 
 def check_upload(uuid):
-    valid_uuids = UploadPackageHistory.objects.filter(
-        operation_uuid=uuid,
-        package_parent__isnull=True,
-    ).values_list("package_status", flat=True)
-    upload_obj = UploadPackageHistory.objects.filter(
-        operation_uuid=uuid,
-        package_parent__isnull=True,
-    ).first()
-    if 5 in valid_uuids:
-        for i in range(6):
-            time.sleep(5)
-            print(f"等待发布第{i}次")
-            upload_obj.refresh_from_db()
-            if upload_obj.package_status != 5:
-                break
+    """ 发布完成后查询各安装包结果 """
     return UploadPackageHistory.objects.filter(
         operation_uuid=uuid,
         package_parent__isnull=True,
@@ -52,25 +40,71 @@ def check_upload(uuid):
 
 
 class ScanFile:
+    # 等待其它扫描任务结束的最长时间，单位秒
+    wait_timeout = 500
+    # 等待进度通知的间隔，超时后查询一次发布状态，避免遗漏通知
+    event_interval = 30
+
     def __init__(self):
         self._scan_lock_key = "back_end_verified"
         self._move_lock_key = "mv_back_end_verified"
         self.redis = RedisLock(
             host=OMP_REDIS_HOST, port=OMP_REDIS_PORT,
             password=OMP_REDIS_PASSWORD)
-        self.move = True
-        self.count = 0
+        # 订阅扫描进度通知，在提交扫描前订阅，避免遗漏
+        self.pubsub = self.redis.rdcon.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(SCAN_EVENT_CHANNEL)
+
+    def events(self, timeout):
+        """ 等待扫描进度通知，超时返回 None """
+        message = self.pubsub.get_message(timeout=timeout)
+        if not message:
+            return None
+        try:
+            return json.loads(message["data"])
+        except (TypeError, ValueError):
+            return None
+
+    def wait_scan_lock(self):
+        """ 等待后台其它扫描任务发布完成 """
+        start_time = time.time()
+        while self.redis.get_lock()[0]:
+            if time.time() - start_time > self.wait_timeout:
+                log_print("扫描超时，或队列积压严重，请重试。")
+                sys.exit(1)
+            log_print("后台有扫描任务正在执行，等待其发布完成。")
+            while self.events(timeout=5) is not None:
+                pass
+
+    def wait_published(self, uuid, total):
+        """ 输出各安装包校验进度，直到发布完成 """
+        done_key = SCAN_DONE_KEY.format(uuid)
+        deadline = time.time() + SCAN_TIMEOUT + 600
+        while time.time() < deadline:
+            if self.redis.rdcon.get(done_key) == b"published":
+                return
+            event = self.events(timeout=self.event_interval)
+            while event is not None:
+                if event.get("uuid") == uuid:
+                    if event.get("event") == "verified":
+                        log_print(
+                            f"安装包{event.get('package')}校验完成"
+                            f"({event.get('finished')}/{total})")
+                    elif event.get("event") == "published":
+                        return
+                event = self.events(timeout=0)
+        log_print("等待发布超时")
+        sys.exit(1)
 
     def valid_package(self):
+        move_lock = self.redis.rdcon.lock(
+            self._move_lock_key, timeout=1200, blocking_timeout=1200)
         try:
-            while self.move:
-                lock, redis_key = self.redis.get_lock(self._move_lock_key)
-                if not lock:
-                    redis_key.lpush(self._move_lock_key, "moving")
-                    redis_key.expire(self._move_lock_key, 1200)
-                    self.move = False
+            if not move_lock.acquire(blocking=False):
                 log_print("有安装包正在上传至back_end_verified路径")
-                time.sleep(5)
+                if not move_lock.acquire():
+                    log_print("等待安装包上传超时，请重试。")
+                    sys.exit(1)
 
             back_verified = os.path.join(
                 PROJECT_DIR, "package_hub/back_end_verified"
@@ -86,14 +120,8 @@ class ScanFile:
             if not exec_name:
                 log_print("无需要扫描的安装包，或安装包已被上一个任务获取送出。")
                 sys.exit(0)
-            while self.redis.get_lock()[0]:
-                log_print(f"后台有扫描任务正在执行,等待次数{self.count}。")
-                log_print(f"等待扫描安装包列表：{' '.join(exec_name)}")
-                time.sleep(5)
-                self.count += 1
-                if self.count > 100:
-                    log_print("扫描超时，或队列积压严重，请重试。")
-                    sys.exit(1)
+            log_print(f"等待扫描安装包列表：{' '.join(exec_name)}")
+            self.wait_scan_lock()
             _cmd_str = f'mv {" ".join(exec_name)} {back_verified}'
             _out, _err, _code = local_cmd(_cmd_str)
             if _code:
@@ -103,46 +131,37 @@ class ScanFile:
                 operation_user="admin"
             )
             log_print("后台安装包扫描提交至omp")
-            result = True
-            while result:
-                valid_uuids = UploadPackageHistory.objects.filter(
-                    operation_uuid=uuid,
-                    package_parent__isnull=True,
-                ).exclude(
-                    package_status__in=[2, 5])
-                if len(exec_name) != valid_uuids.count():
-                    log_print("后台扫描中")
-                    time.sleep(5)
-                # elif 4 in valid_uuids.values_list("package_status", flat=True):
-                #    log_print("后台扫描校验失败")
-                #    result = False
-                else:
-                    status = True
-                    result_ls = []
-                    package_status = {
-                        0: "成功",
-                        1: "失败",
-                        2: "解析中",
-                        3: "发布成功",
-                        4: "发布失败",
-                        5: "发布中",
-                    }
-                    valid_uuids = check_upload(uuid)
-                    for value in valid_uuids:
-                        if value[1] != 3:
-                            status = False
-                        result_ls.append(f"安装包{value[0]},扫描状态:{package_status.get(value[1], '')},扫描信息:{value[2]}")
-                    log_print("应用商店扫描完成")
-                    log_print("\n".join(result_ls))
-                    if status:
-                        sys.exit(0)
-                    else:
-                        sys.exit(1)
+            self.wait_published(uuid, len(exec_name))
+            status = True
+            result_ls = []
+            package_status = {
+                0: "成功",
+                1: "失败",
+                2: "解析中",
+                3: "发布成功",
+                4: "发布失败",
+                5: "发布中",
+            }
+            valid_uuids = check_upload(uuid)
+            for value in valid_uuids:
+                if value[1] != 3:
+                    status = False
+                result_ls.append(f"安装包{value[0]},扫描状态:{package_status.get(value[1], '')},扫描信息:{value[2]}")
+            log_print("应用商店扫描完成")
+            log_print("\n".join(result_ls))
+            if status:
+                sys.exit(0)
+            else:
+                sys.exit(1)
         except Exception as e:
             log_print(f"后台扫描失败:{e}")
             sys.exit(1)
         finally:
-            self.redis.rdcon.delete(self._move_lock_key)
+            self.pubsub.close()
+            try:
+                move_lock.release()
+            except Exception:
+                pass
 
 
 if __name__ == "__main__":
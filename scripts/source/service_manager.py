@@ -1,7 +1,6 @@
 # -*- coding:utf-8 -*-
 import os
 import sys
-import time
 
 import django
 
@@ -12,58 +11,13 @@ sys.path.append(os.path.join(PROJECT_DIR, 'omp_server'))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "omp_server.settings")
 django.setup()
 
-from services.tasks import exec_action
-from db_models.models import Service, ApplicationHub
-from concurrent.futures import (
-    ThreadPoolExecutor, as_completed
-)
-from utils.parse_config import BASIC_ORDER
+from services.action_orchestrator import ServiceActionOrchestrator
+from db_models.models import Service
 import logging
 from utils.plugin.salt_client import SaltClient
 
 logger = logging.getLogger('server')
 
-THREAD_POOL_MAX_WORKERS = 20
-
-
-def check_result(future_list):
-    """
-    查看线程结果
-    """
-    for future in as_completed(future_list):
-        ip, message = future.result()
-        print(f"{ip} {message}")
-    time.sleep(5)
-
-
-def order(service_obj, actions):
-    """
-    执行顺序排序
-    """
-    basic_lists = []
-    for m in range(10):
-        if m not in BASIC_ORDER:
-            break
-        basic_list = [
-            item for item in service_obj
-            if item.service.app_name in BASIC_ORDER[m]
-        ]
-        if len(basic_list) != 0:
-            basic_lists.append(basic_list)
-    self_service = [
-        item for item in service_obj
-        if item.service.app_type == ApplicationHub.APP_TYPE_SERVICE
-    ]
-    if len(self_service) != 0:
-        basic_lists.append(self_service)
-    if actions == "stop":
-        basic_lists.reverse()
-    if actions == "restart":
-        basic_copy = basic_lists[:]
-        basic_lists.reverse()
-        basic_lists.extend(basic_copy)
-    return basic_lists
-
 
 def service_status(service_objs):
     """
@@ -88,13 +42,8 @@ def service_actions(actions, ip=None, service_name=None):
     """
     执行服务启停，支持ip筛选
     状态为删除中，安装中，升级中，会滚中状态不被允许执行服务起停操作
+    按服务依赖关系编排，服务状态就绪后立即执行依赖它的服务
     """
-    choice = {
-        "start": ["1", Service.SERVICE_STATUS_STARTING],
-        "stop": ["2", Service.SERVICE_STATUS_STOPPING],
-        "restart": ["3", Service.SERVICE_STATUS_RESTARTING]
-    }
-    action = choice.get(actions)
     old_actions = actions
     actions = "start" if actions in ["status", "restart"] else actions
     service_obj = Service.objects.filter(service_controllers__has_key=actions).exclude(
@@ -104,32 +53,20 @@ def service_actions(actions, ip=None, service_name=None):
                             Service.SERVICE_STATUS_DELETING
                             ]
     ).select_related("service")
-    if not action:
+    if old_actions == "status":
         service_status(service_obj)
         return
     if ip:
         service_obj = service_obj.filter(ip=ip)
     if service_name:
         service_obj = service_obj.filter(service__app_name=service_name)
-    service_obj.update(service_status=action[1])
-    service_ls = order(service_obj, old_actions)
-    for index, service_ids in enumerate(service_ls):
-        # 重启重写
-        if old_actions == "restart":
-            if index < len(service_ls) / 2:
-                action[0] = "2"
-            else:
-                action[0] = "1"
-        with ThreadPoolExecutor(THREAD_POOL_MAX_WORKERS) as executor:
-            future_list = []
-            for i in service_ids:
-                # print(i.get("service_instance_name"))
-                future_obj = executor.submit(
-                    exec_action, action[0],
-                    i.id, "admin", need_sleep=False
-                )
-                future_list.append(future_obj)
-            check_result(future_list)
+    orchestrator = ServiceActionOrchestrator.create(
+        old_actions, list(service_obj.values_list("id", flat=True)), "admin")
+    if orchestrator is None:
+        print("无可执行的服务")
+        return
+    for instance_name, is_success in orchestrator.run().items():
+        print(f"{instance_name} {'success' if is_success else 'failed'}")
 
 
 if __name__ == '__main__':